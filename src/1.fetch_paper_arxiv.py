@@ -1,9 +1,12 @@
-import arxiv
 import json
 import os
 import sys
 import time
 from datetime import datetime, timedelta, timezone
+from typing import Any
+
+from arxiv_client import ArxivAtomClient, parse_published
+from storage import PaperStore, paper_store_dir_for, save_json
 
 # 项目根目录（当前脚本位于 src/ 下）
 SCRIPT_DIR = os.path.dirname(__file__)
@@ -79,41 +82,67 @@ def save_last_crawl_at(at_time: datetime) -> None:
         json.dump(payload, f, ensure_ascii=False, indent=2)
 
 
-def load_seen_state() -> tuple[set[str], datetime | None]:
+def parse_state_datetime(raw: Any) -> datetime | None:
+    text = str(raw or "").strip()
+    if not text:
+        return None
+    try:
+        dt = datetime.fromisoformat(text.replace("Z", "+00:00"))
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        return dt.astimezone(timezone.utc)
+    except Exception:
+        return None
+
+
+def load_seen_state() -> tuple[set[str], datetime | None, dict[str, datetime]]:
+    """
+    读取 arxiv_seen.json：
+    - ids：已见论文 ID；
+    - latest_published_at：旧版全局水位线（仅在某分类没有自己的水位线时兜底）；
+    - category_watermarks：每个分类查询（cat:<category>*）各自的水位线。
+    """
     if not os.path.exists(SEEN_IDS_FILE):
-        return set(), None
+        return set(), None, {}
     try:
         with open(SEEN_IDS_FILE, "r", encoding="utf-8") as f:
             payload = json.load(f) or {}
     except Exception:
-        return set(), None
+        return set(), None, {}
 
     raw_ids = payload.get("ids") or []
     if not isinstance(raw_ids, list):
         raw_ids = []
     seen_ids = {str(i).strip() for i in raw_ids if str(i).strip()}
 
-    raw_latest = str(payload.get("latest_published_at") or "").strip()
-    latest_dt = None
-    if raw_latest:
-        try:
-            latest_dt = datetime.fromisoformat(raw_latest.replace("Z", "+00:00"))
-            if latest_dt.tzinfo is None:
-                latest_dt = latest_dt.replace(tzinfo=timezone.utc)
-            latest_dt = latest_dt.astimezone(timezone.utc)
-        except Exception:
-            latest_dt = None
+    latest_dt = parse_state_datetime(payload.get("latest_published_at"))
+
+    watermarks: dict[str, datetime] = {}
+    raw_marks = payload.get("category_watermarks") or {}
+    if isinstance(raw_marks, dict):
+        for category, raw in raw_marks.items():
+            dt = parse_state_datetime(raw)
+            if dt is not None:
+                watermarks[str(category)] = dt
 
-    return seen_ids, latest_dt
+    return seen_ids, latest_dt, watermarks
 
 
-def save_seen_state(seen_ids: set[str], latest_published_at: datetime | None) -> None:
+def save_seen_state(
+    seen_ids: set[str],
+    latest_published_at: datetime | None,
+    watermarks: dict[str, datetime] | None = None,
+) -> None:
     os.makedirs(os.path.dirname(SEEN_IDS_FILE), exist_ok=True)
     payload = {
         "updated_at": datetime.now(timezone.utc).isoformat(),
         "latest_published_at": latest_published_at.astimezone(timezone.utc).isoformat()
         if latest_published_at
         else "",
+        "category_watermarks": {
+            category: dt.astimezone(timezone.utc).isoformat()
+            for category, dt in sorted((watermarks or {}).items())
+        },
         "ids": sorted(seen_ids),
     }
     with open(SEEN_IDS_FILE, "w", encoding="utf-8") as f:
@@ -197,19 +226,22 @@ def iter_time_windows(
 
 
 def fetch_category_in_windows(
-    client: arxiv.Client,
+    client: ArxivAtomClient,
     category: str,
     windows: list[tuple[datetime, datetime]],
     seen_ids: set[str],
     unique_papers: dict,
     split_on_error_depth: int = 1,
-) -> datetime | None:
+) -> tuple[datetime | None, datetime | None]:
     """
     按时间窗口抓取单个大类。
     - 失败粒度降为“单窗口失败”，不会丢掉整个分类；
     - 若窗口仍然过大导致 500，可继续在上层按更小窗口重试（可选）。
+    返回 (本分类结果中最新的 published, 最早一个最终失败窗口的起点)：
+    前者用于推进该分类的水位线，后者用于把水位线压回失败处，保证下次从缺口继续补抓。
     """
     max_published_new: datetime | None = None
+    failed_from: datetime | None = None
 
     for idx, (win_start, win_end) in enumerate(windows, start=1):
         start_str = win_start.strftime("%Y%m%d%H%M")
@@ -218,45 +250,26 @@ def fetch_category_in_windows(
         log(f"🚀 Fetching category: {category} | window {idx}/{len(windows)} ...")
 
         query = f"cat:{category}* AND submittedDate:[{start_str} TO {end_str}]"
-        search = arxiv.Search(
-            query=query,
-            max_results=None,
-            sort_by=arxiv.SortCriterion.SubmittedDate,
-            sort_order=arxiv.SortOrder.Descending,
-        )
 
         count = 0
         try:
-            for r in client.results(search):
-                pid = r.get_short_id()
+            for paper_dict in client.iter_papers(query):
+                # 水位线按“该分类实际下载到的数据”推进，已见/跨领域重复的论文同样计入
+                published_dt = parse_published(paper_dict.get("published"))
+                if published_dt is not None:
+                    if max_published_new is None or published_dt > max_published_new:
+                        max_published_new = published_dt
+
+                pid = paper_dict["id"]
                 if pid in seen_ids:
                     continue
                 if pid in unique_papers:
                     continue
 
-                pdf_link = getattr(r, "pdf_url", None) or r.entry_id
-                paper_dict = {
-                    "id": pid,
-                    "source": "arxiv",
-                    "title": r.title.replace("\n", " "),
-                    "abstract": r.summary.replace("\n", " "),
-                    "authors": [a.name for a in r.authors],
-                    "primary_category": r.primary_category,
-                    "categories": r.categories,
-                    "published": str(r.published),
-                    "link": pdf_link,
-                }
                 unique_papers[pid] = paper_dict
                 count += 1
 
                 seen_ids.add(pid)
-                published_dt = r.published
-                if isinstance(published_dt, datetime):
-                    if published_dt.tzinfo is None:
-                        published_dt = published_dt.replace(tzinfo=timezone.utc)
-                    published_dt = published_dt.astimezone(timezone.utc)
-                    if max_published_new is None or published_dt > max_published_new:
-                        max_published_new = published_dt
 
                 if count % 200 == 0:
                     log(f"   Category {category} (win {idx}/{len(windows)}): {count} papers fetched...")
@@ -277,7 +290,7 @@ def fetch_category_in_windows(
                     f"{left[0].strftime('%Y%m%d%H%M')}..{left[1].strftime('%Y%m%d%H%M')} | "
                     f"{right[0].strftime('%Y%m%d%H%M')}..{right[1].strftime('%Y%m%d%H%M')}",
                 )
-                cat_max_left = fetch_category_in_windows(
+                cat_max_left, failed_left = fetch_category_in_windows(
                     client=client,
                     category=category,
                     windows=[left],
@@ -285,7 +298,7 @@ def fetch_category_in_windows(
                     unique_papers=unique_papers,
                     split_on_error_depth=split_on_error_depth - 1,
                 )
-                cat_max_right = fetch_category_in_windows(
+                cat_max_right, failed_right = fetch_category_in_windows(
                     client=client,
                     category=category,
                     windows=[right],
@@ -296,11 +309,34 @@ def fetch_category_in_windows(
                 for candidate in (cat_max_left, cat_max_right):
                     if candidate and (max_published_new is None or candidate > max_published_new):
                         max_published_new = candidate
+                for candidate in (failed_left, failed_right):
+                    if candidate and (failed_from is None or candidate < failed_from):
+                        failed_from = candidate
+            elif failed_from is None or win_start < failed_from:
+                failed_from = win_start
             time.sleep(5)
         finally:
             group_end()
 
-    return max_published_new
+    return max_published_new, failed_from
+
+
+def next_watermark(
+    previous: datetime | None,
+    cat_max: datetime | None,
+    failed_from: datetime | None,
+) -> datetime | None:
+    """
+    计算分类的新水位线：
+    - 正常情况下推进到本次下载到的最新 published（不回退）；
+    - 有窗口最终失败时，不越过失败窗口的起点，下次运行只为该分类补抓缺口。
+    """
+    mark = previous
+    if cat_max and (mark is None or cat_max > mark):
+        mark = cat_max
+    if failed_from is not None and mark is not None and mark > failed_from:
+        mark = failed_from
+    return mark
 
 
 def fetch_all_domains_metadata_robust(
@@ -308,72 +344,90 @@ def fetch_all_domains_metadata_robust(
     output_file: str | None = None,
     ignore_seen: bool = False,
     chunk_days: int = 7,
+    record_dir: str | None = None,
 ) -> None:
     # 1. 计算时间窗口（优先使用上次抓取时间）
     end_date = datetime.now(timezone.utc)
     if days is None:
         days = resolve_days_window(1)
 
-    # ignore_seen 语义：完全按 days_window 回溯，不使用 last_crawl_at / latest_published_at 作为起点
+    floor_date = end_date - timedelta(days=days)
+
+    # ignore_seen 语义：完全按 days_window 回溯，不使用 last_crawl_at / latest_published_at / 分类水位线作为起点
     if ignore_seen:
         log(
-            "🧹 [Global Ingest] ignore_seen=true：将忽略 arxiv_seen（不跳过已见论文，不使用 latest_published_at），"
+            "🧹 [Global Ingest] ignore_seen=true：将忽略 arxiv_seen（不跳过已见论文，不使用水位线），"
             "并忽略 crawl_state（不使用 last_crawl_at），改为严格按 days_window 回溯。",
         )
-        seen_ids, latest_published_at = set(), None
-        start_date = end_date - timedelta(days=days)
+        seen_ids, latest_published_at, watermarks = set(), None, {}
+        default_start = floor_date
         source_desc = f"days_window={days} (ignore_seen)"
     else:
-        seen_ids, latest_published_at = load_seen_state()
+        seen_ids, latest_published_at, watermarks = load_seen_state()
         if latest_published_at:
-            start_date = latest_published_at
+            default_start = latest_published_at
             source_desc = "latest_published_at"
         else:
             last_crawl_at = load_last_crawl_at()
             if last_crawl_at:
-                start_date = last_crawl_at
+                default_start = last_crawl_at
                 source_desc = "last_crawl_at"
             else:
-                start_date = end_date - timedelta(days=days)
+                default_start = floor_date
                 source_desc = f"days_window={days}"
 
-    # 兜底：无论来源如何，都不早于 (now - days_window)
-    start_date = max(start_date, end_date - timedelta(days=days))
-
-    if start_date >= end_date:
-        start_date = end_date - timedelta(minutes=1)
+    def resolve_category_start(category: str) -> tuple[datetime, str]:
+        # 优先使用分类自己的水位线；没有时退回全局起点（旧状态文件 / 新增分类）
+        if category in watermarks:
+            start, desc = watermarks[category], "category_watermark"
+        else:
+            start, desc = default_start, source_desc
+        # 兜底：无论来源如何，都不早于 (now - days_window)
+        start = max(start, floor_date)
+        if start >= end_date:
+            start = end_date - timedelta(minutes=1)
+        return start, desc
 
-    # 按周拆分窗口，避免单次查询过大（尤其 cs* 这种大类）
-    windows = iter_time_windows(start_date, end_date, chunk_days=chunk_days)
-    start_str = start_date.strftime("%Y%m%d%H%M")
     end_str = end_date.strftime("%Y%m%d%H%M")
-    
+
     group_start("Step 1 - fetch arXiv")
-    log(f"🌍 [Global Ingest] Window: {start_str} TO {end_str} ({source_desc})")
-    if len(windows) > 1:
-        log(f"🗓️  [Global Ingest] 将按 {chunk_days} 天/片拆分窗口：{len(windows)} 段")
-    
+    log(f"🌍 [Global Ingest] Window end: {end_str} | default start: {source_desc} | per-category watermarks={len(watermarks)}")
+
     # 结果集使用字典去重 (因为有些论文跨领域，比如同时在 cs 和 stat)
     unique_papers = {}
-    max_published_new: datetime | None = None
-    
-    client = arxiv.Client(
+    new_watermarks: dict[str, datetime] = dict(watermarks)
+
+    # 轻量 Atom 客户端：连接池复用 + 流式 XML 解析，直接产出论文 dict
+    client = ArxivAtomClient(
         page_size=200,    # 降级：从 1000 降到 200，避免单次响应过大导致 500
         delay_seconds=3.0,
-        num_retries=5
+        num_retries=5,
+        record_dir=record_dir,
     )
 
-    # 2. 遍历分类进行抓取
+    # 2. 遍历分类进行抓取：每个分类从自己的水位线开始，落后/上次失败的分类单独补抓
     for category in CATEGORIES_TO_FETCH:
-        cat_max = fetch_category_in_windows(
+        cat_start, cat_desc = resolve_category_start(category)
+        # 按周拆分窗口，避免单次查询过大（尤其 cs* 这种大类）
+        windows = iter_time_windows(cat_start, end_date, chunk_days=chunk_days)
+        log(
+            f"🗓️  [{category}] Window: {cat_start.strftime('%Y%m%d%H%M')} TO {end_str} "
+            f"({cat_desc}, {len(windows)} 段)"
+        )
+        cat_max, failed_from = fetch_category_in_windows(
             client=client,
             category=category,
             windows=windows,
             seen_ids=seen_ids,
             unique_papers=unique_papers,
         )
-        if cat_max and (max_published_new is None or cat_max > max_published_new):
-            max_published_new = cat_max
+        mark = next_watermark(new_watermarks.get(category), cat_max, failed_from)
+        if failed_from is not None:
+            # 没有历史水位线且首个窗口就失败时，至少记住失败起点，避免下次被全局起点跳过
+            mark = mark or failed_from
+            log(f"   ⚠️ [{category}] 存在失败窗口，水位线停在 {mark.isoformat()}，下次运行从此处补抓。")
+        if mark is not None:
+            new_watermarks[category] = mark
 
     # 3. 保存汇总结果
     total_count = len(unique_papers)
@@ -391,16 +445,19 @@ def fetch_all_domains_metadata_robust(
                 f"arxiv_papers_{today_str}.json",
             )
 
-        os.makedirs(os.path.dirname(output_file) if os.path.dirname(output_file) else ".", exist_ok=True)
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(list(unique_papers.values()), f, ensure_ascii=False, indent=2)
-        log(f"💾 File saved to: {output_file}")
+        written = save_json(list(unique_papers.values()), output_file)
+        log(f"💾 File saved to: {written}")
+        store = PaperStore(paper_store_dir_for(output_file))
+        added = store.add(unique_papers.values())
+        log(f"🗂️ Paper store: {store.store_dir} (+{added}, total {len(store)})")
     else:
         log("⚠️ No papers found. Check your date range or network.")
-    if max_published_new:
-        save_seen_state(seen_ids, max_published_new)
-    else:
-        save_seen_state(seen_ids, latest_published_at)
+    # 全局 latest_published_at 取当前配置中各分类水位线的最小值（这些分类都已完整覆盖的时刻），兼容旧版读取方；
+    # 已从配置移除的分类仍保留其水位线，但不能拖住全局值
+    current_marks = [new_watermarks[c] for c in CATEGORIES_TO_FETCH if c in new_watermarks]
+    if current_marks:
+        latest_published_at = min(current_marks)
+    save_seen_state(seen_ids, latest_published_at, new_watermarks)
     save_last_crawl_at(end_date)
     group_end()
 
@@ -431,6 +488,12 @@ if __name__ == "__main__":
         default=7,
         help="将时间窗口拆分为若干段（默认 7=按周），以减少单次查询规模并降低 HTTP 500 概率。",
     )
+    parser.add_argument(
+        "--record-feeds",
+        type=str,
+        default=None,
+        help="可选：把每页 arXiv 原始 Atom 响应另存到该目录（用于离线复现与 src/arxiv_client.py bench 基准测试）。",
+    )
     args = parser.parse_args()
 
     # 建议先用 --days 1 测试一下，没问题再跑更长时间窗口
@@ -439,4 +502,5 @@ if __name__ == "__main__":
         output_file=args.output,
         ignore_seen=bool(args.ignore_seen),
         chunk_days=int(args.chunk_days or 7),
+        record_dir=args.record_feeds,
     )
@@ -7,14 +7,29 @@
 # 5. 将带 tag 的论文列表和每个查询的 top_k 结果写回到一个新的 JSON 文件中。
 
 import argparse
-import json
+import gc
+import heapq
 import math
 import os
 import re
+from array import array
 from datetime import datetime, timezone
 from dataclasses import dataclass, field
 from typing import Dict, List, Set, Any, Iterable
 
+from batch_executor import resolve_file_workers, run_file_tasks
+from cutoff import CutoffPolicy, add_cutoff_args, log_cutoff_summary, policy_from_args
+from score_table import write_score_table
+from storage import (
+  PaperStore,
+  json_exists,
+  list_json_files,
+  load_json,
+  paper_store_dir_for,
+  paper_store_ref,
+  save_json,
+)
+
 
 # 当前脚本位于 src/ 下，config.yaml 在上一级目录
 SCRIPT_DIR = os.path.dirname(__file__)
@@ -95,34 +110,188 @@ class Paper:
     }
 
 
+def build_shard_from_tokens(tokenized_docs: List[List[str]], start: int) -> tuple:
+  """
+  为一段连续文档构建 BM25 分片：(doc_len, doc_freqs, df, inverted, bound_postings)。
+  bound_postings 为 None 表示 max_impact 直接遍历完整倒排表计算。
+  start 为该段第一篇文档的全局下标，倒排表中直接写全局下标，合并时无需再平移。
+  """
+  doc_len = [len(tokens) for tokens in tokenized_docs]
+  doc_freqs: List[Dict[str, int]] = []
+  df: Dict[str, int] = {}
+  inverted: Dict[str, List[tuple[int, int]]] = {}
+  for offset, tokens in enumerate(tokenized_docs):
+    freqs: Dict[str, int] = {}
+    for t in tokens:
+      freqs[t] = freqs.get(t, 0) + 1
+    doc_freqs.append(freqs)
+    idx = start + offset
+    for t in freqs.keys():
+      df[t] = df.get(t, 0) + 1
+      inverted.setdefault(t, []).append((idx, freqs[t]))
+  return doc_len, doc_freqs, df, inverted, None
+
+
+def build_shard(texts: List[str], start: int) -> tuple:
+  """
+  进程池 worker：分词并构建分片（需为模块级函数以便 pickle）。
+  返回扁平的紧凑形式 (doc_len, doc_terms, doc_counts, post_terms, post_bounds, post_ids, post_tfs)：
+  同一词项复用同一个字符串对象（pickle 只序列化一次），计数与倒排各拼成一个 array，
+  避免逐词项 / 逐文档的小对象序列化。由 expand_shard 在主进程还原。
+  """
+  vocab: Dict[str, str] = {}
+  doc_len = array("i")
+  doc_terms: List[tuple] = []
+  doc_counts = array("i")
+  postings: Dict[str, List[int]] = {}
+  for offset, text in enumerate(texts):
+    tokens = tokenize(text)
+    doc_len.append(len(tokens))
+    freqs: Dict[str, int] = {}
+    for t in tokens:
+      freqs[t] = freqs.get(t, 0) + 1
+    terms = []
+    idx = start + offset
+    for t, tf in freqs.items():
+      term = vocab.setdefault(t, t)
+      terms.append(term)
+      plist = postings.get(term)
+      if plist is None:
+        plist = postings[term] = []
+      plist.append(idx)
+      plist.append(tf)
+    doc_terms.append(tuple(terms))
+    doc_counts.extend(freqs.values())
+
+  post_terms = list(postings.keys())
+  post_bounds = array("i", [0])
+  flat: List[int] = []
+  for term in post_terms:
+    flat.extend(postings[term])
+    post_bounds.append(len(flat) // 2)
+  post_ids = array("i", flat[0::2])
+  post_tfs = array("i", flat[1::2])
+
+  # 上界候选：tf 饱和值随 tf 增大、随文档长度减小单调，最大值必落在 (tf 大, dl 小) 的天际线上，
+  # 每个词项通常只剩几篇文档，主进程据此算出与单进程构建完全相同的 max_impact
+  bound_bounds = array("i", [0])
+  bound_ids = array("i")
+  bound_tfs = array("i")
+  for i in range(len(post_terms)):
+    lo, hi = post_bounds[i], post_bounds[i + 1]
+    if hi - lo == 1:
+      bound_ids.append(post_ids[lo])
+      bound_tfs.append(post_tfs[lo])
+      bound_bounds.append(len(bound_ids))
+      continue
+    entries = sorted(
+      zip(post_ids[lo:hi], post_tfs[lo:hi]),
+      key=lambda x: (doc_len[x[0] - start], -x[1]),
+    )
+    best_tf = 0
+    for doc_idx, tf in entries:
+      if tf > best_tf:
+        best_tf = tf
+        bound_ids.append(doc_idx)
+        bound_tfs.append(tf)
+    bound_bounds.append(len(bound_ids))
+  return (
+    doc_len, doc_terms, doc_counts, post_terms, post_bounds, post_ids, post_tfs,
+    bound_bounds, bound_ids, bound_tfs,
+  )
+
+
+def expand_shard(compact: tuple) -> tuple:
+  """把 build_shard 的紧凑结果还原为 build_shard_from_tokens 的分片形式。"""
+  (
+    doc_len, doc_terms, doc_counts, post_terms, post_bounds, post_ids, post_tfs,
+    bound_bounds, bound_ids, bound_tfs,
+  ) = compact
+  counts = doc_counts.tolist()
+  doc_freqs: List[Dict[str, int]] = []
+  pos = 0
+  for terms in doc_terms:
+    doc_freqs.append(dict(zip(terms, counts[pos:pos + len(terms)])))
+    pos += len(terms)
+  pairs = list(zip(post_ids.tolist(), post_tfs.tolist()))
+  bounds = post_bounds.tolist()
+  bound_pairs = list(zip(bound_ids.tolist(), bound_tfs.tolist()))
+  bb = bound_bounds.tolist()
+  df: Dict[str, int] = {}
+  inverted: Dict[str, List[tuple[int, int]]] = {}
+  bound_postings: Dict[str, List[tuple[int, int]]] = {}
+  for i, term in enumerate(post_terms):
+    df[term] = bounds[i + 1] - bounds[i]
+    inverted[term] = pairs[bounds[i]:bounds[i + 1]]
+    bound_postings[term] = bound_pairs[bb[i]:bb[i + 1]]
+  return doc_len.tolist(), doc_freqs, df, inverted, bound_postings
+
+
+# 自动并行构建索引的门槛与进程数上限（进程启动与结果回传有固定开销，小池子单进程更快）
+PARALLEL_INDEX_MIN_DOCS = 8000
+PARALLEL_INDEX_MAX_WORKERS = 8
+# top_k 占论文池的比例超过该值时，剪枝省下的倒排遍历已抵不上候选精确重算的开销，直接全量打分
+TOP_K_PRUNE_MAX_RATIO = 0.08
+
+
 class BM25Index:
   """轻量 BM25 实现，避免额外依赖。"""
 
   def __init__(self, tokenized_docs: List[List[str]], k1: float = 1.5, b: float = 0.75):
+    self._init_from_shards([build_shard_from_tokens(tokenized_docs, 0)], k1, b)
+
+  @classmethod
+  def from_shards(cls, shards: List[tuple], k1: float = 1.5, b: float = 0.75) -> "BM25Index":
+    """由按文档顺序排列的分片（见 build_shard_from_tokens）合并出索引，结果与单线程构建一致。"""
+    index = cls.__new__(cls)
+    index._init_from_shards(shards, k1, b)
+    return index
+
+  def _init_from_shards(self, shards: List[tuple], k1: float, b: float) -> None:
     self.k1 = k1
     self.b = b
 
-    self.doc_len = [len(tokens) for tokens in tokenized_docs]
-    self.avgdl = sum(self.doc_len) / max(len(self.doc_len), 1)
+    self.doc_len: List[int] = []
     self.doc_freqs: List[Dict[str, int]] = []
     self.idf: Dict[str, float] = {}
     self.inverted: Dict[str, List[tuple[int, int]]] = {}
 
+    # 分片的文档下标已是全局下标，按分片顺序拼接即可保持倒排表的文档顺序
     df: Dict[str, int] = {}
-    for idx, tokens in enumerate(tokenized_docs):
-      freqs: Dict[str, int] = {}
-      for t in tokens:
-        freqs[t] = freqs.get(t, 0) + 1
-      self.doc_freqs.append(freqs)
-      for t in freqs.keys():
-        df[t] = df.get(t, 0) + 1
-        self.inverted.setdefault(t, []).append((idx, freqs[t]))
+    bound_postings: Dict[str, List[tuple[int, int]]] | None = {}
+    for doc_len, doc_freqs, shard_df, shard_inverted, shard_bounds in shards:
+      if shard_bounds is None:
+        bound_postings = None
+      elif bound_postings is not None:
+        for t, postings in shard_bounds.items():
+          bound_postings.setdefault(t, []).extend(postings)
+      self.doc_len.extend(doc_len)
+      self.doc_freqs.extend(doc_freqs)
+      for t, dfn in shard_df.items():
+        df[t] = df.get(t, 0) + dfn
+      for t, postings in shard_inverted.items():
+        merged = self.inverted.get(t)
+        if merged is None:
+          self.inverted[t] = postings
+        else:
+          merged.extend(postings)
+    self.avgdl = sum(self.doc_len) / max(len(self.doc_len), 1)
 
-    total_docs = len(tokenized_docs)
+    total_docs = len(self.doc_len)
     for t, dfn in df.items():
       # 标准 BM25 IDF
       self.idf[t] = math.log(1 + (total_docs - dfn + 0.5) / (dfn + 0.5))
 
+    # MaxScore 剪枝用的静态上界：每个词项在所有文档上的最大 tf 饱和值（不含 idf）
+    self.doc_norms = [self.k1 * (1 - self.b + self.b * dl / self.avgdl) for dl in self.doc_len]
+    k1p = self.k1 + 1
+    norms = self.doc_norms
+    self.max_impact: Dict[str, float] = {}
+    # 分片提供了天际线候选时只在候选上取最大值，否则遍历完整倒排表（结果相同）
+    candidates = bound_postings if bound_postings is not None else self.inverted
+    for t, postings in candidates.items():
+      self.max_impact[t] = max(tf * k1p / (tf + norms[doc_idx]) for doc_idx, tf in postings)
+
   def score(self, query_tokens: Iterable[str]) -> List[float]:
     scores = [0.0] * len(self.doc_len)
     if not self.doc_len:
@@ -145,6 +314,134 @@ class BM25Index:
 
     return scores
 
+  def _prepare_parts(self, parts: List[tuple[List[str], float]]) -> List[tuple[List[tuple[str, float, int]], float]]:
+    """把 [(tokens, weight)] 转为 [([(term, idf, q_count)], weight)]，词项顺序与 score() 的 q_tf 一致。"""
+    prepared = []
+    for tokens, weight in parts:
+      q_tf: Dict[str, int] = {}
+      for t in tokens:
+        q_tf[t] = q_tf.get(t, 0) + 1
+      terms = [(t, self.idf[t], c) for t, c in q_tf.items() if t in self.idf]
+      prepared.append((terms, weight))
+    return prepared
+
+  def exact_score(self, doc_idx: int, prepared, total_weight: float) -> float:
+    """
+    按 score() + 加权合并的原始运算顺序计算单篇文档的分数，
+    保证与全量打分逐位一致（同分时的名次也因此一致）。
+    """
+    freqs = self.doc_freqs[doc_idx]
+    dl = self.doc_len[doc_idx]
+    total = 0.0
+    for terms, weight in prepared:
+      part_score = 0.0
+      for term, idf, q_count in terms:
+        tf = freqs.get(term)
+        if not tf:
+          continue
+        denom = tf + self.k1 * (1 - self.b + self.b * dl / self.avgdl)
+        part_score += idf * (tf * (self.k1 + 1) / denom) * q_count
+      total += weight * part_score
+    return total / total_weight
+
+  def top_k(self, parts: List[tuple[List[str], float]], k: int) -> List[tuple[int, float]]:
+    """
+    MaxScore 动态剪枝（term-at-a-time 形式）求加权 BM25 的 Top K，返回 [(doc_idx, score)]。
+    - parts 为 [(query_tokens, weight)]，最终分数 = Σ weight * score(tokens) / Σ weight；
+    - 词项按上界（系数 × idf × 最大 tf 饱和值）从大到小处理；剩余词项上界之和已不足以让
+      新文档超过当前第 k 名时，不再接纳新文档，只对已有候选做 doc_freqs 点查并逐篇提前淘汰；
+    - 候选最终按原始运算顺序精确重算，按 (分数降序, 下标升序) 取前 k，与全量打分 + 稳定排序结果一致；
+    - 命中文档不足 k 篇时，按下标顺序补 0 分文档（与全量排序的行为相同）。
+    """
+    n = len(self.doc_len)
+    total_weight = sum(w for _, w in parts)
+    if n == 0 or k <= 0 or total_weight <= 0:
+      return []
+    k = min(k, n)
+
+    prepared = self._prepare_parts(parts)
+    coef: Dict[str, float] = {}
+    for terms, weight in prepared:
+      for term, idf, q_count in terms:
+        coef[term] = coef.get(term, 0.0) + weight * q_count * idf / total_weight
+    terms = sorted(
+      ((t, c, c * self.max_impact[t]) for t, c in coef.items()),
+      key=lambda x: x[2],
+      reverse=True,
+    )
+    remaining = [0.0] * (len(terms) + 1)
+    for i in range(len(terms) - 1, -1, -1):
+      remaining[i] = remaining[i + 1] + terms[i][2]
+
+    def cutoff(theta: float) -> float:
+      # 近似分数与精确分数只差浮点舍入，留出相对余量保证不误剪
+      return theta - 1e-9 * max(1.0, abs(theta))
+
+    norms = self.doc_norms
+    k1p = self.k1 + 1
+    acc = [0.0] * n
+    touched: List[int] = []
+    theta = 0.0
+    pos = 0
+    while pos < len(terms):
+      term, c, ub = terms[pos]
+      for doc_idx, tf in self.inverted[term]:
+        if not acc[doc_idx]:
+          touched.append(doc_idx)
+        acc[doc_idx] += c * (tf * k1p / (tf + norms[doc_idx]))
+      pos += 1
+      # 命中文档已满 k 篇、且剩余上界小于已处理部分的上界时，才有可能剪枝，此时再算第 k 名阈值
+      if pos < len(terms) and len(touched) >= k and remaining[pos] < remaining[0] - remaining[pos]:
+        theta = heapq.nlargest(k, [acc[doc_idx] for doc_idx in touched])[-1]
+        if remaining[pos] < cutoff(theta):
+          break
+
+    if pos < len(terms):
+      # 剩余词项只作用于已有候选：按词项逐个累加，每处理完一个词项就淘汰上界已低于阈值的文档；
+      # 候选少时逐篇点查 doc_freqs，候选多时顺扫倒排表并用掩码过滤
+      floor = cutoff(theta)
+      alive = [doc_idx for doc_idx in touched if acc[doc_idx] + remaining[pos] >= floor]
+      for i in range(pos, len(terms)):
+        term, c, _ub = terms[i]
+        postings = self.inverted[term]
+        if len(alive) * 2 < len(postings):
+          for doc_idx in alive:
+            tf = self.doc_freqs[doc_idx].get(term)
+            if tf:
+              acc[doc_idx] += c * (tf * k1p / (tf + norms[doc_idx]))
+        else:
+          mask = bytearray(n)
+          for doc_idx in alive:
+            mask[doc_idx] = 1
+          for doc_idx, tf in postings:
+            if mask[doc_idx]:
+              acc[doc_idx] += c * (tf * k1p / (tf + norms[doc_idx]))
+        if len(alive) > k:
+          # 部分分数是最终分数的下界，可以继续抬高阈值
+          floor = max(floor, cutoff(heapq.nlargest(k, [acc[doc_idx] for doc_idx in alive])[-1]))
+        alive = [doc_idx for doc_idx in alive if acc[doc_idx] + remaining[i + 1] >= floor]
+      scored = {doc_idx: acc[doc_idx] for doc_idx in alive}
+    else:
+      scored = {doc_idx: acc[doc_idx] for doc_idx in touched}
+
+    if len(scored) > k:
+      floor = cutoff(heapq.nlargest(k, scored.values())[-1])
+      candidates = [doc_idx for doc_idx, score in scored.items() if score >= floor]
+    else:
+      candidates = list(scored.keys())
+
+    exact = [(doc_idx, self.exact_score(doc_idx, prepared, total_weight)) for doc_idx in candidates]
+    exact.sort(key=lambda x: (-x[1], x[0]))
+    top = exact[:k]
+    if len(top) < k:
+      hit = set(scored.keys())
+      for doc_idx in range(n):
+        if len(top) >= k:
+          break
+        if doc_idx not in hit:
+          top.append((doc_idx, 0.0))
+    return top
+
 
 def load_config() -> dict:
   """
@@ -242,11 +539,10 @@ def load_paper_pool(path: str) -> List[Paper]:
   读取 arxiv_fetch_raw.py 生成的 JSON：
   期望结构为 [ { id, title, abstract, authors, primary_category, categories, published, link }, ... ]
   """
-  if not os.path.exists(path):
+  if not json_exists(path):
     raise FileNotFoundError(f"找不到论文池文件：{path}")
 
-  with open(path, "r", encoding="utf-8") as f:
-    raw = json.load(f)
+  raw = load_json(path)
 
   papers: List[Paper] = []
   for item in raw:
@@ -271,10 +567,62 @@ def load_paper_pool(path: str) -> List[Paper]:
   return papers
 
 
-def build_bm25_index(papers: List[Paper]) -> BM25Index:
+def resolve_index_workers(workers: int, total_docs: int) -> int:
+  """workers<=0 为自动：论文数达到 PARALLEL_INDEX_MIN_DOCS 时按 CPU 数并行，否则单进程。"""
+  if workers > 0:
+    return workers
+  if total_docs < PARALLEL_INDEX_MIN_DOCS:
+    return 1
+  return max(1, min(os.cpu_count() or 1, PARALLEL_INDEX_MAX_WORKERS))
+
+
+def build_bm25_index(papers: List[Paper], workers: int = 1) -> BM25Index:
+  """
+  构建 BM25 索引；workers>1 时把文档切成连续分片，交给进程池分词并构建分片倒排表，
+  再按分片顺序合并（文档长度、IDF、倒排顺序与单进程构建完全一致）。
+  构建过程只创建无环的 dict / list / tuple，期间暂停循环 GC，避免大量分配反复触发全代扫描。
+  """
   docs = [p.text_for_bm25 for p in papers]
-  tokenized = [tokenize(d) for d in docs]
-  return BM25Index(tokenized_docs=tokenized)
+  gc_was_enabled = gc.isenabled()
+  gc.disable()
+  try:
+    if workers <= 1 or len(docs) < 2:
+      tokenized = [tokenize(d) for d in docs]
+      return BM25Index(tokenized_docs=tokenized)
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    # 分片数取 worker 数的若干倍，摊平各分片文本长度不均带来的等待
+    num_shards = min(len(docs), workers * 4)
+    bounds = [len(docs) * i // num_shards for i in range(num_shards + 1)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+      futures = [
+        pool.submit(build_shard, docs[bounds[i]:bounds[i + 1]], bounds[i])
+        for i in range(num_shards)
+      ]
+      shards = [expand_shard(f.result()) for f in futures]
+    return BM25Index.from_shards(shards)
+  finally:
+    if gc_was_enabled:
+      gc.enable()
+
+
+def score_exhaustive(bm25: BM25Index, parts: List[tuple[List[str], float]]) -> List[tuple[int, float]]:
+  """全量打分 + 稳定排序（剪枝前的原始实现），用于 k 覆盖全池或 --exhaustive 校验。"""
+  scores: List[float] | None = None
+  total_weight = 0.0
+  for tokens, weight in parts:
+    term_scores = bm25.score(tokens)
+    if scores is None:
+      scores = [0.0] * len(term_scores)
+    for i, s in enumerate(term_scores):
+      scores[i] += weight * s
+    total_weight += weight
+  scores = scores or []
+  if total_weight > 0:
+    scores = [s / total_weight for s in scores]
+  indices = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)
+  return [(i, scores[i]) for i in indices]
 
 
 def rank_papers_for_queries(
@@ -282,11 +630,14 @@ def rank_papers_for_queries(
   papers: List[Paper],
   queries: List[dict],
   top_k: int = 50,
+  exhaustive: bool = False,
+  cutoff: CutoffPolicy | None = None,
 ) -> dict:
   """
   对每个查询分别进行 BM25 排序：
   - 使用 query_text 分词，与所有论文做 BM25 打分；
-  - 取分数最高的前 top_k 篇论文，记录 arxiv_id；
+  - 取分数最高的前 top_k 篇论文（BM25Index.top_k 做 MaxScore 剪枝，结果与全量排序一致），记录 arxiv_id；
+  - 启用 cutoff 时，再按该查询的分数分布在 [min_k, top_k] 内自适应截断；
   - 为这些论文打上 tag（tag），一篇论文可拥有多个 tag；
   - 返回结构包含：
     {
@@ -302,6 +653,10 @@ def rank_papers_for_queries(
   id_to_paper: Dict[str, Paper] = {p.id: p for p in papers}
 
   results_per_query: List[dict] = []
+  before_counts: List[int] = []
+  after_counts: List[int] = []
+  before_ids: Set[int] = set()
+  after_ids: Set[int] = set()
 
   for q in queries:
     q_text = (q.get("query_text") or "").strip()
@@ -311,8 +666,7 @@ def rank_papers_for_queries(
 
     log(f"[INFO] BM25 处理查询（{q.get('type')}）：tag={q.get('tag') or ''}")
 
-    scores: List[float] | None = None
-    total_weight = 0.0
+    parts: List[tuple[List[str], float]] = []
     query_terms = q.get("query_terms") or []
 
     if isinstance(query_terms, list) and query_terms:
@@ -323,30 +677,32 @@ def rank_papers_for_queries(
         weight = float(term.get("weight", 1.0))
         if not term_text or weight <= 0:
           continue
-        term_scores = bm25.score(tokenize(term_text))
-        if scores is None:
-          scores = [0.0] * len(term_scores)
-        for i, s in enumerate(term_scores):
-          scores[i] += weight * s
-        total_weight += weight
-
-    if scores is None:
-      scores = bm25.score(tokenize(q_text))
-      total_weight = 1.0
+        parts.append((tokenize(term_text), weight))
 
-    if total_weight > 0:
-      scores = [s / total_weight for s in scores]
+    if not parts:
+      parts = [(tokenize(q_text), 1.0)]
 
-    if top_k <= 0 or top_k > len(scores):
-      k = len(scores)
+    if top_k <= 0 or top_k > len(papers):
+      k = len(papers)
     else:
       k = top_k
 
-    indices = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:k]
+    if exhaustive or k > len(papers) * TOP_K_PRUNE_MAX_RATIO:
+      top = score_exhaustive(bm25, parts)[:k]
+    else:
+      top = bm25.top_k(parts, k)
+
+    if cutoff is not None and cutoff.active:
+      before_counts.append(len(top))
+      before_ids.update(idx for idx, _ in top)
+      top = top[: cutoff.apply([score for _, score in top], k)]
+      after_counts.append(len(top))
+      after_ids.update(idx for idx, _ in top)
+
     sim_scores: Dict[str, Dict[str, float | int]] = {}
-    for rank_idx, idx in enumerate(indices, start=1):
+    for rank_idx, (idx, score) in enumerate(top, start=1):
       pid = paper_ids[idx]
-      score = float(scores[idx])
+      score = float(score)
       sim_scores[pid] = {"score": score, "rank": rank_idx}
       if paper_tag:
         id_to_paper[pid].tags.add(paper_tag)
@@ -361,6 +717,9 @@ def rank_papers_for_queries(
       }
     )
 
+  if cutoff is not None and cutoff.active:
+    log_cutoff_summary("BM25", cutoff, before_counts, after_counts, len(before_ids), len(after_ids))
+
   return {
     "queries": results_per_query,
     "papers": id_to_paper,
@@ -370,6 +729,7 @@ def rank_papers_for_queries(
 def save_tagged_results(
   result: dict,
   output_path: str,
+  store: PaperStore | None = None,
 ) -> None:
   """
   将结果写入 JSON：
@@ -377,15 +737,18 @@ def save_tagged_results(
     "top_k": ...,
     "generated_at": "...",
     "queries": [ { type, tag, paper_tag, query_text, sim_scores: {...} }, ... ],
-    "papers": [ { id, title, abstract, ..., tags: [...] }, ... ]  // 仅保留至少有一个 tag 的论文
+    "papers": [ { id, tags: [...] }, ... ],  // 仅保留至少有一个 tag 的论文
+    "paper_store": "../papers"  // 元数据所在的按日论文库（相对路径）
   }
+  未传入 store 时退回旧格式，papers 中保留完整元数据。
   """
   from datetime import datetime, timezone
 
-  os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
-
   id_to_paper: Dict[str, Paper] = result.get("papers") or {}
-  tagged_papers = [p.to_dict() for p in id_to_paper.values() if p.tags]
+  if store is not None:
+    tagged_papers = [{"id": p.id, "tags": sorted(p.tags)} for p in id_to_paper.values() if p.tags]
+  else:
+    tagged_papers = [p.to_dict() for p in id_to_paper.values() if p.tags]
 
   q_list = result.get("queries") or []
   if q_list:
@@ -401,14 +764,88 @@ def save_tagged_results(
     "papers": tagged_papers,
     "queries": result.get("queries") or [],
   }
+  if store is not None:
+    payload["paper_store"] = paper_store_ref(store, output_path)
+
+  written = save_json(payload, output_path)
+  table_path = write_score_table(
+    payload["queries"],
+    output_path,
+    retriever="bm25",
+    generated_at=payload["generated_at"],
+  )
+  if table_path:
+    log(f"[INFO] 已写入列式打分表：{table_path}")
 
-  with open(output_path, "w", encoding="utf-8") as f:
-    json.dump(payload, f, ensure_ascii=False, indent=2)
-
-  log(f"[INFO] 已将带 tag 的论文和每个查询的 top_k 结果写入：{output_path}")
+  log(f"[INFO] 已将带 tag 的论文和每个查询的 top_k 结果写入：{written}")
   log(f"[INFO] 其中带 tag 的论文数：{len(tagged_papers)}")
 
 
+def process_single_file(
+  input_path: str,
+  output_path: str,
+  queries: List[dict],
+  top_k: int | None,
+  index_workers: int,
+  exhaustive: bool,
+  cutoff: CutoffPolicy | None = None,
+) -> None:
+  """
+  处理单个原始文件：读取论文池 -> 构建 BM25 索引 -> 逐查询检索 -> 写出结果。
+  模块级函数，批处理模式下由进程池按文件并发调用。
+  """
+  papers = load_paper_pool(input_path)
+  if not papers:
+    log(f"[ERROR] 论文池为空，跳过文件：{input_path}")
+    return
+
+  # 论文元数据统一放在按日论文库中（步骤 1 已写入；手动指定的输入在这里补齐），产物只引用 ID
+  store = PaperStore(paper_store_dir_for(input_path))
+  added = store.add(p.to_dict() for p in papers)
+  if added:
+    log(f"[INFO] 论文库 {store.store_dir} 新增 {added} 篇论文。")
+
+  total_papers = len(papers)
+  if top_k is None or top_k <= 0:
+    if total_papers <= 0:
+      dynamic_top_k = 50
+    else:
+      blocks = (total_papers - 1) // 1000
+      dynamic_top_k = 50 * (blocks + 1)
+    log(
+      f"[INFO] 文件 {os.path.basename(input_path)} 原始论文数为 {total_papers} 篇，"
+      f"自适应设置每个查询 Top K = {dynamic_top_k}。"
+    )
+  else:
+    dynamic_top_k = top_k
+    log(
+      f"[INFO] 文件 {os.path.basename(input_path)} 使用命令行指定的 Top K = {dynamic_top_k}，"
+      f"原始论文数为 {total_papers} 篇。"
+    )
+  if cutoff is not None and cutoff.active:
+    dynamic_top_k = cutoff.resolve_max_k(dynamic_top_k)
+    log(f"[INFO] 启用自适应截断 {cutoff.describe()}，召回深度 = {dynamic_top_k}。")
+
+  group_start(f"Step 2.1 - build BM25 index ({os.path.basename(input_path)})")
+  index_workers = resolve_index_workers(index_workers, total_papers)
+  log(f"[INFO] 正在为 {total_papers} 篇论文构建 BM25 索引（进程数={index_workers}）...")
+  bm25 = build_bm25_index(papers, workers=index_workers)
+  group_end()
+
+  group_start(f"Step 2.1 - rank queries ({os.path.basename(input_path)})")
+  result = rank_papers_for_queries(
+    bm25=bm25,
+    papers=papers,
+    queries=queries,
+    top_k=dynamic_top_k,
+    exhaustive=exhaustive,
+    cutoff=cutoff,
+  )
+  group_end()
+
+  save_tagged_results(result, output_path, store=store)
+
+
 def main() -> None:
   parser = argparse.ArgumentParser(
     description="步骤 2.1：使用 BM25 对 ArXiv 论文池做关键词 / LLM 查询检索并打 tag。",
@@ -443,8 +880,27 @@ def main() -> None:
     default=0.75,
     help="BM25 b 参数（默认 0.75）。",
   )
+  parser.add_argument(
+    "--workers",
+    type=int,
+    default=0,
+    help=f"构建 BM25 索引的进程数；0 为自动（论文数 >= {PARALLEL_INDEX_MIN_DOCS} 时按 CPU 数并行，否则单进程），1 为强制单进程。",
+  )
+  parser.add_argument(
+    "--file-workers",
+    type=int,
+    default=0,
+    help="批处理模式下同时处理的原始文件数；0 为自动（不超过 CPU 数与文件数，最多 4），1 为逐个处理。",
+  )
+  parser.add_argument(
+    "--exhaustive",
+    action="store_true",
+    help="关闭 Top K 剪枝，对每个查询全量打分后排序（用于校验剪枝结果）。",
+  )
 
+  add_cutoff_args(parser)
   args = parser.parse_args()
+  cutoff = policy_from_args(args)
 
   config = load_config()
   queries = build_queries_from_config(config)
@@ -452,51 +908,11 @@ def main() -> None:
     log("[ERROR] 未能从 config.yaml 中解析到 keywords / llm_queries，退出。")
     return
 
-  def process_single_file(input_path: str, output_path: str) -> None:
-    papers = load_paper_pool(input_path)
-    if not papers:
-      log(f"[ERROR] 论文池为空，跳过文件：{input_path}")
-      return
-
-    total_papers = len(papers)
-    if args.top_k is None or args.top_k <= 0:
-      if total_papers <= 0:
-        dynamic_top_k = 50
-      else:
-        blocks = (total_papers - 1) // 1000
-        dynamic_top_k = 50 * (blocks + 1)
-      log(
-        f"[INFO] 文件 {os.path.basename(input_path)} 原始论文数为 {total_papers} 篇，"
-        f"自适应设置每个查询 Top K = {dynamic_top_k}。"
-      )
-    else:
-      dynamic_top_k = args.top_k
-      log(
-        f"[INFO] 文件 {os.path.basename(input_path)} 使用命令行指定的 Top K = {dynamic_top_k}，"
-        f"原始论文数为 {total_papers} 篇。"
-      )
-
-    group_start(f"Step 2.1 - build BM25 index ({os.path.basename(input_path)})")
-    log(f"[INFO] 正在为 {total_papers} 篇论文构建 BM25 索引...")
-    bm25 = build_bm25_index(papers)
-    group_end()
-
-    group_start(f"Step 2.1 - rank queries ({os.path.basename(input_path)})")
-    result = rank_papers_for_queries(
-      bm25=bm25,
-      papers=papers,
-      queries=queries,
-      top_k=dynamic_top_k,
-    )
-    group_end()
-
-    save_tagged_results(result, output_path)
-
   if args.input:
     input_path = args.input
     if not os.path.isabs(input_path):
       input_path = os.path.abspath(os.path.join(ROOT_DIR, input_path))
-    if not os.path.exists(input_path):
+    if not json_exists(input_path):
       log(f"[ERROR] 指定的输入文件不存在：{input_path}")
       return
 
@@ -510,25 +926,33 @@ def main() -> None:
         base = base[:-5]
       output_path = os.path.join(FILTERED_DIR, f"{base}.bm25.json")
 
-    process_single_file(input_path, output_path)
+    process_single_file(input_path, output_path, queries, args.top_k, args.workers, args.exhaustive, cutoff)
   else:
     if not os.path.isdir(RAW_DIR):
       log(f"[INFO] 原始目录不存在：{RAW_DIR}（今天没有新论文，将跳过 BM25 检索）")
       return
 
-    raw_files = sorted(f for f in os.listdir(RAW_DIR) if f.lower().endswith(".json"))
+    raw_files = list_json_files(RAW_DIR)
     if not raw_files:
       log(f"[INFO] 在 {RAW_DIR} 下未找到任何 .json 原始文件。（今天没有新论文，将跳过 BM25 检索）")
       return
 
-    log(f"[INFO] 批量模式：将在 {RAW_DIR} 下处理 {len(raw_files)} 个 JSON 文件。")
+    file_workers = resolve_file_workers(args.file_workers, len(raw_files))
+    # 文件级已经并发时，索引构建固定单进程，避免进程池嵌套
+    index_workers = 1 if file_workers > 1 else args.workers
+    log(
+      f"[INFO] 批量模式：将在 {RAW_DIR} 下处理 {len(raw_files)} 个 JSON 文件"
+      f"（并发文件数={file_workers}）。"
+    )
+    tasks = []
     for name in raw_files:
       input_path = os.path.join(RAW_DIR, name)
       base = name
       if base.lower().endswith(".json"):
         base = base[:-5]
       output_path = os.path.join(FILTERED_DIR, f"{base}.bm25.json")
-      process_single_file(input_path, output_path)
+      tasks.append((input_path, output_path, queries, args.top_k, index_workers, args.exhaustive, cutoff))
+    run_file_tasks(process_single_file, tasks, file_workers)
 
 
 if __name__ == "__main__":
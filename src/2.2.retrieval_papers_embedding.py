@@ -7,15 +7,29 @@
 # 5. 将带 tag 的论文列表和每个查询的 top_k arxiv_id 写回到一个新的 JSON 文件中。
 
 import argparse
-import json
 import os
 from datetime import datetime, timezone
 from dataclasses import dataclass, field
+from functools import partial
 from typing import Dict, List, Set, Any
 
 import numpy as np
 
-from filter import EmbeddingCoarseFilter, encode_queries
+from batch_executor import ModelServer, resolve_file_workers, run_file_tasks
+from cutoff import CutoffPolicy, add_cutoff_args, log_cutoff_summary, policy_from_args
+from ann_index import ANN_INDEX_DIR, AnnIndex, day_for_artifact
+from embedding_store import STORAGE_MODES, cache_base_for, load_embeddings, load_exact_embeddings
+from filter import EmbeddingCoarseFilter, encode_queries, load_embedding_model
+from score_table import write_score_table
+from storage import (
+  PaperStore,
+  json_exists,
+  list_json_files,
+  load_json,
+  paper_store_dir_for,
+  paper_store_ref,
+  save_json,
+)
 
 
 # 当前脚本位于 src/ 下，config.yaml 在上一级目录
@@ -176,11 +190,10 @@ def load_paper_pool(path: str) -> List[Paper]:
   读取 arxiv_fetch_raw.py 生成的 JSON：
   期望结构为 [ { id, title, abstract, authors, primary_category, categories, published, link }, ... ]
   """
-  if not os.path.exists(path):
+  if not json_exists(path):
     raise FileNotFoundError(f"找不到论文池文件：{path}")
 
-  with open(path, "r", encoding="utf-8") as f:
-    raw = json.load(f)
+  raw = load_json(path)
 
   papers: List[Paper] = []
   for item in raw:
@@ -208,14 +221,17 @@ def load_paper_pool(path: str) -> List[Paper]:
 def rank_papers_for_queries(
   model,
   papers: List[Paper],
-  paper_embeddings: np.ndarray,
+  paper_embeddings: np.ndarray | None,
   queries: List[dict],
   top_k: int = 50,
+  cutoff: CutoffPolicy | None = None,
 ) -> dict:
   """
-  对每个查询分别进行相似度排序：
+  对每个查询分别进行相似度排序（查询已带 top_indices + top_scores 时直接使用，
+  即粗筛器已经算好的 top-k，此时不需要再编码查询，也不需要 paper_embeddings）：
   - 使用 query_text 编码为向量，与所有论文向量做点积；
   - 取相似度最高的前 top_k 篇论文，记录 arxiv_id；
+  - 启用 cutoff 时，再按该查询的分数分布在 [min_k, top_k] 内自适应截断；
   - 为这些论文打上 tag（tag），一篇论文可拥有多个 tag；
   - 返回结构包含：
     {
@@ -231,6 +247,21 @@ def rank_papers_for_queries(
   id_to_paper: Dict[str, Paper] = {p.id: p for p in papers}
 
   results_per_query: List[dict] = []
+  before_counts: List[int] = []
+  after_counts: List[int] = []
+  before_ids: set = set()
+  after_ids: set = set()
+
+  def apply_cutoff(indices, scores, k):
+    if cutoff is None or not cutoff.active:
+      return indices, scores
+    before_counts.append(len(indices))
+    before_ids.update(int(i) for i in indices)
+    keep = cutoff.apply(scores, k)
+    indices, scores = indices[:keep], scores[:keep]
+    after_counts.append(len(indices))
+    after_ids.update(int(i) for i in indices)
+    return indices, scores
 
   for q in queries:
     q_text = q.get("query_text") or ""
@@ -240,6 +271,25 @@ def rank_papers_for_queries(
 
     log(f"[INFO] 正在处理查询（{q.get('type')}）：tag={q.get('tag') or ''}")
 
+    if "top_indices" in q and "top_scores" in q:
+      top_indices, top_scores = apply_cutoff(list(q["top_indices"]), list(q["top_scores"]), len(q["top_indices"]))
+      sim_scores: Dict[str, Dict[str, float | int]] = {}
+      for rank_idx, (idx, score) in enumerate(zip(top_indices, top_scores), start=1):
+        pid = paper_ids[idx]
+        sim_scores[pid] = {"score": float(score), "rank": rank_idx}
+        if paper_tag:
+          id_to_paper[pid].tags.add(paper_tag)
+      results_per_query.append(
+          {
+            "type": q.get("type"),
+            "tag": q.get("tag"),
+            "paper_tag": q.get("paper_tag"),
+            "query_text": q_text,
+            "sim_scores": sim_scores,
+          }
+      )
+      continue
+
     # 查询向量编码：若底层模型（如 Qwen3-Embedding）支持 "query" prompt，则自动使用
     q_emb = encode_queries(
       model,
@@ -256,8 +306,9 @@ def rank_papers_for_queries(
       k = top_k
 
     indices = np.argsort(-sims)[:k]
+    indices, _ = apply_cutoff(indices, sims[indices], k)
     # sim_scores: 以 paper_id 为键，记录该 query 下的相似度与排名
-    sim_scores: Dict[str, Dict[str, float | int]] = {}
+    sim_scores = {}
     for rank_idx, idx in enumerate(indices, start=1):
       pid = paper_ids[idx]
       score = float(sims[idx])
@@ -276,6 +327,9 @@ def rank_papers_for_queries(
         }
     )
 
+  if cutoff is not None and cutoff.active:
+    log_cutoff_summary("Embedding", cutoff, before_counts, after_counts, len(before_ids), len(after_ids))
+
   return {
     "queries": results_per_query,
     "papers": id_to_paper,
@@ -285,6 +339,7 @@ def rank_papers_for_queries(
 def save_tagged_results(
   result: dict,
   output_path: str,
+  store: PaperStore | None = None,
 ) -> None:
   """
   将结果写入 JSON：
@@ -292,16 +347,19 @@ def save_tagged_results(
     "top_k": ...,
     "generated_at": "...",
     "queries": [ { type, tag, paper_tag, query_text, top_ids: [...] }, ... ],
-    "papers": [ { id, title, abstract, ..., tags: [...] }, ... ]  // 仅保留至少有一个 tag 的论文
+    "papers": [ { id, tags: [...] }, ... ],  // 仅保留至少有一个 tag 的论文
+    "paper_store": "../papers"  // 元数据所在的按日论文库（相对路径）
   }
+  未传入 store 时退回旧格式，papers 中保留完整元数据。
   """
   from datetime import datetime, timezone
 
-  os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
-
   id_to_paper: Dict[str, Paper] = result.get("papers") or {}
 
-  tagged_papers = [p.to_dict() for p in id_to_paper.values() if p.tags]
+  if store is not None:
+    tagged_papers = [{"id": p.id, "tags": sorted(p.tags)} for p in id_to_paper.values() if p.tags]
+  else:
+    tagged_papers = [p.to_dict() for p in id_to_paper.values() if p.tags]
 
   # 根据第一个查询推断 top_k：优先使用 sim_scores，其次兼容旧版 top_ids
   q_list = result.get("queries") or []
@@ -324,14 +382,191 @@ def save_tagged_results(
     "papers": tagged_papers,
     "queries": result.get("queries") or [],
   }
+  if store is not None:
+    payload["paper_store"] = paper_store_ref(store, output_path)
+
+  written = save_json(payload, output_path)
+  table_path = write_score_table(
+    payload["queries"],
+    output_path,
+    retriever="embedding",
+    generated_at=payload["generated_at"],
+  )
+  if table_path:
+    log(f"[INFO] 已写入列式打分表：{table_path}")
 
-  with open(output_path, "w", encoding="utf-8") as f:
-    json.dump(payload, f, ensure_ascii=False, indent=2)
-
-  log(f"[INFO] 已将带 tag 的论文和每个查询的 top_k 结果写入：{output_path}")
+  log(f"[INFO] 已将带 tag 的论文和每个查询的 top_k 结果写入：{written}")
   log(f"[INFO] 其中带 tag 的论文数：{len(tagged_papers)}")
 
 
+def process_single_file(
+  input_path: str,
+  output_path: str,
+  queries: List[dict],
+  top_k: int | None,
+  embeddings_dir: str | None,
+  ann_index_dir: str | None,
+  cutoff: CutoffPolicy | None,
+  coarse_filter: EmbeddingCoarseFilter,
+) -> None:
+  """
+  处理单个原始文件：读取论文池 -> 计算向量并粗筛 -> 逐查询打 tag -> 写出结果。
+  coarse_filter 内的模型可以是本进程加载的模型，也可以是指向模型进程的 RemoteEncoder。
+  embeddings_dir 不为空时，论文向量写入该目录下的 <原始文件名>.embeddings.npy（内存映射）。
+  ann_index_dir 不为空时，把当天的论文向量追加到跨日期 ANN 索引中。
+  """
+  papers = load_paper_pool(input_path)
+  if not papers:
+    log(f"[ERROR] 论文池为空，跳过文件：{input_path}")
+    return
+
+  # 论文元数据统一放在按日论文库中（步骤 1 已写入；手动指定的输入在这里补齐），产物只引用 ID
+  store = PaperStore(paper_store_dir_for(input_path))
+  added = store.add(p.to_dict() for p in papers)
+  if added:
+    log(f"[INFO] 论文库 {store.store_dir} 新增 {added} 篇论文。")
+
+  total_papers = len(papers)
+
+  # 自适应计算 Top K：<=1000 篇取 50；每增加 1000 篇增加 50
+  if top_k is None or top_k <= 0:
+    if total_papers <= 0:
+      dynamic_top_k = 50
+    else:
+      blocks = (total_papers - 1) // 1000  # 0: <=1000, 1: 1001~2000, ...
+      dynamic_top_k = 50 * (blocks + 1)
+    log(
+      f"[INFO] 文件 {os.path.basename(input_path)} 原始论文数为 {total_papers} 篇，"
+      f"自适应设置每个查询 Top K = {dynamic_top_k}。"
+    )
+  else:
+    dynamic_top_k = top_k
+    log(
+      f"[INFO] 文件 {os.path.basename(input_path)} 使用命令行指定的 Top K = {dynamic_top_k}，"
+      f"原始论文数为 {total_papers} 篇。"
+    )
+
+  if cutoff is not None and cutoff.active:
+    dynamic_top_k = cutoff.resolve_max_k(dynamic_top_k)
+    log(f"[INFO] 启用自适应截断 {cutoff.describe()}，召回深度 = {dynamic_top_k}。")
+
+  # 更新粗筛器的 top_k
+  coarse_filter.top_k = dynamic_top_k
+
+  mmap_path = None
+  if embeddings_dir:
+    base = os.path.basename(input_path)
+    if base.lower().endswith(".json"):
+      base = base[:-5]
+    mmap_path = os.path.join(embeddings_dir, f"{base}.embeddings.npy")
+
+  # 1) 先用通用粗筛类拿到 embeddings（流式模式下同时拿到每个查询的 top-k）
+  group_start(f"Step 2.2 - compute embeddings ({os.path.basename(input_path)})")
+  coarse_result = coarse_filter.filter(
+    items=papers,
+    queries=queries,
+    mmap_path=mmap_path,
+    cache_base=cache_base_for(input_path),
+  )
+  group_end()
+  paper_embeddings = coarse_result["embeddings"]
+
+  # 2) 再用当前文件中的 rank_papers_for_queries 做「打 tag + 生成 top_ids」
+  group_start(f"Step 2.2 - rank queries ({os.path.basename(input_path)})")
+  result = rank_papers_for_queries(
+    model=coarse_filter.model,
+    papers=papers,
+    paper_embeddings=paper_embeddings,
+    queries=coarse_result["queries"],
+    top_k=dynamic_top_k,
+    cutoff=cutoff,
+  )
+  group_end()
+
+  save_tagged_results(result, output_path, store=store)
+
+  if ann_index_dir:
+    add_to_ann_index(ann_index_dir, input_path, papers, paper_embeddings, coarse_filter.model_name)
+
+
+def add_to_ann_index(
+  ann_index_dir: str,
+  input_path: str,
+  papers: List[Paper],
+  paper_embeddings: np.ndarray | None,
+  model_name: str,
+) -> None:
+  """
+  把当天的论文向量写入 ANN 索引。
+  paper_embeddings 为粗筛返回的矩阵（指定 --embeddings-dir 时即该目录下的内存映射文件）；
+  流式模式未指定 --embeddings-dir、或量化缓存命中时没有矩阵，改读向量缓存：优先 float32 原始向量，否则反量化。
+  """
+  ids = [p.id for p in papers]
+  if paper_embeddings is None:
+    cache_base = cache_base_for(input_path)
+    cached = load_embeddings(cache_base, ids, model_name)
+    if cached is None:
+      log("[WARN] 当前文件没有可用的论文向量（流式模式需配合 --embeddings-dir 保留向量矩阵，或开启 --embedding-cache），跳过写入 ANN 索引。")
+      return
+    exact = load_exact_embeddings(cache_base, cached.shape) if cached.mode != "float32" else None
+    paper_embeddings = exact if exact is not None else cached.dequantize()
+
+  base = os.path.basename(input_path)
+  if base.lower().endswith(".json"):
+    base = base[:-5]
+  day = day_for_artifact(input_path)
+  count = AnnIndex(ann_index_dir).add(day, base, ids, [p.title for p in papers], paper_embeddings, model_name)
+  log(f"[INFO] 已写入 ANN 索引分段 {day}__{base}：{count} 条（{ann_index_dir}）")
+
+
+# 批处理多进程模式下，每个文件 worker 进程持有的粗筛器（模型本体在模型进程中）
+_WORKER_FILTER: EmbeddingCoarseFilter | None = None
+
+
+def init_file_worker(
+  model_name: str,
+  batch_size: int,
+  max_length: int | None,
+  stream: bool,
+  embedding_dtype: str | None,
+  embedding_cache: str | None,
+  embedding_cache_exact: bool,
+  quant_report: bool,
+  query_cache: bool,
+  request_queue,
+  response_queues,
+  slot_queue,
+) -> None:
+  global _WORKER_FILTER
+  encoder = ModelServer.connect(request_queue, response_queues, slot_queue)
+  _WORKER_FILTER = EmbeddingCoarseFilter(
+    model_name=model_name,
+    top_k=50,
+    device="cpu",
+    batch_size=batch_size,
+    max_length=max_length,
+    model=encoder,
+    stream=stream,
+    embedding_dtype=embedding_dtype,
+    embedding_cache=embedding_cache,
+    embedding_cache_exact=embedding_cache_exact,
+    quant_report=quant_report,
+    query_cache=query_cache,
+  )
+
+
+def process_file_in_worker(
+  input_path: str,
+  output_path: str,
+  queries: List[dict],
+  top_k: int | None,
+  embeddings_dir: str | None,
+  ann_index_dir: str | None,
+  cutoff: CutoffPolicy | None,
+) -> None:
+  process_single_file(input_path, output_path, queries, top_k, embeddings_dir, ann_index_dir, cutoff, _WORKER_FILTER)
+
+
 def main() -> None:
   parser = argparse.ArgumentParser(
     description="基于 sentence-transformers 对 ArXiv 论文池做关键词 / LLM 查询相似度筛选，并为论文打 tag。",
@@ -378,8 +613,76 @@ def main() -> None:
     default="cpu",
     help="向量模型运行设备，例如 cuda 或 cpu（默认 cpu）。",
   )
+  parser.add_argument(
+    "--file-workers",
+    type=int,
+    default=0,
+    help="批处理模式下同时处理的原始文件数；0 为自动（不超过 CPU 数与文件数，最多 4），1 为逐个处理。多文件并发时模型只在单独的模型进程中加载一份。",
+  )
+  parser.add_argument(
+    "--encode-workers",
+    type=int,
+    default=1,
+    help="CPU 上计算论文向量的进程数（默认 1）；>1 时按块分给多个进程并固定各自的 torch 线程数，结果顺序与单进程一致。仅在逐个处理文件时生效。",
+  )
+  parser.add_argument(
+    "--autotune",
+    action="store_true",
+    help="在论文池样本上标定 batch_size 与 torch 线程数并覆盖 --batch-size；结果按主机与模型缓存到 archive/embedding_autotune.json。",
+  )
+  parser.add_argument(
+    "--memory-cap-mb",
+    type=float,
+    default=None,
+    help="自动调优时单次编码允许的内存峰值（MB；CPU 为进程 RSS，CUDA 为显存），超出的组合会被淘汰。",
+  )
+  parser.add_argument(
+    "--stream",
+    action="store_true",
+    help="流式计算：先编码查询，论文向量按批到达即更新每个查询的 top-k，不在内存中保留整份向量矩阵；结果与默认模式一致。",
+  )
+  parser.add_argument(
+    "--embedding-dtype",
+    choices=["float32", "float16"],
+    default=None,
+    help="保存论文向量矩阵的类型（默认与模型输出一致，通常为 float32）；float16 占用减半，流式模式下 top-k 仍按 float32 计算。",
+  )
+  parser.add_argument(
+    "--embeddings-dir",
+    type=str,
+    default=None,
+    help="可选：把论文向量写入该目录下的 <原始文件名>.embeddings.npy（预分配的内存映射文件，可用 np.load(mmap_mode='r') 读取）。",
+  )
+  parser.add_argument(
+    "--embedding-cache",
+    choices=list(STORAGE_MODES),
+    default=None,
+    help="按日缓存论文向量到 archive/YYYYMMDD/embeddings（float32 / float16 / int8）；同一天重跑且论文列表不变时跳过编码，量化模式下检索后对候选做 float32 重打分。",
+  )
+  parser.add_argument(
+    "--embedding-cache-exact",
+    action="store_true",
+    help="量化缓存（float16 / int8）旁另存一份 float32 原始向量，重跑命中缓存时重打分不必加载模型；磁盘占用多出一份 float32 矩阵。",
+  )
+  parser.add_argument(
+    "--quant-report",
+    action="store_true",
+    help="写入向量缓存时，用当前查询输出 float32 / float16 / int8 的 recall@k 与占用，便于选择存储模式。",
+  )
+  parser.add_argument(
+    "--no-query-cache",
+    action="store_true",
+    help="不使用查询向量持久缓存（archive/query_embeddings.npz），每次重新编码所有查询。",
+  )
+  parser.add_argument(
+    "--ann-index",
+    action="store_true",
+    help="把当天的论文向量追加到跨日期 ANN 索引（archive/ann），供 python src/ann_index.py query 按日期范围检索历史论文。",
+  )
 
+  add_cutoff_args(parser)
   args = parser.parse_args()
+  cutoff = policy_from_args(args)
 
   config = load_config()
   queries = build_queries_from_config(config)
@@ -387,62 +690,31 @@ def main() -> None:
     log("[ERROR] 未能从 config.yaml 中解析到 keywords / llm_queries，退出。")
     return
 
-  # 使用 EmbeddingCoarseFilter 类进行粗筛（模型只加载一次）
-  coarse_filter = EmbeddingCoarseFilter(
-    model_name=args.model,
-    top_k=50,  # 实际 top_k 会在每个文件内根据数据量动态调整
-    device=args.device,
-    batch_size=args.batch_size,
-    max_length=args.max_length,
-  )
-
-  def process_single_file(input_path: str, output_path: str) -> None:
-    papers = load_paper_pool(input_path)
-    if not papers:
-      log(f"[ERROR] 论文池为空，跳过文件：{input_path}")
-      return
-
-    total_papers = len(papers)
-
-    # 自适应计算 Top K：<=1000 篇取 50；每增加 1000 篇增加 50
-    if args.top_k is None or args.top_k <= 0:
-      if total_papers <= 0:
-        dynamic_top_k = 50
-      else:
-        blocks = (total_papers - 1) // 1000  # 0: <=1000, 1: 1001~2000, ...
-        dynamic_top_k = 50 * (blocks + 1)
-      log(
-        f"[INFO] 文件 {os.path.basename(input_path)} 原始论文数为 {total_papers} 篇，"
-        f"自适应设置每个查询 Top K = {dynamic_top_k}。"
-      )
-    else:
-      dynamic_top_k = args.top_k
-      log(
-        f"[INFO] 文件 {os.path.basename(input_path)} 使用命令行指定的 Top K = {dynamic_top_k}，"
-        f"原始论文数为 {total_papers} 篇。"
-      )
-
-    # 更新粗筛器的 top_k
-    coarse_filter.top_k = dynamic_top_k
-
-    # 1) 先用通用粗筛类拿到 embeddings
-    group_start(f"Step 2.2 - compute embeddings ({os.path.basename(input_path)})")
-    coarse_result = coarse_filter.filter(items=papers, queries=queries)
-    group_end()
-    paper_embeddings = coarse_result["embeddings"]
-
-    # 2) 再用当前文件中的 rank_papers_for_queries 做「打 tag + 生成 top_ids」
-    group_start(f"Step 2.2 - rank queries ({os.path.basename(input_path)})")
-    result = rank_papers_for_queries(
-      model=coarse_filter.model,
-      papers=papers,
-      paper_embeddings=paper_embeddings,
-      queries=queries,
-      top_k=dynamic_top_k,
+  def build_local_filter() -> EmbeddingCoarseFilter:
+    # 使用 EmbeddingCoarseFilter 类进行粗筛（模型只加载一次）
+    return EmbeddingCoarseFilter(
+      model_name=args.model,
+      top_k=50,  # 实际 top_k 会在每个文件内根据数据量动态调整
+      device=args.device,
+      batch_size=args.batch_size,
+      max_length=args.max_length,
+      encode_workers=args.encode_workers,
+      autotune=args.autotune,
+      memory_cap_mb=args.memory_cap_mb,
+      stream=args.stream,
+      embedding_dtype=args.embedding_dtype,
+      embedding_cache=args.embedding_cache,
+      embedding_cache_exact=args.embedding_cache_exact,
+      quant_report=args.quant_report,
+      query_cache=not args.no_query_cache,
     )
-    group_end()
 
-    save_tagged_results(result, output_path)
+  embeddings_dir = None
+  if args.embeddings_dir:
+    embeddings_dir = args.embeddings_dir
+    if not os.path.isabs(embeddings_dir):
+      embeddings_dir = os.path.abspath(os.path.join(ROOT_DIR, embeddings_dir))
+  ann_index_dir = ANN_INDEX_DIR if args.ann_index else None
 
   # 决定处理哪些输入文件：
   # - 如果指定了 --input，则只处理该文件；
@@ -451,7 +723,7 @@ def main() -> None:
     input_path = args.input
     if not os.path.isabs(input_path):
       input_path = os.path.abspath(os.path.join(ROOT_DIR, input_path))
-    if not os.path.exists(input_path):
+    if not json_exists(input_path):
       log(f"[ERROR] 指定的输入文件不存在：{input_path}")
       return
 
@@ -466,20 +738,27 @@ def main() -> None:
         base = base[:-5]
       output_path = os.path.join(FILTERED_DIR, f"{base}.embedding.json")
 
-    process_single_file(input_path, output_path)
+    coarse_filter = build_local_filter()
+    try:
+      process_single_file(input_path, output_path, queries, args.top_k, embeddings_dir, ann_index_dir, cutoff, coarse_filter)
+    finally:
+      coarse_filter.close()
   else:
     if not os.path.isdir(RAW_DIR):
       log(f"[INFO] 原始目录不存在：{RAW_DIR}（今天没有新论文，将跳过 Embedding 检索）")
       return
 
-    raw_files = sorted(
-      f for f in os.listdir(RAW_DIR) if f.lower().endswith(".json")
-    )
+    raw_files = list_json_files(RAW_DIR)
     if not raw_files:
       log(f"[INFO] 在 {RAW_DIR} 下未找到任何 .json 原始文件。（今天没有新论文，将跳过 Embedding 检索）")
       return
 
-    log(f"[INFO] 批量模式：将在 {RAW_DIR} 下处理 {len(raw_files)} 个 JSON 文件。")
+    file_workers = resolve_file_workers(args.file_workers, len(raw_files))
+    log(
+      f"[INFO] 批量模式：将在 {RAW_DIR} 下处理 {len(raw_files)} 个 JSON 文件"
+      f"（并发文件数={file_workers}）。"
+    )
+    tasks = []
     for name in raw_files:
       input_path = os.path.join(RAW_DIR, name)
       # 批量模式下，输出文件名与原始文件名保持一致，但目录变为 archive/YYYYMMDD/filtered
@@ -487,7 +766,46 @@ def main() -> None:
       if base.lower().endswith(".json"):
         base = base[:-5]
       output_path = os.path.join(FILTERED_DIR, f"{base}.embedding.json")
-      process_single_file(input_path, output_path)
+      tasks.append((input_path, output_path, queries, args.top_k, embeddings_dir, ann_index_dir, cutoff))
+
+    if file_workers <= 1:
+      coarse_filter = build_local_filter()
+      try:
+        for task in tasks:
+          process_single_file(*task, coarse_filter)
+      finally:
+        coarse_filter.close()
+      return
+
+    if args.encode_workers > 1:
+      log("[WARN] 多文件并发时编码由模型进程统一完成，忽略 --encode-workers。")
+    if args.autotune:
+      log("[WARN] 多文件并发时模型在模型进程中，无法在文件 worker 里调整 batch_size / 线程数，忽略 --autotune。")
+    if args.memory_cap_mb is not None:
+      log("[WARN] 多文件并发时不做自动调优，忽略 --memory-cap-mb。")
+
+    # 多文件并发：模型只在模型进程中加载一份，各文件 worker 通过队列提交编码批次；
+    # 每个批次仍是一次独立的 encode() 调用，向量结果与单进程逐文件处理一致
+    load_model = partial(load_embedding_model, args.model, args.device, args.max_length)
+    with ModelServer(load_model, num_clients=file_workers) as server:
+      run_file_tasks(
+        process_file_in_worker,
+        tasks,
+        file_workers,
+        initializer=init_file_worker,
+        initargs=(
+          args.model,
+          args.batch_size,
+          args.max_length,
+          args.stream,
+          args.embedding_dtype,
+          args.embedding_cache,
+          args.embedding_cache_exact,
+          args.quant_report,
+          not args.no_query_cache,
+          *server.client_initargs(),
+        ),
+      )
 
 
 if __name__ == "__main__":
@@ -6,11 +6,15 @@
 # 4. 输出融合后的 JSON，供下一步 reranker 使用。
 
 import argparse
-import json
 import os
 from datetime import datetime, timezone
 from typing import Any, Dict, List, Tuple
 
+import storage
+from rank_lists import make_query_key, normalize_rank_list
+from score_table import read_rank_lists, write_score_table
+from storage import json_exists, load_json, open_paper_store, paper_store_ref
+
 
 SCRIPT_DIR = os.path.dirname(__file__)
 ROOT_DIR = os.path.abspath(os.path.join(SCRIPT_DIR, ".."))
@@ -31,59 +35,9 @@ def group_end() -> None:
   print("::endgroup::", flush=True)
 
 
-def load_json(path: str) -> Dict[str, Any]:
-  if not os.path.exists(path):
-    raise FileNotFoundError(f"找不到文件：{path}")
-  with open(path, "r", encoding="utf-8") as f:
-    return json.load(f)
-
-
 def save_json(data: Dict[str, Any], path: str) -> None:
-  os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
-  with open(path, "w", encoding="utf-8") as f:
-    json.dump(data, f, ensure_ascii=False, indent=2)
-  log(f"[INFO] 已写入融合结果：{path}")
-
-
-def make_query_key(q: Dict[str, Any]) -> Tuple[str, str]:
-  """
-  生成用于对齐 BM25 / Embedding 查询的稳定键。
-  优先使用 paper_tag（同一意图在 2.1/2.2 里一致），再退回 tag / query_text。
-  """
-  q_type = str(q.get("type") or "")
-  key_text = (
-    str(q.get("paper_tag") or "")
-    or str(q.get("tag") or "")
-    or str(q.get("query_text") or "")
-  )
-  return (q_type, key_text)
-
-
-def normalize_rank_list(sim_scores: Any) -> List[Tuple[str, int]]:
-  """从 sim_scores 中提取 (paper_id, rank) 列表。"""
-  if not isinstance(sim_scores, dict) or not sim_scores:
-    return []
-
-  items: List[Tuple[str, float | None, int | None]] = []
-  for pid, meta in sim_scores.items():
-    if isinstance(meta, dict):
-      score = meta.get("score")
-      rank = meta.get("rank")
-    else:
-      score = None
-      rank = None
-    items.append((str(pid), float(score) if score is not None else None, int(rank) if rank is not None else None))
-
-  has_rank = all(r is not None for _, _, r in items)
-  if has_rank:
-    items_sorted = sorted(items, key=lambda x: x[2])
-  else:
-    items_sorted = sorted(items, key=lambda x: (x[1] is None, -(x[1] or 0.0)))
-
-  rank_list: List[Tuple[str, int]] = []
-  for idx, (pid, _score, _rank) in enumerate(items_sorted, start=1):
-    rank_list.append((pid, idx))
-  return rank_list
+  written = storage.save_json(data, path)
+  log(f"[INFO] 已写入融合结果：{written}")
 
 
 def rrf_fuse(
@@ -191,15 +145,15 @@ def main() -> None:
     out_path = os.path.abspath(os.path.join(ROOT_DIR, out_path))
 
   # 检查输入文件是否存在，如果不存在说明今天没有新论文，优雅退出
-  if not os.path.exists(bm25_path) and not os.path.exists(emb_path):
+  if not json_exists(bm25_path) and not json_exists(emb_path):
     log("[INFO] BM25 和 Embedding 结果文件都不存在（今天没有新论文，将跳过 RRF 融合）")
     return
 
-  if not os.path.exists(bm25_path):
+  if not json_exists(bm25_path):
     log(f"[INFO] BM25 结果文件不存在：{bm25_path}（将跳过 RRF 融合）")
     return
 
-  if not os.path.exists(emb_path):
+  if not json_exists(emb_path):
     log(f"[INFO] Embedding 结果文件不存在：{emb_path}（将跳过 RRF 融合）")
     return
 
@@ -214,6 +168,15 @@ def main() -> None:
   bm25_map = {make_query_key(q): q for q in bm25_queries}
   emb_map = {make_query_key(q): q for q in emb_queries}
 
+  # 上游写了列式打分表时直接按段读取已排好序的 (paper_id, rank)，否则回退到 sim_scores
+  bm25_table = read_rank_lists(bm25_path, bm25_data.get("generated_at") or "")
+  emb_table = read_rank_lists(emb_path, emb_data.get("generated_at") or "")
+  if bm25_table is not None or emb_table is not None:
+    log(
+      f"[INFO] 使用列式打分表：bm25={'yes' if bm25_table is not None else 'no'} "
+      f"embedding={'yes' if emb_table is not None else 'no'}"
+    )
+
   all_keys = list({*bm25_map.keys(), *emb_map.keys()})
   log(f"[INFO] RRF keys={len(all_keys)} | bm25_queries={len(bm25_queries)} | emb_queries={len(emb_queries)}")
 
@@ -238,15 +201,23 @@ def main() -> None:
     q_paper_tag = bm25_q.get("paper_tag") or emb_q.get("paper_tag") or ""
     q_text = bm25_q.get("query_text") or emb_q.get("query_text") or ""
 
-    bm25_ranks = normalize_rank_list(bm25_q.get("sim_scores"))
-    emb_ranks = normalize_rank_list(emb_q.get("sim_scores"))
+    table_key = f"{q_type}::{q_key_text}"
+    if bm25_table is not None:
+      bm25_ranks = bm25_table.get(table_key, [])
+    else:
+      bm25_ranks = normalize_rank_list(bm25_q.get("sim_scores"))
+    if emb_table is not None:
+      emb_ranks = emb_table.get(table_key, [])
+    else:
+      emb_ranks = normalize_rank_list(emb_q.get("sim_scores"))
 
     score_map = rrf_fuse(bm25_ranks, emb_ranks, args.rrf_k)
     if not score_map:
       continue
 
     sorted_items = sorted(score_map.items(), key=lambda x: x[1], reverse=True)
-    top_items = sorted_items[: args.top_n]
+    # RRF 分数只由名次决定，不再按分数分布截断：自适应截断只在 2.1 / 2.2 的原始分数上做一次
+    top_items = sorted_items[:args.top_n]
 
     sim_scores: Dict[str, Dict[str, float | int]] = {}
     for rank_idx, (pid, score) in enumerate(top_items, start=1):
@@ -279,8 +250,16 @@ def main() -> None:
     "papers": tagged_papers,
     "queries": fused_queries,
   }
+  # 上游产物只引用论文 ID 时，沿用同一个按日论文库（路径相对于输出文件重新计算）
+  for data, path in ((bm25_data, bm25_path), (emb_data, emb_path)):
+    if data.get("paper_store"):
+      payload["paper_store"] = paper_store_ref(open_paper_store(data, path), out_path)
+      break
 
   save_json(payload, out_path)
+  table_path = write_score_table(fused_queries, out_path, retriever="rrf", generated_at=payload["generated_at"])
+  if table_path:
+    log(f"[INFO] 已写入列式打分表：{table_path}")
 
 
 if __name__ == "__main__":
@@ -1,14 +1,21 @@
 #!/usr/bin/env python
-# 使用柏拉图 Rerank API 对候选论文做重排序（简化版）。
+# 使用柏拉图 Rerank API（或本地 CPU cross-encoder，见 reranker.py）对候选论文做重排序（简化版）。
 
 import argparse
-import json
 import os
 import random
+import time
+from dataclasses import dataclass
 from datetime import datetime, timezone
 from typing import Any, Dict, List, Optional, Tuple
 
-from llm import BltClient
+import storage
+from handoff import RankStreamWriter
+from planner import record_stage
+from rank_lists import query_key
+from score_table import read_rank_lists
+from reranker import MAX_CHARS_PER_DOC, add_reranker_args, build_documents, reranker_from_args
+from storage import hydrate_papers, json_exists, load_json, open_paper_store, paper_store_ref
 
 SCRIPT_DIR = os.path.dirname(__file__)
 ROOT_DIR = os.path.abspath(os.path.join(SCRIPT_DIR, ".."))
@@ -17,11 +24,31 @@ ARCHIVE_DIR = os.path.join(ROOT_DIR, "archive", TODAY_STR)
 FILTERED_DIR = os.path.join(ARCHIVE_DIR, "filtered")
 RANKED_DIR = os.path.join(ARCHIVE_DIR, "rank")
 
-MAX_CHARS_PER_DOC = 850
 BATCH_SIZE = 100
 TOKEN_SAFETY = 29000
 RRF_K = 60
 
+# 级联 rerank 的默认参数：每片按 RRF 排名取 CASCADE_SLICE 篇（一片恰好是一次 rerank 请求），
+# 最新一片里至少 CASCADE_MIN_HITS 篇的 relevance_score ≥ 阈值时才继续扩展下一片。
+# 阈值按后端区分：API 返回 [0, 1] 的相关度；本地 CrossEncoder.predict 返回 logit，0 对应 sigmoid 后的 0.5
+CASCADE_SLICE = BATCH_SIZE
+CASCADE_THRESHOLDS = {"api": 0.5, "local": 0.0}
+CASCADE_MIN_HITS = 1
+CASCADE_AUDIT_K = 10
+# 审计时全量 rerank 的打乱顺序按 (种子, 查询) 固定，便于复现对比结果
+CASCADE_AUDIT_SEED = 0
+
+
+@dataclass
+class CascadeConfig:
+  slice_size: int = CASCADE_SLICE
+  threshold: float = CASCADE_THRESHOLDS["api"]
+  min_hits: int = CASCADE_MIN_HITS
+  # audit=True 时每个查询再做一次全量 rerank，对比两者 top audit_k 的集合（会多花一倍调用）
+  audit: bool = False
+  audit_k: int = CASCADE_AUDIT_K
+  audit_seed: int = CASCADE_AUDIT_SEED
+
 
 def log(message: str) -> None:
   ts = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
@@ -61,46 +88,20 @@ def score_to_stars(score: float) -> int:
   return 1
 
 
-def load_json(path: str) -> Dict[str, Any]:
-  if not os.path.exists(path):
-    raise FileNotFoundError(f"找不到文件：{path}")
-  with open(path, "r", encoding="utf-8") as f:
-    return json.load(f)
-
-
 def save_json(data: Dict[str, Any], path: str) -> None:
-  os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
-  with open(path, "w", encoding="utf-8") as f:
-    json.dump(data, f, ensure_ascii=False, indent=2)
-  log(f"[INFO] 已将打分结果写入：{path}")
-
-
-def format_doc(title: str, abstract: str) -> str:
-  content = f"Title: {title}\nAbstract: {abstract}".strip()
-  if len(content) > MAX_CHARS_PER_DOC:
-    content = content[:MAX_CHARS_PER_DOC]
-  return content
-
-
-def build_documents(papers_by_id: Dict[str, Dict[str, Any]], paper_ids: List[str]) -> List[str]:
-  docs: List[str] = []
-  for pid in paper_ids:
-    p = papers_by_id.get(pid)
-    if not p:
-      docs.append(f"[Missing paper {pid}]")
-      continue
-    title = (p.get("title") or "").strip()
-    abstract = (p.get("abstract") or "").strip()
-    if title or abstract:
-      docs.append(format_doc(title, abstract))
-    else:
-      docs.append(f"[Empty paper {pid}]")
-  return docs
+  written = storage.save_json(data, path)
+  log(f"[INFO] 已将打分结果写入：{written}")
 
 
-def get_top_ids(query_obj: Dict[str, Any]) -> List[str]:
+def get_top_ids(
+  query_obj: Dict[str, Any],
+  rank_lists: Optional[Dict[str, List[Tuple[str, int]]]] = None,
+) -> List[str]:
   sim_scores = query_obj.get("sim_scores") or {}
   top_ids = query_obj.get("top_ids") or []
+  if not top_ids and rank_lists is not None:
+    # 列式打分表里各查询段已按 rank 排好序，直接取 paper_id 列
+    top_ids = [pid for pid, _rank in rank_lists.get(query_key(query_obj), [])]
   if not top_ids and isinstance(sim_scores, dict) and sim_scores:
     top_ids = sorted(sim_scores.keys(), key=lambda pid: sim_scores[pid].get("rank", 1e9))
   return list(top_ids)
@@ -139,75 +140,266 @@ def rrf_merge(scores: Dict[int, float], rank_idx: int, orig_idx: int) -> None:
   scores[orig_idx] = scores.get(orig_idx, 0.0) + 1.0 / (RRF_K + rank_idx)
 
 
+def parse_rerank_results(response: Dict[str, Any]) -> List[Dict[str, Any]]:
+  """兼容 {"output": {"results": [...]}} 与 {"results": [...]}，按 relevance_score 降序返回。"""
+  if isinstance(response, dict) and "output" in response:
+    results = response.get("output", {}).get("results", [])
+  else:
+    results = response.get("results", [])
+  return sorted(
+    results or [],
+    key=lambda x: x.get("relevance_score", x.get("score", 0.0)),
+    reverse=True,
+  )
+
+
+def batch_tokens(batch_docs: List[str], query_tokens: int, encoder) -> int:
+  return query_tokens + sum(estimate_tokens(doc, encoder) for doc in batch_docs)
+
+
+def rerank_full(
+  reranker: Any,
+  q_text: str,
+  documents: List[str],
+  query_tokens: int,
+  encoder,
+  rerank_model: str,
+  rng: Optional[random.Random] = None,
+) -> Tuple[Dict[int, float], Dict[str, int]]:
+  """
+  全量模式：打乱候选后分批 rerank，各批内的名次用 RRF 合并。返回 (rrf_scores, {calls, tokens})。
+  rng 为 None 时使用全局随机数；级联审计传入按查询固定种子的 Random，保证结果可复现。
+  """
+  docs_with_idx = list(enumerate(documents))
+  (rng or random).shuffle(docs_with_idx)
+  batches = iter_batches(docs_with_idx, query_tokens, encoder)
+  log(f"[INFO] 全量 rerank：candidates={len(documents)} | batches={len(batches)}")
+
+  rrf_scores: Dict[int, float] = {}
+  usage = {"calls": 0, "tokens": 0}
+  for batch_idx, (batch_indices, batch_docs) in enumerate(batches, 1):
+    log(
+      f"[INFO] 发送批次 {batch_idx}/{len(batches)} | docs={len(batch_docs)}"
+    )
+    response = reranker.rerank(
+      query=q_text,
+      documents=batch_docs,
+      top_n=len(batch_docs),
+      model=rerank_model,
+    )
+    usage["calls"] += 1
+    usage["tokens"] += batch_tokens(batch_docs, query_tokens, encoder)
+    for rank_idx, item in enumerate(parse_rerank_results(response), start=1):
+      idx = int(item.get("index", -1))
+      if idx < 0 or idx >= len(batch_indices):
+        continue
+      orig_idx = batch_indices[idx]
+      rrf_merge(rrf_scores, rank_idx, orig_idx)
+  return rrf_scores, usage
+
+
+def rerank_cascade(
+  reranker: Any,
+  q_text: str,
+  documents: List[str],
+  query_tokens: int,
+  encoder,
+  rerank_model: str,
+  cascade: CascadeConfig,
+) -> Tuple[Dict[int, float], Dict[str, int]]:
+  """
+  级联模式：documents 已按 RRF 排名排序，先 rerank 最前面的一片；
+  只要最新一片里仍有至少 min_hits 篇的 relevance_score ≥ threshold，就继续扩展下一片。
+  各片的 relevance_score 来自同一个逐点打分模型，可以直接比较：按分数整体排序后，
+  与全量模式一样用 RRF 名次得分输出（相当于所有已 rerank 的候选在同一批内排序）。
+  """
+  relevance: Dict[int, float] = {}
+  usage = {"calls": 0, "tokens": 0, "slices": 0}
+  slice_size = max(1, cascade.slice_size)
+  for start in range(0, len(documents), slice_size):
+    docs_with_idx = [(i, documents[i]) for i in range(start, min(start + slice_size, len(documents)))]
+    hits = 0
+    for batch_indices, batch_docs in iter_batches(docs_with_idx, query_tokens, encoder):
+      response = reranker.rerank(
+        query=q_text,
+        documents=batch_docs,
+        top_n=len(batch_docs),
+        model=rerank_model,
+      )
+      usage["calls"] += 1
+      usage["tokens"] += batch_tokens(batch_docs, query_tokens, encoder)
+      for item in parse_rerank_results(response):
+        idx = int(item.get("index", -1))
+        if idx < 0 or idx >= len(batch_indices):
+          continue
+        score = float(item.get("relevance_score", item.get("score", 0.0)))
+        relevance[batch_indices[idx]] = score
+        if score >= cascade.threshold:
+          hits += 1
+    usage["slices"] += 1
+    log(
+      f"[INFO] 级联第 {usage['slices']} 片：RRF 名次 {start + 1}-{start + len(docs_with_idx)}，"
+      f"relevance≥{cascade.threshold} 的有 {hits} 篇"
+    )
+    if hits < cascade.min_hits:
+      break
+
+  rrf_scores: Dict[int, float] = {}
+  ordered = sorted(relevance.items(), key=lambda x: x[1], reverse=True)
+  for rank_idx, (orig_idx, _score) in enumerate(ordered, start=1):
+    rrf_merge(rrf_scores, rank_idx, orig_idx)
+  return rrf_scores, usage
+
+
+def full_rerank_cost(documents: List[str], query_tokens: int, encoder) -> Dict[str, int]:
+  """不实际调用时估算全量 rerank 的调用数与 token（按 RRF 顺序分批）。"""
+  batches = iter_batches(list(enumerate(documents)), query_tokens, encoder)
+  return {
+    "calls": len(batches),
+    "tokens": sum(batch_tokens(docs, query_tokens, encoder) for _, docs in batches),
+  }
+
+
+def top_set(rrf_scores: Dict[int, float], k: int) -> set:
+  return {idx for idx, _ in sorted(rrf_scores.items(), key=lambda x: x[1], reverse=True)[:k]}
+
+
+def log_cascade_summary(stats: Dict[str, Any]) -> None:
+  saved_calls = stats["full_calls"] - stats["calls"]
+  saved_tokens = stats["full_tokens"] - stats["tokens"]
+  log(
+    f"[INFO] 级联 rerank 汇总：queries={stats['queries']}，调用 {stats['calls']}/{stats['full_calls']}"
+    f"（节省 {saved_calls}），tokens≈{stats['tokens']}/{stats['full_tokens']}"
+    f"（节省 {saved_tokens}，{(saved_tokens / stats['full_tokens'] * 100) if stats['full_tokens'] else 0:.1f}%），"
+    f"rerank 候选 {stats['docs']}/{stats['full_docs']}"
+  )
+  if stats.get("audited"):
+    log(
+      f"[INFO] 级联审计：top{stats['audit_k']} 集合与全量不同的查询 {stats['top_set_differs']}/{stats['audited']}，"
+      f"平均重合率 {stats['mean_overlap']:.3f}"
+    )
+
+
 def process_file(
-  reranker: BltClient,
+  reranker: Any,  # llm.BltClient 或 reranker.LocalCrossEncoderReranker，rerank() 返回格式相同
   input_path: str,
   output_path: str,
   top_n: Optional[int],
   rerank_model: str,
+  cascade: Optional[CascadeConfig] = None,
+  stream: Optional[RankStreamWriter] = None,
+  max_candidates: Optional[int] = None,
 ) -> None:
+  """
+  stream 不为空时，每个查询 rerank 完成后立即把 ranked 写入流式交接文件（步骤 4 --follow 读取）。
+  max_candidates 限制每个查询按 RRF 排名送去 rerank 的候选数（planner 按预算降级时传入）。
+  """
   data = load_json(input_path)
   papers_list = data.get("papers") or []
   queries = data.get("queries") or []
   if not papers_list or not queries:
     log(f"[WARN] 文件 {os.path.basename(input_path)} 中缺少 papers 或 queries，跳过。")
+    if stream is not None:
+      stream.done(None, status="skipped")
     return
 
-  papers_by_id = {str(p.get("id")): p for p in papers_list if p.get("id")}
+  if stream is not None:
+    stream.start(
+      input_path,
+      [{"type": q.get("type"), "tag": q.get("tag"), "query_text": q.get("query_text")} for q in queries],
+    )
+
+  # 中间产物只带 {id, tags} 时，从按日论文库补齐候选论文的标题/摘要；写回的 papers 仍保持引用形态
+  rank_lists = read_rank_lists(input_path, data.get("generated_at") or "")
+  if rank_lists is not None:
+    keys = [query_key(q) for q in queries]
+    if len(set(keys)) != len(keys):
+      rank_lists = None
+    else:
+      log(f"[INFO] 使用列式打分表选取 rerank 候选：queries={len(rank_lists)}")
+
+  papers_by_id = {str(p.get("id")): dict(p) for p in papers_list if p.get("id")}
+  if data.get("paper_store"):
+    store = open_paper_store(data, input_path)
+    candidate_ids = {pid for q in queries for pid in get_top_ids(q, rank_lists)}
+    hydrate_papers(list(papers_by_id.values()), store, candidate_ids)
+    data["paper_store"] = paper_store_ref(store, output_path)
   encoder = build_token_encoder()
   group_start(f"Step 3 - rerank {os.path.basename(input_path)}")
   log(
     f"[INFO] 开始 rerank：queries={len(queries)}，papers={len(papers_list)}，"
     f"batch_size={BATCH_SIZE}，max_chars={MAX_CHARS_PER_DOC}，token_safety={TOKEN_SAFETY}"
   )
+  if cascade is not None:
+    log(
+      f"[INFO] 级联模式：slice={cascade.slice_size}，threshold={cascade.threshold}，"
+      f"min_hits={cascade.min_hits}，audit={cascade.audit}"
+    )
+  cascade_stats: Dict[str, Any] = {
+    "queries": 0, "calls": 0, "tokens": 0, "docs": 0,
+    "full_calls": 0, "full_tokens": 0, "full_docs": 0,
+    "audited": 0, "audit_k": cascade.audit_k if cascade else 0, "top_set_differs": 0, "overlap_sum": 0.0,
+  }
+  if max_candidates:
+    log(f"[INFO] 每个查询最多 rerank {max_candidates} 篇候选（按 RRF 排名截断）")
+  totals = {"calls": 0, "tokens": 0, "docs": 0}
+  started_at = time.time()
 
   for q_idx, q in enumerate(queries, start=1):
     q_text = (q.get("rewrite") or q.get("query_text") or "").strip()
-    top_ids = get_top_ids(q)
+    top_ids = get_top_ids(q, rank_lists)
+    if max_candidates:
+      top_ids = top_ids[:max_candidates]
     if not q_text or not top_ids:
       continue
 
     group_start(f"Query {q_idx}/{len(queries)} tag={q.get('tag') or ''}")
     documents = build_documents(papers_by_id, top_ids)
-    docs_with_idx = list(enumerate(documents))
-    random.shuffle(docs_with_idx)
 
     query_tokens = estimate_tokens(q_text, encoder)
-    batches = iter_batches(docs_with_idx, query_tokens, encoder)
     log(
       f"[INFO] Query {q_idx}/{len(queries)} tag={q.get('tag') or ''} | candidates={len(top_ids)} "
-      f"| batches={len(batches)} | query_tokens≈{query_tokens}"
+      f"| query_tokens≈{query_tokens}"
     )
 
-    rrf_scores: Dict[int, float] = {}
-
     try:
-      for batch_idx, (batch_indices, batch_docs) in enumerate(batches, 1):
-        log(
-          f"[INFO] 发送批次 {batch_idx}/{len(batches)} | docs={len(batch_docs)}"
+      if cascade is None:
+        rrf_scores, usage = rerank_full(reranker, q_text, documents, query_tokens, encoder, rerank_model)
+      else:
+        # top_ids 已按 RRF 排名排序，级联从排名最前的一片开始
+        rrf_scores, usage = rerank_cascade(
+          reranker, q_text, documents, query_tokens, encoder, rerank_model, cascade
         )
-        response = reranker.rerank(
-          query=q_text,
-          documents=batch_docs,
-          top_n=len(batch_docs),
-          model=rerank_model,
-        )
-        if isinstance(response, dict) and "output" in response:
-          results = response.get("output", {}).get("results", [])
+        if cascade.audit:
+          full_scores, full_usage = rerank_full(
+            reranker, q_text, documents, query_tokens, encoder, rerank_model,
+            rng=random.Random(f"{cascade.audit_seed}:{q_text}"),
+          )
+          totals["calls"] += full_usage["calls"]
+          totals["tokens"] += full_usage["tokens"]
+          k = min(cascade.audit_k, len(full_scores))
+          if k > 0:
+            overlap = len(top_set(rrf_scores, k) & top_set(full_scores, k)) / k
+            cascade_stats["audited"] += 1
+            cascade_stats["overlap_sum"] += overlap
+            if overlap < 1.0:
+              cascade_stats["top_set_differs"] += 1
         else:
-          results = response.get("results", [])
-
-        ranked = sorted(
-          results or [],
-          key=lambda x: x.get("relevance_score", x.get("score", 0.0)),
-          reverse=True,
+          full_usage = full_rerank_cost(documents, query_tokens, encoder)
+        cascade_stats["queries"] += 1
+        cascade_stats["calls"] += usage["calls"]
+        cascade_stats["tokens"] += usage["tokens"]
+        cascade_stats["docs"] += len(rrf_scores)
+        cascade_stats["full_calls"] += full_usage["calls"]
+        cascade_stats["full_tokens"] += full_usage["tokens"]
+        cascade_stats["full_docs"] += len(documents)
+        log(
+          f"[INFO] 级联 rerank：{usage['slices']} 片 / {len(rrf_scores)} 篇，调用 {usage['calls']}"
+          f"（全量 {full_usage['calls']}），tokens≈{usage['tokens']}（全量 ≈{full_usage['tokens']}）"
         )
-        for rank_idx, item in enumerate(ranked, start=1):
-          idx = int(item.get("index", -1))
-          if idx < 0 or idx >= len(batch_indices):
-            continue
-          orig_idx = batch_indices[idx]
-          rrf_merge(rrf_scores, rank_idx, orig_idx)
+      totals["calls"] += usage["calls"]
+      totals["tokens"] += usage["tokens"]
+      totals["docs"] += len(rrf_scores)
 
       if not rrf_scores:
         log("[WARN] 本次 query 未得到有效 rerank 结果，跳过。")
@@ -241,18 +433,47 @@ def process_file(
 
     ranked_for_query.sort(key=lambda x: x["score"], reverse=True)
     q["ranked"] = ranked_for_query
+    if stream is not None:
+      stream.query(q_idx, {"tag": q.get("tag"), "ranked": ranked_for_query})
+
+  if cascade is not None and cascade_stats["queries"]:
+    audited = cascade_stats["audited"]
+    cascade_stats["mean_overlap"] = cascade_stats.pop("overlap_sum") / audited if audited else None
+    log_cascade_summary(cascade_stats)
+    data["rerank_cascade"] = {
+      "slice_size": cascade.slice_size,
+      "threshold": cascade.threshold,
+      "min_hits": cascade.min_hits,
+      **cascade_stats,
+    }
 
   meta_generated_at = data.get("generated_at") or ""
   data["reranked_at"] = datetime.utcnow().isoformat()
   data["generated_at"] = meta_generated_at
 
   save_json(data, output_path)
+  if stream is not None:
+    stream.done(output_path)
+  seconds = time.time() - started_at
+  record_stage(
+    "rerank",
+    {
+      "requests": totals["calls"],
+      "prompt_tokens": totals["tokens"],
+      "completion_tokens": 0,
+      "seconds": round(seconds, 1),
+      "docs": totals["docs"],
+      "queries": len(queries),
+      "max_candidates": max_candidates,
+    },
+    [("rerank", {"calls": totals["calls"], "prompt_tokens": totals["tokens"], "completion_tokens": 0, "seconds": seconds}, totals["docs"])],
+  )
   group_end()
 
 
 def main() -> None:
   parser = argparse.ArgumentParser(
-    description="步骤 3：使用 BLT Rerank API 对候选论文做重排序（简化版）。",
+    description="步骤 3：使用 BLT Rerank API 或本地 cross-encoder 对候选论文做重排序（简化版）。",
   )
   parser.add_argument(
     "--input",
@@ -279,6 +500,56 @@ def main() -> None:
     help="BLT Rerank 模型名称（默认 qwen3-reranker-4b）。",
   )
 
+  parser.add_argument(
+    "--cascade",
+    action="store_true",
+    help="级联 rerank：按 RRF 排名先 rerank 前一片，最新一片仍有高分候选时才扩展下一片。",
+  )
+  parser.add_argument(
+    "--cascade-slice",
+    type=int,
+    default=CASCADE_SLICE,
+    help=f"级联每片的候选数（默认 {CASCADE_SLICE}，与 rerank 批大小一致）。",
+  )
+  parser.add_argument(
+    "--cascade-threshold",
+    type=float,
+    default=None,
+    help=(
+      "级联继续扩展所需的 relevance_score 阈值（默认按后端：api 为 "
+      f"{CASCADE_THRESHOLDS['api']}，local 为 logit {CASCADE_THRESHOLDS['local']}，即 sigmoid 后 0.5）。"
+    ),
+  )
+  parser.add_argument(
+    "--cascade-min-hits",
+    type=int,
+    default=CASCADE_MIN_HITS,
+    help=f"最新一片中至少多少篇达到阈值才继续扩展（默认 {CASCADE_MIN_HITS}）。",
+  )
+  parser.add_argument(
+    "--cascade-audit",
+    action="store_true",
+    help=f"审计：每个查询同时做一次全量 rerank，统计 top{CASCADE_AUDIT_K} 集合与级联结果不同的比例（调用数翻倍）。",
+  )
+  parser.add_argument(
+    "--cascade-audit-seed",
+    type=int,
+    default=CASCADE_AUDIT_SEED,
+    help=f"审计时全量 rerank 打乱候选所用的随机种子（与查询文本组合，默认 {CASCADE_AUDIT_SEED}）。",
+  )
+  parser.add_argument(
+    "--stream-out",
+    type=str,
+    default=None,
+    help="可选：每个查询 rerank 完成后立即追加到该 JSONL（步骤 4 --follow 跟随读取，两步可并行）。",
+  )
+  parser.add_argument(
+    "--max-candidates",
+    type=int,
+    default=None,
+    help="每个查询最多 rerank 的候选数（按 RRF 排名截断；main.py 按预算降级时传入）。",
+  )
+  add_reranker_args(parser)
   args = parser.parse_args()
 
   input_path = args.input
@@ -289,22 +560,46 @@ def main() -> None:
   if not os.path.isabs(output_path):
     output_path = os.path.abspath(os.path.join(ROOT_DIR, output_path))
 
-  if not os.path.exists(input_path):
+  stream = None
+  if args.stream_out:
+    stream_path = args.stream_out
+    if not os.path.isabs(stream_path):
+      stream_path = os.path.abspath(os.path.join(ROOT_DIR, stream_path))
+    stream = RankStreamWriter(stream_path)
+
+  if not json_exists(input_path):
     log(f"[WARN] 输入文件不存在（今天可能没有新论文）：{input_path}，将跳过 Step 3。")
+    if stream is not None:
+      stream.done(None, status="skipped")
     return
 
-  api_key = os.getenv("BLT_API_KEY")
-  if not api_key:
-    raise RuntimeError("缺少 BLT_API_KEY 环境变量，无法调用 BLT Rerank API。")
-
-  reranker = BltClient(api_key=api_key, model=args.rerank_model)
-  process_file(
-    reranker=reranker,
-    input_path=input_path,
-    output_path=output_path,
-    top_n=args.top_n,
-    rerank_model=args.rerank_model,
-  )
+  try:
+    reranker = reranker_from_args(args, args.rerank_model)
+    process_file(
+      reranker=reranker,
+      input_path=input_path,
+      output_path=output_path,
+      top_n=args.top_n,
+      rerank_model=args.rerank_model,
+      cascade=CascadeConfig(
+        slice_size=args.cascade_slice,
+        threshold=(
+          args.cascade_threshold
+          if args.cascade_threshold is not None
+          else CASCADE_THRESHOLDS[args.rerank_backend]
+        ),
+        min_hits=args.cascade_min_hits,
+        audit=args.cascade_audit,
+        audit_seed=args.cascade_audit_seed,
+      ) if args.cascade else None,
+      stream=stream,
+      max_candidates=args.max_candidates,
+    )
+  except BaseException:
+    # 让跟随方立即退出，而不是等到超时
+    if stream is not None:
+      stream.done(None, status="failed")
+    raise
 
 
 if __name__ == "__main__":
@@ -8,7 +8,11 @@ import time
 from datetime import datetime, timezone
 from typing import Any, Dict, List, Tuple
 
-from llm import BltClient
+import storage
+from handoff import DEFAULT_FOLLOW_TIMEOUT_S, follow_rank_stream
+from llm import BatchChatClient, BatchDeferred, BatchSession, BltClient
+from planner import record_stage, refine_profile
+from storage import hydrate_papers, json_exists, load_json, open_paper_store, paper_store_ref
 
 SCRIPT_DIR = os.path.dirname(__file__)
 ROOT_DIR = os.path.abspath(os.path.join(SCRIPT_DIR, ".."))
@@ -31,18 +35,9 @@ def group_start(title: str) -> None:
 
 def group_end() -> None:
     print("::endgroup::", flush=True)
-def load_json(path: str) -> Dict[str, Any]:
-    if not os.path.exists(path):
-        raise FileNotFoundError(f"missing file: {path}")
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
-
-
 def save_json(data: Dict[str, Any], path: str) -> None:
-    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-    log(f"[INFO] saved: {path}")
+    written = storage.save_json(data, path)
+    log(f"[INFO] saved: {written}")
 
 
 def load_config() -> Dict[str, Any]:
@@ -148,63 +143,42 @@ def chunk_list(items: List[Any], batch_size: int) -> List[List[Any]]:
     return [items[i : i + batch_size] for i in range(0, len(items), batch_size)]
 
 
-def call_filter(
-    client: BltClient,
-    keywords: List[Dict[str, str]],
-    queries: List[Dict[str, str]],
-    docs: List[Dict[str, str]],
-    debug_dir: str,
-    debug_tag: str,
-) -> List[Dict[str, Any]]:
-    def load_json_lenient(text: str) -> Dict[str, Any]:
-        """
-        宽松解析模型返回的 JSON。
-        兼容常见问题：
-        - JSON 后面夹带了额外文本（json.loads 报 Extra data）
-        - 前后包含多余空白或换行
-        """
-        raw = (text or "").strip()
-        if not raw:
-            return {}
-
-        decoder = json.JSONDecoder()
-        try:
-            obj, _idx = decoder.raw_decode(raw)
+def load_json_lenient(text: str) -> Dict[str, Any]:
+    """
+    宽松解析模型返回的 JSON。
+    兼容常见问题：
+    - JSON 后面夹带了额外文本（json.loads 报 Extra data）
+    - 前后包含多余空白或换行
+    """
+    raw = (text or "").strip()
+    if not raw:
+        return {}
+
+    decoder = json.JSONDecoder()
+    try:
+        obj, _idx = decoder.raw_decode(raw)
+        return obj if isinstance(obj, dict) else {}
+    except Exception:
+        start = raw.find("{")
+        end = raw.rfind("}")
+        if start != -1 and end != -1 and end > start:
+            clipped = raw[start : end + 1]
+            obj = json.loads(clipped)
             return obj if isinstance(obj, dict) else {}
-        except Exception:
-            start = raw.find("{")
-            end = raw.rfind("}")
-            if start != -1 and end != -1 and end > start:
-                clipped = raw[start : end + 1]
-                obj = json.loads(clipped)
-                return obj if isinstance(obj, dict) else {}
-            raise
-
-    schema = {
+        raise
+
+
+def results_schema(properties: Dict[str, Any]) -> Dict[str, Any]:
+    """{"results": [{<properties>}]}，所有字段必填。"""
+    return {
         "type": "object",
         "properties": {
             "results": {
                 "type": "array",
                 "items": {
                     "type": "object",
-                    "properties": {
-                        "id": {"type": "string"},
-                        "evidence_en": {"type": "string"},
-                        "evidence_cn": {"type": "string"},
-                        "tldr_en": {"type": "string"},
-                        "tldr_cn": {"type": "string"},
-                        "score": {"type": "number"},
-                        "tags": {"type": "array", "items": {"type": "string"}},
-                    },
-                    "required": [
-                        "id",
-                        "evidence_en",
-                        "evidence_cn",
-                        "tldr_en",
-                        "tldr_cn",
-                        "score",
-                        "tags",
-                    ],
+                    "properties": properties,
+                    "required": list(properties.keys()),
                     "additionalProperties": False,
                 },
             }
@@ -213,6 +187,17 @@ def call_filter(
         "additionalProperties": False,
     }
 
+
+def chat_results(
+    client: BltClient,
+    system_prompt: str,
+    user_prompt: str,
+    schema_name: str,
+    schema: Dict[str, Any],
+    debug_dir: str,
+    debug_tag: str,
+) -> List[Dict[str, Any]]:
+    """发送一次结构化请求并解析出 results 列表；解析失败时把原始输出写入 debug_dir 并抛出 ValueError。"""
     use_json_object = "gemini" in (client.model or "").lower()
     if use_json_object:
         response_format = {"type": "json_object"}
@@ -220,12 +205,158 @@ def call_filter(
         response_format = {
             "type": "json_schema",
             "json_schema": {
-                "name": "rerank_batch",
+                "name": schema_name,
                 "schema": schema,
                 "strict": True,
             },
         }
 
+    resp = client.chat(
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt},
+        ],
+        response_format=response_format,
+    )
+    content = resp.get("content", "")
+    try:
+        payload = load_json_lenient(content)
+    except Exception as exc:
+        preview = (content or "").strip().replace("\n", " ")
+        if len(preview) > 800:
+            preview = preview[:800] + "..."
+        debug_path = ""
+        if debug_dir:
+            os.makedirs(debug_dir, exist_ok=True)
+            tag = debug_tag or f"batch_{int(time.time())}"
+            debug_path = os.path.join(debug_dir, f"filter_raw_{tag}.txt")
+            with open(debug_path, "w", encoding="utf-8") as f:
+                f.write(content or "")
+        msg = f"JSON parse failed: {exc}. raw={preview}"
+        if debug_path:
+            msg = f"{msg} | saved={debug_path}"
+        raise ValueError(msg)
+    results = payload.get("results", [])
+    if not isinstance(results, list):
+        return []
+    return results
+
+
+WIRE_FORMATS = ("full", "compact")
+# 紧凑线格式的字段短键：请求与响应里的长字段名 / arXiv ID 每批每篇都重复一次，输出越短补全越快
+WIRE_KEYS = {
+    "id": "i",
+    "content": "c",
+    "score": "s",
+    "tags": "g",
+    "evidence_en": "ee",
+    "evidence_cn": "ec",
+    "tldr_en": "te",
+    "tldr_cn": "tc",
+}
+WIRE_FIELDS = {v: k for k, v in WIRE_KEYS.items()}
+
+
+class WireCodec:
+    """
+    步骤 4 的紧凑线格式：tag 换成短别名（k1.. / q1..），每批论文 ID 换成批内序号，
+    字段名换成 WIRE_KEYS 中的短键；decode() 把模型输出还原成 paper_id 与原始 tag 值，
+    merge_results / llm_ranked 的格式与 full 模式完全相同。
+    """
+
+    def __init__(self, keywords: List[Dict[str, str]], queries: List[Dict[str, str]]):
+        self.tag_to_alias: Dict[str, str] = {}
+        self.keywords = [{**k, "tag": self._alias(k["tag"], f"k{i}")} for i, k in enumerate(keywords, start=1)]
+        self.queries = [{**q, "tag": self._alias(q["tag"], f"q{i}")} for i, q in enumerate(queries, start=1)]
+        self.alias_to_tag = {v: k for k, v in self.tag_to_alias.items()}
+
+    def _alias(self, tag: str, alias: str) -> str:
+        self.tag_to_alias[tag] = alias
+        return alias
+
+    def encode_docs(self, docs: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Dict[str, str]]:
+        """返回 (短键文档列表, 批内序号 -> paper_id)；序号只在本批内有效，并发批次互不影响。"""
+        encoded: List[Dict[str, Any]] = []
+        id_map: Dict[str, str] = {}
+        for idx, doc in enumerate(docs, start=1):
+            alias = str(idx)
+            id_map[alias] = str(doc.get("id"))
+            item: Dict[str, Any] = {}
+            for key, value in doc.items():
+                if key == "id":
+                    value = alias
+                elif key == "tags":
+                    value = [self.tag_to_alias.get(t, t) for t in value or []]
+                item[WIRE_KEYS.get(key, key)] = value
+            encoded.append(item)
+        return encoded, id_map
+
+    def encode_fields(self, properties: Dict[str, Any]) -> Dict[str, Any]:
+        return {WIRE_KEYS.get(k, k): v for k, v in properties.items()}
+
+    def example(self, example_json: str) -> str:
+        example = json.loads(example_json)
+        results = [
+            {WIRE_KEYS.get(k, k): ("1" if k == "id" else v) for k, v in item.items()}
+            for item in example.get("results") or []
+        ]
+        for item in results:
+            if "g" in item:
+                item["g"] = [a for a in ("k1", "q1") if a in self.alias_to_tag][: len(item["g"])]
+        return json.dumps({"results": results}, ensure_ascii=False)
+
+    def legend(self, properties: Dict[str, Any]) -> str:
+        keys = ", ".join(f"{WIRE_KEYS.get(k, k)}={k}" for k in properties)
+        return (
+            "\n\nCOMPACT FORMAT (overrides field names above): "
+            "papers are given as i=id, c=content (plus s=score, g=tags when present). "
+            f"Output keys: {keys}. Use each paper's i value as its id. "
+            "Tag values are short aliases (k* for keywords, q* for queries): return the aliases, not the full tags."
+        )
+
+    def decode(self, results: List[Dict[str, Any]], id_map: Dict[str, str]) -> List[Dict[str, Any]]:
+        decoded: List[Dict[str, Any]] = []
+        for item in results:
+            if not isinstance(item, dict):
+                continue
+            out = {WIRE_FIELDS.get(k, k): v for k, v in item.items()}
+            pid = id_map.get(str(out.get("id", "")).strip())
+            if pid is None:
+                continue
+            out["id"] = pid
+            if isinstance(out.get("tags"), list):
+                tags = [self.alias_to_tag.get(str(t).strip(), str(t).strip()) for t in out["tags"]]
+                out["tags"] = [t for t in tags if t in self.tag_to_alias]
+            decoded.append(out)
+        return decoded
+
+
+def call_filter(
+    client: BltClient,
+    keywords: List[Dict[str, str]],
+    queries: List[Dict[str, str]],
+    docs: List[Dict[str, str]],
+    debug_dir: str,
+    debug_tag: str,
+    codec: WireCodec | None = None,
+) -> List[Dict[str, Any]]:
+    properties = {
+        "id": {"type": "string"},
+        "evidence_en": {"type": "string"},
+        "evidence_cn": {"type": "string"},
+        "tldr_en": {"type": "string"},
+        "tldr_cn": {"type": "string"},
+        "score": {"type": "number"},
+        "tags": {"type": "array", "items": {"type": "string"}},
+    }
+    schema = results_schema(codec.encode_fields(properties) if codec is not None else properties)
+    example = "{\"results\": [{\"id\": \"paper_id\", \"evidence_en\": \"short English phrase\", \"evidence_cn\": \"简短中文短语\", \"tldr_en\": \"one-sentence TLDR\", \"tldr_cn\": \"一句话 TLDR\", \"score\": 7, \"tags\": [\"tag1\", \"tag2\"]}]}"
+    id_map: Dict[str, str] = {}
+    if codec is not None:
+        keywords, queries = codec.keywords, codec.queries
+        docs, id_map = codec.encode_docs(docs)
+        example = codec.example(example)
+
     system_prompt = (
         "You are an intelligent Research Relevance Evaluator. "
         "Score papers (0-10) based purely on relevance to the user's profile and queries. "
@@ -250,7 +381,7 @@ def call_filter(
         "Papers:\n"
         f"{json.dumps(docs, ensure_ascii=False)}\n\n"
         "Output JSON format example:\n"
-        "{\"results\": [{\"id\": \"paper_id\", \"evidence_en\": \"short English phrase\", \"evidence_cn\": \"简短中文短语\", \"tldr_en\": \"one-sentence TLDR\", \"tldr_cn\": \"一句话 TLDR\", \"score\": 7, \"tags\": [\"tag1\", \"tag2\"]}]}\n\n"
+        f"{example}\n\n"
         "Requirement: You MUST return exactly one result for every input paper. "
         "The results length must match the papers length, and every input id must appear once.\n\n"
         "Output must be a single-line JSON string. "
@@ -270,36 +401,597 @@ def call_filter(
         "If unrelated, use evidence_en=\"not relevant\", evidence_cn=\"不相关\", "
         "tldr_en=\"not relevant\", tldr_cn=\"不相关\", score 0, and tags=[]."
     )
+    if codec is not None:
+        user_prompt += codec.legend(properties)
+    results = chat_results(client, system_prompt, user_prompt, "rerank_batch", schema, debug_dir, debug_tag)
+    return codec.decode(results, id_map) if codec is not None else results
 
-    resp = client.chat(
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt},
+
+SCORING_RUBRIC = (
+    "SCORING RUBRIC:\n"
+    "9-10: Perfect Match (directly answers a query and aligns with interests)\n"
+    "7-8: Domain Hit (strongly aligns with interests, slightly broader than query)\n"
+    "5-6: Methodological Bridge (transferable method/approach)\n"
+    "3-4: Tangential (same broad discipline, weak link)\n"
+    "0-2: Noise (irrelevant)\n\n"
+    "GUARDRAILS:\n"
+    "1) Beware of Polysemy: If a keyword is ambiguous, only match the sense that aligns with the user's intent.\n"
+    "2) Reject Literal Matching: Do NOT assign a tag just because the word appears; require conceptual relevance.\n\n"
+)
+
+
+def call_score(
+    client: BltClient,
+    keywords: List[Dict[str, str]],
+    queries: List[Dict[str, str]],
+    docs: List[Dict[str, str]],
+    debug_dir: str,
+    debug_tag: str,
+    codec: WireCodec | None = None,
+) -> List[Dict[str, Any]]:
+    """两阶段模式的第一阶段：只输出 score 与 tags（与 call_filter 相同的评分标准），输出 token 很少。"""
+    properties = {
+        "id": {"type": "string"},
+        "score": {"type": "number"},
+        "tags": {"type": "array", "items": {"type": "string"}},
+    }
+    schema = results_schema(codec.encode_fields(properties) if codec is not None else properties)
+    example = "{\"results\": [{\"id\": \"paper_id\", \"score\": 7, \"tags\": [\"tag1\"]}]}"
+    id_map: Dict[str, str] = {}
+    if codec is not None:
+        keywords, queries = codec.keywords, codec.queries
+        docs, id_map = codec.encode_docs(docs)
+        example = codec.example(example)
+
+    system_prompt = (
+        "You are an intelligent Research Relevance Evaluator. "
+        "Score papers (0-10) based purely on relevance to the user's profile and queries. "
+        "Use the rubric and return JSON only."
+    )
+    user_prompt = (
+        "USER PROFILE:\n"
+        f"Long_Term_Interests = {json.dumps(keywords, ensure_ascii=False)}\n"
+        f"Current_Search_Queries = {json.dumps(queries, ensure_ascii=False)}\n\n"
+        + SCORING_RUBRIC
+        + "Papers:\n"
+        f"{json.dumps(docs, ensure_ascii=False)}\n\n"
+        "Output JSON format example:\n"
+        f"{example}\n\n"
+        "Requirement: You MUST return exactly one result for every input paper, and every input id must appear once. "
+        "Output a single-line JSON string with only id, score (0-10) and tags; no explanations. "
+        "Tags must be selected from the provided tag values (keep prefixes like \"keyword:\" or \"query:\" as-is); "
+        "use tags=[] for unrelated papers."
+    )
+    if codec is not None:
+        user_prompt += codec.legend(properties)
+    results = chat_results(client, system_prompt, user_prompt, "score_batch", schema, debug_dir, debug_tag)
+    return codec.decode(results, id_map) if codec is not None else results
+
+
+def call_enrich(
+    client: BltClient,
+    keywords: List[Dict[str, str]],
+    queries: List[Dict[str, str]],
+    docs: List[Dict[str, Any]],
+    debug_dir: str,
+    debug_tag: str,
+    codec: WireCodec | None = None,
+) -> List[Dict[str, Any]]:
+    """两阶段模式的第二阶段：只为高分论文生成中英双语 evidence 与 TLDR（docs 带上第一阶段的 score / tags）。"""
+    properties = {
+        "id": {"type": "string"},
+        "evidence_en": {"type": "string"},
+        "evidence_cn": {"type": "string"},
+        "tldr_en": {"type": "string"},
+        "tldr_cn": {"type": "string"},
+    }
+    schema = results_schema(codec.encode_fields(properties) if codec is not None else properties)
+    example = "{\"results\": [{\"id\": \"paper_id\", \"evidence_en\": \"short English phrase\", \"evidence_cn\": \"简短中文短语\", \"tldr_en\": \"one-sentence TLDR\", \"tldr_cn\": \"一句话 TLDR\"}]}"
+    id_map: Dict[str, str] = {}
+    if codec is not None:
+        keywords, queries = codec.keywords, codec.queries
+        docs, id_map = codec.encode_docs(docs)
+        example = codec.example(example)
+
+    system_prompt = (
+        "You are a research assistant writing short bilingual recommendation notes. "
+        "Each paper has already been judged relevant; explain why and summarize it. Return JSON only."
+    )
+    user_prompt = (
+        "USER PROFILE:\n"
+        f"Long_Term_Interests = {json.dumps(keywords, ensure_ascii=False)}\n"
+        f"Current_Search_Queries = {json.dumps(queries, ensure_ascii=False)}\n\n"
+        "Papers (with the relevance score and matched tags already assigned):\n"
+        f"{json.dumps(docs, ensure_ascii=False)}\n\n"
+        "Output JSON format example:\n"
+        f"{example}\n\n"
+        "Requirement: You MUST return exactly one result for every input paper, and every input id must appear once.\n\n"
+        "Output must be a single-line JSON string. "
+        "Do not include line breaks inside any string fields. "
+        "Avoid double quotes inside evidence text fields.\n\n"
+        "Evidence must be provided in both languages: evidence_en (English) and evidence_cn (Chinese). "
+        "They should be short phrases linking the paper to the queries or interests (matching its tags); "
+        "they do NOT need to be direct quotes. "
+        "TLDR should be one sentence summarizing what the paper does and why it matters. "
+        "Keep TLDR concise: <= 120 characters in English and <= 60 Chinese characters."
+    )
+    if codec is not None:
+        user_prompt += codec.legend(properties)
+    results = chat_results(client, system_prompt, user_prompt, "enrich_batch", schema, debug_dir, debug_tag)
+    return codec.decode(results, id_map) if codec is not None else results
+
+
+def make_filter_client(filter_model: str, max_output_tokens: int) -> BltClient:
+    api_key = os.getenv("BLT_API_KEY")
+    if not api_key:
+        raise RuntimeError("missing BLT_API_KEY")
+
+    filter_client = BltClient(api_key=api_key, model=filter_model)
+    filter_client.kwargs.update({"temperature": 0.1, "max_tokens": max_output_tokens})
+    return filter_client
+
+
+def build_docs(candidate_ids: List[str], paper_map: Dict[str, Dict[str, Any]], max_chars: int) -> List[Dict[str, str]]:
+    docs: List[Dict[str, str]] = []
+    for pid in candidate_ids:
+        paper = paper_map.get(pid)
+        if not paper:
+            continue
+        title = (paper.get("title") or "").strip()
+        abstract = (paper.get("abstract") or "").strip()
+        content = format_doc(title, abstract, max_chars)
+        docs.append({"id": pid, "content": content})
+    return docs
+
+
+def merge_results(
+    merged: Dict[str, Dict[str, Any]],
+    results: List[Dict[str, Any]],
+    batch: List[Dict[str, str]],
+) -> None:
+    batch_ids = {str(d.get("id")) for d in batch}
+    for item in results:
+        pid = str(item.get("id", "")).strip()
+        if pid not in batch_ids:
+            continue
+        try:
+            score = float(item.get("score", 0))
+        except Exception:
+            score = 0.0
+        # 新字段：中英双语 evidence（兼容旧字段 evidence）
+        evidence_en = str(item.get("evidence_en") or "").strip()
+        evidence_cn = str(item.get("evidence_cn") or "").strip()
+        tldr_en = str(item.get("tldr_en") or "").strip()
+        tldr_cn = str(item.get("tldr_cn") or "").strip()
+        legacy = str(item.get("evidence", "")).strip()
+        if not evidence_en:
+            evidence_en = legacy
+        if not evidence_cn:
+            # 若模型未返回中文 evidence，则回退为英文（下游可再做翻译/展示策略）
+            evidence_cn = legacy or evidence_en
+        if not tldr_en:
+            tldr_en = "not relevant" if score <= 0 else evidence_en
+        if not tldr_cn:
+            tldr_cn = "不相关" if score <= 0 else (evidence_cn or tldr_en)
+        tags = item.get("tags")
+        if not isinstance(tags, list):
+            tags = []
+        tags = [str(t).strip() for t in tags if str(t).strip()]
+        prev = merged.get(pid)
+        if (prev is None) or (score > float(prev.get("score", 0))):
+            merged[pid] = {
+                "paper_id": pid,
+                "score": score,
+                "evidence_en": evidence_en,
+                "evidence_cn": evidence_cn,
+                "tldr_en": tldr_en,
+                "tldr_cn": tldr_cn,
+                "tags": tags,
+            }
+
+
+REFINE_MODES = ("single", "two-phase")
+DEFAULT_ENRICH_MIN_SCORE = 6.0  # 与步骤 5 split_layers 的最低分层（llm_score >= 6）一致
+DEFAULT_FAST_FILTER_MODEL = os.getenv("BLT_FAST_FILTER_MODEL") or "gpt-4o-mini"
+DEFAULT_RESCORE_BAND = (4.0, 7.0)
+# 批处理模式按阶段分轮提交：后一阶段的请求要用到前一阶段的结果
+PHASE_STAGES = {"filter": 0, "score": 0, "filter_rescore": 1, "score_rescore": 1, "enrich": 2}
+
+
+def usage_delta(after: Dict[str, Any], before: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: after.get(k, 0) - before.get(k, 0) for k in after}
+
+
+def cascade_agreement(pairs: List[Tuple[float, float]], threshold: float) -> Dict[str, Any]:
+    """快慢两档模型对同一论文的打分一致性；threshold 两侧是否一致决定了复核是否改变了入选结果。"""
+    n = len(pairs)
+    if not n:
+        return {"pairs": 0}
+    diffs = [s2 - s1 for s1, s2 in pairs]
+    return {
+        "pairs": n,
+        "mean_abs_diff": round(sum(abs(d) for d in diffs) / n, 3),
+        "mean_diff": round(sum(diffs) / n, 3),
+        "exact": round(sum(1 for d in diffs if d == 0) / n, 3),
+        "within_1": round(sum(1 for d in diffs if abs(d) <= 1) / n, 3),
+        "same_side": round(sum(1 for s1, s2 in pairs if (s1 >= threshold) == (s2 >= threshold)) / n, 3),
+        "promoted": sum(1 for s1, s2 in pairs if s1 < threshold <= s2),
+        "demoted": sum(1 for s1, s2 in pairs if s2 < threshold <= s1),
+    }
+
+
+class Refiner:
+    """
+    把候选批次送去精读并合并到 merged：
+    - single：一次请求同时输出 score / tags / 双语 evidence / TLDR（原有行为）；
+    - two-phase：先对全部候选只打分（score + tags），score >= enrich_min_score 的论文攒满一批后
+      再请求中英双语 evidence 与 TLDR，低分论文不再生成长文本。
+    两种模式都按阶段统计调用次数、token 与耗时，stats() 写入输出的 llm_refine_stats。
+    wire="compact" 时请求与响应使用 WireCodec 的短键 / 短别名格式，合并前还原。
+    传入 fast_client 时按模型分档：快模型先给全部候选打分，分数落在 rescore_band（闭区间）内
+    或漏掉的论文攒满一批后由 client（强模型）重新打分并以其结果为准，同时记录两档的一致性。
+    传入 batch_session 时客户端为 BatchChatClient：还没有批处理结果的请求记为 deferred，
+    这一批按失败处理，由 refine_in_batches 提交后重放。
+    """
+
+    def __init__(
+        self,
+        client: BltClient,
+        keywords: List[Dict[str, str]],
+        query_items: List[Dict[str, str]],
+        mode: str = "single",
+        enrich_min_score: float = DEFAULT_ENRICH_MIN_SCORE,
+        batch_size: int = 10,
+        wire: str = "full",
+        fast_client: BltClient | None = None,
+        rescore_band: Tuple[float, float] = DEFAULT_RESCORE_BAND,
+        batch_session: BatchSession | None = None,
+    ):
+        if mode not in REFINE_MODES:
+            raise ValueError(f"unknown refine mode: {mode}")
+        if wire not in WIRE_FORMATS:
+            raise ValueError(f"unknown wire format: {wire}")
+        self.client = client
+        self.fast_client = fast_client
+        self.keywords = keywords
+        self.query_items = query_items
+        self.mode = mode
+        self.enrich_min_score = float(enrich_min_score)
+        self.batch_size = max(1, int(batch_size))
+        self.wire = wire
+        self.codec = WireCodec(keywords, query_items) if wire == "compact" else None
+        self.rescore_band = (float(min(rescore_band)), float(max(rescore_band)))
+        self.batch_session = batch_session
+        self.deferred = 0
+        self.debug_dir = os.path.join(RANKED_DIR, "debug")
+        self.merged: Dict[str, Dict[str, Any]] = {}
+        self.pending_enrich: List[Dict[str, Any]] = []
+        self.pending_rescore: List[Dict[str, str]] = []
+        self.fast_results: Dict[str, Dict[str, Any]] = {}
+        self.fast_scores: List[float] = []
+        self.agreement_pairs: List[Tuple[float, float]] = []
+        self.enrich_count = 0
+        self.rescore_count = 0
+        self.rescored = 0
+        self.enriched = 0
+        self.candidates = 0
+        self.phase_usage: Dict[str, Dict[str, Any]] = {}
+        self.phase_wall: Dict[str, float] = {}
+        self.started_at = time.time()
+
+    def _run_phase(
+        self,
+        phase: str,
+        fn,
+        docs: List[Dict[str, Any]],
+        debug_tag: str,
+        client: BltClient | None = None,
+    ) -> List[Dict[str, Any]] | None:
+        client = client or self.client
+        if isinstance(client, BatchChatClient):
+            client.stage = PHASE_STAGES[phase]
+        before = client.usage()
+        t0 = time.time()
+        try:
+            return fn(
+                client,
+                self.keywords,
+                self.query_items,
+                docs,
+                debug_dir=self.debug_dir,
+                debug_tag=debug_tag,
+                codec=self.codec,
+            )
+        except BatchDeferred:
+            self.deferred += 1
+            return None
+        except Exception as exc:
+            log(f"[WARN] {phase} batch failed: {exc}")
+            return None
+        finally:
+            delta = usage_delta(client.usage(), before)
+            acc = self.phase_usage.setdefault(phase, {k: 0 for k in delta})
+            for k, v in delta.items():
+                acc[k] = acc.get(k, 0) + v
+            self.phase_wall[phase] = self.phase_wall.get(phase, 0.0) + (time.time() - t0)
+
+    @property
+    def profile(self) -> str:
+        return refine_profile(self.mode, self.wire, self.fast_client is not None, self.batch_session is not None)
+
+    @property
+    def _score_phase(self):
+        return ("filter", call_filter) if self.mode == "single" else ("score", call_score)
+
+    def run_batch(self, batch: List[Dict[str, str]], debug_tag: str) -> None:
+        self.candidates += len(batch)
+        phase, fn = self._score_phase
+        results = self._run_phase(phase, fn, batch, debug_tag, self.fast_client)
+        if results is None and self.fast_client is None:
+            return
+        scored: Dict[str, Dict[str, Any]] = {}
+        # 分档模式下快模型整批失败时，这批论文全部交给强模型
+        merge_results(scored, results or [], batch)
+        if self.fast_client is None:
+            self._accept(batch, scored)
+            return
+
+        lo, hi = self.rescore_band
+        settled: List[Dict[str, str]] = []
+        for doc in batch:
+            item = scored.get(str(doc.get("id")))
+            if item is not None:
+                self.fast_scores.append(float(item["score"]))
+            if item is None or lo <= float(item["score"]) <= hi:
+                self.pending_rescore.append(doc)
+                if item is not None:
+                    self.fast_results[str(doc.get("id"))] = item
+            else:
+                settled.append(doc)
+        self._accept(settled, scored)
+        while len(self.pending_rescore) >= self.batch_size:
+            self._rescore(self.pending_rescore[: self.batch_size])
+            self.pending_rescore = self.pending_rescore[self.batch_size :]
+
+    def _rescore(self, docs: List[Dict[str, str]]) -> None:
+        self.rescore_count += 1
+        phase, fn = self._score_phase
+        log(f"[INFO] rescore batch {self.rescore_count} docs={len(docs)} model={self.client.model}")
+        results = self._run_phase(f"{phase}_rescore", fn, docs, f"rescore_{self.rescore_count:03d}")
+        rescored: Dict[str, Dict[str, Any]] = {}
+        if results:
+            merge_results(rescored, results, docs)
+        final: Dict[str, Dict[str, Any]] = {}
+        for doc in docs:
+            pid = str(doc.get("id"))
+            fast, strong = self.fast_results.pop(pid, None), rescored.get(pid)
+            if strong is not None:
+                self.rescored += 1
+                if fast is not None:
+                    self.agreement_pairs.append((float(fast["score"]), float(strong["score"])))
+            # 强模型失败或漏掉时保留快模型的结果
+            item = strong or fast
+            if item is not None:
+                final[pid] = item
+        self._accept(docs, final)
+
+    def _accept(self, docs: List[Dict[str, str]], scored: Dict[str, Dict[str, Any]]) -> None:
+        for doc in docs:
+            pid = str(doc.get("id"))
+            item = scored.get(pid)
+            if item is None:
+                continue
+            prev = self.merged.get(pid)
+            if prev is None or float(item["score"]) > float(prev.get("score", 0)):
+                self.merged[pid] = item
+            if self.mode == "two-phase" and float(item["score"]) >= self.enrich_min_score:
+                self.pending_enrich.append({**doc, "score": item["score"], "tags": item["tags"]})
+        while len(self.pending_enrich) >= self.batch_size:
+            self._enrich(self.pending_enrich[: self.batch_size])
+            self.pending_enrich = self.pending_enrich[self.batch_size :]
+
+    def _enrich(self, docs: List[Dict[str, Any]]) -> None:
+        self.enrich_count += 1
+        log(f"[INFO] enrich batch {self.enrich_count} docs={len(docs)}")
+        results = self._run_phase("enrich", call_enrich, docs, f"enrich_{self.enrich_count:03d}")
+        if not results:
+            return
+        batch_ids = {str(d.get("id")) for d in docs}
+        for item in results:
+            pid = str(item.get("id", "")).strip()
+            target = self.merged.get(pid)
+            if pid not in batch_ids or target is None:
+                continue
+            evidence_en = str(item.get("evidence_en") or "").strip()
+            evidence_cn = str(item.get("evidence_cn") or "").strip() or evidence_en
+            tldr_en = str(item.get("tldr_en") or "").strip() or evidence_en
+            tldr_cn = str(item.get("tldr_cn") or "").strip() or evidence_cn or tldr_en
+            target.update(
+                {"evidence_en": evidence_en, "evidence_cn": evidence_cn, "tldr_en": tldr_en, "tldr_cn": tldr_cn}
+            )
+            self.enriched += 1
+
+    def finish(self) -> None:
+        if self.pending_rescore:
+            self._rescore(self.pending_rescore)
+            self.pending_rescore = []
+        if self.pending_enrich:
+            self._enrich(self.pending_enrich)
+            self.pending_enrich = []
+
+    def stats(self) -> Dict[str, Any]:
+        phases: Dict[str, Any] = {}
+        for phase, usage in self.phase_usage.items():
+            phases[phase] = {
+                "calls": usage.get("calls", 0),
+                "prompt_tokens": usage.get("prompt", 0),
+                "output_tokens": usage.get("thinking", 0) + usage.get("content", 0),
+                "llm_seconds": round(usage.get("seconds", 0.0), 2),
+                "wall_seconds": round(self.phase_wall.get(phase, 0.0), 2),
+            }
+        stats: Dict[str, Any] = {
+            "mode": self.mode,
+            "wire": self.wire,
+            "candidates": self.candidates,
+            "scored": len(self.merged),
+            "phases": phases,
+            "output_tokens": sum(p["output_tokens"] for p in phases.values()),
+            "prompt_tokens": sum(p["prompt_tokens"] for p in phases.values()),
+            "wall_seconds": round(time.time() - self.started_at, 2),
+        }
+        if self.mode == "two-phase":
+            stats["enrich_min_score"] = self.enrich_min_score
+            stats["enriched"] = self.enriched
+        if self.batch_session is not None:
+            stats["batch"] = self.batch_session.stats()
+        if self.fast_client is not None:
+            hist: Dict[str, int] = {}
+            for s in self.fast_scores:
+                key = str(int(round(s)))
+                hist[key] = hist.get(key, 0) + 1
+            stats["cascade"] = {
+                "fast_model": self.fast_client.model,
+                "strong_model": self.client.model,
+                "band": list(self.rescore_band),
+                "fast_scored": len(self.fast_scores),
+                "rescored": self.rescored,
+                "fast_score_hist": dict(sorted(hist.items(), key=lambda kv: int(kv[0]))),
+                "agreement": cascade_agreement(self.agreement_pairs, self.enrich_min_score),
+                "score_pairs": [[s1, s2] for s1, s2 in self.agreement_pairs],
+            }
+        return stats
+
+    def log_stats(self) -> Dict[str, Any]:
+        stats = self.stats()
+        for phase, p in stats["phases"].items():
+            log(
+                f"[INFO] refine phase {phase}: calls={p['calls']} output_tokens={p['output_tokens']} "
+                f"prompt_tokens={p['prompt_tokens']} llm_time={p['llm_seconds']:.1f}s wall={p['wall_seconds']:.1f}s"
+            )
+        cascade = stats.get("cascade")
+        if cascade:
+            agree = cascade["agreement"]
+            detail = ""
+            if agree.get("pairs"):
+                detail = (
+                    f" | agreement: mean|Δ|={agree['mean_abs_diff']} within_1={agree['within_1']:.0%} "
+                    f"same_side@{self.enrich_min_score:g}={agree['same_side']:.0%} "
+                    f"promoted={agree['promoted']} demoted={agree['demoted']}"
+                )
+            log(
+                f"[INFO] refine cascade {cascade['fast_model']} -> {cascade['strong_model']}: "
+                f"band={self.rescore_band[0]:g}-{self.rescore_band[1]:g} "
+                f"rescored={cascade['rescored']}/{cascade['fast_scored']}{detail}"
+            )
+        batch = stats.get("batch")
+        if batch:
+            log(
+                f"[INFO] refine batch jobs={len(batch['jobs'])} requests={batch['requests']} "
+                f"succeeded={batch['succeeded']} wait={batch['seconds']:.1f}s"
+            )
+        extra = ""
+        if self.mode == "two-phase":
+            extra = f" enriched={stats['enriched']}/{stats['scored']} (score>={self.enrich_min_score:g})"
+        log(
+            f"[INFO] refine summary mode={self.mode} wire={self.wire}: candidates={stats['candidates']}{extra} "
+            f"output_tokens={stats['output_tokens']} prompt_tokens={stats['prompt_tokens']} "
+            f"wall={stats['wall_seconds']:.1f}s"
+        )
+        return stats
+
+
+def refine_in_batches(
+    make_refiner,
+    batches: List[List[Dict[str, str]]],
+    session: BatchSession,
+) -> Refiner:
+    """
+    批处理模式：每轮用新的 Refiner 从头重放全部批次，已有结果直接命中，缺结果的请求登记后整批提交，
+    等任务结束再进入下一轮；某一轮没有新请求时，这一轮的 Refiner 就是最终结果（与交互模式的合并结果一致）。
+    每轮只提交最靠前阶段的请求，轮数等于阶段数（single 1 轮，two-phase 2 轮，分档再多 1 轮）。
+    """
+    started_at = time.time()
+    round_no = 0
+    while True:
+        round_no += 1
+        refiner = make_refiner()
+        refiner.started_at = started_at
+        for idx, batch in enumerate(batches, start=1):
+            refiner.run_batch(batch, f"batch_{idx:03d}")
+        refiner.finish()
+        if not refiner.deferred:
+            log(f"[INFO] batch mode finished after {round_no} round(s)")
+            return refiner
+        if round_no > len(set(PHASE_STAGES.values())):
+            # 每个阶段至多一轮；再有缺口说明请求体不稳定，避免无限重放
+            raise RuntimeError(f"batch mode still has {refiner.deferred} deferred requests after {round_no} rounds")
+        submitted = session.flush()
+        log(f"[INFO] batch round {round_no}: deferred={refiner.deferred} submitted={submitted}")
+
+
+def save_llm_ranked(data: Dict[str, Any], refiner: Refiner, output_path: str) -> None:
+    refiner.finish()
+    data["llm_refine_stats"] = refiner.log_stats()
+    merged = refiner.merged
+    if not merged:
+        log("[WARN] no llm results returned.")
+        save_json(data, output_path)
+        return
+
+    llm_ranked = sorted(merged.values(), key=lambda x: x.get("score", 0), reverse=True)
+    data["llm_ranked"] = llm_ranked
+
+    data["llm_ranked_at"] = datetime.now(timezone.utc).isoformat()
+    save_json(data, output_path)
+
+
+def record_refine(refiner: Refiner, stats: Dict[str, Any], ranked_docs: int, max_candidates: int | None) -> None:
+    """实际开销写入运行报告；遥测按单篇候选折算，并记录 rerank 结果到精读候选的转化率（planner 用来预测候选数）。"""
+    totals = {
+        "calls": sum(p["calls"] for p in stats["phases"].values()),
+        "prompt_tokens": stats["prompt_tokens"],
+        "completion_tokens": stats["output_tokens"],
+        "seconds": stats["wall_seconds"],
+    }
+    record_stage(
+        "refine",
+        {
+            "requests": totals["calls"],
+            "prompt_tokens": totals["prompt_tokens"],
+            "completion_tokens": totals["completion_tokens"],
+            "seconds": totals["seconds"],
+            "candidates": stats["candidates"],
+            "ranked_docs": ranked_docs,
+            "profile": refiner.profile,
+            "max_candidates": max_candidates,
+        },
+        [
+            (f"refine:{refiner.profile}", totals, stats["candidates"]),
+            ("refine:funnel", {"candidate_rate": stats["candidates"]}, ranked_docs),
         ],
-        response_format=response_format,
     )
-    content = resp.get("content", "")
-    try:
-        payload = load_json_lenient(content)
-    except Exception as exc:
-        preview = (content or "").strip().replace("\n", " ")
-        if len(preview) > 800:
-            preview = preview[:800] + "..."
-        debug_path = ""
-        if debug_dir:
-            os.makedirs(debug_dir, exist_ok=True)
-            tag = debug_tag or f"batch_{int(time.time())}"
-            debug_path = os.path.join(debug_dir, f"filter_raw_{tag}.txt")
-            with open(debug_path, "w", encoding="utf-8") as f:
-                f.write(content or "")
-        msg = f"JSON parse failed: {exc}. raw={preview}"
-        if debug_path:
-            msg = f"{msg} | saved={debug_path}"
-        raise ValueError(msg)
-    results = payload.get("results", [])
-    if not isinstance(results, list):
-        return []
-    return results
+
+
+def select_candidates(queries: List[Dict[str, Any]], min_star: int, max_candidates: int | None) -> List[str]:
+    """按查询顺序取 star_rating >= min_star 的候选并去重；设置 max_candidates 时保留星级 / rerank 分数最高的若干篇。"""
+    candidate_ids: List[str] = []
+    best: Dict[str, Tuple[int, float]] = {}
+    for q in queries:
+        ranked = q.get("ranked") or []
+        for item in ranked:
+            if item.get("star_rating", 0) >= min_star:
+                pid = str(item.get("paper_id"))
+                if pid:
+                    candidate_ids.append(pid)
+                    key = (int(item.get("star_rating", 0)), float(item.get("score", 0.0)))
+                    best[pid] = max(best.get(pid, key), key)
+
+    candidate_ids = unique_tagged([{"tag": pid} for pid in candidate_ids])
+    candidate_ids = [item["tag"] for item in candidate_ids]
+    if max_candidates is not None and len(candidate_ids) > max_candidates:
+        log(f"[INFO] candidates capped: {len(candidate_ids)} -> {max_candidates} (by star_rating / rerank score)")
+        candidate_ids = sorted(candidate_ids, key=lambda pid: best[pid], reverse=True)[:max_candidates]
+    return candidate_ids
 
 
 def process_file(
@@ -310,9 +1002,16 @@ def process_file(
     max_chars: int,
     filter_model: str,
     max_output_tokens: int,
+    refine_mode: str = "single",
+    enrich_min_score: float = DEFAULT_ENRICH_MIN_SCORE,
+    wire: str = "full",
+    fast_model: str | None = None,
+    rescore_band: Tuple[float, float] = DEFAULT_RESCORE_BAND,
+    max_candidates: int | None = None,
+    batch: bool = False,
 ) -> None:
     # 检查输入文件是否存在，如果不存在说明今天没有新论文，优雅退出
-    if not os.path.exists(input_path):
+    if not json_exists(input_path):
         log(f"[INFO] 输入文件不存在：{input_path}（今天没有新论文，将跳过 LLM refine）")
         return
 
@@ -326,46 +1025,32 @@ def process_file(
     config = load_config()
     keywords, query_items = build_context_lists(config, queries)
     paper_map = build_paper_map(papers)
+    store = open_paper_store(data, input_path) if data.get("paper_store") else None
+    if store is not None:
+        data["paper_store"] = paper_store_ref(store, output_path)
 
-    api_key = os.getenv("BLT_API_KEY")
-    if not api_key:
-        raise RuntimeError("missing BLT_API_KEY")
-
-    filter_client = BltClient(api_key=api_key, model=filter_model)
-    filter_client.kwargs.update({"temperature": 0.1, "max_tokens": max_output_tokens})
+    filter_client = make_filter_client(filter_model, max_output_tokens)
 
     group_start(f"Step 4 - llm refine {os.path.basename(input_path)}")
     log(
         f"[INFO] start filter: queries={len(queries)}, papers={len(papers)}, "
-        f"min_star={min_star}, batch_size={batch_size}, max_chars={max_chars}"
+        f"min_star={min_star}, batch_size={batch_size}, max_chars={max_chars}, refine_mode={refine_mode}, wire={wire}"
+        + (f", fast_model={fast_model} rescore_band={rescore_band[0]:g}-{rescore_band[1]:g}" if fast_model else "")
     )
 
-    candidate_ids: List[str] = []
-    for q in queries:
-        ranked = q.get("ranked") or []
-        for item in ranked:
-            if item.get("star_rating", 0) >= min_star:
-                pid = str(item.get("paper_id"))
-                if pid:
-                    candidate_ids.append(pid)
-
-    candidate_ids = unique_tagged([{"tag": pid} for pid in candidate_ids])
-    candidate_ids = [item["tag"] for item in candidate_ids]
+    candidate_ids = select_candidates(queries, min_star, max_candidates)
     if not candidate_ids:
         log("[WARN] no candidates found with star_rating >= min_star.")
         save_json(data, output_path)
         group_end()
         return
 
-    docs: List[Dict[str, str]] = []
-    for pid in candidate_ids:
-        paper = paper_map.get(pid)
-        if not paper:
-            continue
-        title = (paper.get("title") or "").strip()
-        abstract = (paper.get("abstract") or "").strip()
-        content = format_doc(title, abstract, max_chars)
-        docs.append({"id": pid, "content": content})
+    if store is not None:
+        # papers only carry {id, tags}; hydrate title/abstract for the candidates without touching data
+        paper_map = {pid: dict(p) for pid, p in paper_map.items()}
+        hydrate_papers(list(paper_map.values()), store, candidate_ids)
+
+    docs = build_docs(candidate_ids, paper_map, max_chars)
 
     if not docs:
         log("[WARN] candidate papers not found in paper map.")
@@ -380,74 +1065,164 @@ def process_file(
         f"| keywords={len(keywords)} queries={len(query_items)}"
     )
 
-    merged: Dict[str, Dict[str, Any]] = {}
-    debug_dir = os.path.join(RANKED_DIR, "debug")
-    for idx, batch in enumerate(batches, start=1):
-        log(f"[INFO] filter batch {idx}/{len(batches)} docs={len(batch)}")
-        try:
-            results = call_filter(
+    fast_client = make_filter_client(fast_model, max_output_tokens) if fast_model else None
+    if batch:
+        session = BatchSession()
+        filter_client = BatchChatClient(filter_client, session)
+        fast_client = BatchChatClient(fast_client, session) if fast_client else None
+        refiner = refine_in_batches(
+            lambda: Refiner(
                 filter_client,
                 keywords,
                 query_items,
-                batch,
-                debug_dir=debug_dir,
-                debug_tag=f"batch_{idx:03d}",
-            )
-        except Exception as exc:
-            log(f"[WARN] filter batch failed: {exc}")
-            continue
+                refine_mode,
+                enrich_min_score,
+                batch_size,
+                wire,
+                fast_client,
+                rescore_band,
+                session,
+            ),
+            batches,
+            session,
+        )
+    else:
+        refiner = Refiner(
+            filter_client,
+            keywords,
+            query_items,
+            refine_mode,
+            enrich_min_score,
+            batch_size,
+            wire,
+            fast_client,
+            rescore_band,
+        )
+        for idx, docs_batch in enumerate(batches, start=1):
+            log(f"[INFO] filter batch {idx}/{len(batches)} docs={len(docs_batch)}")
+            refiner.run_batch(docs_batch, f"batch_{idx:03d}")
 
-        batch_ids = {str(d.get("id")) for d in batch}
-        for item in results:
-            pid = str(item.get("id", "")).strip()
-            if pid not in batch_ids:
-                continue
-            try:
-                score = float(item.get("score", 0))
-            except Exception:
-                score = 0.0
-            # 新字段：中英双语 evidence（兼容旧字段 evidence）
-            evidence_en = str(item.get("evidence_en") or "").strip()
-            evidence_cn = str(item.get("evidence_cn") or "").strip()
-            tldr_en = str(item.get("tldr_en") or "").strip()
-            tldr_cn = str(item.get("tldr_cn") or "").strip()
-            legacy = str(item.get("evidence", "")).strip()
-            if not evidence_en:
-                evidence_en = legacy
-            if not evidence_cn:
-                # 若模型未返回中文 evidence，则回退为英文（下游可再做翻译/展示策略）
-                evidence_cn = legacy or evidence_en
-            if not tldr_en:
-                tldr_en = "not relevant" if score <= 0 else evidence_en
-            if not tldr_cn:
-                tldr_cn = "不相关" if score <= 0 else (evidence_cn or tldr_en)
-            tags = item.get("tags")
-            if not isinstance(tags, list):
-                tags = []
-            tags = [str(t).strip() for t in tags if str(t).strip()]
-            prev = merged.get(pid)
-            if (prev is None) or (score > float(prev.get("score", 0))):
-                merged[pid] = {
-                    "paper_id": pid,
-                    "score": score,
-                    "evidence_en": evidence_en,
-                    "evidence_cn": evidence_cn,
-                    "tldr_en": tldr_en,
-                    "tldr_cn": tldr_cn,
-                    "tags": tags,
-                }
+    save_llm_ranked(data, refiner, output_path)
+    ranked_docs = len({str(item.get("paper_id")) for q in queries for item in q.get("ranked") or []})
+    record_refine(refiner, data["llm_refine_stats"], ranked_docs, max_candidates)
+    group_end()
 
-    if not merged:
-        log("[WARN] no llm results returned.")
-        save_json(data, output_path)
-        group_end()
+
+def follow_stream(
+    stream_path: str,
+    output_path: str,
+    min_star: int,
+    batch_size: int,
+    max_chars: int,
+    filter_model: str,
+    max_output_tokens: int,
+    timeout_s: float = DEFAULT_FOLLOW_TIMEOUT_S,
+    refine_mode: str = "single",
+    enrich_min_score: float = DEFAULT_ENRICH_MIN_SCORE,
+    wire: str = "full",
+    fast_model: str | None = None,
+    rescore_band: Tuple[float, float] = DEFAULT_RESCORE_BAND,
+    max_candidates: int | None = None,
+) -> None:
+    """
+    跟随步骤 3 的流式交接文件（handoff.py）：每个查询的 ranked 一到达就按 min_star 取候选、跨查询去重，
+    攒满 batch_size 篇立即精读；步骤 3 写完 rank 文件（done 记录）后处理剩余候选，输出格式与 process_file 相同。
+    """
+    log(f"[INFO] follow rerank stream: {stream_path}")
+    records = follow_rank_stream(stream_path, timeout_s=timeout_s)
+    start = next(records)
+    if start.get("type") == "done":
+        log(f"[INFO] rerank stream finished without queries (status={start.get('status')}), skip LLM refine.")
         return
+    if start.get("type") != "start":
+        raise ValueError(f"unexpected first record in {stream_path}: {start.get('type')}")
 
-    llm_ranked = sorted(merged.values(), key=lambda x: x.get("score", 0), reverse=True)
-    data["llm_ranked"] = llm_ranked
+    source_path = start.get("input") or ""
+    source = load_json(source_path)
+    paper_map = {pid: dict(p) for pid, p in build_paper_map(source.get("papers") or []).items()}
+    store = open_paper_store(source, source_path) if source.get("paper_store") else None
+    keywords, query_items = build_context_lists(load_config(), start.get("queries") or [])
+    filter_client = make_filter_client(filter_model, max_output_tokens)
 
-    data["llm_ranked_at"] = datetime.now(timezone.utc).isoformat()
-    save_json(data, output_path)
+    group_start(f"Step 4 - llm refine (follow) {os.path.basename(stream_path)}")
+    log(
+        f"[INFO] start filter (follow): queries={len(start.get('queries') or [])}, papers={len(paper_map)}, "
+        f"min_star={min_star}, batch_size={batch_size}, max_chars={max_chars}, refine_mode={refine_mode}, wire={wire}"
+        + (f", fast_model={fast_model} rescore_band={rescore_band[0]:g}-{rescore_band[1]:g}" if fast_model else "")
+    )
+
+    seen: set = set()
+    ranked_ids: set = set()
+    pending: List[str] = []
+    fast_client = make_filter_client(fast_model, max_output_tokens) if fast_model else None
+    refiner = Refiner(
+        filter_client,
+        keywords,
+        query_items,
+        refine_mode,
+        enrich_min_score,
+        batch_size,
+        wire,
+        fast_client,
+        rescore_band,
+    )
+    batch_count = 0
+    started_at = time.time()
+
+    def flush(ids: List[str]) -> None:
+        nonlocal batch_count
+        if store is not None:
+            hydrate_papers([paper_map[pid] for pid in ids if pid in paper_map], store, ids)
+        batch = build_docs(ids, paper_map, max_chars)
+        if not batch:
+            return
+        batch_count += 1
+        log(f"[INFO] filter batch {batch_count} docs={len(batch)} (+{time.time() - started_at:.1f}s)")
+        refiner.run_batch(batch, f"batch_{batch_count:03d}")
+
+    done: Dict[str, Any] = {}
+    for record in records:
+        if record.get("type") == "done":
+            done = record
+            break
+        if record.get("type") != "query":
+            continue
+        fresh = 0
+        for item in record.get("ranked") or []:
+            pid = str(item.get("paper_id") or "")
+            if pid:
+                ranked_ids.add(pid)
+            if max_candidates is not None and len(seen) >= max_candidates:
+                # 流式模式按到达顺序截断
+                continue
+            if pid and item.get("star_rating", 0) >= min_star and pid not in seen:
+                seen.add(pid)
+                pending.append(pid)
+                fresh += 1
+        log(f"[INFO] query {record.get('index')} tag={record.get('tag') or ''} arrived: +{fresh} new candidates")
+        while len(pending) >= batch_size:
+            flush(pending[:batch_size])
+            pending = pending[batch_size:]
+
+    if done.get("status") != "ok":
+        group_end()
+        if done.get("status") == "skipped":
+            log("[INFO] rerank stage skipped, skip LLM refine.")
+            return
+        raise RuntimeError(f"rerank stage did not finish (status={done.get('status')})")
+    if pending:
+        flush(pending)
+
+    rank_path = done.get("output") or ""
+    data = load_json(rank_path)
+    if data.get("paper_store"):
+        data["paper_store"] = paper_store_ref(open_paper_store(data, rank_path), output_path)
+    log(f"[INFO] global candidates={len(seen)} batches={batch_count} | keywords={len(keywords)} queries={len(query_items)}")
+    if not seen:
+        log("[WARN] no candidates found with star_rating >= min_star.")
+    save_llm_ranked(data, refiner, output_path)
+    if seen:
+        record_refine(refiner, data["llm_refine_stats"], len(ranked_ids), max_candidates)
     group_end()
 
 
@@ -498,6 +1273,66 @@ def main() -> None:
         help="max tokens for model output (clamped to 4096 in llm.py).",
     )
 
+    parser.add_argument(
+        "--follow",
+        type=str,
+        default=None,
+        help="follow the rerank stream (JSONL written by step 3 --stream-out) and refine batches as queries arrive.",
+    )
+    parser.add_argument(
+        "--follow-timeout",
+        type=float,
+        default=DEFAULT_FOLLOW_TIMEOUT_S,
+        help="give up if the rerank stream makes no progress for this many seconds.",
+    )
+    parser.add_argument(
+        "--refine-mode",
+        choices=list(REFINE_MODES),
+        default="single",
+        help="single: one request per batch with score+evidence+TLDR; "
+        "two-phase: score+tags for all candidates, bilingual evidence/TLDR only for survivors.",
+    )
+    parser.add_argument(
+        "--enrich-min-score",
+        type=float,
+        default=DEFAULT_ENRICH_MIN_SCORE,
+        help="two-phase: min score to get evidence/TLDR in the enrichment pass.",
+    )
+    parser.add_argument(
+        "--wire",
+        choices=list(WIRE_FORMATS),
+        default="full",
+        help="full: arXiv ids and full field/tag names on the wire; "
+        "compact: per-batch short ids, tag aliases and short keys (mapped back before merging).",
+    )
+    parser.add_argument(
+        "--fast-model",
+        type=str,
+        default=None,
+        help=f"tiered scoring: this cheap model scores every candidate first and --filter-model only re-scores "
+        f"the ambiguous band (e.g. {DEFAULT_FAST_FILTER_MODEL}); off by default.",
+    )
+    parser.add_argument(
+        "--rescore-band",
+        type=float,
+        nargs=2,
+        metavar=("LOW", "HIGH"),
+        default=list(DEFAULT_RESCORE_BAND),
+        help="tiered scoring: fast-model scores within [LOW, HIGH] are re-scored by --filter-model.",
+    )
+    parser.add_argument(
+        "--max-candidates",
+        type=int,
+        default=None,
+        help="cap on refine candidates (highest star_rating / rerank score first; set by main.py budgets).",
+    )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="submit requests as OpenAI-compatible batch jobs (one job per refine stage) instead of interactive calls; "
+        "for backfills. LLM_BATCH_BASE_URL can point at src/batch_standin.py. Not available with --follow.",
+    )
+
     args = parser.parse_args()
 
     input_path = args.input
@@ -508,6 +1343,31 @@ def main() -> None:
     if not os.path.isabs(output_path):
         output_path = os.path.abspath(os.path.join(ROOT_DIR, output_path))
 
+    if args.follow and args.batch:
+        parser.error("--batch cannot be combined with --follow")
+
+    if args.follow:
+        stream_path = args.follow
+        if not os.path.isabs(stream_path):
+            stream_path = os.path.abspath(os.path.join(ROOT_DIR, stream_path))
+        follow_stream(
+            stream_path=stream_path,
+            output_path=output_path,
+            min_star=args.min_star,
+            batch_size=args.batch_size,
+            max_chars=args.max_chars,
+            filter_model=args.filter_model,
+            max_output_tokens=args.max_output_tokens,
+            timeout_s=args.follow_timeout,
+            refine_mode=args.refine_mode,
+            enrich_min_score=args.enrich_min_score,
+            wire=args.wire,
+            fast_model=args.fast_model,
+            rescore_band=tuple(args.rescore_band),
+            max_candidates=args.max_candidates,
+        )
+        return
+
     process_file(
         input_path=input_path,
         output_path=output_path,
@@ -516,6 +1376,13 @@ def main() -> None:
         max_chars=args.max_chars,
         filter_model=args.filter_model,
         max_output_tokens=args.max_output_tokens,
+        refine_mode=args.refine_mode,
+        enrich_min_score=args.enrich_min_score,
+        wire=args.wire,
+        fast_model=args.fast_model,
+        rescore_band=tuple(args.rescore_band),
+        max_candidates=args.max_candidates,
+        batch=args.batch,
     )
 
 
@@ -8,6 +8,9 @@ import re
 from datetime import date, datetime, timedelta, timezone
 from typing import Any, Dict, List, Tuple
 
+import storage
+from storage import hydrate_papers, json_exists, list_json_files, load_json, open_paper_store
+
 SCRIPT_DIR = os.path.dirname(__file__)
 ROOT_DIR = os.path.abspath(os.path.join(SCRIPT_DIR, ".."))
 ARCHIVE_ROOT = os.path.join(ROOT_DIR, "archive")
@@ -73,18 +76,9 @@ def group_end() -> None:
     print("::endgroup::", flush=True)
 
 
-def load_json(path: str) -> Dict[str, Any]:
-    if not os.path.exists(path):
-        raise FileNotFoundError(f"missing file: {path}")
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
-
-
-def save_json(data: Dict[str, Any], path: str) -> None:
-    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-    log(f"[INFO] saved: {path}")
+def save_json(data: Dict[str, Any], path: str, codec: str | None = None) -> None:
+    written = storage.save_json(data, path, codec=codec)
+    log(f"[INFO] saved: {written}")
 
 
 def parse_date_str(date_str: str) -> date:
@@ -109,7 +103,7 @@ def collect_seen_ids(archive_root: str, today_str: str) -> set:
         rec_dir = os.path.join(archive_root, day, "recommend")
         if not os.path.isdir(rec_dir):
             continue
-        for name in os.listdir(rec_dir):
+        for name in list_json_files(rec_dir):
             if not name.startswith(f"arxiv_papers_{day}.") or not name.endswith(".json"):
                 continue
             rec_path = os.path.join(rec_dir, name)
@@ -814,7 +808,7 @@ def main() -> None:
             llm_ranked = []
         else:
             # 检查输入文件是否存在，如果不存在则只使用 carryover
-            if not os.path.exists(input_path):
+            if not json_exists(input_path):
                 log(f"[INFO] 输入文件不存在：{input_path}（今天没有新论文，将只使用 carryover）")
                 papers = []
                 llm_ranked = []
@@ -822,6 +816,10 @@ def main() -> None:
                 data = load_json(input_path)
                 papers = data.get("papers") or []
                 llm_ranked = data.get("llm_ranked") or []
+                if data.get("paper_store"):
+                    # 中间产物只引用 ID：为进入推荐的论文补齐元数据，recommend / carryover 仍保存完整信息
+                    scored_ids = [item.get("paper_id") or item.get("id") for item in llm_ranked]
+                    hydrate_papers(papers, open_paper_store(data, input_path), [pid for pid in scored_ids if pid])
     finally:
         log_substep("5.1", "加载输入数据", "END")
 
@@ -899,7 +897,7 @@ def main() -> None:
             "carryover_days": carryover_days,
             "items": [],
         }
-        save_json(carryover_payload, CARRYOVER_PATH)
+        save_json(carryover_payload, CARRYOVER_PATH, codec="none")
         group_end()
         return
 
@@ -951,7 +949,7 @@ def main() -> None:
             "carryover_days": carryover_days,
             "items": carryover_out,
         }
-        save_json(carryover_payload, CARRYOVER_PATH)
+        save_json(carryover_payload, CARRYOVER_PATH, codec="none")
     log_substep("5.5", "写入 carryover 状态", "END")
 
     group_end()
@@ -14,7 +14,9 @@ from typing import Any, Dict, List, Tuple
 
 import fitz  # PyMuPDF
 import requests
-from llm import BltClient
+from llm import BatchChatClient, BatchSession, BltClient
+from planner import record_stage
+from storage import json_exists, load_json
 
 SCRIPT_DIR = os.path.dirname(__file__)
 ROOT_DIR = os.path.abspath(os.path.join(SCRIPT_DIR, ".."))
@@ -35,17 +37,73 @@ def call_blt_text(
     temperature: float,
     max_tokens: int,
     response_format: Dict[str, Any] | None = None,
+    fresh: bool = False,
 ) -> str:
+    """fresh=True 用于重试：内容不可用时重发同一请求，不能复用刚完成的相同请求的响应。"""
     client.kwargs.update(
         {
             "temperature": float(temperature),
             "max_tokens": int(max_tokens),
         }
     )
-    resp = client.chat(messages=messages, response_format=response_format)
+    resp = client.chat(messages=messages, response_format=response_format, fresh=fresh)
     return (resp.get("content") or "").strip()
 
 
+def llm_usage() -> Dict[str, float]:
+    if LLM_CLIENT is None:
+        return {"calls": 0, "prompt": 0, "thinking": 0, "content": 0, "seconds": 0.0}
+    return LLM_CLIENT.usage()
+
+
+def record_docs_stage(
+    date_str: str,
+    deep_papers: int,
+    quick_papers: int,
+    start: Dict[str, float],
+    after_deep: Dict[str, float],
+    end: Dict[str, float],
+    deep_seconds: float,
+    total_seconds: float,
+    full_deep: bool,
+    mode: str,
+    batch: Dict[str, Any] | None = None,
+) -> None:
+    """把 Step 6 的实际 LLM 开销写入运行报告；精读区 / 速读区分别按单篇折算进遥测（供 planner 预测）。"""
+
+    def delta(a: Dict[str, float], b: Dict[str, float], seconds: float) -> Dict[str, float]:
+        return {
+            "calls": b["calls"] - a["calls"],
+            "prompt_tokens": b["prompt"] - a["prompt"],
+            "completion_tokens": (b["thinking"] + b["content"]) - (a["thinking"] + a["content"]),
+            "seconds": seconds,
+        }
+
+    deep = delta(start, after_deep, deep_seconds)
+    quick = delta(after_deep, end, total_seconds - deep_seconds)
+    record_stage(
+        "docs",
+        {
+            "requests": deep["calls"] + quick["calls"],
+            "prompt_tokens": deep["prompt_tokens"] + quick["prompt_tokens"],
+            "completion_tokens": deep["completion_tokens"] + quick["completion_tokens"],
+            "seconds": round(total_seconds, 1),
+            "deep_papers": deep_papers,
+            "quick_papers": quick_papers,
+            "deep_summaries": full_deep,
+            **({"batch": batch} if batch else {}),
+        },
+        # 批处理模式的耗时是任务排队时间，不代表交互调用，不更新遥测
+        [] if batch else [
+            ("docs:deep" if full_deep else "docs:glance", deep, deep_papers),
+            ("docs:glance", quick, quick_papers),
+            # skims（回溯窗口）全部进速览区，不代表日常的篇数
+            *([("docs:counts", {"deep_papers": deep_papers, "quick_papers": quick_papers}, 1)] if mode != "skims" else []),
+        ],
+        date_str=date_str,
+    )
+
+
 def log(message: str) -> None:
     ts = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
     print(f"[{ts}] {message}", flush=True)
@@ -135,14 +193,22 @@ def fetch_paper_markdown_via_jina(pdf_url: str, max_retries: int = 3) -> str | N
     return None
 
 
-def translate_title_and_abstract_to_zh(title: str, abstract: str) -> Tuple[str, str]:
-    if LLM_CLIENT is None:
-        return "", ""
-    title = title.strip() if title else ""
-    abstract = abstract.strip() if abstract else ""
-    if not title and not abstract:
-        return "", ""
+TRANSLATE_PARAMS = {"temperature": 0.2, "max_tokens": 4000}
+GLANCE_PARAMS = {"temperature": 0.2, "max_tokens": 2048}
+
+
+def json_response_format(name: str, schema: Dict[str, Any]) -> Dict[str, Any]:
+    use_json_object = "gemini" in (getattr(LLM_CLIENT, "model", "") or "").lower()
+    if use_json_object:
+        return {"type": "json_object"}
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": name, "schema": schema, "strict": True},
+    }
 
+
+def translation_request(title: str, abstract: str) -> Tuple[List[Dict[str, str]], Dict[str, Any]]:
+    """中文翻译请求的 messages 与 response_format（交互调用与批处理预取共用，请求体一致才能命中）。"""
     system_prompt = (
         "你是一名熟悉机器学习与自然科学论文的专业翻译，请将英文标题和摘要翻译为自然、准确的中文。"
         "保持学术风格，尽量保留专有名词，不要额外添加评论。"
@@ -160,30 +226,33 @@ def translate_title_and_abstract_to_zh(title: str, abstract: str) -> Tuple[str,
         {"role": "user", "content": user_text},
         {"role": "user", "content": user_prompt},
     ]
+    schema = {
+        "type": "object",
+        "properties": {
+            "title_zh": {"type": "string"},
+            "abstract_zh": {"type": "string"},
+        },
+        "required": ["title_zh", "abstract_zh"],
+        "additionalProperties": False,
+    }
+    return messages, json_response_format("translate_zh", schema)
+
+
+def translate_title_and_abstract_to_zh(title: str, abstract: str) -> Tuple[str, str]:
+    if LLM_CLIENT is None:
+        return "", ""
+    title = title.strip() if title else ""
+    abstract = abstract.strip() if abstract else ""
+    if not title and not abstract:
+        return "", ""
+
+    messages, response_format = translation_request(title, abstract)
     try:
-        schema = {
-            "type": "object",
-            "properties": {
-                "title_zh": {"type": "string"},
-                "abstract_zh": {"type": "string"},
-            },
-            "required": ["title_zh", "abstract_zh"],
-            "additionalProperties": False,
-        }
-        use_json_object = "gemini" in (getattr(LLM_CLIENT, "model", "") or "").lower()
-        if use_json_object:
-            response_format = {"type": "json_object"}
-        else:
-            response_format = {
-                "type": "json_schema",
-                "json_schema": {"name": "translate_zh", "schema": schema, "strict": True},
-            }
         content = call_blt_text(
             LLM_CLIENT,
             messages,
-            temperature=0.2,
-            max_tokens=4000,
             response_format=response_format,
+            **TRANSLATE_PARAMS,
         )
     except Exception:
         return "", ""
@@ -420,7 +489,7 @@ def generate_deep_summary(md_file_path: str, txt_file_path: str, max_retries: in
     last = ""
     for attempt in range(1, max_retries + 1):
         try:
-            summary = call_blt_text(LLM_CLIENT, messages, temperature=0.3, max_tokens=4096)
+            summary = call_blt_text(LLM_CLIENT, messages, temperature=0.3, max_tokens=4096, fresh=attempt > 1)
             summary = (summary or "").strip()
             if not summary:
                 continue
@@ -435,7 +504,7 @@ def generate_deep_summary(md_file_path: str, txt_file_path: str, max_retries: in
                 {"role": "user", "content": "你上一次的总结可能被截断了，请从中断处继续补全，不要重复已输出内容。"},
                 {"role": "user", "content": f"上一次输出如下：\n\n{summary}\n\n请继续补全，最后以一行“（完）”结束。"},
             ]
-            cont = call_blt_text(LLM_CLIENT, cont_messages, temperature=0.3, max_tokens=2048)
+            cont = call_blt_text(LLM_CLIENT, cont_messages, temperature=0.3, max_tokens=2048, fresh=attempt > 1)
             cont = (cont or "").strip()
             merged = f"{summary}\n\n{cont}".strip()
             if os.getenv("DPR_DEBUG_STEP6") == "1":
@@ -448,15 +517,8 @@ def generate_deep_summary(md_file_path: str, txt_file_path: str, max_retries: in
     return last or None
 
 
-def generate_glance_overview(title: str, abstract: str, max_retries: int = 3) -> str | None:
-    """
-    生成论文速览（包含 TLDR、Motivation、Method、Result、Conclusion）。
-    使用 JSON 结构化输出，确保返回完整的五个字段。
-    """
-    if LLM_CLIENT is None:
-        log("[WARN] 未配置 LLM_CLIENT，跳过速览生成。")
-        return None
-
+def glance_request(title: str, abstract: str) -> Tuple[List[Dict[str, str]], Dict[str, Any]]:
+    """速览请求的 messages 与 response_format（交互调用与批处理预取共用）。"""
     system_prompt = "你是论文速览助手，请用中文简洁地总结论文的关键信息。"
     payload = {"title": title, "abstract": abstract}
     user_text = json.dumps(payload, ensure_ascii=False)
@@ -480,29 +542,33 @@ def generate_glance_overview(title: str, abstract: str, max_retries: int = 3) ->
         "required": ["tldr", "motivation", "method", "result", "conclusion"],
         "additionalProperties": False,
     }
-    use_json_object = "gemini" in (getattr(LLM_CLIENT, "model", "") or "").lower()
-    if use_json_object:
-        response_format = {"type": "json_object"}
-    else:
-        response_format = {
-            "type": "json_schema",
-            "json_schema": {"name": "glance_overview", "schema": schema, "strict": True},
-        }
-
     messages = [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": user_text},
         {"role": "user", "content": user_prompt},
     ]
+    return messages, json_response_format("glance_overview", schema)
+
+
+def generate_glance_overview(title: str, abstract: str, max_retries: int = 3) -> str | None:
+    """
+    生成论文速览（包含 TLDR、Motivation、Method、Result、Conclusion）。
+    使用 JSON 结构化输出，确保返回完整的五个字段。
+    """
+    if LLM_CLIENT is None:
+        log("[WARN] 未配置 LLM_CLIENT，跳过速览生成。")
+        return None
+
+    messages, response_format = glance_request(title, abstract)
 
     for attempt in range(1, max_retries + 1):
         try:
             content = call_blt_text(
                 LLM_CLIENT,
                 messages,
-                temperature=0.2,
-                max_tokens=2048,
                 response_format=response_format,
+                fresh=attempt > 1,
+                **GLANCE_PARAMS,
             )
             obj = json.loads(content)
             if not isinstance(obj, dict):
@@ -955,6 +1021,44 @@ def build_tags_list(section: str, llm_tags: List[str]) -> List[str]:
     return tags
 
 
+def prefetch_docs_requests(
+    papers: List[Dict[str, Any]],
+    docs_dir: str,
+    date_str: str,
+    glance_only: bool,
+    force_glance: bool,
+) -> BatchSession:
+    """
+    批处理模式（回溯运行）：把能提前确定的请求（新页面的中文翻译、缺失或需重生成的速览）作为批处理任务提交，
+    LLM_CLIENT 换成以任务结果应答的包装后再照常逐篇生成；精读总结依赖生成后的页面与全文、
+    续写与重试依赖上一次输出，这些请求仍走交互调用。
+    """
+    global LLM_CLIENT
+    session = BatchSession()
+    LLM_CLIENT = BatchChatClient(LLM_CLIENT, session, on_miss="call")
+    for paper in papers:
+        title = (paper.get("title") or "").strip()
+        arxiv_id = str(paper.get("id") or paper.get("paper_id") or "").strip()
+        md_path, _, _ = prepare_paper_paths(docs_dir, date_str, title, arxiv_id)
+        abstract_en = (paper.get("abstract") or "").strip()
+        if os.path.exists(md_path):
+            # 与 process_paper 相同的判断：已有速览默认不重复生成
+            try:
+                with open(md_path, "r", encoding="utf-8") as f:
+                    existing = f.read()
+            except Exception:
+                existing = ""
+            if force_glance or "## 速览" not in existing:
+                LLM_CLIENT.prefetch(*glance_request(title, abstract_en), **GLANCE_PARAMS)
+            continue
+        if not glance_only and (title or abstract_en):
+            LLM_CLIENT.prefetch(*translation_request(title, abstract_en), **TRANSLATE_PARAMS)
+        LLM_CLIENT.prefetch(*glance_request(title, abstract_en), **GLANCE_PARAMS)
+    submitted = session.flush()
+    log(f"[INFO] 批处理预取：提交 {submitted} 条请求（{len(papers)} 篇论文）")
+    return session
+
+
 def process_paper(
     paper: Dict[str, Any],
     section: str,
@@ -962,6 +1066,7 @@ def process_paper(
     docs_dir: str,
     glance_only: bool = False,
     force_glance: bool = False,
+    skip_deep_summary: bool = False,
 ) -> Tuple[str, str]:
     title = (paper.get("title") or "").strip()
     arxiv_id = str(paper.get("id") or paper.get("paper_id") or "").strip()
@@ -1102,7 +1207,7 @@ def process_paper(
             # 只生成速览：不拉取 PDF、不做精读总结
             return paper_id, title
 
-        if section == "deep":
+        if section == "deep" and not skip_deep_summary:
             # 精读区：检查是否已有详细总结
             tail = extract_section_tail(existing, "论文详细总结（自动生成）")
             if tail:
@@ -1152,8 +1257,8 @@ def process_paper(
     with open(md_path, "w", encoding="utf-8") as f:
         f.write(content)
 
-    # 精读区：生成详细总结
-    if section == "deep":
+    # 精读区：生成详细总结（按预算降级时跳过，之后重跑 Step 6 会自动补齐）
+    if section == "deep" and not skip_deep_summary:
         summary = generate_deep_summary(md_path, txt_path)
         if summary:
             upsert_auto_block(md_path, "论文详细总结（自动生成）", summary)
@@ -1434,6 +1539,17 @@ def main() -> None:
         action="store_true",
         help="仅修复已生成文章里的 `**Tags**`（移除“精读区/速读区”标签），不触发 LLM。",
     )
+    parser.add_argument(
+        "--skip-deep-summary",
+        action="store_true",
+        help="精读区照常生成页面（翻译、速览），但不下载全文、不生成精读总结（main.py 按预算降级时传入）。",
+    )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="回溯运行用：翻译与速览请求先作为 OpenAI 兼容的批处理任务提交（LLM_BATCH_BASE_URL 可指向 src/batch_standin.py），"
+        "精读总结仍逐篇交互调用。",
+    )
     args = parser.parse_args()
 
     date_str = args.date or TODAY_STR
@@ -1448,15 +1564,14 @@ def main() -> None:
     docs_dir = args.docs_dir or resolve_docs_dir()
     archive_dir = os.path.join(ROOT_DIR, "archive", date_str, "recommend")
     recommend_path = os.path.join(archive_dir, f"arxiv_papers_{date_str}.{mode}.json")
-    if not os.path.exists(recommend_path):
+    if not json_exists(recommend_path):
         log(f"[WARN] recommend 文件不存在（今天可能没有新论文）：{recommend_path}，将跳过 Step 6。")
         return
 
     log_substep("6.1", "读取 recommend 结果", "START")
     payload = {}
     try:
-        with open(recommend_path, "r", encoding="utf-8") as f:
-            payload = json.load(f)
+        payload = load_json(recommend_path)
     finally:
         log_substep("6.1", "读取 recommend 结果", "END")
     deep_list = payload.get("deep_dive") or []
@@ -1524,6 +1639,13 @@ def main() -> None:
             quick_entries.append((pid, title, extract_sidebar_tags(paper)))
         log_substep("6.3", "跳过生成文章（仅更新侧边栏）", "SKIP")
     else:
+        usage_start = llm_usage()
+        started_at = time.time()
+        session = None
+        if args.batch and LLM_CLIENT is not None:
+            session = prefetch_docs_requests(
+                deep_list + quick_list, docs_dir, date_str, args.glance_only, args.force_glance
+            )
         log_substep("6.2", "生成精读区文章", "START")
         for paper in deep_list:
             pid, title = process_paper(
@@ -1533,9 +1655,12 @@ def main() -> None:
                 docs_dir,
                 glance_only=args.glance_only,
                 force_glance=args.force_glance,
+                skip_deep_summary=args.skip_deep_summary,
             )
             deep_entries.append((pid, title, extract_sidebar_tags(paper)))
         log_substep("6.2", "生成精读区文章", "END")
+        usage_deep = llm_usage()
+        deep_seconds = time.time() - started_at
 
         log_substep("6.3", "生成速读区文章", "START")
         for paper in quick_list:
@@ -1549,6 +1674,19 @@ def main() -> None:
             )
             quick_entries.append((pid, title, extract_sidebar_tags(paper)))
         log_substep("6.3", "生成速读区文章", "END")
+        record_docs_stage(
+            date_str,
+            len(deep_list),
+            len(quick_list),
+            usage_start,
+            usage_deep,
+            llm_usage(),
+            deep_seconds,
+            time.time() - started_at,
+            full_deep=not (args.glance_only or args.skip_deep_summary),
+            mode=mode,
+            batch=session.stats() if session is not None else None,
+        )
 
     sidebar_path = os.path.join(docs_dir, "_sidebar.md")
     log_substep("6.4", "更新侧边栏", "START")
@@ -0,0 +1,445 @@
+#!/usr/bin/env python
+# 跨日期的论文向量近邻索引（IVF，纯 numpy 实现），位于 archive/ann：
+# 1. 粗量化器：对向量做球面 k-means 得到 nlist 个中心，每篇论文归入最近的中心（倒排列表）；
+# 2. 每天（每个原始文件）一个分段：segments/<YYYYMMDD>__<name>.npz，向量按列表号排序并记录偏移，
+#    以 embedding_store 的 float16 / int8 形式保存，同时保存论文 ID 与标题，便于不依赖当天的论文库展示；
+# 3. 增量：2.2 计算完当天向量后追加分段（同名分段覆盖），中心在第一次写入时用当天向量训练；
+#    向量总数超过训练时的 RETRAIN_FACTOR 倍后自动 rebuild（以全部分段重新训练并重新分配），也可手动 rebuild；
+# 4. 查询：先算查询与各中心的相似度取前 nprobe 个列表，只扫描日期范围内分段中这些列表的行，
+#    得到近似 top-k；用于新订阅在历史论文上的回填，不需要重跑步骤 1–2。
+#
+# 用法：
+#   python src/ann_index.py add --day 20260124           # 从 archive/20260124/embeddings 的向量缓存补录
+#   python src/ann_index.py query "diffusion for video" --from 20260101 --to 20260131 -k 20
+#   python src/ann_index.py stats | rebuild --nlist 256
+
+import argparse
+import glob
+import json
+import os
+import re
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from embedding_store import EMBEDDING_STORE_DIRNAME, QuantizedMatrix, load_embeddings
+from storage import ARCHIVE_ROOT, PaperStore, file_lock, paper_store_dir_for
+
+ANN_INDEX_DIR = os.path.join(ARCHIVE_ROOT, "ann")
+ANN_META_FILE = "meta.json"
+ANN_CENTROIDS_FILE = "centroids.npy"
+ANN_SEGMENTS_DIRNAME = "segments"
+ANN_LOCK_FILE = ".lock"
+DEFAULT_NPROBE = 8
+DEFAULT_MODE = "int8"
+MAX_NLIST = 256
+KMEANS_ITERS = 20
+RETRAIN_FACTOR = 4
+DAY_RE = re.compile(r"^\d{8}$")
+
+
+def log(message: str) -> None:
+    ts = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    print(f"[{ts}] {message}", flush=True)
+
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    x = np.asarray(x, dtype=np.float32)
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    return x / np.where(norms > 0, norms, 1.0)
+
+
+def default_nlist(num_vectors: int) -> int:
+    """约 2·√N 个列表，至少 1 个、至多 MAX_NLIST 个。"""
+    return int(max(1, min(MAX_NLIST, round(2 * np.sqrt(max(num_vectors, 1))))))
+
+
+def train_centroids(vectors: np.ndarray, nlist: int, seed: int = 0) -> np.ndarray:
+    """球面 k-means（点积相似度）；空簇用离中心最远的点重新初始化。"""
+    x = _normalize(vectors)
+    n = x.shape[0]
+    nlist = max(1, min(nlist, n))
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(n, size=nlist, replace=False)].copy()
+    for _ in range(KMEANS_ITERS):
+        sims = x @ centroids.T
+        assign = sims.argmax(axis=1)
+        best = sims[np.arange(n), assign]
+        new = np.zeros_like(centroids)
+        np.add.at(new, assign, x)
+        counts = np.bincount(assign, minlength=nlist)
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            far = np.argsort(best)[: len(empty)]
+            new[empty] = x[far]
+        centroids = _normalize(new)
+    return centroids
+
+
+def assign_lists(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    return (np.asarray(vectors, dtype=np.float32) @ centroids.T).argmax(axis=1).astype(np.int32)
+
+
+class AnnSegment:
+    """一个分段：按列表号排序的向量（量化存储）+ 列表偏移 + 论文 ID / 标题。"""
+
+    def __init__(self, day: str, name: str, matrix: QuantizedMatrix, offsets: np.ndarray, ids: np.ndarray, titles: np.ndarray):
+        self.day = day
+        self.name = name
+        self.matrix = matrix
+        self.offsets = offsets
+        self.ids = ids
+        self.titles = titles
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def load(cls, path: str) -> "AnnSegment":
+        with np.load(path, allow_pickle=False) as z:
+            mode = str(z["mode"])
+            scale = z["scale"] if "scale" in z.files else None
+            matrix = QuantizedMatrix(mode, z["data"], scale)
+            return cls(str(z["day"]), str(z["name"]), matrix, z["offsets"], z["ids"], z["titles"])
+
+    def rows_for_lists(self, lists: Sequence[int]) -> np.ndarray:
+        parts = [np.arange(self.offsets[i], self.offsets[i + 1]) for i in lists if self.offsets[i + 1] > self.offsets[i]]
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+
+
+class AnnIndex:
+    """archive/ann 下的 IVF 索引。"""
+
+    def __init__(self, index_dir: str = ANN_INDEX_DIR):
+        self.index_dir = index_dir
+        self.segments_dir = os.path.join(index_dir, ANN_SEGMENTS_DIRNAME)
+        self._meta: Dict[str, Any] | None = None
+        self._centroids: np.ndarray | None = None
+        self._segment_cache: Dict[str, AnnSegment] = {}
+
+    # ---- 元数据 ----
+    @property
+    def meta(self) -> Dict[str, Any]:
+        if self._meta is None:
+            path = os.path.join(self.index_dir, ANN_META_FILE)
+            if os.path.exists(path):
+                with open(path, "r", encoding="utf-8") as f:
+                    self._meta = json.load(f)
+            else:
+                self._meta = {}
+        return self._meta
+
+    def _save_meta(self) -> None:
+        os.makedirs(self.index_dir, exist_ok=True)
+        path = os.path.join(self.index_dir, ANN_META_FILE)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+    @property
+    def centroids(self) -> np.ndarray | None:
+        if self._centroids is None:
+            path = os.path.join(self.index_dir, ANN_CENTROIDS_FILE)
+            if os.path.exists(path):
+                self._centroids = np.load(path)
+        return self._centroids
+
+    def _set_centroids(self, centroids: np.ndarray, trained_on: int) -> None:
+        os.makedirs(self.index_dir, exist_ok=True)
+        np.save(os.path.join(self.index_dir, ANN_CENTROIDS_FILE), centroids.astype(np.float32))
+        self._centroids = centroids.astype(np.float32)
+        self.meta["nlist"] = int(centroids.shape[0])
+        self.meta["dim"] = int(centroids.shape[1])
+        self.meta["trained_on"] = int(trained_on)
+
+    def _trained_on(self) -> int:
+        """训练中心时的向量数；旧索引没有记录时按 nlist ≈ 2·√N 反推。"""
+        trained_on = self.meta.get("trained_on")
+        if trained_on:
+            return int(trained_on)
+        nlist = int(self.meta.get("nlist") or 1)
+        return max(1, (nlist // 2) ** 2)
+
+    def _total_vectors(self) -> int:
+        return sum(int(v.get("count") or 0) for v in (self.meta.get("segments") or {}).values())
+
+    # ---- 分段 ----
+    def segment_path(self, day: str, name: str) -> str:
+        return os.path.join(self.segments_dir, f"{day}__{name}.npz")
+
+    def segment_paths(self, date_from: str | None = None, date_to: str | None = None) -> List[str]:
+        paths = []
+        for path in sorted(glob.glob(os.path.join(self.segments_dir, "*.npz"))):
+            day = os.path.basename(path).split("__", 1)[0]
+            if date_from and day < date_from:
+                continue
+            if date_to and day > date_to:
+                continue
+            paths.append(path)
+        return paths
+
+    def _load_segment(self, path: str) -> AnnSegment:
+        mtime = os.path.getmtime(path)
+        key = f"{path}@{mtime}"
+        seg = self._segment_cache.get(key)
+        if seg is None:
+            seg = AnnSegment.load(path)
+            self._segment_cache[key] = seg
+        return seg
+
+    def _write_segment(
+        self,
+        day: str,
+        name: str,
+        ids: Sequence[str],
+        titles: Sequence[str],
+        vectors: np.ndarray,
+        mode: str,
+    ) -> int:
+        lists = assign_lists(vectors, self.centroids)
+        order = np.argsort(lists, kind="stable")
+        offsets = np.zeros(self.centroids.shape[0] + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(lists, minlength=self.centroids.shape[0]))
+        matrix = QuantizedMatrix.from_float32(vectors[order], mode)
+        arrays = {
+            "day": np.array(day),
+            "name": np.array(name),
+            "mode": np.array(mode),
+            "data": matrix.data,
+            "offsets": offsets,
+            "ids": np.array([str(ids[i]) for i in order]),
+            "titles": np.array([str(titles[i]) for i in order]),
+        }
+        if matrix.scale is not None:
+            arrays["scale"] = matrix.scale
+        os.makedirs(self.segments_dir, exist_ok=True)
+        path = self.segment_path(day, name)
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+        return len(order)
+
+    def add(
+        self,
+        day: str,
+        name: str,
+        ids: Sequence[str],
+        titles: Sequence[str],
+        embeddings: np.ndarray,
+        model_name: str,
+        mode: str = DEFAULT_MODE,
+    ) -> int:
+        """追加（或覆盖）一个分段；索引还没有中心时先用这批向量训练。返回写入的向量数。"""
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if len(vectors) == 0:
+            return 0
+        # 2.2 多文件并发时会同时写入：加锁并重新读取元数据与中心
+        with file_lock(os.path.join(self.index_dir, ANN_LOCK_FILE)):
+            self._meta = None
+            self._centroids = None
+            return self._add_locked(day, name, ids, titles, vectors, model_name, mode)
+
+    def _add_locked(
+        self,
+        day: str,
+        name: str,
+        ids: Sequence[str],
+        titles: Sequence[str],
+        vectors: np.ndarray,
+        model_name: str,
+        mode: str,
+    ) -> int:
+        if self.meta.get("model") and self.meta["model"] != model_name:
+            raise ValueError(f"索引使用的模型为 {self.meta['model']}，不能写入 {model_name} 的向量")
+        if self.centroids is not None and self.centroids.shape[1] != vectors.shape[1]:
+            raise ValueError(f"向量维度 {vectors.shape[1]} 与索引维度 {self.centroids.shape[1]} 不一致")
+        if self.centroids is None:
+            nlist = default_nlist(len(vectors))
+            log(f"[INFO] ANN 索引首次写入，用 {len(vectors)} 条向量训练 {nlist} 个中心。")
+            self._set_centroids(train_centroids(vectors, nlist), len(vectors))
+
+        count = self._write_segment(day, name, ids, titles, vectors, mode)
+        self.meta["model"] = model_name
+        self.meta["mode"] = mode
+        self.meta.setdefault("segments", {})[f"{day}__{name}"] = {"day": day, "count": count}
+        self.meta["updated_at"] = datetime.now(timezone.utc).isoformat()
+        self._save_meta()
+
+        # 中心只代表训练时的那批向量：数据量涨到训练量的 RETRAIN_FACTOR 倍后，列表会越来越不均衡，自动重建
+        total, trained_on = self._total_vectors(), self._trained_on()
+        if total > RETRAIN_FACTOR * trained_on:
+            log(f"[INFO] ANN 索引已有 {total} 条向量，超过训练时 {trained_on} 条的 {RETRAIN_FACTOR} 倍，重新训练中心。")
+            self._rebuild_locked()
+        return count
+
+    def rebuild(self, nlist: int | None = None) -> None:
+        """用全部分段（反量化后）重新训练中心并重写各分段。"""
+        with file_lock(os.path.join(self.index_dir, ANN_LOCK_FILE)):
+            self._meta = None
+            self._centroids = None
+            self._rebuild_locked(nlist)
+
+    def _rebuild_locked(self, nlist: int | None = None) -> None:
+        segs = [self._load_segment(p) for p in self.segment_paths()]
+        if not segs:
+            log("[WARN] 索引为空，无需重建。")
+            return
+        all_vectors = np.concatenate([s.matrix.dequantize() for s in segs])
+        nlist = nlist or default_nlist(len(all_vectors))
+        log(f"[INFO] 重建 ANN 索引：{len(all_vectors)} 条向量，{nlist} 个中心。")
+        self._set_centroids(train_centroids(all_vectors, nlist), len(all_vectors))
+        for s in segs:
+            self._write_segment(s.day, s.name, list(s.ids), list(s.titles), s.matrix.dequantize(), s.matrix.mode)
+        self._segment_cache.clear()
+        self.meta["updated_at"] = datetime.now(timezone.utc).isoformat()
+        self._save_meta()
+
+    # ---- 查询 ----
+    def search(
+        self,
+        query_embeddings: np.ndarray,
+        k: int = 20,
+        date_from: str | None = None,
+        date_to: str | None = None,
+        nprobe: int = DEFAULT_NPROBE,
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        每个查询返回至多 k 条 {id, title, day, score}，按分数降序；同一篇论文出现在多天时只保留分数最高的一条。
+        date_from / date_to 为 YYYYMMDD（含端点）。
+        """
+        if self.centroids is None:
+            return [[] for _ in range(len(np.atleast_2d(query_embeddings)))]
+        q = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        nprobe = max(1, min(nprobe, self.centroids.shape[0]))
+        probe_lists = np.argsort(-(q @ self.centroids.T), axis=1)[:, :nprobe]
+        segments = [self._load_segment(p) for p in self.segment_paths(date_from, date_to)]
+
+        results: List[List[Dict[str, Any]]] = []
+        for qi in range(q.shape[0]):
+            best: Dict[str, Tuple[float, str, str]] = {}
+            for seg in segments:
+                rows = seg.rows_for_lists(probe_lists[qi])
+                if not len(rows):
+                    continue
+                sub = QuantizedMatrix(seg.matrix.mode, seg.matrix.data[rows], seg.matrix.scale)
+                scores = sub.dot(q[qi])[0]
+                take = np.arange(len(rows)) if len(rows) <= k else np.argpartition(-scores, k - 1)[:k]
+                for pos in take.tolist():
+                    r = int(rows[pos])
+                    pid = str(seg.ids[r])
+                    score = float(scores[pos])
+                    if pid not in best or score > best[pid][0]:
+                        best[pid] = (score, seg.day, str(seg.titles[r]))
+            ranked = sorted(best.items(), key=lambda kv: (-kv[1][0], kv[0]))[:k]
+            results.append(
+                [{"id": pid, "title": title, "day": day, "score": round(score, 6)} for pid, (score, day, title) in ranked]
+            )
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        segs = self.meta.get("segments") or {}
+        days = sorted({v["day"] for v in segs.values()})
+        return {
+            "model": self.meta.get("model"),
+            "mode": self.meta.get("mode"),
+            "nlist": self.meta.get("nlist"),
+            "dim": self.meta.get("dim"),
+            "trained_on": self.meta.get("trained_on"),
+            "segments": len(segs),
+            "vectors": self._total_vectors(),
+            "first_day": days[0] if days else None,
+            "last_day": days[-1] if days else None,
+        }
+
+
+def day_for_artifact(path: str) -> str:
+    """archive/YYYYMMDD/<stage>/x.json -> YYYYMMDD；无法推断时用当前 UTC 日期。"""
+    stage_dir = os.path.dirname(os.path.abspath(path))
+    day = os.path.basename(os.path.dirname(stage_dir))
+    if DAY_RE.match(day):
+        return day
+    return datetime.now(timezone.utc).strftime("%Y%m%d")
+
+
+def add_day_from_cache(index: AnnIndex, day: str, mode: str = DEFAULT_MODE) -> int:
+    """从 archive/<day>/embeddings 下的向量缓存（2.2 --embedding-cache）补录一天的分段。"""
+    emb_dir = os.path.join(ARCHIVE_ROOT, day, EMBEDDING_STORE_DIRNAME)
+    total = 0
+    for meta_path in sorted(glob.glob(os.path.join(emb_dir, "*.meta.json"))):
+        cache_base = meta_path[: -len(".meta.json")]
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        matrix = load_embeddings(cache_base)
+        if matrix is None:
+            continue
+        ids = [str(x) for x in meta.get("ids") or []]
+        store = PaperStore(paper_store_dir_for(os.path.join(ARCHIVE_ROOT, day, "raw", "x.json")))
+        found = store.get_many(ids) if os.path.isdir(store.store_dir) else {}
+        titles = [str((found.get(pid) or {}).get("title") or "") for pid in ids]
+        count = index.add(day, os.path.basename(cache_base), ids, titles, matrix.dequantize(), meta.get("model"), mode)
+        log(f"[INFO] 已写入分段 {day}__{os.path.basename(cache_base)}：{count} 条")
+        total += count
+    if total == 0:
+        log(f"[WARN] {emb_dir} 下没有可用的向量缓存（需要 2.2 --embedding-cache）。")
+    return total
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="跨日期论文向量 ANN 索引（archive/ann）。")
+    parser.add_argument("--index-dir", default=ANN_INDEX_DIR, help="索引目录（默认 archive/ann）。")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_add = sub.add_parser("add", help="从某天的向量缓存补录分段。")
+    p_add.add_argument("--day", required=True, action="append", help="YYYYMMDD，可重复。")
+    p_add.add_argument("--mode", choices=["float16", "int8"], default=DEFAULT_MODE)
+
+    p_query = sub.add_parser("query", help="按查询文本检索历史论文。")
+    p_query.add_argument("text", help="查询文本（与订阅的 query_text 相同）。")
+    p_query.add_argument("--from", dest="date_from", default=None, help="起始日期 YYYYMMDD（含）。")
+    p_query.add_argument("--to", dest="date_to", default=None, help="结束日期 YYYYMMDD（含）。")
+    p_query.add_argument("-k", type=int, default=20)
+    p_query.add_argument("--nprobe", type=int, default=DEFAULT_NPROBE)
+    p_query.add_argument("--device", default="cpu")
+    p_query.add_argument("--json", action="store_true", help="以 JSON 输出。")
+
+    p_rebuild = sub.add_parser("rebuild", help="用全部分段重新训练中心。")
+    p_rebuild.add_argument("--nlist", type=int, default=None)
+
+    sub.add_parser("stats", help="查看索引概况。")
+
+    args = parser.parse_args()
+    index = AnnIndex(args.index_dir)
+
+    if args.command == "add":
+        for day in args.day:
+            add_day_from_cache(index, day, args.mode)
+    elif args.command == "stats":
+        print(json.dumps(index.stats(), ensure_ascii=False, indent=2))
+    elif args.command == "rebuild":
+        index.rebuild(args.nlist)
+    elif args.command == "query":
+        model_name = index.meta.get("model")
+        if not model_name:
+            log("[ERROR] 索引为空。")
+            return
+        # 延迟导入：只有查询时才需要 torch / sentence-transformers
+        from filter import encode_queries, load_embedding_model
+
+        model = load_embedding_model(model_name, args.device)
+        q_emb = encode_queries(model, [args.text])
+        start = time.time()
+        hits = index.search(q_emb, k=args.k, date_from=args.date_from, date_to=args.date_to, nprobe=args.nprobe)[0]
+        elapsed_ms = (time.time() - start) * 1000
+        if args.json:
+            print(json.dumps(hits, ensure_ascii=False, indent=2))
+        else:
+            log(f"[INFO] 命中 {len(hits)} 篇（检索耗时 {elapsed_ms:.1f}ms）")
+            for rank, h in enumerate(hits, start=1):
+                print(f"{rank:>3}. [{h['day']}] {h['id']}  {h['score']:.4f}  {h['title']}")
+
+
+if __name__ == "__main__":
+    main()
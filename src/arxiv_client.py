@@ -0,0 +1,418 @@
+#!/usr/bin/env python
+# 轻量 arXiv Atom 客户端：
+# 1. 复用连接池（requests.Session），按页请求 export.arxiv.org/api/query；
+# 2. 使用增量 XML 解析器（XMLPullParser）边下载边解析，逐条产出论文 dict；
+# 3. 只保留流水线需要的字段，其余元素解析完立即丢弃，不构造 arxiv.Result；
+# 4. 附带基准测试入口：对比本地录制的 feed 在旧路径（arxiv 包）与流式路径下的 CPU 时间与内存。
+
+import argparse
+import os
+import re
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Iterator, List
+from urllib.parse import urlencode
+
+import requests
+from requests.adapters import HTTPAdapter
+
+API_URL = "https://export.arxiv.org/api/query"
+USER_AGENT = "daily-paper-reader (+https://github.com/enjnks/daily-paper-reader)"
+
+ATOM_NS = "{http://www.w3.org/2005/Atom}"
+ARXIV_NS = "{http://arxiv.org/schemas/atom}"
+OPENSEARCH_NS = "{http://a9.com/-/spec/opensearch/1.1/}"
+
+TAG_ENTRY = f"{ATOM_NS}entry"
+TAG_ID = f"{ATOM_NS}id"
+TAG_TITLE = f"{ATOM_NS}title"
+TAG_SUMMARY = f"{ATOM_NS}summary"
+TAG_PUBLISHED = f"{ATOM_NS}published"
+TAG_AUTHOR = f"{ATOM_NS}author"
+TAG_NAME = f"{ATOM_NS}name"
+TAG_LINK = f"{ATOM_NS}link"
+TAG_CATEGORY = f"{ATOM_NS}category"
+TAG_PRIMARY_CATEGORY = f"{ARXIV_NS}primary_category"
+TAG_TOTAL_RESULTS = f"{OPENSEARCH_NS}totalResults"
+
+WHITESPACE_RE = re.compile(r"\s+")
+CHUNK_SIZE = 64 * 1024
+
+
+class ArxivFetchError(RuntimeError):
+    """单页请求在重试后仍失败（HTTP 错误或意外的空页）。"""
+
+
+class ArxivClientError(ArxivFetchError):
+    """4xx（429 除外）：请求参数本身有误，重试无意义，直接失败。"""
+
+
+def parse_published(value: str | None) -> datetime | None:
+    """把 Atom 的 RFC 3339 时间（如 2026-01-27T18:59:55Z）解析为 UTC datetime。"""
+    raw = (value or "").strip()
+    if not raw:
+        return None
+    try:
+        dt = datetime.fromisoformat(raw.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+def normalize_whitespace(text: str) -> str:
+    """折叠连续空白（含换行）为单个空格并去掉首尾空白；标题与摘要共用。"""
+    return WHITESPACE_RE.sub(" ", text or "").strip()
+
+
+def entry_to_paper(entry: ET.Element) -> Dict[str, Any] | None:
+    """
+    将一个 <entry> 元素直接转换为流水线使用的论文 dict。
+    字段与旧实现（arxiv.Result -> dict）保持一致，published 仍为 str(datetime)。
+    """
+    entry_id = ""
+    title = ""
+    summary = ""
+    published_raw = ""
+    authors: List[str] = []
+    categories: List[str] = []
+    primary_category = ""
+    pdf_link = None
+
+    for child in entry:
+        tag = child.tag
+        if tag == TAG_ID:
+            entry_id = (child.text or "").strip()
+        elif tag == TAG_TITLE:
+            title = child.text or ""
+        elif tag == TAG_SUMMARY:
+            summary = child.text or ""
+        elif tag == TAG_PUBLISHED:
+            published_raw = child.text or ""
+        elif tag == TAG_AUTHOR:
+            name = child.find(TAG_NAME)
+            authors.append((name.text or "") if name is not None else "")
+        elif tag == TAG_LINK:
+            if pdf_link is None and child.get("title") == "pdf":
+                pdf_link = child.get("href")
+        elif tag == TAG_CATEGORY:
+            term = child.get("term")
+            if term is not None:
+                categories.append(term)
+        elif tag == TAG_PRIMARY_CATEGORY:
+            primary_category = child.get("term") or ""
+
+    if not entry_id:
+        return None
+    published = parse_published(published_raw)
+    if published is None:
+        return None
+
+    return {
+        "id": entry_id.split("arxiv.org/abs/")[-1],
+        "source": "arxiv",
+        "title": normalize_whitespace(title),
+        "abstract": normalize_whitespace(summary),
+        "authors": authors,
+        "primary_category": primary_category,
+        "categories": categories,
+        "published": str(published),
+        "link": pdf_link or entry_id,
+    }
+
+
+class AtomStreamParser:
+    """
+    增量解析 arXiv Atom 响应：feed() 喂入字节块，返回本块内解析完成的论文 dict。
+    每个 <entry> 处理完后立即从树上摘除，内存占用与单条 entry 同阶。
+    """
+
+    def __init__(self):
+        self._parser = ET.XMLPullParser(events=("start", "end"))
+        self._root: ET.Element | None = None
+        self.total_results: int | None = None
+        self.entries = 0
+
+    def feed(self, chunk: bytes) -> List[Dict[str, Any]]:
+        self._parser.feed(chunk)
+        return self._drain()
+
+    def close(self) -> List[Dict[str, Any]]:
+        self._parser.close()
+        return self._drain()
+
+    def _drain(self) -> List[Dict[str, Any]]:
+        papers: List[Dict[str, Any]] = []
+        for event, elem in self._parser.read_events():
+            if event == "start":
+                if self._root is None:
+                    self._root = elem
+                continue
+            tag = elem.tag
+            if tag == TAG_ENTRY:
+                self.entries += 1
+                paper = entry_to_paper(elem)
+                if paper is not None:
+                    papers.append(paper)
+                elem.clear()
+                if self._root is not None:
+                    self._root.remove(elem)
+            elif tag == TAG_TOTAL_RESULTS:
+                try:
+                    self.total_results = int((elem.text or "").strip())
+                except ValueError:
+                    self.total_results = 0
+        return papers
+
+
+def parse_feed_bytes(content: bytes, chunk_size: int = CHUNK_SIZE) -> List[Dict[str, Any]]:
+    """解析一份完整的 Atom 响应（用于录制文件 / 基准测试）。"""
+    parser = AtomStreamParser()
+    papers: List[Dict[str, Any]] = []
+    for start in range(0, len(content), chunk_size):
+        papers.extend(parser.feed(content[start : start + chunk_size]))
+    papers.extend(parser.close())
+    return papers
+
+
+class ArxivAtomClient:
+    """
+    按 arXiv API 使用条款（默认 3 秒/请求）分页抓取，复用同一连接池。
+    - iter_papers(query) 逐条产出论文 dict（按 submittedDate 倒序）；
+    - record_dir 非空时，把每页原始响应另存到磁盘，便于离线复现与基准测试。
+    """
+
+    def __init__(
+        self,
+        page_size: int = 200,
+        delay_seconds: float = 3.0,
+        num_retries: int = 5,
+        timeout: float = 60.0,
+        record_dir: str | None = None,
+    ):
+        self.page_size = max(int(page_size), 1)
+        self.delay_seconds = float(delay_seconds)
+        self.num_retries = max(int(num_retries), 0)
+        self.timeout = timeout
+        self.record_dir = record_dir
+        self._last_request_at: float | None = None
+        self._record_seq = 0
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=2)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"User-Agent": USER_AGENT})
+
+    def _wait_rate_limit(self) -> None:
+        if self._last_request_at is None:
+            return
+        elapsed = time.monotonic() - self._last_request_at
+        if elapsed < self.delay_seconds:
+            time.sleep(self.delay_seconds - elapsed)
+
+    def _open_record_file(self):
+        if not self.record_dir:
+            return None
+        os.makedirs(self.record_dir, exist_ok=True)
+        self._record_seq += 1
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S")
+        path = os.path.join(self.record_dir, f"feed_{stamp}_{self._record_seq:04d}.xml")
+        return open(path, "wb")
+
+    def _fetch_page(self, params: Dict[str, str], first_page: bool) -> tuple[List[Dict[str, Any]], int]:
+        """
+        请求单页并流式解析；返回（论文列表，totalResults）。
+        - 5xx / 429 / 网络错误 / 解析错误按 num_retries 重试；其余 4xx 属于请求本身有误，直接失败；
+        - 录制文件每页只打开一次，重试时截断重写，只保留最后一次响应。
+        """
+        url = f"{API_URL}?{urlencode(params)}"
+        last_error: Exception | None = None
+        record = self._open_record_file()
+        try:
+            for attempt in range(self.num_retries + 1):
+                self._wait_rate_limit()
+                if record is not None:
+                    record.seek(0)
+                    record.truncate()
+                try:
+                    with self.session.get(url, stream=True, timeout=self.timeout) as resp:
+                        self._last_request_at = time.monotonic()
+                        status = resp.status_code
+                        if 400 <= status < 500 and status != 429:
+                            raise ArxivClientError(f"HTTP {status} for {url}")
+                        if status != 200:
+                            raise ArxivFetchError(f"HTTP {status} for {url}")
+                        parser = AtomStreamParser()
+                        papers: List[Dict[str, Any]] = []
+                        for chunk in resp.iter_content(chunk_size=CHUNK_SIZE):
+                            if not chunk:
+                                continue
+                            if record is not None:
+                                record.write(chunk)
+                            papers.extend(parser.feed(chunk))
+                        papers.extend(parser.close())
+                    if parser.entries == 0 and not first_page:
+                        raise ArxivFetchError(f"unexpected empty page: {url}")
+                    return papers, int(parser.total_results or 0)
+                except ArxivClientError:
+                    raise
+                except (ArxivFetchError, ET.ParseError, requests.exceptions.RequestException) as e:
+                    last_error = e
+                    self._last_request_at = time.monotonic()
+        finally:
+            if record is not None:
+                record.close()
+        raise ArxivFetchError(f"giving up after {self.num_retries + 1} tries: {last_error}")
+
+    def iter_papers(self, query: str, max_results: int | None = None) -> Iterator[Dict[str, Any]]:
+        offset = 0
+        first_page = True
+        while True:
+            page_size = self.page_size
+            if max_results is not None:
+                page_size = min(page_size, max_results - offset)
+                if page_size <= 0:
+                    return
+            params = {
+                "search_query": query,
+                "start": str(offset),
+                "max_results": str(page_size),
+                "sortBy": "submittedDate",
+                "sortOrder": "descending",
+            }
+            papers, total = self._fetch_page(params, first_page=first_page)
+            first_page = False
+            if not papers:
+                return
+            yield from papers
+            offset += len(papers)
+            if offset >= total:
+                return
+
+
+def papers_via_arxiv_package(content: bytes) -> List[Dict[str, Any]]:
+    """旧路径：用 arxiv 包解析整份 feed，构造 arxiv.Result 后再转换为 dict。"""
+    import arxiv  # type: ignore
+
+    try:
+        from arxiv import _feed  # type: ignore
+
+        results = _feed.parse(content).results
+    except ImportError:
+        import feedparser  # type: ignore
+
+        feed = feedparser.parse(content)
+        results = [arxiv.Result._from_feed_entry(e) for e in feed.entries]
+
+    papers: List[Dict[str, Any]] = []
+    for r in results:
+        papers.append(
+            {
+                "id": r.get_short_id(),
+                "source": "arxiv",
+                "title": r.title.replace("\n", " "),
+                "abstract": r.summary.replace("\n", " "),
+                "authors": [a.name for a in r.authors],
+                "primary_category": r.primary_category,
+                "categories": r.categories,
+                "published": str(r.published),
+                "link": getattr(r, "pdf_url", None) or r.entry_id,
+            }
+        )
+    return papers
+
+
+def measure(parse_fn, blobs: Iterable[bytes]) -> Dict[str, float]:
+    """对 parse_fn 跑一遍全部录制文件，统计条目数、CPU 时间与 Python 堆峰值。"""
+    blobs = list(blobs)
+    tracemalloc.start()
+    cpu_start = time.process_time()
+    count = 0
+    for blob in blobs:
+        count += len(parse_fn(blob))
+    cpu = time.process_time() - cpu_start
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    per_k = 1000.0 / count if count else 0.0
+    return {
+        "entries": count,
+        "cpu_s": cpu,
+        "cpu_ms_per_1k": cpu * 1000.0 * per_k,
+        "peak_mb": peak / 1024 / 1024,
+        "peak_mb_per_1k": peak / 1024 / 1024 * per_k,
+    }
+
+
+def run_benchmark(paths: List[str], repeat: int) -> None:
+    files: List[str] = []
+    for p in paths:
+        if os.path.isdir(p):
+            files.extend(
+                os.path.join(p, name) for name in sorted(os.listdir(p)) if name.lower().endswith(".xml")
+            )
+        elif os.path.exists(p):
+            files.append(p)
+        else:
+            print(f"[WARN] 路径不存在，跳过：{p}")
+    if not files:
+        print("[ERROR] 没有找到录制的 feed 文件（*.xml）。")
+        return
+    blobs = []
+    for path in files:
+        with open(path, "rb") as f:
+            blobs.append(f.read())
+    print(f"[INFO] feeds={len(files)} bytes={sum(len(b) for b in blobs)} repeat={repeat}")
+
+    candidates = [("stream", parse_feed_bytes)]
+    try:
+        import arxiv  # type: ignore  # noqa: F401
+
+        candidates.insert(0, ("arxiv", papers_via_arxiv_package))
+    except ImportError:
+        print("[WARN] 未安装 arxiv 包，仅测试流式解析路径。")
+
+    for name, fn in candidates:
+        best: Dict[str, float] | None = None
+        for _ in range(max(repeat, 1)):
+            stats = measure(fn, blobs)
+            if best is None or stats["cpu_s"] < best["cpu_s"]:
+                best = stats
+        print(
+            f"[BENCH] {name:<7} entries={int(best['entries'])} "
+            f"cpu={best['cpu_ms_per_1k']:.1f}ms/1k "
+            f"peak_heap={best['peak_mb_per_1k']:.2f}MB/1k (total {best['peak_mb']:.2f}MB)"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="arXiv Atom 流式客户端：录制 feed 或对比解析开销（旧 arxiv 包路径 vs 流式路径）。",
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    bench = sub.add_parser("bench", help="基于磁盘上录制的 feed 做解析基准测试。")
+    bench.add_argument("paths", nargs="+", help="feed 文件或目录（目录下的 *.xml）。")
+    bench.add_argument("--repeat", type=int, default=3, help="重复次数，取 CPU 最少的一次（默认 3）。")
+
+    record = sub.add_parser("record", help="请求一个查询并把每页原始响应保存到目录。")
+    record.add_argument("query", help="arXiv search_query，例如 'cat:cs.LG'。")
+    record.add_argument("--out-dir", required=True, help="保存目录。")
+    record.add_argument("--max-results", type=int, default=1000, help="最多抓取条数（默认 1000）。")
+    record.add_argument("--page-size", type=int, default=200, help="每页条数（默认 200）。")
+
+    args = parser.parse_args()
+    if args.command == "bench":
+        run_benchmark(args.paths, args.repeat)
+        return
+
+    client = ArxivAtomClient(page_size=args.page_size, record_dir=args.out_dir)
+    count = sum(1 for _ in client.iter_papers(args.query, max_results=args.max_results))
+    print(f"[INFO] recorded {count} entries into {args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# 批量处理多个原始文件的执行器（2.1 / 2.2 的批处理模式共用）：
+# 1. run_file_tasks：进程池按文件并发执行，结果按提交顺序返回；进程数即同时驻留内存的文件数上限；
+# 2. ModelServer：单独的模型进程持有唯一一份向量模型，各文件 worker 通过队列发送文本批次；
+# 3. RemoteEncoder：worker 侧的 encode() 代理，与 SentenceTransformer.encode 接口一致，
+#    filter.compute_embeddings / encode_queries 无需修改即可使用。
+# 本模块不导入 torch，worker 进程本身不加载模型。
+
+import multiprocessing as mp
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, List, Sequence
+
+# 自动模式下并发文件数的上限：每个 worker 都会完整持有一个文件的论文池与中间结果
+MAX_AUTO_FILE_WORKERS = 4
+
+
+def log(message: str) -> None:
+    ts = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    print(f"[{ts}] {message}", flush=True)
+
+
+def resolve_file_workers(workers: int, num_files: int) -> int:
+    """workers<=0 为自动：min(CPU 数, 文件数, MAX_AUTO_FILE_WORKERS)；显式指定时不超过文件数。"""
+    if num_files <= 1:
+        return 1
+    if workers > 0:
+        return max(1, min(workers, num_files))
+    return max(1, min(os.cpu_count() or 1, num_files, MAX_AUTO_FILE_WORKERS))
+
+
+def run_file_tasks(
+    fn: Callable[..., Any],
+    tasks: Sequence[tuple],
+    workers: int,
+    initializer: Callable[..., None] | None = None,
+    initargs: tuple = (),
+) -> List[Any]:
+    """
+    对每个参数元组调用 fn(*task)，返回与 tasks 同序的结果列表。
+    - workers<=1 时在当前进程串行执行（不调用 initializer）；
+    - fn / initializer 必须是模块级函数（需要被 pickle）；
+    - 任一文件失败时，等已提交的文件结束后按顺序抛出第一个异常，与串行循环的行为一致。
+    """
+    if workers <= 1 or len(tasks) <= 1:
+        return [fn(*task) for task in tasks]
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=mp.get_context(),
+        initializer=initializer,
+        initargs=initargs,
+    ) as pool:
+        futures = [pool.submit(fn, *task) for task in tasks]
+        return [f.result() for f in futures]
+
+
+def _serve_model(
+    load_model: Callable[[], Any],
+    request_queue,
+    response_queues: List[Any],
+) -> None:
+    """模型进程主循环：按到达顺序处理 (client_id, texts, kwargs) 请求，收到 None 时退出。"""
+    try:
+        model = load_model()
+    except BaseException as e:  # 加载失败时让所有客户端都能拿到异常
+        error = RuntimeError(f"模型进程加载失败：{e}")
+        while True:
+            msg = request_queue.get()
+            if msg is None:
+                return
+            response_queues[msg[0]].put(error)
+
+    while True:
+        msg = request_queue.get()
+        if msg is None:
+            return
+        client_id, texts, kwargs = msg
+        try:
+            result = model.encode(texts, **kwargs)
+        except BaseException as e:
+            result = RuntimeError(f"模型进程编码失败：{e}")
+        response_queues[client_id].put(result)
+
+
+class RemoteEncoder:
+    """worker 侧的模型代理：encode() 把文本发给模型进程并阻塞等待结果。"""
+
+    def __init__(self, request_queue, response_queue, client_id: int):
+        self.request_queue = request_queue
+        self.response_queue = response_queue
+        self.client_id = client_id
+
+    def encode(self, sentences, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        self.request_queue.put((self.client_id, texts, kwargs))
+        result = self.response_queue.get()
+        if isinstance(result, BaseException):
+            raise result
+        return result[0] if single else result
+
+
+class ModelServer:
+    """
+    在独立进程中加载一份模型，供 num_clients 个 worker 共享。
+    用法：
+        with ModelServer(load_model, num_clients=n) as server:
+            run_file_tasks(fn, tasks, n, initializer=..., initargs=server.client_initargs())
+    每个 worker 在 initializer 中调用 ModelServer.connect(*initargs) 领取一个独占的回包队列。
+    """
+
+    def __init__(self, load_model: Callable[[], Any], num_clients: int):
+        ctx = mp.get_context()
+        self.request_queue = ctx.Queue()
+        self.response_queues = [ctx.Queue() for _ in range(num_clients)]
+        self.slot_queue = ctx.Queue()
+        for slot in range(num_clients):
+            self.slot_queue.put(slot)
+        self.process = ctx.Process(
+            target=_serve_model,
+            args=(load_model, self.request_queue, self.response_queues),
+            name="dpr-model-server",
+            daemon=True,
+        )
+
+    def __enter__(self) -> "ModelServer":
+        self.process.start()
+        log(f"[INFO] 模型进程已启动：pid={self.process.pid}，客户端数={len(self.response_queues)}")
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.request_queue.put(None)
+        self.process.join(timeout=60)
+        if self.process.is_alive():
+            self.process.terminate()
+
+    def client_initargs(self) -> tuple:
+        return (self.request_queue, self.response_queues, self.slot_queue)
+
+    @staticmethod
+    def connect(request_queue, response_queues: List[Any], slot_queue) -> RemoteEncoder:
+        slot = slot_queue.get()
+        return RemoteEncoder(request_queue, response_queues[slot], slot)
@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+# 本地批处理替身：实现 OpenAI Batch API 的最小子集（/v1/files 与 /v1/batches），
+# 把每个任务的请求行并发转发到上游 OpenAI 兼容接口的 Chat Completions，结果按 Batch API 的输出格式写回。
+# 用途：
+# 1. 网关不支持 /batches 时，步骤 4 / 6 的 --batch 模式仍可使用（LLM_BATCH_BASE_URL=http://127.0.0.1:8799/v1）；
+# 2. 本地联调批处理模式（--upstream 指向任意 OpenAI 兼容接口或测试桩）。
+# 上游 key 默认沿用提交任务时的 Authorization 头；文件与任务只保存在内存里，进程退出即丢弃。
+#
+#   python src/batch_standin.py --port 8799 --upstream https://api.bltcy.ai/v1 --workers 8
+
+import argparse
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Tuple
+
+import requests
+
+DEFAULT_PORT = 8799
+DEFAULT_WORKERS = 8
+SUPPORTED_ENDPOINTS = ("/v1/chat/completions",)
+
+
+def log(message: str) -> None:
+    ts = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    print(f"[{ts}] {message}", flush=True)
+
+
+class BatchStore:
+    """内存中的文件与任务；任务在后台线程里执行。"""
+
+    def __init__(self, upstream: str, api_key: str | None, workers: int):
+        self.upstream = upstream.rstrip("/")
+        self.api_key = api_key
+        self.workers = max(1, int(workers))
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.contents: Dict[str, bytes] = {}
+        self.batches: Dict[str, Dict[str, Any]] = {}
+        self.lock = threading.Lock()
+
+    def add_file(self, content: bytes, filename: str, purpose: str) -> Dict[str, Any]:
+        file_id = f"file-{uuid.uuid4().hex[:24]}"
+        meta = {
+            "id": file_id,
+            "object": "file",
+            "bytes": len(content),
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": purpose,
+        }
+        with self.lock:
+            self.files[file_id] = meta
+            self.contents[file_id] = content
+        return meta
+
+    def create_batch(self, request: Dict[str, Any], authorization: str) -> Tuple[int, Dict[str, Any]]:
+        input_file_id = request.get("input_file_id")
+        endpoint = request.get("endpoint")
+        if input_file_id not in self.contents:
+            return 400, error_body(f"input file not found: {input_file_id}")
+        if endpoint not in SUPPORTED_ENDPOINTS:
+            return 400, error_body(f"unsupported endpoint: {endpoint}")
+        batch_id = f"batch_{uuid.uuid4().hex[:24]}"
+        batch = {
+            "id": batch_id,
+            "object": "batch",
+            "endpoint": endpoint,
+            "input_file_id": input_file_id,
+            "completion_window": request.get("completion_window") or "24h",
+            "status": "validating",
+            "output_file_id": None,
+            "error_file_id": None,
+            "errors": None,
+            "created_at": int(time.time()),
+            "in_progress_at": None,
+            "completed_at": None,
+            "failed_at": None,
+            "cancelled_at": None,
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+            "metadata": request.get("metadata") or {},
+        }
+        with self.lock:
+            self.batches[batch_id] = batch
+        key = f"Bearer {self.api_key}" if self.api_key else authorization
+        threading.Thread(target=self._run, args=(batch_id, key), name=batch_id, daemon=True).start()
+        return 200, dict(batch)
+
+    def get_batch(self, batch_id: str) -> Dict[str, Any] | None:
+        with self.lock:
+            batch = self.batches.get(batch_id)
+            return json.loads(json.dumps(batch)) if batch else None
+
+    def cancel(self, batch_id: str) -> Dict[str, Any] | None:
+        with self.lock:
+            batch = self.batches.get(batch_id)
+            if batch and batch["status"] not in ("completed", "failed", "expired", "cancelled"):
+                batch["status"] = "cancelling"
+        return self.get_batch(batch_id)
+
+    def _update(self, batch_id: str, **fields) -> None:
+        with self.lock:
+            self.batches[batch_id].update(fields)
+
+    def _run(self, batch_id: str, authorization: str) -> None:
+        batch = self.get_batch(batch_id)
+        lines, errors = parse_input(self.contents[batch["input_file_id"]], batch["endpoint"])
+        if errors:
+            self._update(batch_id, status="failed", failed_at=int(time.time()), errors={"object": "list", "data": errors})
+            log(f"[WARN] {batch_id} 校验失败：{errors[:3]}")
+            return
+        self._update(
+            batch_id,
+            status="in_progress",
+            in_progress_at=int(time.time()),
+            request_counts={"total": len(lines), "completed": 0, "failed": 0},
+        )
+        log(f"[INFO] {batch_id} 开始：{len(lines)} 条请求，并发 {self.workers}")
+
+        outputs: List[Dict[str, Any]] = []
+        failures: List[Dict[str, Any]] = []
+
+        def forward(line: Dict[str, Any]) -> None:
+            with self.lock:
+                cancelled = self.batches[batch_id]["status"] == "cancelling"
+            if cancelled:
+                return
+            row = self._forward(line, authorization)
+            with self.lock:
+                counts = self.batches[batch_id]["request_counts"]
+                if row["error"] is None:
+                    outputs.append(row)
+                    counts["completed"] += 1
+                else:
+                    failures.append(row)
+                    counts["failed"] += 1
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            list(pool.map(forward, lines))
+
+        with self.lock:
+            cancelled = self.batches[batch_id]["status"] == "cancelling"
+        if not cancelled:
+            self._update(batch_id, status="finalizing")
+        output_id = self.add_file(jsonl(outputs), f"{batch_id}_output.jsonl", "batch_output")["id"] if outputs else None
+        error_id = self.add_file(jsonl(failures), f"{batch_id}_error.jsonl", "batch_output")["id"] if failures else None
+        self._update(
+            batch_id,
+            status="cancelled" if cancelled else "completed",
+            output_file_id=output_id,
+            error_file_id=error_id,
+            **({"cancelled_at": int(time.time())} if cancelled else {"completed_at": int(time.time())}),
+        )
+        log(f"[INFO] {batch_id} 结束：成功 {len(outputs)}，失败 {len(failures)}")
+
+    def _forward(self, line: Dict[str, Any], authorization: str) -> Dict[str, Any]:
+        row: Dict[str, Any] = {
+            "id": f"batch_req_{uuid.uuid4().hex[:24]}",
+            "custom_id": line["custom_id"],
+            "response": None,
+            "error": None,
+        }
+        url = f"{self.upstream}/{line['url'].split('/v1/', 1)[-1]}"
+        try:
+            response = requests.post(
+                url,
+                headers={"Authorization": authorization, "Content-Type": "application/json"},
+                json=line["body"],
+                timeout=300,
+            )
+        except requests.exceptions.RequestException as exc:
+            row["error"] = {"code": "upstream_error", "message": str(exc)}
+            return row
+        try:
+            body: Any = response.json()
+        except ValueError:
+            body = {"error": {"message": response.text[:500]}}
+        row["response"] = {
+            "status_code": response.status_code,
+            "request_id": response.headers.get("x-request-id") or "",
+            "body": body,
+        }
+        if response.status_code >= 400:
+            row["error"] = {"code": str(response.status_code), "message": str(body)[:500]}
+        return row
+
+
+def error_body(message: str) -> Dict[str, Any]:
+    return {"error": {"message": message, "type": "invalid_request_error"}}
+
+
+def jsonl(rows: List[Dict[str, Any]]) -> bytes:
+    return "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows).encode("utf-8")
+
+
+def parse_input(content: bytes, endpoint: str) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """校验输入文件：每行都要有 custom_id（不重复）、method=POST、url 与任务 endpoint 一致、body 为对象。"""
+    lines: List[Dict[str, Any]] = []
+    errors: List[Dict[str, Any]] = []
+    seen: set = set()
+    for number, raw in enumerate(content.decode("utf-8").splitlines(), start=1):
+        if not raw.strip():
+            continue
+        try:
+            line = json.loads(raw)
+        except ValueError as exc:
+            errors.append({"line": number, "message": f"invalid JSON: {exc}"})
+            continue
+        custom_id = line.get("custom_id")
+        if not custom_id or custom_id in seen:
+            errors.append({"line": number, "message": f"missing or duplicate custom_id: {custom_id}"})
+        elif line.get("method") != "POST" or line.get("url") != endpoint or not isinstance(line.get("body"), dict):
+            errors.append({"line": number, "message": "method must be POST, url must match the batch endpoint"})
+        else:
+            seen.add(custom_id)
+            lines.append(line)
+    return lines, errors
+
+
+def parse_multipart(content_type: str, body: bytes) -> Tuple[Dict[str, str], Dict[str, Tuple[str, bytes]]]:
+    """multipart/form-data -> (普通字段, 文件字段 name -> (filename, bytes))。"""
+    message = BytesParser(policy=HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode("utf-8") + body
+    )
+    fields: Dict[str, str] = {}
+    files: Dict[str, Tuple[str, bytes]] = {}
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        payload = part.get_payload(decode=True) or b""
+        filename = part.get_filename()
+        if filename is not None:
+            files[name] = (filename, payload)
+        else:
+            fields[name] = payload.decode("utf-8")
+    return fields, files
+
+
+def make_handler(store: BatchStore):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+        def _path(self) -> str:
+            path = self.path.split("?", 1)[0].rstrip("/")
+            return path[3:] if path.startswith("/v1/") else path
+
+        def _send(self, status: int, body: Any, content_type: str = "application/json") -> None:
+            data = body if isinstance(body, bytes) else json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _body(self) -> bytes:
+            return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+        def do_GET(self) -> None:
+            parts = self._path().strip("/").split("/")
+            if len(parts) == 2 and parts[0] == "batches":
+                batch = store.get_batch(parts[1])
+                return self._send(200, batch) if batch else self._send(404, error_body("batch not found"))
+            if len(parts) == 2 and parts[0] == "files" and parts[1] in store.files:
+                return self._send(200, store.files[parts[1]])
+            if len(parts) == 3 and parts[0] == "files" and parts[2] == "content" and parts[1] in store.contents:
+                return self._send(200, store.contents[parts[1]], "application/jsonl")
+            self._send(404, error_body(f"not found: {self.path}"))
+
+        def do_POST(self) -> None:
+            parts = self._path().strip("/").split("/")
+            body = self._body()
+            if parts == ["files"]:
+                content_type = self.headers.get("Content-Type") or ""
+                if not content_type.startswith("multipart/form-data"):
+                    return self._send(400, error_body("expected multipart/form-data"))
+                fields, files = parse_multipart(content_type, body)
+                if "file" not in files:
+                    return self._send(400, error_body("missing file field"))
+                filename, content = files["file"]
+                return self._send(200, store.add_file(content, filename, fields.get("purpose") or "batch"))
+            if parts == ["batches"]:
+                try:
+                    request = json.loads(body or b"{}")
+                except ValueError:
+                    return self._send(400, error_body("invalid JSON body"))
+                status, payload = store.create_batch(request, self.headers.get("Authorization") or "")
+                return self._send(status, payload)
+            if len(parts) == 3 and parts[0] == "batches" and parts[2] == "cancel":
+                batch = store.cancel(parts[1])
+                return self._send(200, batch) if batch else self._send(404, error_body("batch not found"))
+            self._send(404, error_body(f"not found: {self.path}"))
+
+    return Handler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="本地 OpenAI Batch API 替身：把批处理任务转成对上游 Chat Completions 的并发请求。",
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址。")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="监听端口。")
+    parser.add_argument(
+        "--upstream",
+        default=os.getenv("BLT_API_BASE", "https://api.bltcy.ai/v1"),
+        help="上游 OpenAI 兼容接口（含 /v1），默认 BLT_API_BASE。",
+    )
+    parser.add_argument(
+        "--api-key",
+        default=None,
+        help="上游 key；默认使用提交任务时的 Authorization 头。",
+    )
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="每个任务转发上游的并发数。")
+    args = parser.parse_args()
+
+    store = BatchStore(args.upstream, args.api_key, args.workers)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(store))
+    log(f"[INFO] batch stand-in listening on http://{args.host}:{args.port}/v1 -> {store.upstream}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# 按每个查询的分数分布自适应截断召回列表（2.1 / 2.2 在各自的原始分数上使用；
+# 2.3 的 RRF 分数只由名次决定，不参与截断，避免同一候选被截两次）：
+# - gap：在 [min_k, max_k] 内找相邻分数的最大落差，落差明显大于窗口内平均落差时在此处截断；
+# - zscore：保留分数的 z 值（相对整条列表的均值 / 标准差）不低于阈值的论文；
+# - knee：Kneedle 拐点——归一化后的降序分数曲线离首尾连线最远的位置；
+# - none：不截断（保持 max_k，等同于原来的固定 top_k）。
+# 结果始终限制在 [min_k, max_k]；截断后记录每个查询的 k，并按步骤 3（rerank 批次）与
+# 步骤 4（LLM 精读文档与 token）的开销估算下游成本，便于观察候选量是否随真实相关度变化。
+
+import math
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Sequence
+
+CUTOFF_METHODS = ("none", "gap", "zscore", "knee")
+DEFAULT_MIN_K = 10
+DEFAULT_GAP_FACTOR = 3.0
+DEFAULT_Z_THRESHOLD = 1.0
+
+# 下游成本估算用的常量：与 3.rank_papers.py 的 BATCH_SIZE、reranker.py 的 MAX_CHARS_PER_DOC 对齐，
+# 步骤 4 每篇文档约为标题 + 截断摘要，按 4 字符 ≈ 1 token 估算
+RERANK_BATCH_SIZE = 100
+RERANK_CHARS_PER_DOC = 850
+LLM_CHARS_PER_DOC = 1000
+CHARS_PER_TOKEN = 4
+
+
+def log(message: str) -> None:
+    ts = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    print(f"[{ts}] {message}", flush=True)
+
+
+def _clamp(k: int, min_k: int, max_k: int) -> int:
+    return max(min(k, max_k), min(min_k, max_k))
+
+
+def gap_cutoff(scores: Sequence[float], min_k: int, max_k: int, gap_factor: float = DEFAULT_GAP_FACTOR) -> int:
+    n = min(len(scores), max_k)
+    lo = max(1, min(min_k, n))
+    if n <= lo:
+        return n
+    gaps = [scores[i - 1] - scores[i] for i in range(1, n)]
+    window = gaps[lo - 1 :]  # 截在第 i 篇之后对应 gaps[i-1]，i ∈ [lo, n-1]
+    if not window:
+        return n
+    mean_gap = sum(window) / len(window)
+    best_i = max(range(len(window)), key=lambda j: window[j])
+    if mean_gap <= 0 or window[best_i] < gap_factor * mean_gap:
+        return n
+    return lo + best_i
+
+
+def zscore_cutoff(scores: Sequence[float], min_k: int, max_k: int, threshold: float = DEFAULT_Z_THRESHOLD) -> int:
+    n = len(scores)
+    if n == 0:
+        return 0
+    mean = sum(scores) / n
+    std = math.sqrt(sum((s - mean) ** 2 for s in scores) / n)
+    if std <= 0:
+        return _clamp(n, min_k, max_k)
+    k = sum(1 for s in scores if (s - mean) / std >= threshold)
+    return _clamp(k, min_k, max_k)
+
+
+def knee_cutoff(scores: Sequence[float], min_k: int, max_k: int) -> int:
+    n = min(len(scores), max_k)
+    if n <= 2:
+        return n
+    top, bottom = scores[0], scores[n - 1]
+    if top <= bottom:
+        return _clamp(n, min_k, max_k)
+    # 降序曲线归一化到 [0,1]×[0,1] 后，首尾连线为 y = 1 - x，拐点是 (1 - x) - y 最大的位置
+    best_i, best_d = n - 1, -1.0
+    for i in range(n):
+        x = i / (n - 1)
+        y = (scores[i] - bottom) / (top - bottom)
+        d = (1.0 - x) - y
+        if d > best_d:
+            best_i, best_d = i, d
+    return _clamp(best_i + 1, min_k, max_k)
+
+
+class CutoffPolicy:
+    """截断策略：apply(降序分数) -> 保留条数；max_k=None 时由调用方传入默认上限。"""
+
+    def __init__(
+        self,
+        method: str = "none",
+        min_k: int = DEFAULT_MIN_K,
+        max_k: int | None = None,
+        gap_factor: float = DEFAULT_GAP_FACTOR,
+        z_threshold: float = DEFAULT_Z_THRESHOLD,
+    ):
+        if method not in CUTOFF_METHODS:
+            raise ValueError(f"未知的截断方法：{method}")
+        self.method = method
+        self.min_k = max(0, int(min_k))
+        self.max_k = max_k
+        self.gap_factor = gap_factor
+        self.z_threshold = z_threshold
+
+    @property
+    def active(self) -> bool:
+        return self.method != "none"
+
+    def resolve_max_k(self, default_max_k: int) -> int:
+        """召回深度：显式指定的 max_k 优先，否则沿用原来的 top_k。"""
+        return int(self.max_k) if self.max_k and self.max_k > 0 else int(default_max_k)
+
+    def apply(self, scores: Sequence[float], max_k: int) -> int:
+        scores = [float(s) for s in scores]
+        max_k = min(max_k, len(scores)) if max_k > 0 else len(scores)
+        if not self.active or not scores:
+            return max_k
+        if self.method == "gap":
+            return gap_cutoff(scores, self.min_k, max_k, self.gap_factor)
+        if self.method == "zscore":
+            return zscore_cutoff(scores, self.min_k, max_k, self.z_threshold)
+        return knee_cutoff(scores, self.min_k, max_k)
+
+    def describe(self) -> str:
+        extra = ""
+        if self.method == "gap":
+            extra = f", gap_factor={self.gap_factor}"
+        elif self.method == "zscore":
+            extra = f", z>={self.z_threshold}"
+        return f"{self.method}(min_k={self.min_k}, max_k={self.max_k or 'top_k'}{extra})"
+
+
+def add_cutoff_args(parser, default_method: str = "none") -> None:
+    parser.add_argument(
+        "--cutoff",
+        choices=list(CUTOFF_METHODS),
+        default=default_method,
+        help="按每个查询的分数分布自适应截断：gap（最大落差）/ zscore / knee（拐点）；none 为固定 top_k。",
+    )
+    parser.add_argument("--cutoff-min-k", type=int, default=DEFAULT_MIN_K, help=f"自适应截断的最少保留数（默认 {DEFAULT_MIN_K}）。")
+    parser.add_argument(
+        "--cutoff-max-k",
+        type=int,
+        default=None,
+        help="自适应截断的最多保留数（同时是召回深度）；默认沿用原来的 top_k / top_n。",
+    )
+    parser.add_argument("--cutoff-gap-factor", type=float, default=DEFAULT_GAP_FACTOR, help="gap：落差至少为窗口平均落差的倍数。")
+    parser.add_argument("--cutoff-z", type=float, default=DEFAULT_Z_THRESHOLD, help="zscore：保留的最低 z 值。")
+
+
+def policy_from_args(args) -> CutoffPolicy:
+    return CutoffPolicy(
+        method=args.cutoff,
+        min_k=args.cutoff_min_k,
+        max_k=args.cutoff_max_k,
+        gap_factor=args.cutoff_gap_factor,
+        z_threshold=args.cutoff_z,
+    )
+
+
+def estimate_downstream_cost(per_query_counts: Sequence[int], unique_papers: int) -> Dict[str, Any]:
+    """步骤 3 按查询分批 rerank（每批至多 RERANK_BATCH_SIZE 篇），步骤 4 对去重后的候选做 LLM 精读（上限估计）。"""
+    rerank_docs = int(sum(per_query_counts))
+    rerank_batches = int(sum(math.ceil(c / RERANK_BATCH_SIZE) for c in per_query_counts if c > 0))
+    return {
+        "rerank_docs": rerank_docs,
+        "rerank_batches": rerank_batches,
+        "rerank_tokens": rerank_docs * RERANK_CHARS_PER_DOC // CHARS_PER_TOKEN,
+        "llm_docs_max": int(unique_papers),
+        "llm_tokens_max": int(unique_papers) * LLM_CHARS_PER_DOC // CHARS_PER_TOKEN,
+    }
+
+
+def log_cutoff_summary(
+    stage: str,
+    policy: CutoffPolicy,
+    before_counts: List[int],
+    after_counts: List[int],
+    unique_before: int,
+    unique_after: int,
+) -> None:
+    before = estimate_downstream_cost(before_counts, unique_before)
+    after = estimate_downstream_cost(after_counts, unique_after)
+    log(
+        f"[INFO] {stage} 自适应截断 {policy.describe()}：候选 {before['rerank_docs']} -> {after['rerank_docs']}"
+        f"（去重 {unique_before} -> {unique_after}），每查询 k={after_counts}"
+    )
+    log(
+        f"[INFO] {stage} 预计下游成本：步骤 3 rerank {after['rerank_batches']} 批 / ≈{after['rerank_tokens']} tokens"
+        f"（截断前 {before['rerank_batches']} 批 / ≈{before['rerank_tokens']}），"
+        f"步骤 4 LLM ≤{after['llm_docs_max']} 篇 / ≈{after['llm_tokens_max']} tokens"
+        f"（截断前 ≤{before['llm_docs_max']} 篇）"
+    )
@@ -0,0 +1,398 @@
+#!/usr/bin/env python
+# 论文向量的按日缓存与量化存储：
+# 1. 三种存储模式：float32（原样）、float16（半精度）、int8（按维度对称标量量化，每维一个 scale）；
+# 2. 与存储模式配套的点积核：分块转为 float32 后做矩阵-向量乘，int8 把 scale 乘到查询向量上，
+#    不需要先把整份矩阵反量化；
+# 3. search：量化矩阵上先取 k × shortlist_factor 的候选，再用 float32 向量对候选重新打分，
+#    top-k 与精确结果的差异只来自候选截断；
+# 4. recall_report：在同一批查询上对比各模式（重打分前 / 后）相对 float32 的 recall@k 与内存占用；
+# 5. 缓存位于 archive/YYYYMMDD/embeddings/<原始文件名>.<mode>.npy（+ .scale.npy / .meta.json），
+#    以内存映射方式读取；meta 里记录模型名与论文 ID，不一致时视为失效；
+#    量化模式下可选（默认关闭）另存一份 float32 原始向量 <原始文件名>.exact.npy，命中缓存时按行内存映射读取候选
+#    做重打分、无需加载模型重新编码，代价是磁盘占用多出一份 float32 矩阵（recall_report 的占用也会计入）；
+# 6. QueryEmbeddingCache：订阅查询向量的持久缓存（archive/query_embeddings.npz），
+#    键为 (模型, 查询前缀, 截断长度, 文本) 的哈希，模型变化时整份缓存失效。
+
+import argparse
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from storage import ARCHIVE_ROOT, ARCHIVE_STAGE_DIRS
+
+EMBEDDING_STORE_DIRNAME = "embeddings"
+STORAGE_MODES = ("float32", "float16", "int8")
+DEFAULT_SHORTLIST_FACTOR = 4
+# 分块计算点积时每块的行数（控制临时 float32 块的内存）
+DOT_BLOCK_ROWS = 8192
+QUERY_CACHE_FILE = os.path.join(ARCHIVE_ROOT, "query_embeddings.npz")
+# 查询缓存最多保留的条目数（按最近使用淘汰），防止反复修改订阅后无限增长
+QUERY_CACHE_MAX_ENTRIES = 4096
+
+
+def log(message: str) -> None:
+    ts = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    print(f"[{ts}] {message}", flush=True)
+
+
+class QuantizedMatrix:
+    """按 mode 存储的 (N, D) 向量矩阵；data 可以是内存中的数组，也可以是只读内存映射。"""
+
+    def __init__(self, mode: str, data: np.ndarray, scale: np.ndarray | None = None):
+        if mode not in STORAGE_MODES:
+            raise ValueError(f"未知的向量存储模式：{mode}")
+        self.mode = mode
+        self.data = data
+        self.scale = scale
+
+    @classmethod
+    def from_float32(cls, embeddings: np.ndarray, mode: str) -> "QuantizedMatrix":
+        emb = np.asarray(embeddings, dtype=np.float32)
+        if mode == "float32":
+            return cls(mode, emb)
+        if mode == "float16":
+            return cls(mode, emb.astype(np.float16))
+        if mode == "int8":
+            # 每一维独立的对称量化：x ≈ code * scale，code ∈ [-127, 127]
+            max_abs = np.abs(emb).max(axis=0) if emb.shape[0] else np.zeros(emb.shape[1], np.float32)
+            scale = np.where(max_abs > 0, max_abs / 127.0, 1.0).astype(np.float32)
+            codes = np.clip(np.rint(emb / scale), -127, 127).astype(np.int8)
+            return cls(mode, codes, scale)
+        raise ValueError(f"未知的向量存储模式：{mode}")
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return tuple(self.data.shape)
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.data.nbytes + (self.scale.nbytes if self.scale is not None else 0))
+
+    def dequantize(self, rows: np.ndarray | None = None) -> np.ndarray:
+        data = self.data if rows is None else self.data[rows]
+        out = np.asarray(data, dtype=np.float32)
+        if self.scale is not None:
+            out = out * self.scale
+        return out
+
+    def dot(self, queries: np.ndarray) -> np.ndarray:
+        """(N, D) × (M, D)^T -> (M, N) 的近似相似度。"""
+        q = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if self.scale is not None:
+            q = q * self.scale  # code · (scale ∘ q) == (code ∘ scale) · q
+        n = self.data.shape[0]
+        out = np.empty((q.shape[0], n), dtype=np.float32)
+        for start in range(0, n, DOT_BLOCK_ROWS):
+            block = np.asarray(self.data[start : start + DOT_BLOCK_ROWS], dtype=np.float32)
+            # 逐查询做矩阵-向量乘：float32 模式下与整矩阵 np.dot(emb, q) 逐位一致
+            for qi in range(q.shape[0]):
+                out[qi, start : start + len(block)] = np.dot(block, q[qi])
+        return out
+
+
+def _top_k_rows(scores: np.ndarray, k: int) -> np.ndarray:
+    """对 (M, N) 的每一行取前 k 个下标（未排序）。"""
+    n = scores.shape[1]
+    if k <= 0 or k >= n:
+        return np.broadcast_to(np.arange(n), scores.shape).copy()
+    return np.argpartition(-scores, k - 1, axis=1)[:, :k]
+
+
+def search(
+    matrix: QuantizedMatrix,
+    queries: np.ndarray,
+    k: int,
+    shortlist_factor: int = DEFAULT_SHORTLIST_FACTOR,
+    exact_rows: Callable[[np.ndarray], np.ndarray] | None = None,
+) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    返回每个查询的 (下标, 分数)，按分数降序（同分按下标升序）。
+    - exact_rows(indices) 返回这些行的 float32 向量时，在 k × shortlist_factor 的候选上精确重打分；
+    - 未提供 exact_rows 时分数为量化点积（float32 模式下即精确结果）。
+    """
+    q = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+    approx = matrix.dot(q)
+    n = approx.shape[1]
+    k_eff = n if k <= 0 else min(k, n)
+    rescore = exact_rows is not None and matrix.mode != "float32"
+    shortlist = _top_k_rows(approx, k_eff * max(1, shortlist_factor) if rescore else k_eff)
+
+    exact_lookup: Dict[int, np.ndarray] = {}
+    if rescore:
+        unique = np.unique(shortlist)
+        vectors = np.asarray(exact_rows(unique), dtype=np.float32)
+        exact_lookup = {int(i): v for i, v in zip(unique, vectors)}
+
+    results: List[Tuple[np.ndarray, np.ndarray]] = []
+    for qi, cand in enumerate(shortlist):
+        if rescore:
+            vectors = np.stack([exact_lookup[int(i)] for i in cand])
+            scores = np.dot(vectors, q[qi])
+        else:
+            scores = approx[qi, cand]
+        order = np.lexsort((cand, -scores))[:k_eff]
+        results.append((cand[order], scores[order]))
+    return results
+
+
+def exact_search(embeddings: np.ndarray, queries: np.ndarray, k: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+    return search(QuantizedMatrix("float32", np.asarray(embeddings, dtype=np.float32)), queries, k)
+
+
+def recall_at_k(approx: Sequence[np.ndarray], exact: Sequence[np.ndarray]) -> float:
+    """各查询 |approx ∩ exact| / |exact| 的平均值。"""
+    values = []
+    for a, e in zip(approx, exact):
+        if len(e):
+            values.append(len(set(a.tolist()) & set(e.tolist())) / len(e))
+    return float(np.mean(values)) if values else 1.0
+
+
+def recall_report(
+    embeddings: np.ndarray,
+    queries: np.ndarray,
+    k_values: Sequence[int],
+    modes: Sequence[str] = STORAGE_MODES,
+    shortlist_factor: int = DEFAULT_SHORTLIST_FACTOR,
+    exact_copy: bool = False,
+) -> List[Dict[str, Any]]:
+    """
+    对比各存储模式相对 float32 精确检索的 recall@k（重打分前 / 后）与占用字节数。
+    exact_copy=True 时量化模式的占用包含另存的 float32 原始向量（.exact.npy）。
+    """
+    emb = np.asarray(embeddings, dtype=np.float32)
+    rows: List[Dict[str, Any]] = []
+    for mode in modes:
+        matrix = QuantizedMatrix.from_float32(emb, mode)
+        stored = matrix.nbytes + (emb.nbytes if exact_copy and mode != "float32" else 0)
+        for k in k_values:
+            exact = [idx for idx, _ in exact_search(emb, queries, k)]
+            raw = [idx for idx, _ in search(matrix, queries, k)]
+            rescored = [idx for idx, _ in search(matrix, queries, k, shortlist_factor, exact_rows=lambda ids: emb[ids])]
+            rows.append(
+                {
+                    "mode": mode,
+                    "k": k,
+                    "bytes": stored,
+                    "compression": round(emb.nbytes / stored, 2) if stored else None,
+                    "recall": round(recall_at_k(raw, exact), 4),
+                    "recall_rescored": round(recall_at_k(rescored, exact), 4),
+                }
+            )
+    return rows
+
+
+def log_recall_report(rows: List[Dict[str, Any]]) -> None:
+    for r in rows:
+        log(
+            f"[INFO] 向量存储 {r['mode']:>7} | recall@{r['k']}={r['recall']:.4f} "
+            f"| 重打分后={r['recall_rescored']:.4f} | {r['bytes'] / (1024 * 1024):.2f}MB (x{r['compression']})"
+        )
+
+
+def embedding_store_dir_for(artifact_path: str) -> str:
+    """archive/YYYYMMDD/<raw|filtered|...>/x.json -> archive/YYYYMMDD/embeddings；其它位置用同目录下的 embeddings/。"""
+    parent = os.path.dirname(os.path.abspath(artifact_path))
+    if os.path.basename(parent) in ARCHIVE_STAGE_DIRS:
+        return os.path.join(os.path.dirname(parent), EMBEDDING_STORE_DIRNAME)
+    return os.path.join(parent, EMBEDDING_STORE_DIRNAME)
+
+
+def cache_base_for(input_path: str) -> str:
+    """原始文件 -> 缓存文件前缀（不含 .<mode>.npy 后缀）。"""
+    base = os.path.basename(input_path)
+    if base.lower().endswith(".json"):
+        base = base[:-5]
+    return os.path.join(embedding_store_dir_for(input_path), base)
+
+
+def save_embeddings(
+    cache_base: str,
+    ids: List[str],
+    matrix: QuantizedMatrix,
+    model_name: str,
+    exact: np.ndarray | None = None,
+) -> str:
+    """
+    写入量化矩阵（及 int8 的 scale）与 meta；exact 为对应的 float32 原始向量（可选），
+    量化模式下另存为 .exact.npy 供命中缓存时重打分（float32 模式下数据本身即精确值，不再重复保存）。
+    不传 exact 时清掉旧的 .exact.npy，命中缓存后只对候选重新编码。
+    """
+    os.makedirs(os.path.dirname(cache_base) or ".", exist_ok=True)
+    # 换存储模式时清掉旧模式的文件
+    for mode in STORAGE_MODES:
+        if mode != matrix.mode and os.path.exists(f"{cache_base}.{mode}.npy"):
+            os.remove(f"{cache_base}.{mode}.npy")
+    if matrix.scale is None and os.path.exists(f"{cache_base}.scale.npy"):
+        os.remove(f"{cache_base}.scale.npy")
+    exact_path = f"{cache_base}.exact.npy"
+    if os.path.exists(exact_path):
+        os.remove(exact_path)
+    data_path = f"{cache_base}.{matrix.mode}.npy"
+    np.save(data_path, np.ascontiguousarray(matrix.data))
+    if matrix.scale is not None:
+        np.save(f"{cache_base}.scale.npy", matrix.scale)
+    if exact is not None and matrix.mode != "float32":
+        np.save(exact_path, np.ascontiguousarray(exact, dtype=np.float32))
+    meta = {
+        "model": model_name,
+        "mode": matrix.mode,
+        "shape": list(matrix.shape),
+        "ids": list(ids),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    }
+    # meta 最后写入：读取方以 meta 为准，中途失败不会留下“看似有效”的缓存
+    tmp_path = f"{cache_base}.meta.json.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(tmp_path, f"{cache_base}.meta.json")
+    return data_path
+
+
+def load_embeddings(
+    cache_base: str,
+    ids: List[str] | None = None,
+    model_name: str | None = None,
+    mode: str | None = None,
+) -> QuantizedMatrix | None:
+    """读取缓存（内存映射）；缺失、模型或存储模式不同、论文 ID 不一致时返回 None。"""
+    meta_path = f"{cache_base}.meta.json"
+    if not os.path.exists(meta_path):
+        return None
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if model_name is not None and meta.get("model") != model_name:
+            log(f"[INFO] 向量缓存的模型不同（{meta.get('model')}），忽略：{cache_base}")
+            return None
+        if mode is not None and meta.get("mode") != mode:
+            log(f"[INFO] 向量缓存的存储模式为 {meta.get('mode')}，与要求的 {mode} 不同，将重新计算：{cache_base}")
+            return None
+        if ids is not None and list(meta.get("ids") or []) != list(ids):
+            log(f"[INFO] 向量缓存的论文列表已变化，忽略：{cache_base}")
+            return None
+        stored_mode = meta.get("mode")
+        data = np.load(f"{cache_base}.{stored_mode}.npy", mmap_mode="r")
+        scale = np.load(f"{cache_base}.scale.npy") if stored_mode == "int8" else None
+        return QuantizedMatrix(stored_mode, data, scale)
+    except Exception as e:
+        log(f"[WARN] 向量缓存读取失败，将重新计算：{cache_base}（{e}）")
+        return None
+
+
+def load_exact_embeddings(cache_base: str, shape: Tuple[int, ...]) -> np.ndarray | None:
+    """
+    内存映射读取量化缓存旁的 float32 原始向量（.exact.npy）；缺失或形状与量化矩阵不一致时返回 None。
+    只在 load_embeddings 校验过 meta 之后调用：.exact.npy 先于 meta 写入，meta 有效即说明它与矩阵同批生成。
+    """
+    path = f"{cache_base}.exact.npy"
+    if not os.path.exists(path):
+        return None
+    try:
+        data = np.load(path, mmap_mode="r")
+    except Exception as e:
+        log(f"[WARN] float32 向量读取失败，将重新编码候选：{path}（{e}）")
+        return None
+    if data.dtype != np.float32 or tuple(data.shape) != tuple(shape):
+        log(f"[WARN] float32 向量与量化缓存的形状不一致，将重新编码候选：{path}")
+        return None
+    return data
+
+
+class QueryEmbeddingCache:
+    """
+    订阅查询向量的持久缓存：查询文本只在修改 config.yaml 或重跑步骤 0 时变化，命中时直接返回上次编码的向量
+    （与重新编码逐位一致）。文件里记录模型名，模型不同则视为空缓存，保存时整份覆盖。
+    """
+
+    def __init__(self, model_name: str, cache_file: str = QUERY_CACHE_FILE):
+        self.model_name = model_name
+        self.cache_file = cache_file
+        self.entries: Dict[str, np.ndarray] = {}
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self) -> None:
+        if not os.path.exists(self.cache_file):
+            return
+        try:
+            with np.load(self.cache_file, allow_pickle=False) as data:
+                model = str(data["model"])
+                if model != self.model_name:
+                    log(f"[INFO] 查询向量缓存的模型不同（{model}），将重新编码：{self.cache_file}")
+                    self.dirty = True
+                    return
+                for key, vec in zip(data["keys"].tolist(), data["vectors"]):
+                    self.entries[key] = vec
+        except Exception as e:
+            log(f"[WARN] 查询向量缓存读取失败，将重新编码：{self.cache_file}（{e}）")
+            self.entries = {}
+            self.dirty = True
+
+    def key(self, text: str, prefix: str, max_length: int | None) -> str:
+        raw = f"{self.model_name}\x00{prefix}\x00{max_length or 0}\x00{text}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> np.ndarray | None:
+        vec = self.entries.get(key)
+        if vec is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        # 移到末尾，保存时按最近使用保留
+        self.entries[key] = self.entries.pop(key)
+        return vec
+
+    def put(self, key: str, vec: np.ndarray) -> None:
+        self.entries.pop(key, None)
+        self.entries[key] = np.asarray(vec)
+        self.dirty = True
+
+    def save(self) -> None:
+        if not self.dirty:
+            return
+        keys = list(self.entries.keys())[-QUERY_CACHE_MAX_ENTRIES:]
+        if not keys:
+            return
+        os.makedirs(os.path.dirname(self.cache_file) or ".", exist_ok=True)
+        tmp_path = self.cache_file + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            model=np.array(self.model_name),
+            keys=np.array(keys),
+            vectors=np.stack([self.entries[k] for k in keys]),
+        )
+        os.replace(tmp_path, self.cache_file)
+        self.dirty = False
+        log(f"[INFO] 已写入查询向量缓存：{len(keys)} 条（本次命中 {self.hits} / 未命中 {self.misses}）：{self.cache_file}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="向量量化存储工具：评估 float16 / int8 相对 float32 的 recall@k。")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_report = sub.add_parser("report", help="以论文向量自身为查询，对比各存储模式的 recall@k 与占用。")
+    p_report.add_argument("embeddings", help="float32 向量 .npy（如 2.2 --embeddings-dir 写出的文件）。")
+    p_report.add_argument("--k", default="10,50", help="逗号分隔的 k 列表（默认 10,50）。")
+    p_report.add_argument("--queries", type=int, default=100, help="随机抽取多少行作为查询（默认 100）。")
+    p_report.add_argument("--shortlist-factor", type=int, default=DEFAULT_SHORTLIST_FACTOR, help="重打分候选倍数（默认 4）。")
+    p_report.add_argument("--seed", type=int, default=0)
+
+    args = parser.parse_args()
+    if args.command == "report":
+        emb = np.asarray(np.load(args.embeddings, mmap_mode="r"), dtype=np.float32)
+        rng = np.random.default_rng(args.seed)
+        picks = rng.choice(emb.shape[0], size=min(args.queries, emb.shape[0]), replace=False)
+        k_values = [int(x) for x in args.k.split(",") if x.strip()]
+        log(f"[INFO] {args.embeddings}：{emb.shape[0]} 条向量，维度 {emb.shape[1]}，查询 {len(picks)} 条")
+        log_recall_report(recall_report(emb, emb[picks], k_values, shortlist_factor=args.shortlist_factor))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+# 向量编码参数自动调优（2.2 / EmbeddingCoarseFilter 使用）：
+# 1. 在当前论文池的一个样本上，对若干 batch_size × torch 线程数组合做短时标定，测 paper/s；
+# 2. 单次试验的内存峰值超过上限的组合直接淘汰，更大的 batch_size 不再尝试；
+# 3. 选出的组合按「主机指纹 + 模型 + 设备 + 截断长度」持久化到 archive/embedding_autotune.json，
+#    之后同一台机器（含 CI 上同规格的 runner）直接复用，不再重复标定。
+# 主机指纹只取硬件/运行时特征（CPU 型号、核数、内存、torch 版本），不含主机名，
+# 这样每次主机名都不同的 CI runner 也能命中缓存。
+
+import hashlib
+import json
+import os
+import platform
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+
+import torch
+
+SCRIPT_DIR = os.path.dirname(__file__)
+ROOT_DIR = os.path.abspath(os.path.join(SCRIPT_DIR, ".."))
+AUTOTUNE_CACHE_FILE = os.path.join(ROOT_DIR, "archive", "embedding_autotune.json")
+
+DEFAULT_BATCH_SIZES = (8, 16, 32, 64, 128)
+DEFAULT_SAMPLE_SIZE = 128
+DEFAULT_TIME_BUDGET_S = 60.0
+# 同一线程数下，吞吐比当前最好值低这么多时不再继续增大 batch_size
+BATCH_DROP_RATIO = 0.9
+
+
+def log(message: str) -> None:
+    ts = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    print(f"[{ts}] {message}", flush=True)
+
+
+def _cpu_model() -> str:
+    try:
+        with open("/proc/cpuinfo", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or platform.machine()
+
+
+def _total_memory_mb() -> int:
+    try:
+        return int(os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / (1024 * 1024))
+    except (ValueError, OSError, AttributeError):
+        return 0
+
+
+def host_fingerprint() -> str:
+    parts = [
+        platform.system(),
+        platform.machine(),
+        _cpu_model(),
+        str(os.cpu_count() or 0),
+        # 按 GB 取整，避免可用内存的细微差异导致缓存失效
+        str(round(_total_memory_mb() / 1024)),
+        str(getattr(torch, "__version__", "")),
+    ]
+    return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+def cache_key(model_name: str, device: str, max_length: int | None) -> str:
+    return f"{host_fingerprint()}|{model_name}|{device}|{max_length or 0}"
+
+
+def load_cached(model_name: str, device: str, max_length: int | None, cache_file: str = AUTOTUNE_CACHE_FILE) -> Dict[str, Any] | None:
+    if not os.path.exists(cache_file):
+        return None
+    try:
+        with open(cache_file, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except Exception as e:
+        log(f"[WARN] 读取调优缓存失败，将重新标定：{cache_file}（{e}）")
+        return None
+    entry = (data.get("entries") or {}).get(cache_key(model_name, device, max_length))
+    return entry if isinstance(entry, dict) else None
+
+
+def save_cached(
+    model_name: str,
+    device: str,
+    max_length: int | None,
+    entry: Dict[str, Any],
+    cache_file: str = AUTOTUNE_CACHE_FILE,
+) -> None:
+    data: Dict[str, Any] = {"entries": {}}
+    if os.path.exists(cache_file):
+        try:
+            with open(cache_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception:
+            data = {"entries": {}}
+    data.setdefault("entries", {})[cache_key(model_name, device, max_length)] = entry
+    os.makedirs(os.path.dirname(cache_file) or ".", exist_ok=True)
+    tmp_path = cache_file + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, cache_file)
+
+
+def default_thread_counts() -> List[int]:
+    """1, 2, 4, ... 直到 CPU 核数（含核数本身）。"""
+    cpus = os.cpu_count() or 1
+    counts = []
+    n = 1
+    while n < cpus:
+        counts.append(n)
+        n *= 2
+    counts.append(cpus)
+    return counts
+
+
+def _read_status_mb(field: str) -> float | None:
+    try:
+        with open("/proc/self/status", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return None
+
+
+def _reset_peak_rss() -> bool:
+    """Linux 下写 5 到 clear_refs 可以重置 VmHWM；不支持时返回 False。"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+class _PeakMemory:
+    """单次试验的内存峰值（MB）：CUDA 用显存峰值，CPU 用进程 RSS 峰值（无法重置时退化为试验后的 RSS）。"""
+
+    def __init__(self, device: str):
+        self.cuda = device.startswith("cuda") and torch.cuda.is_available()
+        self.peak_mb: float | None = None
+
+    def __enter__(self) -> "_PeakMemory":
+        if self.cuda:
+            torch.cuda.reset_peak_memory_stats()
+        else:
+            self._hwm = _reset_peak_rss()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if self.cuda:
+            self.peak_mb = torch.cuda.max_memory_allocated() / (1024 * 1024)
+        else:
+            self.peak_mb = _read_status_mb("VmHWM" if self._hwm else "VmRSS")
+
+
+def sample_texts(texts: List[str], sample_size: int) -> List[str]:
+    """等间隔抽样，保留论文池里长短文本的分布。"""
+    if len(texts) <= sample_size:
+        return list(texts)
+    step = len(texts) / sample_size
+    return [texts[int(i * step)] for i in range(sample_size)]
+
+
+def calibrate(
+    model: Any,
+    texts: List[str],
+    device: str = "cpu",
+    batch_sizes: List[int] | None = None,
+    thread_counts: List[int] | None = None,
+    memory_cap_mb: float | None = None,
+    time_budget_s: float = DEFAULT_TIME_BUDGET_S,
+) -> Dict[str, Any] | None:
+    """
+    在 texts 上逐个组合计时，返回最快且未超内存上限的 {batch_size, threads, papers_per_s, peak_mb, trials}。
+    非 CPU 设备只调 batch_size。超出 time_budget_s 后停止，返回目前最好的组合。
+    """
+    if not texts:
+        return None
+    batch_sizes = sorted(batch_sizes or DEFAULT_BATCH_SIZES)
+    if device != "cpu":
+        thread_counts = [torch.get_num_threads()]
+    else:
+        thread_counts = sorted(thread_counts or default_thread_counts(), reverse=True)
+
+    encode_kwargs = {"convert_to_numpy": True, "normalize_embeddings": True, "show_progress_bar": False}
+    original_threads = torch.get_num_threads()
+    trials: List[Dict[str, Any]] = []
+    best: Dict[str, Any] | None = None
+    deadline = time.time() + time_budget_s
+
+    try:
+        for threads in thread_counts:
+            torch.set_num_threads(threads)
+            best_for_threads = 0.0
+            for batch_size in batch_sizes:
+                if time.time() > deadline:
+                    break
+                # 预热一个批次，排除首次分配与懒初始化的开销
+                model.encode(texts[:batch_size], batch_size=batch_size, **encode_kwargs)
+                with _PeakMemory(device) as mem:
+                    start = time.time()
+                    for s in range(0, len(texts), batch_size):
+                        model.encode(texts[s : s + batch_size], batch_size=batch_size, **encode_kwargs)
+                    elapsed = time.time() - start
+                rate = len(texts) / elapsed if elapsed > 0 else 0.0
+                over_cap = memory_cap_mb is not None and mem.peak_mb is not None and mem.peak_mb > memory_cap_mb
+                trial = {
+                    "batch_size": batch_size,
+                    "threads": threads,
+                    "papers_per_s": round(rate, 2),
+                    "peak_mb": round(mem.peak_mb, 1) if mem.peak_mb is not None else None,
+                    "over_cap": over_cap,
+                }
+                trials.append(trial)
+                log(
+                    f"[INFO] 调优试验：batch_size={batch_size} threads={threads} "
+                    f"{trial['papers_per_s']} paper/s peak={trial['peak_mb']}MB" + ("（超出内存上限）" if over_cap else "")
+                )
+                if over_cap:
+                    break
+                if best is None or rate > best["papers_per_s"]:
+                    best = dict(trial)
+                if rate < best_for_threads * BATCH_DROP_RATIO:
+                    break
+                best_for_threads = max(best_for_threads, rate)
+            if time.time() > deadline:
+                log(f"[WARN] 调优超出时间预算 {time_budget_s:.0f}s，使用目前最好的组合。")
+                break
+    finally:
+        torch.set_num_threads(original_threads)
+
+    if best is None:
+        return None
+    best.pop("over_cap", None)
+    best["trials"] = trials
+    best["sample_size"] = len(texts)
+    best["memory_cap_mb"] = memory_cap_mb
+    best["tuned_at"] = datetime.now(timezone.utc).isoformat()
+    best["host"] = host_fingerprint()
+    return best
+
+
+def resolve_encoding_params(
+    model: Any,
+    model_name: str,
+    texts: List[str],
+    device: str = "cpu",
+    max_length: int | None = None,
+    memory_cap_mb: float | None = None,
+    sample_size: int = DEFAULT_SAMPLE_SIZE,
+    cache_file: str = AUTOTUNE_CACHE_FILE,
+    retune: bool = False,
+) -> Dict[str, Any] | None:
+    """
+    优先读取本机缓存；没有缓存、retune=True 或缓存组合的内存峰值超出当前上限时，在样本上标定并写回缓存。
+    返回 {batch_size, threads, ...}；无法标定时返回 None，调用方保持原参数。
+    """
+    if not retune:
+        cached = load_cached(model_name, device, max_length, cache_file)
+        peak_mb = cached.get("peak_mb") if cached else None
+        cap_ok = memory_cap_mb is None or (peak_mb is not None and peak_mb <= memory_cap_mb)
+        if cached and cap_ok:
+            log(
+                f"[INFO] 使用本机调优缓存：batch_size={cached.get('batch_size')} threads={cached.get('threads')}"
+                f"（{cached.get('papers_per_s')} paper/s，{cached.get('tuned_at')}）"
+            )
+            return cached
+
+    sample = sample_texts(texts, sample_size)
+    log(f"[INFO] 开始向量编码调优：样本 {len(sample)} 篇，内存上限={memory_cap_mb or '不限'}MB")
+    result = calibrate(model, sample, device=device, memory_cap_mb=memory_cap_mb)
+    if result is None:
+        log("[WARN] 没有满足内存上限的组合，保持原有编码参数。")
+        return None
+    save_cached(model_name, device, max_length, result, cache_file)
+    log(
+        f"[INFO] 调优完成：batch_size={result['batch_size']} threads={result['threads']}"
+        f"（{result['papers_per_s']} paper/s），已写入 {cache_file}"
+    )
+    return result
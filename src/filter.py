@@ -1,9 +1,14 @@
 #!/usr/bin/env python
 # 通用向量检索工具：封装 sentence-transformers 的向量计算与粗筛逻辑
 
+import argparse
+import json
+import multiprocessing as mp
 import os
 import numpy as np
-from typing import Any, Dict, List
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, Iterator, List, Tuple
 import time
 from datetime import datetime, timezone
 
@@ -12,10 +17,31 @@ os.environ.setdefault("HF_HUB_DISABLE_SYMLINKS", "1")
 import torch
 from sentence_transformers import SentenceTransformer
 
+from embedding_store import (
+  QuantizedMatrix,
+  QueryEmbeddingCache,
+  load_embeddings,
+  load_exact_embeddings,
+  log_recall_report,
+  recall_report,
+  save_embeddings,
+  search,
+)
+from encode_autotune import resolve_encoding_params
+from storage import load_json
+
 
 # E5 系列推荐使用 query/passsage 前缀来区分检索侧与文档侧
 E5_QUERY_PREFIX = "query: "
 
+# 多进程编码时每个 worker 分到的文本块约为 batch_size 的整数倍；
+# 每个 worker 大约分到这么多块，兼顾负载均衡与进度日志的粒度
+ENCODE_CHUNKS_PER_WORKER = 4
+# 多进程编码时同时在途的块数（按 worker 数的倍数），限制已完成但尚未被消费的结果占用的内存
+ENCODE_INFLIGHT_PER_WORKER = 2
+# 流式 top-k 累积多少行向量后做一次相似度计算
+STREAM_TOPK_BLOCK_ROWS = 2048
+
 
 def log(message: str) -> None:
   ts = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
@@ -73,9 +99,17 @@ def debug_hf_runtime(prefix: str) -> None:
 
 
 def _set_max_seq_length(model: SentenceTransformer, max_length: int | None) -> None:
-  """尽量通过 SentenceTransformer 的 max_seq_length 控制截断长度。"""
+  """
+  尽量通过 SentenceTransformer 的 max_seq_length 控制截断长度。
+  对尚未加载的 LazyModel 只记下 max_length、由其加载时套用，不会因为探测属性而触发加载。
+  """
   if max_length is None or max_length <= 0:
     return
+  if isinstance(model, LazyModel):
+    if not model.loaded:
+      model.max_length = max_length
+      return
+    model = model.get()
   if hasattr(model, "max_seq_length"):
     try:
       model.max_seq_length = max_length
@@ -91,17 +125,74 @@ def _set_max_seq_length(model: SentenceTransformer, max_length: int | None) -> N
       pass
 
 
+def resolve_device(device: str | None) -> str:
+  if device is None:
+    return "cuda" if torch.cuda.is_available() else "cpu"
+  return device
+
+
+def load_embedding_model(
+  model_name: str,
+  device: str | None = None,
+  max_length: int | None = None,
+) -> SentenceTransformer:
+  """加载 sentence-transformers 模型（模块级函数，批处理模式下也作为模型进程的加载入口）。"""
+  device = resolve_device(device)
+  print(f"[INFO] 正在加载向量模型：{model_name}，device={device}")
+  debug_hf_runtime("before SentenceTransformer()")
+  model = SentenceTransformer(model_name, device=device)
+  debug_hf_runtime("after SentenceTransformer()")
+  _set_max_seq_length(model, max_length)
+  return model
+
+
+class LazyModel:
+  """
+  首次调用 encode() 或访问模型属性时才加载向量模型。
+  论文向量与查询向量都命中缓存时，整个运行都不需要加载模型。
+  """
+
+  def __init__(self, loader: Callable[[], SentenceTransformer], max_length: int | None = None):
+    self._loader = loader
+    self._model: SentenceTransformer | None = None
+    # 加载前通过 _set_max_seq_length 设置的截断长度，加载后立即套用
+    self.max_length = max_length
+
+  @property
+  def loaded(self) -> bool:
+    return self._model is not None
+
+  def get(self) -> SentenceTransformer:
+    if self._model is None:
+      model = self._loader()
+      _set_max_seq_length(model, self.max_length)
+      self._model = model
+    return self._model
+
+  def encode(self, *args, **kwargs):
+    return self.get().encode(*args, **kwargs)
+
+  def __getattr__(self, name: str) -> Any:
+    if name.startswith("_"):
+      raise AttributeError(name)
+    return getattr(self.get(), name)
+
+
 def encode_queries(
   model: SentenceTransformer,
   texts: List[str],
   batch_size: int = 8,
   max_length: int | None = None,
+  cache: QueryEmbeddingCache | None = None,
 ) -> np.ndarray:
   """
   编码查询文本向量。
 
   这里为 E5 系列显式添加 query 前缀：
   query: <用户查询>
+
+  传入 cache 时先按 (模型, 前缀, max_length, 文本) 查持久缓存，只编码未命中的文本并写回缓存；
+  全部命中时不会调用模型（配合 LazyModel 可以完全不加载模型）。
   """
   decorated: List[str] = []
   for t in texts:
@@ -111,6 +202,17 @@ def encode_queries(
     else:
       decorated.append(f"{E5_QUERY_PREFIX}{t}")
 
+  if cache is not None:
+    keys = [cache.key(t, E5_QUERY_PREFIX, max_length) for t in decorated]
+    vectors = [cache.get(k) for k in keys]
+    missing = [i for i, v in enumerate(vectors) if v is None]
+    if missing:
+      fresh = encode_queries(model, [texts[i] for i in missing], batch_size=batch_size, max_length=max_length)
+      for i, vec in zip(missing, fresh):
+        cache.put(keys[i], vec)
+        vectors[i] = vec
+    return np.stack(vectors)
+
   _set_max_seq_length(model, max_length)
 
   encode_kwargs: Dict[str, Any] = {
@@ -126,18 +228,127 @@ def encode_queries(
   )
 
 
-def compute_embeddings(
-  model: SentenceTransformer,
-  items: List[Any],
-  batch_size: int = 8,
-  max_length: int | None = None,
-  log_every: int = 20,
-) -> np.ndarray:
+def default_threads_per_worker(workers: int) -> int:
+  """多进程编码时每个 worker 的 torch 线程数：CPU 核数平均分给各 worker，避免线程超卖。"""
+  return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+
+# 多进程编码模式下，每个编码 worker 进程持有的模型
+_ENCODE_WORKER_MODEL: SentenceTransformer | None = None
+
+
+def _init_encode_worker(
+  model_name: str,
+  device: str,
+  max_length: int | None,
+  threads: int,
+) -> None:
+  global _ENCODE_WORKER_MODEL
+  # 固定线程数：N 个 worker × 默认线程数（= 全部核数）会严重超卖
+  for key in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+    os.environ[key] = str(threads)
+  torch.set_num_threads(threads)
+  try:
+    torch.set_num_interop_threads(1)
+  except RuntimeError:
+    pass
+  _ENCODE_WORKER_MODEL = load_embedding_model(model_name, device, max_length)
+
+
+def _encode_chunk(texts: List[str], batch_size: int, encode_kwargs: Dict[str, Any]) -> np.ndarray:
+  """worker 内按 batch_size 切片逐批 encode，切片方式与单进程路径完全一致。"""
+  model = _ENCODE_WORKER_MODEL
+  parts = [
+    model.encode(texts[start : start + batch_size], **encode_kwargs)
+    for start in range(0, len(texts), batch_size)
+  ]
+  return np.vstack(parts)
+
+
+class EncodePool:
   """
-  为给定列表计算向量表示。
-  约定：每个元素需提供 text_for_embedding 属性，返回「用于向量化的文本」。
-  返回形状为 (N, D) 的 numpy 数组，并做归一化，便于用点积近似余弦相似度。
+  多进程 CPU 编码池：
+  - 每个 worker 进程各自加载一份模型，并把 torch 线程数固定为 threads_per_worker；
+  - encode 时把文本切成 batch_size 整数倍的连续块分发给各 worker，按提交顺序拼回，
+    每个 encode() 批次与单进程路径相同，结果矩阵与之逐行对应；
+  - 使用 spawn 启动，避免 fork 继承父进程已初始化的 OpenMP 线程池；
+  - 进程在首次使用时启动，用完需 close()（或作为上下文管理器使用）。
   """
+
+  def __init__(
+    self,
+    model_name: str,
+    workers: int,
+    device: str = "cpu",
+    max_length: int | None = None,
+    threads_per_worker: int | None = None,
+  ):
+    self.model_name = model_name
+    self.workers = max(1, int(workers))
+    self.device = device
+    self.max_length = max_length
+    self.threads_per_worker = threads_per_worker or default_threads_per_worker(self.workers)
+    self._executor: ProcessPoolExecutor | None = None
+
+  def __enter__(self) -> "EncodePool":
+    return self
+
+  def __exit__(self, exc_type, exc, tb) -> None:
+    self.close()
+
+  def _ensure_started(self) -> ProcessPoolExecutor:
+    if self._executor is None:
+      log(
+        f"[INFO] 启动多进程编码池：workers={self.workers}，"
+        f"每个 worker 的 torch 线程数={self.threads_per_worker}"
+      )
+      self._executor = ProcessPoolExecutor(
+        max_workers=self.workers,
+        mp_context=mp.get_context("spawn"),
+        initializer=_init_encode_worker,
+        initargs=(self.model_name, self.device, self.max_length, self.threads_per_worker),
+      )
+    return self._executor
+
+  def warmup(self) -> None:
+    """让所有 worker 完成模型加载，便于把加载耗时排除在吞吐量统计之外。"""
+    executor = self._ensure_started()
+    futures = [executor.submit(_encode_chunk, ["warmup"], 1, {}) for _ in range(self.workers)]
+    for f in futures:
+      f.result()
+
+  def iter_encode(
+    self,
+    items: List[Any],
+    batch_size: int,
+    encode_kwargs: Dict[str, Any],
+  ) -> Iterator[np.ndarray]:
+    """按原始顺序逐块产出向量矩阵；文本按块现取，在途块数有上限。"""
+    if not items:
+      return
+    executor = self._ensure_started()
+    total_batches = (len(items) + batch_size - 1) // batch_size
+    batches_per_chunk = max(1, -(-total_batches // (self.workers * ENCODE_CHUNKS_PER_WORKER)))
+    chunk_size = batches_per_chunk * batch_size
+    starts = list(range(0, len(items), chunk_size))
+    max_inflight = self.workers * ENCODE_INFLIGHT_PER_WORKER
+    pending: List[Any] = []
+    next_idx = 0
+    while next_idx < len(starts) or pending:
+      while next_idx < len(starts) and len(pending) < max_inflight:
+        start = starts[next_idx]
+        texts = _texts_for_embedding(items[start : start + chunk_size])
+        pending.append(executor.submit(_encode_chunk, texts, batch_size, encode_kwargs))
+        next_idx += 1
+      yield pending.pop(0).result()
+
+  def close(self) -> None:
+    if self._executor is not None:
+      self._executor.shutdown(wait=True)
+      self._executor = None
+
+
+def _texts_for_embedding(items: List[Any]) -> List[str]:
   texts = []
   for it in items:
     text = getattr(it, "text_for_embedding", None)
@@ -147,13 +358,27 @@ def compute_embeddings(
       texts.append(text)
     else:
       texts.append(str(it))
+  return texts
 
+
+def iter_embedding_batches(
+  model: SentenceTransformer,
+  items: List[Any],
+  batch_size: int = 8,
+  max_length: int | None = None,
+  log_every: int = 20,
+  encode_pool: EncodePool | None = None,
+) -> Iterator[Tuple[int, np.ndarray]]:
+  """
+  逐批产出 (起始下标, 向量块)，顺序与 items 一致。
+  文本按批现取，不在内存里另存一份完整的文本列表；传入 encode_pool 时由多进程编码池计算。
+  """
   _set_max_seq_length(model, max_length)
 
-  if not texts:
-    return np.zeros((0, 0), dtype=np.float32)
+  total = len(items)
+  if total == 0:
+    return
 
-  total = len(texts)
   log(f"[INFO] 正在为 {total} 条记录计算向量表示...")
   encode_kwargs: Dict[str, Any] = {
     "convert_to_numpy": True,
@@ -161,15 +386,21 @@ def compute_embeddings(
     "batch_size": batch_size,
   }
 
-  embeddings_list: List[np.ndarray] = []
+  if encode_pool is not None:
+    # 子进程里不显示进度条，进度统一由下面的日志输出
+    batches = encode_pool.iter_encode(items, batch_size, {**encode_kwargs, "show_progress_bar": False})
+  else:
+    batches = (
+      model.encode(_texts_for_embedding(items[start : start + batch_size]), **encode_kwargs)
+      for start in range(0, total, batch_size)
+    )
+
   start_time = time.time()
   processed = 0
   next_log_at = log_every if log_every > 0 else 0
-  for start in range(0, total, batch_size):
-    batch = texts[start : start + batch_size]
-    batch_emb = model.encode(batch, **encode_kwargs)
-    embeddings_list.append(batch_emb)
-    processed += len(batch)
+  for batch_emb in batches:
+    yield processed, batch_emb
+    processed += len(batch_emb)
     if log_every > 0:
       while processed >= next_log_at and next_log_at <= total:
         elapsed = time.time() - start_time
@@ -181,7 +412,120 @@ def compute_embeddings(
       rate = processed / elapsed if elapsed > 0 else 0.0
       log(f"[INFO] Embedding 进度: {processed}/{total} (~{rate:.2f} paper/s)")
 
-  return np.vstack(embeddings_list)
+
+def allocate_embeddings(
+  rows: int,
+  dim: int,
+  dtype: Any = np.float32,
+  mmap_path: str | None = None,
+) -> np.ndarray:
+  """预分配 (rows, dim) 的向量矩阵；给出 mmap_path 时为磁盘上的 .npy 内存映射文件。"""
+  if mmap_path:
+    os.makedirs(os.path.dirname(mmap_path) or ".", exist_ok=True)
+    return np.lib.format.open_memmap(mmap_path, mode="w+", dtype=dtype, shape=(rows, dim))
+  return np.empty((rows, dim), dtype=dtype)
+
+
+def compute_embeddings(
+  model: SentenceTransformer,
+  items: List[Any],
+  batch_size: int = 8,
+  max_length: int | None = None,
+  log_every: int = 20,
+  encode_pool: EncodePool | None = None,
+  dtype: Any = None,
+  mmap_path: str | None = None,
+  on_batch: Callable[[int, np.ndarray], None] | None = None,
+) -> np.ndarray:
+  """
+  为给定列表计算向量表示。
+  约定：每个元素需提供 text_for_embedding 属性，返回「用于向量化的文本」。
+  返回形状为 (N, D) 的 numpy 数组，并做归一化，便于用点积近似余弦相似度。
+  - 各批次直接写入预分配的矩阵（不再先收集列表再 vstack，峰值内存约为最终矩阵一份）；
+  - dtype 默认与模型输出一致，可指定 float16 减半占用；mmap_path 指定时矩阵落在磁盘内存映射文件上；
+  - on_batch(start, batch_emb) 在每批写入前以 float32 原始结果回调，可用于流式 top-k；
+  - 传入 encode_pool 时由多进程编码池计算（model 不参与编码），结果按原始顺序写入。
+  """
+  _set_max_seq_length(model, max_length)
+
+  if not items:
+    return np.zeros((0, 0), dtype=np.float32)
+
+  out: np.ndarray | None = None
+  for start, batch_emb in iter_embedding_batches(
+    model,
+    items,
+    batch_size=batch_size,
+    max_length=max_length,
+    log_every=log_every,
+    encode_pool=encode_pool,
+  ):
+    if on_batch is not None:
+      on_batch(start, batch_emb)
+    if out is None:
+      out = allocate_embeddings(len(items), batch_emb.shape[1], dtype or batch_emb.dtype, mmap_path)
+    out[start : start + len(batch_emb)] = batch_emb
+
+  if isinstance(out, np.memmap):
+    out.flush()
+  return out
+
+
+class StreamingTopK:
+  """
+  随向量批次到达增量维护每个查询的 top-k：
+  - 攒够 STREAM_TOPK_BLOCK_ROWS 行后逐查询做点积（与整矩阵 np.dot 的结果逐位一致），
+    与已有的 top-k 合并后用 argpartition 截断；
+  - 任意时刻只保留 (查询数 × k) 的分数/下标与一个块的向量，论文向量无需整体驻留内存；
+  - k<=0 表示保留全部。
+  """
+
+  def __init__(self, query_embeddings: np.ndarray, k: int, block_rows: int = STREAM_TOPK_BLOCK_ROWS):
+    self.queries = np.asarray(query_embeddings, dtype=np.float32)
+    self.k = k
+    self.block_rows = max(1, block_rows)
+    num_queries = self.queries.shape[0]
+    self.scores = np.empty((num_queries, 0), dtype=np.float32)
+    self.indices = np.empty((num_queries, 0), dtype=np.int64)
+    self._buffer: List[np.ndarray] = []
+    self._buffer_start = 0
+    self._buffer_rows = 0
+
+  def update(self, start: int, batch_emb: np.ndarray) -> None:
+    if not self._buffer:
+      self._buffer_start = start
+    self._buffer.append(np.asarray(batch_emb, dtype=np.float32))
+    self._buffer_rows += len(batch_emb)
+    if self._buffer_rows >= self.block_rows:
+      self._flush()
+
+  def _flush(self) -> None:
+    if not self._buffer:
+      return
+    block = self._buffer[0] if len(self._buffer) == 1 else np.concatenate(self._buffer)
+    sims = np.stack([np.dot(block, q) for q in self.queries])  # (查询数, 块行数)
+    ids = np.broadcast_to(
+      np.arange(self._buffer_start, self._buffer_start + len(block), dtype=np.int64),
+      sims.shape,
+    )
+    scores = np.concatenate([self.scores, sims], axis=1)
+    indices = np.concatenate([self.indices, ids], axis=1)
+    if 0 < self.k < scores.shape[1]:
+      keep = np.argpartition(-scores, self.k - 1, axis=1)[:, : self.k]
+      scores = np.take_along_axis(scores, keep, axis=1)
+      indices = np.take_along_axis(indices, keep, axis=1)
+    self.scores, self.indices = scores, indices
+    self._buffer = []
+    self._buffer_rows = 0
+
+  def result(self) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """每个查询的 (下标, 分数)，按分数降序（同分按下标升序）。"""
+    self._flush()
+    out: List[Tuple[np.ndarray, np.ndarray]] = []
+    for scores, indices in zip(self.scores, self.indices):
+      order = np.lexsort((indices, -scores))
+      out.append((indices[order], scores[order]))
+    return out
 
 
 class EmbeddingCoarseFilter:
@@ -199,24 +543,112 @@ class EmbeddingCoarseFilter:
     device: str | None = None,
     batch_size: int = 8,
     max_length: int | None = None,
+    model: Any = None,
+    encode_workers: int = 1,
+    autotune: bool = False,
+    memory_cap_mb: float | None = None,
+    stream: bool = False,
+    embedding_dtype: str | None = None,
+    embedding_cache: str | None = None,
+    embedding_cache_exact: bool = False,
+    quant_report: bool = False,
+    query_cache: bool = False,
   ):
+    """
+    model 可传入已加载的模型或任何提供 encode() 的对象（如 batch_executor.RemoteEncoder），此时不再加载。
+    encode_workers>1 时论文侧向量改由多进程编码池计算（仅 CPU；查询侧仍用本进程模型）。
+    autotune=True 时首次 filter() 前在论文池样本上标定 batch_size 与 torch 线程数（结果按主机缓存），
+    memory_cap_mb 为单次编码允许的内存峰值上限。
+    stream=True 时先编码查询，论文向量随批次到达即更新每个查询的 top-k（见 filter 的说明）；
+    embedding_dtype 为保存论文向量矩阵的类型（float32 / float16，默认与模型输出一致）。
+    embedding_cache 为按日向量缓存的存储模式（float32 / float16 / int8，None 不缓存），见 embedding_store；
+    embedding_cache_exact=True 时量化缓存旁另存 float32 原始向量，命中缓存时重打分不必加载模型（多占一份 float32 磁盘）。
+    quant_report=True 时在重新计算向量后输出各存储模式相对 float32 的 recall@k。
+    query_cache=True 时查询向量走持久缓存（embedding_store.QueryEmbeddingCache）。
+    未传入 model 时模型延迟到第一次需要编码时才加载。
+    """
     self.model_name = model_name
     self.top_k = top_k
     self.batch_size = batch_size
     self.max_length = max_length
-
-    if device is None:
-      self.device = "cuda" if torch.cuda.is_available() else "cpu"
+    self.device = resolve_device(device)
+    self.stream = stream
+    self.embedding_dtype = np.dtype(embedding_dtype) if embedding_dtype else None
+    self.embedding_cache = embedding_cache
+    self.embedding_cache_exact = embedding_cache_exact
+    self.quant_report = quant_report
+    self.query_cache = QueryEmbeddingCache(model_name) if query_cache else None
+
+    if model is not None:
+      self.model = model
     else:
-      self.device = device
+      self.model = LazyModel(partial(load_embedding_model, self.model_name, self.device), max_length=self.max_length)
+
+    self.autotune = autotune
+    self.memory_cap_mb = memory_cap_mb
+    if autotune and model is not None:
+      log("[WARN] 模型由外部传入（如模型进程），无法在本进程调整线程数，跳过自动调优。")
+      self.autotune = False
+    if autotune and encode_workers > 1:
+      log("[WARN] 已启用多进程编码，跳过自动调优（线程数由编码池按 worker 数分配）。")
+      self.autotune = False
+
+    self.encode_pool: EncodePool | None = None
+    if encode_workers > 1:
+      if self.device != "cpu":
+        log(f"[WARN] 多进程编码仅用于 CPU，device={self.device} 时忽略 encode_workers={encode_workers}。")
+      else:
+        self.encode_pool = EncodePool(
+          self.model_name,
+          encode_workers,
+          device=self.device,
+          max_length=self.max_length,
+        )
+
+  def close(self) -> None:
+    if self.encode_pool is not None:
+      self.encode_pool.close()
+
+  def _apply_autotune(self, items: List[Any]) -> None:
+    """只在第一次 filter() 时执行：命中本机缓存直接套用，否则在 items 样本上标定。"""
+    self.autotune = False
+    params = resolve_encoding_params(
+      self.model,
+      self.model_name,
+      _texts_for_embedding(items),
+      device=self.device,
+      max_length=self.max_length,
+      memory_cap_mb=self.memory_cap_mb,
+    )
+    if not params:
+      return
+    self.batch_size = int(params["batch_size"])
+    if self.device == "cpu":
+      torch.set_num_threads(int(params["threads"]))
+    log(f"[INFO] 向量编码参数：batch_size={self.batch_size} torch_threads={torch.get_num_threads()}")
+
+  def _encode_query(self, q_text: str) -> np.ndarray:
+    # 查询侧使用 E5 的 query 前缀
+    return encode_queries(
+      self.model,
+      [q_text],
+      batch_size=self.batch_size,
+      max_length=self.max_length,
+      cache=self.query_cache,
+    )[0]
 
-    print(f"[INFO] 正在加载向量模型：{self.model_name}，device={self.device}")
-    debug_hf_runtime("before SentenceTransformer()")
-    self.model = SentenceTransformer(self.model_name, device=self.device)
-    debug_hf_runtime("after SentenceTransformer()")
-    _set_max_seq_length(self.model, self.max_length)
+  def _resolve_k(self, total: int) -> int:
+    if self.top_k <= 0 or self.top_k > total:
+      return total
+    return self.top_k
 
-  def filter(self, items: List[Any], queries: List[Dict[str, Any]]) -> Dict[str, Any]:
+  def filter(
+    self,
+    items: List[Any],
+    queries: List[Dict[str, Any]],
+    mmap_path: str | None = None,
+    cache_base: str | None = None,
+  ) -> Dict[str, Any]:
     """
     使用内部向量模型，对给定对象列表按 queries 做粗筛。
 
@@ -228,6 +660,10 @@ class EmbeddingCoarseFilter:
       "queries": [ { ... 原 query 字段 ..., "top_indices": [int, ...] }, ... ],
       "embeddings": np.ndarray  # items 对应的向量
     }
+    每个查询额外带 "top_scores"（与 top_indices 对齐的相似度），调用方可直接使用；
+    此时只有给出 mmap_path 才保留论文向量（写入磁盘 .npy 内存映射），否则 embeddings 为 None。
+    启用 embedding_cache 且给出 cache_base 时：命中缓存则跳过编码，在量化矩阵上检索并对候选做 float32 重打分
+    （查询同样带 top_scores）；未命中则照常计算并按存储模式写入缓存。
     """
     if not items:
       print("[WARN] items 为空，跳过粗筛。")
@@ -236,11 +672,52 @@ class EmbeddingCoarseFilter:
       print("[WARN] 查询列表为空，跳过粗筛。")
       return {"queries": [], "embeddings": None}
 
+    if self.embedding_cache and cache_base:
+      cached = load_embeddings(
+        cache_base,
+        [str(getattr(it, "id", "")) for it in items],
+        self.model_name,
+        mode=self.embedding_cache,
+      )
+      if cached is not None:
+        log(f"[INFO] 命中向量缓存（{cached.mode}）：{cache_base}，跳过论文编码。")
+        result = self._filter_cached(items, queries, cached, cache_base)
+        self._save_query_cache()
+        return result
+
+    if self.autotune:
+      self._apply_autotune(items)
+
+    if self.stream:
+      result = self._filter_streaming(items, queries, mmap_path)
+    else:
+      result = self._filter_full(items, queries, mmap_path)
+
+    if self.embedding_cache and cache_base:
+      self._save_cache(items, result, cache_base)
+    self._save_query_cache()
+    return result
+
+  def _save_query_cache(self) -> None:
+    if self.query_cache is not None:
+      self.query_cache.save()
+    if isinstance(self.model, LazyModel) and not self.model.loaded:
+      log("[INFO] 论文向量与查询向量均命中缓存，本次未加载向量模型。")
+
+  def _filter_full(
+    self,
+    items: List[Any],
+    queries: List[Dict[str, Any]],
+    mmap_path: str | None,
+  ) -> Dict[str, Any]:
     item_embeddings = compute_embeddings(
       self.model,
       items,
       batch_size=self.batch_size,
       max_length=self.max_length,
+      encode_pool=self.encode_pool,
+      dtype=self.embedding_dtype,
+      mmap_path=mmap_path,
     )
 
     results_per_query: List[Dict[str, Any]] = []
@@ -252,28 +729,235 @@ class EmbeddingCoarseFilter:
 
       print(f"[INFO] Embedding 粗筛：query_text={q_text[:40]}...")
 
-      # 查询侧使用 E5 的 query 前缀
-      q_emb = encode_queries(
+      q_emb = self._encode_query(q_text)
+
+      sims = np.dot(item_embeddings, q_emb)
+
+      k = self._resolve_k(sims.shape[0])
+
+      indices = np.argsort(-sims)[:k]
+
+      enriched = dict(q)
+      enriched["top_indices"] = indices.tolist()
+      # 同时带上分数，调用方不必再编码一次查询重新计算相似度
+      enriched["top_scores"] = sims[indices].tolist()
+      results_per_query.append(enriched)
+
+    return {
+      "queries": results_per_query,
+      "embeddings": item_embeddings,
+    }
+
+  def _filter_cached(
+    self,
+    items: List[Any],
+    queries: List[Dict[str, Any]],
+    cached: QuantizedMatrix,
+    cache_base: str,
+  ) -> Dict[str, Any]:
+    active = [q for q in queries if (q.get("query_text") or "").strip()]
+    if not active:
+      return {"queries": [], "embeddings": None}
+
+    query_embeddings = np.stack([self._encode_query(q["query_text"].strip()) for q in active])
+    exact = load_exact_embeddings(cache_base, cached.shape) if cached.mode != "float32" else None
+
+    def exact_rows(indices: np.ndarray) -> np.ndarray:
+      # 量化模式下候选论文的 float32 向量优先从缓存旁的 .exact.npy 按行读取（需 embedding_cache_exact），
+      # 没有时只为这 k × shortlist_factor 篇候选重新编码
+      if exact is not None:
+        log(f"[INFO] 对 {len(indices)} 篇候选论文做 float32 重打分（读取缓存的原始向量）...")
+        return np.asarray(exact[indices], dtype=np.float32)
+      log(f"[INFO] 对 {len(indices)} 篇候选论文重新编码后做 float32 重打分...")
+      return compute_embeddings(
         self.model,
-        [q_text],
+        [items[int(i)] for i in indices],
         batch_size=self.batch_size,
         max_length=self.max_length,
-      )[0]
+        log_every=0,
+        encode_pool=self.encode_pool,
+      )
 
-      sims = np.dot(item_embeddings, q_emb)
+    hits = search(cached, query_embeddings, self._resolve_k(len(items)), exact_rows=exact_rows)
+    results_per_query: List[Dict[str, Any]] = []
+    for q, (indices, scores) in zip(active, hits):
+      enriched = dict(q)
+      enriched["top_indices"] = indices.tolist()
+      enriched["top_scores"] = scores.tolist()
+      results_per_query.append(enriched)
 
-      if self.top_k <= 0 or self.top_k > sims.shape[0]:
-        k = sims.shape[0]
-      else:
-        k = self.top_k
+    return {
+      "queries": results_per_query,
+      "embeddings": cached.data if cached.mode == "float32" else None,
+    }
 
-      indices = np.argsort(-sims)[:k]
+  def _save_cache(self, items: List[Any], result: Dict[str, Any], cache_base: str) -> None:
+    embeddings = result.get("embeddings")
+    if embeddings is None:
+      log("[WARN] 流式模式且未指定向量文件，论文向量未保留，跳过写入向量缓存。")
+      return
+    matrix = QuantizedMatrix.from_float32(embeddings, self.embedding_cache)
+    path = save_embeddings(
+      cache_base,
+      [str(getattr(it, "id", "")) for it in items],
+      matrix,
+      self.model_name,
+      exact=embeddings if self.embedding_cache_exact else None,
+    )
+    # 占用按实际落盘计：开启 exact 时量化模式还有一份 float32 原始向量
+    stored = matrix.nbytes + (embeddings.nbytes if self.embedding_cache_exact and matrix.mode != "float32" else 0)
+    log(f"[INFO] 已写入向量缓存（{matrix.mode}，{stored / (1024 * 1024):.2f}MB）：{path}")
+
+    if self.quant_report:
+      active = [q for q in result.get("queries") or [] if (q.get("query_text") or "").strip()]
+      if active:
+        query_embeddings = np.stack([self._encode_query(q["query_text"].strip()) for q in active])
+        k = self._resolve_k(len(items))
+        log_recall_report(
+          recall_report(embeddings, query_embeddings, sorted({min(10, k), k}), exact_copy=self.embedding_cache_exact)
+        )
+
+  def _filter_streaming(
+    self,
+    items: List[Any],
+    queries: List[Dict[str, Any]],
+    mmap_path: str | None,
+  ) -> Dict[str, Any]:
+    active = [q for q in queries if (q.get("query_text") or "").strip()]
+    if not active:
+      return {"queries": [], "embeddings": None}
 
+    log(f"[INFO] Embedding 流式粗筛：{len(active)} 个查询，边编码边维护 top-k。")
+    query_embeddings = np.stack([self._encode_query(q["query_text"].strip()) for q in active])
+    topk = StreamingTopK(query_embeddings, self._resolve_k(len(items)))
+
+    item_embeddings = None
+    if mmap_path:
+      item_embeddings = compute_embeddings(
+        self.model,
+        items,
+        batch_size=self.batch_size,
+        max_length=self.max_length,
+        encode_pool=self.encode_pool,
+        dtype=self.embedding_dtype,
+        mmap_path=mmap_path,
+        on_batch=topk.update,
+      )
+    else:
+      for start, batch_emb in iter_embedding_batches(
+        self.model,
+        items,
+        batch_size=self.batch_size,
+        max_length=self.max_length,
+        encode_pool=self.encode_pool,
+      ):
+        topk.update(start, batch_emb)
+
+    results_per_query: List[Dict[str, Any]] = []
+    for q, (indices, scores) in zip(active, topk.result()):
       enriched = dict(q)
       enriched["top_indices"] = indices.tolist()
+      enriched["top_scores"] = scores.tolist()
       results_per_query.append(enriched)
 
     return {
       "queries": results_per_query,
       "embeddings": item_embeddings,
     }
+
+
+def _load_benchmark_texts(path: str, limit: int) -> List[str]:
+  """从步骤 1 的原始 JSON（.json / .json.zst / .json.gz）构造与 2.2 相同格式的 passage 文本。"""
+  raw = load_json(path)
+  texts: List[str] = []
+  for item in raw:
+    title = str(item.get("title") or "").strip()
+    abstract = str(item.get("abstract") or "").strip()
+    texts.append(f"passage: Title: {title}\n\nAbstract: {abstract}")
+    if 0 < limit <= len(texts):
+      break
+  return texts
+
+
+def benchmark_encode_workers(
+  model_name: str,
+  texts: List[str],
+  worker_counts: List[int],
+  batch_size: int = 8,
+  max_length: int | None = None,
+) -> List[Dict[str, Any]]:
+  """
+  对比不同 worker 数下的编码吞吐（paper/s），模型加载耗时不计入。
+  workers=1 为本进程直接编码（torch 默认线程数），其余为 EncodePool。
+  """
+  rows: List[Dict[str, Any]] = []
+  baseline: np.ndarray | None = None
+  baseline_rate = 0.0
+  for workers in worker_counts:
+    if workers <= 1:
+      model = load_embedding_model(model_name, "cpu", max_length)
+      threads = torch.get_num_threads() if hasattr(torch, "get_num_threads") else None
+      start = time.time()
+      emb = compute_embeddings(model, texts, batch_size=batch_size, max_length=max_length, log_every=0)
+      elapsed = time.time() - start
+    else:
+      with EncodePool(model_name, workers, device="cpu", max_length=max_length) as pool:
+        pool.warmup()
+        threads = pool.threads_per_worker
+        start = time.time()
+        emb = compute_embeddings(
+          None, texts, batch_size=batch_size, max_length=max_length, log_every=0, encode_pool=pool
+        )
+        elapsed = time.time() - start
+
+    rate = len(texts) / elapsed if elapsed > 0 else 0.0
+    if baseline is None:
+      baseline = emb
+      baseline_rate = rate
+    rows.append(
+      {
+        "workers": max(1, workers),
+        "threads_per_worker": threads,
+        "papers": len(texts),
+        "seconds": round(elapsed, 3),
+        "papers_per_s": round(rate, 2),
+        "speedup": round(rate / baseline_rate, 2) if baseline_rate > 0 else None,
+        "max_abs_diff": float(np.max(np.abs(emb - baseline))) if emb.shape == baseline.shape else None,
+      }
+    )
+    log(
+      f"[INFO] workers={rows[-1]['workers']} threads/worker={threads} "
+      f"{rows[-1]['papers_per_s']} paper/s（{rows[-1]['seconds']}s，speedup={rows[-1]['speedup']}）"
+    )
+  return rows
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description="向量编码吞吐测试：对比不同编码进程数下的 paper/s。")
+  parser.add_argument("--input", required=True, help="步骤 1 产出的原始 JSON（archive/YYYYMMDD/raw/*.json）。")
+  parser.add_argument("--model", default="BAAI/bge-small-en-v1.5", help="sentence-transformers 模型名称。")
+  parser.add_argument("--workers", default="1,2,4", help="逗号分隔的编码进程数列表（默认 1,2,4）。")
+  parser.add_argument("--batch-size", type=int, default=8, help="向量编码批大小（默认 8）。")
+  parser.add_argument("--max-length", type=int, default=None, help="最大 token 长度（默认不截断）。")
+  parser.add_argument("--limit", type=int, default=512, help="最多使用多少篇论文（默认 512，0 为全部）。")
+  parser.add_argument("--report", default=None, help="可选：把结果写为 JSON 报告。")
+  args = parser.parse_args()
+
+  worker_counts = [int(x) for x in args.workers.split(",") if x.strip()]
+  texts = _load_benchmark_texts(args.input, args.limit)
+  log(f"[INFO] 编码吞吐测试：{len(texts)} 篇论文，CPU 数={os.cpu_count()}，workers={worker_counts}")
+  rows = benchmark_encode_workers(args.model, texts, worker_counts, args.batch_size, args.max_length)
+
+  print("| workers | threads/worker | paper/s | seconds | speedup |")
+  print("|---|---|---|---|---|")
+  for r in rows:
+    print(f"| {r['workers']} | {r['threads_per_worker']} | {r['papers_per_s']} | {r['seconds']} | {r['speedup']} |")
+
+  if args.report:
+    with open(args.report, "w", encoding="utf-8") as f:
+      json.dump({"cpu_count": os.cpu_count(), "model": args.model, "results": rows}, f, ensure_ascii=False, indent=2)
+    log(f"[INFO] 报告已写入：{args.report}")
+
+
+if __name__ == "__main__":
+  main()
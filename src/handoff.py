@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# 步骤 3 → 步骤 4 的流式交接：
+# 1. 步骤 3（--stream-out）每完成一个查询的 rerank，就向 JSONL 追加一行该查询的 ranked 列表并立即刷盘；
+# 2. 步骤 4（--follow）跟随读取这个文件，按到达顺序去重候选，攒满一批就发起精读，
+#    不必等步骤 3 写完整个 rank 文件；
+# 3. 记录类型：start（输入文件、查询列表）→ query × N → done（rank 文件路径；跳过或失败时带 status）。
+# 两个阶段分别受限于不同服务的网络延迟，并行后总耗时接近两者中较长的一个。
+
+import json
+import os
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator
+
+DEFAULT_FOLLOW_TIMEOUT_S = 1800.0
+FOLLOW_POLL_S = 0.5
+
+
+def log(message: str) -> None:
+    ts = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    print(f"[{ts}] {message}", flush=True)
+
+
+def stream_path_for(rank_path: str) -> str:
+    """archive/YYYYMMDD/rank/x.json -> archive/YYYYMMDD/rank/x.stream.jsonl"""
+    base = rank_path[:-5] if rank_path.lower().endswith(".json") else rank_path
+    return f"{base}.stream.jsonl"
+
+
+class RankStreamWriter:
+    """步骤 3 使用：每条记录写一行 JSON 并 fsync，跟随方读到的行总是完整的。"""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._f = open(path, "w", encoding="utf-8")
+        self.closed = False
+
+    def write(self, record: Dict[str, Any]) -> None:
+        self._f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._f.flush()
+        os.fsync(self._f.fileno())
+
+    def start(self, input_path: str, queries: Any) -> None:
+        self.write({"type": "start", "input": os.path.abspath(input_path), "queries": queries})
+
+    def query(self, index: int, query: Dict[str, Any]) -> None:
+        self.write({"type": "query", "index": index, **query})
+
+    def done(self, output_path: str | None, status: str = "ok") -> None:
+        if self.closed:
+            return
+        self.write({"type": "done", "status": status, "output": os.path.abspath(output_path) if output_path else None})
+        self._f.close()
+        self.closed = True
+
+
+def follow_rank_stream(
+    path: str,
+    timeout_s: float = DEFAULT_FOLLOW_TIMEOUT_S,
+    poll_s: float = FOLLOW_POLL_S,
+) -> Iterator[Dict[str, Any]]:
+    """
+    逐条产出流中的记录，直到读到 done；文件尚未创建时等待。
+    超过 timeout_s 没有新记录时抛出 TimeoutError（步骤 3 异常退出且没写 done 的情况）。
+    """
+    last_progress = time.time()
+    while not os.path.exists(path):
+        if time.time() - last_progress > timeout_s:
+            raise TimeoutError(f"等待流式交接文件超时：{path}")
+        time.sleep(poll_s)
+
+    buffer = ""
+    with open(path, "r", encoding="utf-8") as f:
+        while True:
+            chunk = f.readline()
+            if not chunk:
+                if time.time() - last_progress > timeout_s:
+                    raise TimeoutError(f"流式交接文件 {timeout_s:.0f}s 内没有新记录：{path}")
+                time.sleep(poll_s)
+                continue
+            buffer += chunk
+            if not buffer.endswith("\n"):
+                # 写入方还没写完这一行
+                continue
+            line, buffer = buffer.strip(), ""
+            if not line:
+                continue
+            last_progress = time.time()
+            record = json.loads(line)
+            yield record
+            if record.get("type") == "done":
+                return
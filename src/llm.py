@@ -1,6 +1,12 @@
+import hashlib
+import json
+import math
 import os
+import threading
 import time
-from typing import List, Dict, Tuple, Any, Optional
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from typing import List, Dict, Tuple, Any, Optional, Callable
 
 import requests
 
@@ -46,6 +52,332 @@ def get_global_time() -> float:
     return float(GLOBAL_TIME_SECONDS)
 
 
+# ---------------- 请求对冲（hedged requests） ----------------
+# 单次请求最长等 120s，步骤 3/4/6 的串行循环里少数慢请求决定了总耗时。
+# 开启后（LLM_HEDGE=1），按端点（chat:模型 / rerank:模型）记录最近成功请求的耗时；
+# 请求超过第 p 百分位仍未返回，就再发一份相同的请求，先返回的有效响应胜出。
+# 对冲次数不超过该端点调用数的 LLM_HEDGE_MAX_RATIO；落败的请求无法取消，它返回后的 token 记为 wasted_tokens。
+HEDGE_WINDOW = 200        # 每个端点保留的最近耗时样本数
+HEDGE_MIN_DELAY_S = 1.0   # 对冲等待下限，避免对本来就很快的请求也发副本
+
+
+def hedge_enabled() -> bool:
+    return os.getenv('LLM_HEDGE') == '1'
+
+
+def _spawn(fn: Callable[[], Any]) -> Future:
+    """在守护线程里执行 fn；落败的请求可能还要跑满 timeout，不能拖住进程退出。"""
+    future: Future = Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn())
+        except BaseException as exc:
+            future.set_exception(exc)
+
+    threading.Thread(target=run, name='llm-hedge', daemon=True).start()
+    return future
+
+
+def _good_response(future: Future) -> bool:
+    """HTTP 成功、可解析为 JSON 且不含 error 字段才算有效响应。"""
+    if future.exception() is not None:
+        return False
+    response = future.result()
+    if response.status_code >= 400:
+        return False
+    try:
+        data = response.json()
+    except ValueError:
+        return False
+    return not (isinstance(data, dict) and 'error' in data)
+
+
+def _response_tokens(response: requests.Response) -> int:
+    try:
+        return int(((response.json() or {}).get('usage') or {}).get('total_tokens') or 0)
+    except Exception:
+        return 0
+
+
+class RequestHedger:
+    """单个端点的对冲状态：最近耗时窗口 + 对冲计数。线程安全。"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.percentile = float(os.getenv('LLM_HEDGE_PERCENTILE', '95'))
+        self.max_ratio = float(os.getenv('LLM_HEDGE_MAX_RATIO', '0.1'))
+        self.min_samples = int(os.getenv('LLM_HEDGE_MIN_SAMPLES', '10'))
+        self._latencies: deque = deque(maxlen=HEDGE_WINDOW)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.wasted_tokens = 0
+        self.saved_seconds = 0.0
+
+    def delay(self) -> Optional[float]:
+        """当前的对冲等待时间；样本不足时返回 None（不对冲，只收集耗时）。"""
+        with self._lock:
+            samples = sorted(self._latencies)
+        if len(samples) < self.min_samples:
+            return None
+        index = min(len(samples) - 1, max(0, math.ceil(self.percentile / 100.0 * len(samples)) - 1))
+        return max(HEDGE_MIN_DELAY_S, samples[index])
+
+    def _observe(self, future: Future, started: float) -> None:
+        if _good_response(future):
+            with self._lock:
+                self._latencies.append(time.time() - started)
+
+    def _launch(self, send: Callable[[], requests.Response]) -> Future:
+        started = time.time()
+        future = _spawn(send)
+        future.add_done_callback(lambda f: self._observe(f, started))
+        return future
+
+    def _allow_hedge(self) -> bool:
+        with self._lock:
+            if self.hedged + 1 > self.max_ratio * self.calls:
+                return False
+            self.hedged += 1
+            return True
+
+    def run(self, send: Callable[[], requests.Response]) -> requests.Response:
+        """
+        发送请求并返回响应。没有发出副本时行为与直接调用 send() 相同（异常原样抛出）；
+        发出副本后返回先到的有效响应，两份都无效时按原请求的结果返回/抛出，由调用方照常处理。
+        """
+        with self._lock:
+            self.calls += 1
+        delay = self.delay()
+        if delay is None:
+            started = time.time()
+            response = send()
+            if response.ok:
+                with self._lock:
+                    self._latencies.append(time.time() - started)
+            return response
+
+        primary = self._launch(send)
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._allow_hedge():
+            return primary.result()
+
+        hedge = self._launch(send)
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            # 同时完成时优先原请求
+            for future in sorted(done, key=lambda f: f is not primary):
+                if _good_response(future):
+                    self._settle(future is hedge, (pending | done) - {future})
+                    return future.result()
+        return primary.result()
+
+    def _settle(self, hedge_won: bool, losers: set) -> None:
+        """记录胜负；落败的请求返回后把 token 计入 wasted_tokens，副本胜出时顺带记下原请求多等的时间。"""
+        if hedge_won:
+            with self._lock:
+                self.hedge_wins += 1
+        settled_at = time.time()
+
+        def account(future: Future) -> None:
+            if future.exception() is not None:
+                return
+            tokens = _response_tokens(future.result())
+            with self._lock:
+                self.wasted_tokens += tokens
+                if hedge_won:
+                    # 副本胜出时落败的只可能是原请求
+                    self.saved_seconds += max(0.0, time.time() - settled_at)
+
+        for future in losers:
+            future.add_done_callback(account)
+
+    def stats(self) -> Dict[str, Any]:
+        delay = self.delay()
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'hedged': self.hedged,
+                'hedge_wins': self.hedge_wins,
+                'win_rate': round(self.hedge_wins / self.hedged, 3) if self.hedged else 0.0,
+                'overhead': round(self.hedged / self.calls, 3) if self.calls else 0.0,
+                'wasted_tokens': self.wasted_tokens,
+                'saved_seconds': round(self.saved_seconds, 1),
+                'delay_s': round(delay, 2) if delay is not None else None,
+                'samples': len(self._latencies),
+            }
+
+
+_HEDGERS: Dict[str, RequestHedger] = {}
+_HEDGERS_LOCK = threading.Lock()
+
+
+def get_hedger(name: str) -> RequestHedger:
+    with _HEDGERS_LOCK:
+        if name not in _HEDGERS:
+            _HEDGERS[name] = RequestHedger(name)
+        return _HEDGERS[name]
+
+
+def hedge_stats() -> Dict[str, Dict[str, Any]]:
+    """本进程各端点的对冲统计（未开启对冲时为空）。"""
+    with _HEDGERS_LOCK:
+        hedgers = list(_HEDGERS.values())
+    return {h.name: h.stats() for h in hedgers}
+
+
+def log_hedge_stats() -> None:
+    for name, s in hedge_stats().items():
+        print(
+            f"[INFO] 请求对冲 {name}：调用 {s['calls']} 次，对冲 {s['hedged']} 次（{s['overhead']:.0%}），"
+            f"副本胜出 {s['hedge_wins']} 次（胜率 {s['win_rate']:.0%}），"
+            f"省下约 {s['saved_seconds']:.1f}s，额外 tokens {s['wasted_tokens']}，当前等待阈值 {s['delay_s']}s",
+            flush=True,
+        )
+
+
+# ---------------- 相同请求合并（singleflight） ----------------
+# 并发的阶段或重跑可能同时发出字节级相同的 chat / rerank 请求（同一篇论文的翻译、同一条速览提示词等）。
+# 请求体按键排序规范化后，连同接口地址与 key 的哈希作为指纹：同一指纹已有请求在飞行中时，后来者等待并共享它的响应。
+# 默认只合并在飞行中的请求。另可选复用刚完成的响应：设置 LLM_COALESCE_TTL>0（秒，默认 0 即关闭）后，
+# 发起者成功（HTTP 2xx）的响应按同一指纹保留这段时间（最多 LLM_COALESCE_MAX_ENTRIES 条，默认 256），
+# 之后顺序发出的相同请求直接复用，不再请求接口。
+# 只有发起者计入调用次数、token 与耗时；共享者（在飞行中或命中已完成的响应）计入 coalesced，
+# 响应里的 token 记为 saved_tokens。LLM_COALESCE=0 关闭合并。
+
+
+def coalesce_enabled() -> bool:
+    return os.getenv('LLM_COALESCE', '1') != '0'
+
+
+def request_fingerprint(url: str, api_key: str, payload: Dict[str, Any]) -> str:
+    raw = json.dumps(
+        {
+            'url': url,
+            'key': hashlib.sha1((api_key or '').encode('utf-8')).hexdigest(),
+            'body': payload,
+        },
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(',', ':'),
+    )
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.response: Optional[requests.Response] = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """同一指纹同时只发一次请求，成功的响应在短时间内供顺序的重复请求复用。线程安全。"""
+
+    def __init__(self):
+        self.ttl = float(os.getenv('LLM_COALESCE_TTL', '0'))
+        self.max_entries = int(os.getenv('LLM_COALESCE_MAX_ENTRIES', '256'))
+        self._lock = threading.Lock()
+        self._flights: Dict[str, _Flight] = {}
+        # 指纹 -> (完成时刻, 响应)，按完成顺序排列，便于淘汰最旧的条目
+        self._recent: 'OrderedDict[str, Tuple[float, requests.Response]]' = OrderedDict()
+        self.leaders = 0
+        self.coalesced = 0
+        self.memo_hits = 0
+        self.saved_tokens = 0
+
+    def _recent_response(self, key: str) -> Optional[requests.Response]:
+        """调用方需持有 _lock。"""
+        entry = self._recent.get(key)
+        if entry is None:
+            return None
+        finished_at, response = entry
+        if time.monotonic() - finished_at > self.ttl:
+            del self._recent[key]
+            return None
+        return response
+
+    def _remember(self, key: str, response: requests.Response) -> None:
+        if self.ttl <= 0 or self.max_entries <= 0 or not getattr(response, 'ok', False):
+            return
+        with self._lock:
+            self._recent[key] = (time.monotonic(), response)
+            self._recent.move_to_end(key)
+            while len(self._recent) > self.max_entries:
+                self._recent.popitem(last=False)
+
+    def do(self, key: str, fn: Callable[[], requests.Response], fresh: bool = False) -> Tuple[requests.Response, bool]:
+        """
+        返回 (响应, 是否共享了其他调用方的请求)；发起者的异常会原样抛给所有等待者。
+        fresh=True 时不复用已完成的响应（调用方因内容不可用而重试同一请求），新响应会替换旧的。
+        """
+        with self._lock:
+            recent = None if fresh else self._recent_response(key)
+            if recent is not None:
+                self.coalesced += 1
+                self.memo_hits += 1
+                self.saved_tokens += _response_tokens(recent)
+                return recent, True
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            with self._lock:
+                self.saved_tokens += _response_tokens(flight.response)
+            return flight.response, True
+        try:
+            flight.response = fn()
+            self._remember(key, flight.response)
+            return flight.response, False
+        except BaseException as exc:
+            flight.error = exc
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'requests': self.leaders,
+                'coalesced': self.coalesced,
+                'memo_hits': self.memo_hits,
+                'saved_tokens': self.saved_tokens,
+            }
+
+
+_SINGLEFLIGHT = SingleFlight()
+
+
+def coalesce_stats() -> Dict[str, Any]:
+    """本进程的请求合并统计（没有发生合并时为空）。"""
+    stats = _SINGLEFLIGHT.stats()
+    return stats if stats['coalesced'] else {}
+
+
+def log_coalesce_stats() -> None:
+    stats = coalesce_stats()
+    if stats:
+        print(
+            f"[INFO] 相同请求合并：发出 {stats['requests']} 次，合并 {stats['coalesced']} 次"
+            f"（其中复用已完成的响应 {stats['memo_hits']} 次），省下 tokens {stats['saved_tokens']}",
+            flush=True,
+        )
+
+
 class LLMClient:
     tokens = {
         'prompt': 0,
@@ -75,6 +407,8 @@ class LLMClient:
         }
         # 实例级别的累计耗时（秒）
         self._cum_time_seconds: float = 0.0
+        # 共享了其他调用方相同请求的次数（不计 token / 耗时）
+        self._coalesced = 0
         self.kwargs: Dict[str, Any] = {
             'max_tokens': 4000,  # 更安全的默认值，避免超过部分模型上限
             'temperature': 0.6,
@@ -85,6 +419,42 @@ class LLMClient:
             'stream': False,
         }
 
+    def usage(self) -> Dict[str, Any]:
+        """本实例的累计调用次数、token 与耗时（秒），便于调用方按阶段做差统计。"""
+        return {
+            'calls': self._call_index,
+            'prompt': self._cum_tokens['prompt'],
+            'thinking': self._cum_tokens['thinking'],
+            'content': self._cum_tokens['content'],
+            'total': self._cum_tokens['total'],
+            'seconds': self._cum_time_seconds,
+            'coalesced': self._coalesced,
+        }
+
+    def _post(
+        self,
+        url: str,
+        headers: Dict[str, str],
+        payload: Dict[str, Any],
+        endpoint: str,
+        fresh: bool = False,
+    ) -> Tuple[requests.Response, bool]:
+        """
+        发送 POST（超时 120s），返回 (响应, 是否共享)；相同请求正在飞行中或刚完成时共享它的响应
+        （fresh=True 时不复用已完成的响应），开启对冲时实际发送交给该端点的 RequestHedger。
+        """
+        def send() -> requests.Response:
+            return requests.post(url, headers=headers, json=payload, timeout=120)
+
+        def call() -> requests.Response:
+            if not hedge_enabled():
+                return send()
+            return get_hedger(endpoint).run(send)
+
+        if not coalesce_enabled():
+            return call(), False
+        return _SINGLEFLIGHT.do(request_fingerprint(url, self.api_key, payload), call, fresh=fresh)
+
     def _provider_name(self) -> str:
         try:
             url = (self.base_url or '').lower()
@@ -102,19 +472,12 @@ class LLMClient:
             pass
         return 'llm'
 
-    def chat(self, messages: List[Dict[str, str]], response_format: Optional[Dict[str, Any]] = None) -> dict:
-        """
-        统一 Chat Completions 请求。
-
-        :param messages: OpenAI 格式的消息列表
-        :param response_format: 可选，结构化输出配置（柏拉图支持）
-        """
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json",
-        }
-        request_url = f"{self.base_url.rstrip('/')}/chat/completions"
-
+    def build_chat_payload(
+        self,
+        messages: List[Dict[str, str]],
+        response_format: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        """按当前 kwargs 构造 Chat Completions 请求体（交互调用与批处理任务共用）。"""
         model_name = self.model
         if 'qwen3' in model_name.lower():
             if '/think' in model_name:
@@ -148,11 +511,32 @@ class LLMClient:
                 payload['max_tokens'] = 10000
         except Exception:
             pass
+        return payload
+
+    def chat(
+        self,
+        messages: List[Dict[str, str]],
+        response_format: Optional[Dict[str, Any]] = None,
+        fresh: bool = False,
+    ) -> dict:
+        """
+        统一 Chat Completions 请求。
+
+        :param messages: OpenAI 格式的消息列表
+        :param response_format: 可选，结构化输出配置（柏拉图支持）
+        :param fresh: 重试同一请求时传 True，不复用刚完成的相同请求的响应
+        """
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+        }
+        request_url = f"{self.base_url.rstrip('/')}/chat/completions"
+        payload = self.build_chat_payload(messages, response_format)
 
         # 计时（用于统计每次调用与总耗时）
         start_time = time.time()
         try:
-            response = requests.post(request_url, headers=headers, json=payload, timeout=120)
+            response, shared = self._post(request_url, headers, payload, f"chat:{payload['model']}", fresh=fresh)
             response.raise_for_status()
             try:
                 response_data = response.json()
@@ -162,88 +546,7 @@ class LLMClient:
             debug_raw = os.getenv("BLT_DEBUG_RAW") == "1" or os.getenv("LLM_DEBUG_RAW") == "1"
             if debug_raw and self._provider_name() == "blt":
                 print("[DEBUG] BLT 原始响应包:", response.text)
-
-            if isinstance(response_data, dict) and 'error' in response_data:
-                err = response_data.get('error') or {}
-                print("API 返回错误:", {
-                    'type': err.get('type'),
-                    'code': err.get('code'),
-                    'message': err.get('message') or err,
-                })
-                raise requests.exceptions.HTTPError(f"API error: {err}")
-
-            if 'choices' not in response_data or not response_data['choices']:
-                print("API 响应不包含 choices 字段或为空：", str(response_data)[:500])
-                raise requests.exceptions.HTTPError("API response missing choices")
-
-            message = response_data['choices'][0].get('message', {})
-            content = message.get('content', '') or ''
-            reasoning_content = message.get('reasoning_content', '') or ''
-
-            usage = response_data.get('usage', {})
-            prompt_tokens = usage.get('prompt_tokens', 0)
-            completion_tokens = usage.get('completion_tokens', 0)
-            total_tokens = usage.get('total_tokens', 0)
-            reasoning_tokens = 0
-            if 'completion_tokens_details' in usage:
-                reasoning_tokens = usage['completion_tokens_details'].get('reasoning_tokens', 0)
-
-            self.tokens['prompt'] += prompt_tokens
-            self.tokens['content'] += completion_tokens - reasoning_tokens
-            self.tokens['reasoning'] += reasoning_tokens
-            self.tokens['total'] += total_tokens
-
-            try:
-                GLOBAL_TOKENS['prompt'] += int(prompt_tokens)
-                GLOBAL_TOKENS['thinking'] += int(reasoning_tokens)
-                GLOBAL_TOKENS['content'] += int(completion_tokens - reasoning_tokens)
-                GLOBAL_TOKENS['total'] += int(total_tokens)
-            except Exception:
-                pass
-
-            try:
-                elapsed = time.time() - start_time
-                self._cum_time_seconds += float(elapsed)
-                try:
-                    global GLOBAL_TIME_SECONDS
-                    GLOBAL_TIME_SECONDS += float(elapsed)
-                except Exception:
-                    pass
-
-                self._call_index += 1
-                self._cum_tokens['prompt'] += int(prompt_tokens)
-                self._cum_tokens['thinking'] += int(reasoning_tokens)
-                self._cum_tokens['content'] += int(completion_tokens - reasoning_tokens)
-                self._cum_tokens['total'] += int(total_tokens)
-
-                provider = self._provider_name()
-                header = f"[{provider}][{self.model}] 第{self._call_index}次"
-                line_cur = (
-                    f"本次 tokens：prompt={int(prompt_tokens)}, thinking={int(reasoning_tokens)}, "
-                    f"content={int(completion_tokens - reasoning_tokens)}, total={int(total_tokens)}"
-                )
-                line_cum = (
-                    f"累计 tokens：prompt={self._cum_tokens['prompt']}, thinking={self._cum_tokens['thinking']}, "
-                    f"content={self._cum_tokens['content']}, total={self._cum_tokens['total']}"
-                )
-                line_time = (
-                    f"本次用时：{elapsed:.2f}s，"
-                    f"累计用时：{self._cum_time_seconds:.2f}s"
-                )
-                print(header + "\n" + line_cur + "\n" + line_cum + "\n" + line_time)
-            except Exception:
-                pass
-
-            return {
-                "content": content,
-                "reasoning_content": reasoning_content,
-                "tokens": {
-                    "prompt": prompt_tokens,
-                    "content": completion_tokens - reasoning_tokens,
-                    "reasoning": reasoning_tokens,
-                    "total": total_tokens
-                }
-            }
+            return self.chat_result(response_data, time.time() - start_time, shared=shared)
 
         except requests.exceptions.RequestException as e:
             print(f"通过 requests 调用 API 时出错: {e}")
@@ -257,6 +560,105 @@ class LLMClient:
                         pass
             raise
 
+    def chat_result(self, response_data: Any, elapsed: float, shared: bool = False, replay: bool = False) -> dict:
+        """
+        解析一条 Chat Completions 响应体并累计 token / 耗时统计。
+        批处理任务的结果行也经由这里，统计口径与交互调用一致。
+        shared=True 表示共享了另一调用方的同一请求：token 与耗时已由发起者计入，这里只记 coalesced。
+        replay=True 表示同一条批处理结果再次被读取（逐轮重放）：第一次读取时已计入，这里什么都不记。
+        """
+        if isinstance(response_data, dict) and 'error' in response_data:
+            err = response_data.get('error') or {}
+            print("API 返回错误:", {
+                'type': err.get('type'),
+                'code': err.get('code'),
+                'message': err.get('message') or err,
+            })
+            raise requests.exceptions.HTTPError(f"API error: {err}")
+
+        if 'choices' not in response_data or not response_data['choices']:
+            print("API 响应不包含 choices 字段或为空：", str(response_data)[:500])
+            raise requests.exceptions.HTTPError("API response missing choices")
+
+        message = response_data['choices'][0].get('message', {})
+        content = message.get('content', '') or ''
+        reasoning_content = message.get('reasoning_content', '') or ''
+
+        usage = response_data.get('usage', {})
+        prompt_tokens = usage.get('prompt_tokens', 0)
+        completion_tokens = usage.get('completion_tokens', 0)
+        total_tokens = usage.get('total_tokens', 0)
+        reasoning_tokens = 0
+        if 'completion_tokens_details' in usage:
+            reasoning_tokens = usage['completion_tokens_details'].get('reasoning_tokens', 0)
+
+        if shared or replay:
+            if shared:
+                self._coalesced += 1
+                print(f"[{self._provider_name()}][{self.model}] 共享相同请求的响应（进行中或刚完成，不计 token），用时 {elapsed:.2f}s")
+            return {
+                "content": content,
+                "reasoning_content": reasoning_content,
+                "tokens": {"prompt": 0, "content": 0, "reasoning": 0, "total": 0},
+                "coalesced": shared,
+            }
+
+        self.tokens['prompt'] += prompt_tokens
+        self.tokens['content'] += completion_tokens - reasoning_tokens
+        self.tokens['reasoning'] += reasoning_tokens
+        self.tokens['total'] += total_tokens
+
+        try:
+            GLOBAL_TOKENS['prompt'] += int(prompt_tokens)
+            GLOBAL_TOKENS['thinking'] += int(reasoning_tokens)
+            GLOBAL_TOKENS['content'] += int(completion_tokens - reasoning_tokens)
+            GLOBAL_TOKENS['total'] += int(total_tokens)
+        except Exception:
+            pass
+
+        try:
+            self._cum_time_seconds += float(elapsed)
+            try:
+                global GLOBAL_TIME_SECONDS
+                GLOBAL_TIME_SECONDS += float(elapsed)
+            except Exception:
+                pass
+
+            self._call_index += 1
+            self._cum_tokens['prompt'] += int(prompt_tokens)
+            self._cum_tokens['thinking'] += int(reasoning_tokens)
+            self._cum_tokens['content'] += int(completion_tokens - reasoning_tokens)
+            self._cum_tokens['total'] += int(total_tokens)
+
+            provider = self._provider_name()
+            header = f"[{provider}][{self.model}] 第{self._call_index}次"
+            line_cur = (
+                f"本次 tokens：prompt={int(prompt_tokens)}, thinking={int(reasoning_tokens)}, "
+                f"content={int(completion_tokens - reasoning_tokens)}, total={int(total_tokens)}"
+            )
+            line_cum = (
+                f"累计 tokens：prompt={self._cum_tokens['prompt']}, thinking={self._cum_tokens['thinking']}, "
+                f"content={self._cum_tokens['content']}, total={self._cum_tokens['total']}"
+            )
+            line_time = (
+                f"本次用时：{elapsed:.2f}s，"
+                f"累计用时：{self._cum_time_seconds:.2f}s"
+            )
+            print(header + "\n" + line_cur + "\n" + line_cum + "\n" + line_time)
+        except Exception:
+            pass
+
+        return {
+            "content": content,
+            "reasoning_content": reasoning_content,
+            "tokens": {
+                "prompt": prompt_tokens,
+                "content": completion_tokens - reasoning_tokens,
+                "reasoning": reasoning_tokens,
+                "total": total_tokens
+            }
+        }
+
     def rerank(
         self,
         query: str,
@@ -338,7 +740,7 @@ class BltClient(LLMClient):
             payload["top_n"] = int(top_n)
 
         try:
-            response = requests.post(request_url, headers=headers, json=payload, timeout=120)
+            response, _ = self._post(request_url, headers, payload, f"rerank:{payload['model']}")
             response.raise_for_status()
             try:
                 response_data = response.json()
@@ -378,6 +780,241 @@ class BltClient(LLMClient):
             raise
 
 
+# ---------------- 批处理任务（OpenAI 兼容 Batch API） ----------------
+# 回溯运行（--fetch-days / skims）时步骤 4、6 要逐条发出成百上千次交互请求。批处理模式下：
+# 1. BatchChatClient 包装原客户端：chat() 先查已完成任务的结果（按请求体哈希作 custom_id），命中即返回；
+#    未命中时 defer 模式登记请求并抛出 BatchDeferred，call 模式直接走交互请求；
+# 2. BatchSession.flush() 把登记的请求按（接口地址, 模型）写成 JSONL，上传 /files、创建 /batches 任务，
+#    轮询到结束后下载结果文件写回缓存；
+# 3. 有先后依赖的调用方分轮重放（步骤 4：打分 → 复核 → 补全），可提前算好请求的调用方先预取（步骤 6）。
+# 网关不支持 /batches 时，可启动 src/batch_standin.py 并设置 LLM_BATCH_BASE_URL 指向它。
+BATCH_ENDPOINT = '/v1/chat/completions'
+BATCH_COMPLETION_WINDOW = '24h'
+BATCH_TERMINAL_STATUSES = ('completed', 'failed', 'expired', 'cancelled')
+
+
+class BatchDeferred(Exception):
+    """defer 模式下请求还没有批处理结果；已登记，下一次 flush() 会提交。"""
+
+
+def batch_request_id(payload: Dict[str, Any]) -> str:
+    digest = hashlib.sha1(json.dumps(payload, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+    return f"req-{digest[:24]}"
+
+
+class BatchJobRunner:
+    """Batch API 的一次完整往返：上传输入文件 → 创建任务 → 轮询 → 下载结果 / 错误文件。"""
+
+    def __init__(self, api_key: str, base_url: str, poll_s: Optional[float] = None, timeout_s: Optional[float] = None):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.poll_s = float(poll_s if poll_s is not None else os.getenv('LLM_BATCH_POLL_S', '10'))
+        self.timeout_s = float(timeout_s if timeout_s is not None else os.getenv('LLM_BATCH_TIMEOUT_S', '86400'))
+
+    def _request(self, method: str, path: str, **kwargs) -> requests.Response:
+        response = requests.request(
+            method,
+            f"{self.base_url}{path}",
+            headers={"Authorization": f"Bearer {self.api_key}"},
+            timeout=120,
+            **kwargs,
+        )
+        response.raise_for_status()
+        return response
+
+    def submit(self, lines: List[Dict[str, Any]], metadata: Optional[Dict[str, str]] = None) -> str:
+        content = ''.join(json.dumps(line, ensure_ascii=False) + '\n' for line in lines).encode('utf-8')
+        uploaded = self._request(
+            'POST',
+            '/files',
+            files={'file': ('batch_input.jsonl', content, 'application/jsonl')},
+            data={'purpose': 'batch'},
+        ).json()
+        batch = self._request(
+            'POST',
+            '/batches',
+            json={
+                'input_file_id': uploaded['id'],
+                'endpoint': BATCH_ENDPOINT,
+                'completion_window': BATCH_COMPLETION_WINDOW,
+                'metadata': metadata or {},
+            },
+        ).json()
+        return batch['id']
+
+    def wait(self, batch_id: str) -> Dict[str, Any]:
+        started = time.time()
+        last = None
+        while True:
+            batch = self._request('GET', f'/batches/{batch_id}').json()
+            status = batch.get('status')
+            counts = batch.get('request_counts') or {}
+            progress = (status, counts.get('completed'), counts.get('failed'))
+            if progress != last:
+                print(
+                    f"[INFO] 批处理任务 {batch_id}：{status}，"
+                    f"完成 {counts.get('completed', 0)}/{counts.get('total', 0)}，失败 {counts.get('failed', 0)}",
+                    flush=True,
+                )
+                last = progress
+            if status in BATCH_TERMINAL_STATUSES:
+                return batch
+            if time.time() - started > self.timeout_s:
+                raise TimeoutError(f"批处理任务 {batch_id} 超过 {self.timeout_s:.0f}s 仍未结束（状态 {status}）")
+            time.sleep(self.poll_s)
+
+    def download(self, file_id: Optional[str]) -> List[Dict[str, Any]]:
+        if not file_id:
+            return []
+        text = self._request('GET', f'/files/{file_id}/content').text
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+    def run(self, lines: List[Dict[str, Any]], metadata: Optional[Dict[str, str]] = None) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        batch = self.wait(self.submit(lines, metadata))
+        if batch.get('status') == 'failed':
+            errors = (batch.get('errors') or {}).get('data') or []
+            raise RuntimeError(f"批处理任务 {batch.get('id')} 失败：{errors[:3]}")
+        return batch, self.download(batch.get('output_file_id')) + self.download(batch.get('error_file_id'))
+
+
+class BatchSession:
+    """
+    一次运行内的批处理状态：已完成请求的结果（custom_id -> 响应体 / 错误）与待提交的请求。
+    接口地址与 key 默认沿用各客户端自己的配置，LLM_BATCH_BASE_URL / LLM_BATCH_API_KEY 可整体改指向。
+    """
+
+    def __init__(self, base_url: Optional[str] = None, api_key: Optional[str] = None):
+        self.base_url = base_url or os.getenv('LLM_BATCH_BASE_URL') or None
+        self.api_key = api_key or os.getenv('LLM_BATCH_API_KEY') or None
+        self.results: Dict[str, Dict[str, Any]] = {}
+        self.pending: Dict[str, Tuple['LLMClient', Dict[str, Any], int]] = {}
+        self.jobs: List[Dict[str, Any]] = []
+        # 已被 chat() 读取并计入统计的结果；重放时同一结果不重复计 token
+        self.consumed: set = set()
+
+    def add(self, client: 'LLMClient', payload: Dict[str, Any], stage: int = 0) -> str:
+        custom_id = batch_request_id(payload)
+        if custom_id not in self.results and custom_id not in self.pending:
+            self.pending[custom_id] = (client, payload, stage)
+        return custom_id
+
+    def flush(self) -> int:
+        """
+        提交最靠前阶段（stage 最小）的待处理请求，每个（接口地址, 模型）一个任务，等待全部结束；返回提交的请求数。
+        更靠后阶段的请求依赖前一阶段的结果，直接丢弃，由调用方下一轮重放时重新登记。
+        """
+        if not self.pending:
+            return 0
+        stage = min(item[2] for item in self.pending.values())
+        groups: Dict[Tuple[str, str, str], List[Dict[str, Any]]] = {}
+        for custom_id, (client, payload, item_stage) in self.pending.items():
+            if item_stage != stage:
+                continue
+            key = (self.base_url or client.base_url, self.api_key or client.api_key, payload.get('model', ''))
+            groups.setdefault(key, []).append(
+                {'custom_id': custom_id, 'method': 'POST', 'url': BATCH_ENDPOINT, 'body': payload}
+            )
+        self.pending = {}
+
+        submitted = 0
+        for (base_url, api_key, model), lines in groups.items():
+            started = time.time()
+            batch, rows = BatchJobRunner(api_key, base_url).run(lines, metadata={'model': model, 'stage': str(stage)})
+            succeeded = 0
+            for row in rows:
+                response = row.get('response') or {}
+                body = response.get('body')
+                if response.get('status_code') == 200 and isinstance(body, dict):
+                    self.results[row.get('custom_id')] = {'body': body}
+                    succeeded += 1
+                else:
+                    self.results[row.get('custom_id')] = {'error': row.get('error') or body or 'no response'}
+            for line in lines:
+                self.results.setdefault(line['custom_id'], {'error': f"batch {batch.get('id')} {batch.get('status')} 未返回该请求"})
+            seconds = time.time() - started
+            self.jobs.append({
+                'id': batch.get('id'),
+                'model': model,
+                'stage': stage,
+                'status': batch.get('status'),
+                'requests': len(lines),
+                'succeeded': succeeded,
+                'seconds': round(seconds, 1),
+            })
+            print(f"[INFO] 批处理任务 {batch.get('id')}（{model}）：成功 {succeeded}/{len(lines)}，用时 {seconds:.1f}s", flush=True)
+            submitted += len(lines)
+        return submitted
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'jobs': list(self.jobs),
+            'requests': sum(j['requests'] for j in self.jobs),
+            'succeeded': sum(j['succeeded'] for j in self.jobs),
+            'seconds': round(sum(j['seconds'] for j in self.jobs), 1),
+        }
+
+
+class BatchChatClient:
+    """
+    以批处理结果应答的客户端包装，接口与 LLMClient 相同（chat / usage / model / kwargs）。
+    on_miss="defer"：没有结果时登记请求（阶段为 self.stage）并抛出 BatchDeferred；
+    on_miss="call"：没有结果时走原客户端的交互请求，结果用一次即丢弃（重试 / 续写会重新请求）。
+    """
+
+    def __init__(self, client: 'LLMClient', session: BatchSession, on_miss: str = 'defer'):
+        if on_miss not in ('defer', 'call'):
+            raise ValueError(f"unknown on_miss: {on_miss}")
+        self.client = client
+        self.session = session
+        self.on_miss = on_miss
+        self.stage = 0
+
+    @property
+    def model(self) -> str:
+        return self.client.model
+
+    @property
+    def kwargs(self) -> Dict[str, Any]:
+        return self.client.kwargs
+
+    def usage(self) -> Dict[str, Any]:
+        return self.client.usage()
+
+    def prefetch(self, messages: List[Dict[str, str]], response_format: Optional[Dict[str, Any]] = None, **overrides) -> None:
+        """按 overrides（如 temperature / max_tokens）登记一条请求，请求体与之后同参数的 chat() 完全一致。"""
+        saved = dict(self.client.kwargs)
+        self.client.kwargs.update(overrides)
+        try:
+            payload = self.client.build_chat_payload(messages, response_format)
+        finally:
+            self.client.kwargs.clear()
+            self.client.kwargs.update(saved)
+        self.session.add(self.client, payload, self.stage)
+
+    def chat(
+        self,
+        messages: List[Dict[str, str]],
+        response_format: Optional[Dict[str, Any]] = None,
+        fresh: bool = False,
+    ) -> dict:
+        payload = self.client.build_chat_payload(messages, response_format)
+        custom_id = batch_request_id(payload)
+        if self.on_miss == 'call':
+            result = self.session.results.pop(custom_id, None)
+            if result is None:
+                return self.client.chat(messages, response_format, fresh=fresh)
+        else:
+            result = self.session.results.get(custom_id)
+            if result is None:
+                self.session.add(self.client, payload, self.stage)
+                raise BatchDeferred(custom_id)
+        if 'error' in result:
+            raise requests.exceptions.HTTPError(f"batch request {custom_id} failed: {result['error']}")
+        replay = custom_id in self.session.consumed
+        self.session.consumed.add(custom_id)
+        return self.client.chat_result(result['body'], 0.0, replay=replay)
+
+
 def parse_provider_model(model_str: str) -> Tuple[str, str]:
     """
     解析模型字符串为 (provider, model)。
@@ -5,6 +5,7 @@ import subprocess
 import sys
 from datetime import datetime, timedelta, timezone
 
+import planner
 
 SRC_DIR = os.path.dirname(__file__)
 
@@ -14,6 +15,33 @@ def run_step(label: str, args: list[str]) -> None:
     subprocess.run(args, check=True)
 
 
+def run_pipelined_steps(
+    producer_label: str,
+    producer_args: list[str],
+    consumer_label: str,
+    consumer_args: list[str],
+    stream_path: str,
+) -> None:
+    """
+    同时运行两个步骤：producer 边处理边写 stream_path，consumer 跟随读取。
+    producer 失败时终止 consumer；两者都成功才返回。
+    """
+    if os.path.exists(stream_path):
+        # 避免 consumer 读到上一次运行留下的文件
+        os.remove(stream_path)
+    print(f"[INFO] {consumer_label}: {' '.join(consumer_args)}", flush=True)
+    consumer = subprocess.Popen(consumer_args)
+    try:
+        run_step(producer_label, producer_args)
+    except BaseException:
+        consumer.terminate()
+        consumer.wait()
+        raise
+    returncode = consumer.wait()
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, consumer_args)
+
+
 def main() -> None:
     parser = argparse.ArgumentParser(
         description="Daily Paper Reader pipeline (steps 0~6).",
@@ -34,6 +62,107 @@ def main() -> None:
         default=8,
         help="Batch size for embedding retrieval (default: 8).",
     )
+    parser.add_argument(
+        "--embedding-encode-workers",
+        type=int,
+        default=1,
+        help="CPU encoding processes for embedding retrieval (default: 1, single process).",
+    )
+    parser.add_argument(
+        "--embedding-autotune",
+        action="store_true",
+        help="Calibrate embedding batch size / torch threads on this host (cached per host and model); overrides --embedding-batch-size.",
+    )
+    parser.add_argument(
+        "--embedding-memory-cap-mb",
+        type=float,
+        default=None,
+        help="Peak memory cap (MB) for --embedding-autotune.",
+    )
+    parser.add_argument(
+        "--embedding-stream",
+        action="store_true",
+        help="Stream paper embeddings into a running per-query top-k instead of holding the full matrix.",
+    )
+    parser.add_argument(
+        "--embedding-cache",
+        choices=["float32", "float16", "int8"],
+        default=None,
+        help="Cache paper embeddings per day under archive/YYYYMMDD/embeddings (float32 / float16 / int8); "
+        "same-day reruns skip paper encoding.",
+    )
+    parser.add_argument(
+        "--embedding-cache-exact",
+        action="store_true",
+        help="Also keep a float32 copy next to a float16 / int8 cache so cache hits rescore without loading the model "
+        "(costs one extra float32 matrix on disk).",
+    )
+    parser.add_argument(
+        "--embedding-ann-index",
+        action="store_true",
+        help="Append today's paper embeddings to the cross-day ANN index (archive/ann).",
+    )
+    parser.add_argument(
+        "--rerank-backend",
+        choices=["api", "local"],
+        default="api",
+        help="Step 3 rerank backend: api (BLT Rerank, default) or local (in-process CPU cross-encoder, no API key needed).",
+    )
+    parser.add_argument(
+        "--rerank-cascade",
+        action="store_true",
+        help="Step 3 cascade rerank: rerank the top RRF slice first and expand only while the newest slice still scores high.",
+    )
+    parser.add_argument(
+        "--pipeline-refine",
+        action="store_true",
+        help="Run Step 4 concurrently with Step 3: each query's reranked list is refined as soon as it is ready.",
+    )
+    parser.add_argument(
+        "--refine-mode",
+        choices=["single", "two-phase"],
+        default="single",
+        help="Step 4 refine mode: single (score+evidence+TLDR per request) or two-phase (score all, enrich survivors only).",
+    )
+    parser.add_argument(
+        "--refine-wire",
+        choices=["full", "compact"],
+        default="full",
+        help="Step 4 wire format: compact uses short per-batch ids, tag aliases and short keys to cut output tokens.",
+    )
+    parser.add_argument(
+        "--refine-fast-model",
+        type=str,
+        default=None,
+        help="Step 4 tiered scoring: a cheap model scores all candidates and the filter model only re-scores the ambiguous band.",
+    )
+    parser.add_argument(
+        "--llm-batch",
+        action="store_true",
+        help="Submit Step 4 refine requests and Step 6 translation/glance requests as OpenAI-compatible batch jobs "
+        "(for --fetch-days backfills; set LLM_BATCH_BASE_URL to use src/batch_standin.py). Not with --pipeline-refine.",
+    )
+    parser.add_argument(
+        "--hedge",
+        action="store_true",
+        help="Hedge LLM/rerank requests in Steps 0/3/4/6: resend a request that is slower than the recent p95 latency "
+        "and use the first good response (sets LLM_HEDGE=1; tune with LLM_HEDGE_PERCENTILE / LLM_HEDGE_MAX_RATIO).",
+    )
+    parser.add_argument(
+        "--budget",
+        action="append",
+        default=[],
+        metavar="STAGE.METRIC=VALUE",
+        help="Per-stage budget cap for Steps 3/4/6, e.g. rerank.calls=40, refine.tokens=300000, docs.seconds=1200 "
+        "(repeatable). When the plan exceeds a cap: shrink rerank top-k, cap refine candidates, skip deep summaries.",
+    )
+    parser.add_argument(
+        "--retrieval-cutoff",
+        choices=["none", "gap", "zscore", "knee"],
+        default="none",
+        help="Adaptive per-query top-k cutoff for Steps 2.1/2.2, applied once on each retriever's own scores "
+        "(Step 2.3 fuses the cut lists without cutting again; default: none, fixed top-k).",
+    )
     parser.add_argument(
         "--fetch-ignore-seen",
         action="store_true",
@@ -46,8 +175,16 @@ def main() -> None:
         help="Pass --days to Step1 (fetch arxiv). Default: use config.yaml/state logic.",
     )
     args = parser.parse_args()
+    if args.llm_batch and args.pipeline_refine:
+        parser.error("--llm-batch cannot be combined with --pipeline-refine")
 
     python = sys.executable
+    if args.hedge:
+        # 子步骤继承环境变量，由 llm.py 读取
+        os.environ["LLM_HEDGE"] = "1"
+    budgets = planner.parse_budgets(args.budget)
+    today = datetime.now(timezone.utc).strftime("%Y%m%d")
+    cutoff_args = ["--cutoff", args.retrieval_cutoff] if args.retrieval_cutoff != "none" else []
 
     sidebar_date_label = None
     if args.fetch_days is not None:
@@ -73,7 +210,7 @@ def main() -> None:
     )
     run_step(
         "Step 2.1 - BM25",
-        [python, os.path.join(SRC_DIR, "2.1.retrieval_papers_bm25.py")],
+        [python, os.path.join(SRC_DIR, "2.1.retrieval_papers_bm25.py"), *cutoff_args],
     )
     run_step(
         "Step 2.2 - Embedding",
@@ -84,20 +221,76 @@ def main() -> None:
             str(args.embedding_device),
             "--batch-size",
             str(args.embedding_batch_size),
+            "--encode-workers",
+            str(args.embedding_encode_workers),
+            *(["--autotune"] if args.embedding_autotune else []),
+            *(
+                ["--memory-cap-mb", str(args.embedding_memory_cap_mb)]
+                if args.embedding_memory_cap_mb is not None
+                else []
+            ),
+            *(["--stream"] if args.embedding_stream else []),
+            *(["--embedding-cache", args.embedding_cache] if args.embedding_cache else []),
+            *(["--embedding-cache-exact"] if args.embedding_cache_exact else []),
+            *(["--ann-index"] if args.embedding_ann_index else []),
+            *cutoff_args,
         ],
     )
     run_step(
         "Step 2.3 - RRF",
         [python, os.path.join(SRC_DIR, "2.3.retrieval_papers_rrf.py")],
     )
-    run_step(
-        "Step 3 - Rerank",
-        [python, os.path.join(SRC_DIR, "3.rank_papers.py")],
-    )
-    run_step(
-        "Step 4 - LLM refine",
-        [python, os.path.join(SRC_DIR, "4.llm_refine_papers.py")],
-    )
+
+    # 步骤 3 之前：预测 3 / 4 / 6 的调用数、token 与耗时，超出预算时降级
+    actions = {}
+    try:
+        plan = planner.plan_run(
+            os.path.abspath(os.path.join(SRC_DIR, "..", "archive", today, "filtered", f"arxiv_papers_{today}.json")),
+            budgets,
+            planner.refine_profile(args.refine_mode, args.refine_wire, bool(args.refine_fast_model), args.llm_batch),
+            skims=args.fetch_days is not None,
+            date_str=today,
+        )
+        actions = plan["actions"]
+    except Exception as exc:
+        print(f"[WARN] planner failed, running without a plan: {exc}", flush=True)
+    rerank_args = [
+        python,
+        os.path.join(SRC_DIR, "3.rank_papers.py"),
+        "--rerank-backend",
+        args.rerank_backend,
+        *(["--cascade"] if args.rerank_cascade else []),
+        *(["--max-candidates", str(actions["rerank_max_k"])] if actions.get("rerank_max_k") else []),
+    ]
+    refine_args = [
+        python,
+        os.path.join(SRC_DIR, "4.llm_refine_papers.py"),
+        "--refine-mode",
+        args.refine_mode,
+        "--wire",
+        args.refine_wire,
+        *(["--fast-model", args.refine_fast_model] if args.refine_fast_model else []),
+        *(["--batch"] if args.llm_batch else []),
+        *(
+            ["--max-candidates", str(actions["refine_max_candidates"])]
+            if actions.get("refine_max_candidates") is not None
+            else []
+        ),
+    ]
+    if args.pipeline_refine:
+        stream_path = os.path.abspath(
+            os.path.join(SRC_DIR, "..", "archive", today, "rank", f"arxiv_papers_{today}.stream.jsonl")
+        )
+        run_pipelined_steps(
+            "Step 3 - Rerank",
+            [*rerank_args, "--stream-out", stream_path],
+            "Step 4 - LLM refine (follow)",
+            [*refine_args, "--follow", stream_path],
+            stream_path,
+        )
+    else:
+        run_step("Step 3 - Rerank", rerank_args)
+        run_step("Step 4 - LLM refine", refine_args)
     run_step(
         "Step 5 - Select",
         [
@@ -117,8 +310,11 @@ def main() -> None:
                 if sidebar_date_label
                 else []
             ),
+            *(["--skip-deep-summary"] if actions.get("docs_skip_deep_summary") else []),
+            *(["--batch"] if args.llm_batch else []),
         ],
     )
+    planner.summarize_report(today)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,377 @@
+#!/usr/bin/env python
+# 运行前的成本 / 延迟规划与运行报告：
+# 1. main.py 在步骤 2.3 之后、步骤 3 之前调用 plan_run()：按 2.3 产物里每个查询的候选数，
+#    结合历史遥测（archive/llm_telemetry.json，按单位候选 / 单篇论文的调用数、token、耗时做指数滑动平均）
+#    预测步骤 3（rerank）、4（LLM 精读）、6（生成文档）的请求数、prompt / completion token 与耗时；
+# 2. 可按阶段设置预算上限（--budget rerank.calls=40 / refine.tokens=300000 / docs.seconds=1200）：
+#    超出时依次缩小步骤 3 每个查询的候选数、限制步骤 4 的候选数、步骤 6 跳过精读总结，
+#    降级后仍超出则只告警，不中断流程；
+# 3. 步骤 3 / 4 / 6 结束时调用 record_stage() 写入实际数字并更新遥测（附带请求对冲与相同请求合并的统计）；
+#    预测、预算、降级与实际值都写入 archive/YYYYMMDD/recommend/run_report.json（随推荐结果一起提交）。
+# 没有遥测时使用 PRIORS 中的保守先验；遥测按 EWMA_ALPHA 逐次向最近的运行靠拢。
+
+import math
+import os
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Tuple
+
+import storage
+from llm import coalesce_stats, hedge_stats, log_coalesce_stats, log_hedge_stats
+from rank_lists import ordered_scores, query_key
+from score_table import read_rank_lists
+
+SCRIPT_DIR = os.path.dirname(__file__)
+ROOT_DIR = os.path.abspath(os.path.join(SCRIPT_DIR, ".."))
+ARCHIVE_ROOT = os.path.join(ROOT_DIR, "archive")
+TELEMETRY_FILE = os.path.join(ARCHIVE_ROOT, "llm_telemetry.json")
+LOCK_FILE = os.path.join(ARCHIVE_ROOT, ".planner.lock")
+RUN_REPORT_NAME = "run_report.json"
+
+STAGES = ("rerank", "refine", "docs")
+BUDGET_METRICS = ("calls", "tokens", "seconds")
+EWMA_ALPHA = 0.3
+RERANK_BATCH_SIZE = 100  # 与 3.rank_papers.py 的 BATCH_SIZE 一致
+MIN_RERANK_K = 10
+
+# 没有遥测时的先验：rerank / refine 按每篇候选，docs 按每篇论文（deep 含翻译 + 速览 + 精读总结，glance 含翻译 + 速览）
+PRIORS: Dict[str, Dict[str, float]] = {
+    "rerank": {"calls": 0.01, "prompt_tokens": 220.0, "completion_tokens": 0.0, "seconds": 0.03},
+    "refine": {"calls": 0.1, "prompt_tokens": 300.0, "completion_tokens": 50.0, "seconds": 0.8},
+    "refine:funnel": {"candidate_rate": 0.3},
+    "docs:deep": {"calls": 4.0, "prompt_tokens": 25000.0, "completion_tokens": 3500.0, "seconds": 90.0},
+    "docs:glance": {"calls": 2.0, "prompt_tokens": 900.0, "completion_tokens": 500.0, "seconds": 10.0},
+    "docs:counts": {"deep_papers": 8.0, "quick_papers": 12.0},
+}
+
+
+def log(message: str) -> None:
+    ts = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    print(f"[{ts}] {message}", flush=True)
+
+
+def today_str() -> str:
+    return datetime.now(timezone.utc).strftime("%Y%m%d")
+
+
+def run_report_path(date_str: str | None = None) -> str:
+    return os.path.join(ARCHIVE_ROOT, date_str or today_str(), "recommend", RUN_REPORT_NAME)
+
+
+def _load_plain(path: str) -> Dict[str, Any]:
+    if not storage.json_exists(path):
+        return {}
+    try:
+        data = storage.load_json(path)
+        return data if isinstance(data, dict) else {}
+    except Exception as exc:
+        log(f"[WARN] 读取 {path} 失败：{exc}")
+        return {}
+
+
+def load_telemetry() -> Dict[str, Any]:
+    return _load_plain(TELEMETRY_FILE)
+
+
+def rate(telemetry: Dict[str, Any], key: str, metric: str) -> float:
+    """遥测里的滑动平均；缺失时回退到先验（refine:<profile> 回退到 refine 的先验）。"""
+    entry = (telemetry.get("rates") or {}).get(key) or {}
+    if metric in entry:
+        return float(entry[metric])
+    base = key if key in PRIORS else key.split(":", 1)[0]
+    return float(PRIORS.get(base, {}).get(metric, 0.0))
+
+
+def _update_rates(telemetry: Dict[str, Any], key: str, values: Dict[str, float], units: float) -> None:
+    if units <= 0:
+        return
+    rates = telemetry.setdefault("rates", {})
+    entry = rates.setdefault(key, {"runs": 0})
+    first = entry.get("runs", 0) == 0
+    for metric, total in values.items():
+        x = float(total) / units
+        entry[metric] = x if first or metric not in entry else (1 - EWMA_ALPHA) * float(entry[metric]) + EWMA_ALPHA * x
+    entry["runs"] = int(entry.get("runs", 0)) + 1
+
+
+def _cost(requests: float, prompt: float, completion: float, seconds: float, **extra: Any) -> Dict[str, Any]:
+    return {
+        "requests": int(math.ceil(requests)),
+        "prompt_tokens": int(round(prompt)),
+        "completion_tokens": int(round(completion)),
+        "seconds": round(seconds, 1),
+        **extra,
+    }
+
+
+def over_budget(cost: Dict[str, Any], caps: Dict[str, float]) -> List[str]:
+    used = {
+        "calls": cost["requests"],
+        "tokens": cost["prompt_tokens"] + cost["completion_tokens"],
+        "seconds": cost["seconds"],
+    }
+    return [f"{m}={used[m]}>{caps[m]:g}" for m in BUDGET_METRICS if m in caps and used[m] > caps[m]]
+
+
+def parse_budgets(items: List[str] | None) -> Dict[str, Dict[str, float]]:
+    """["rerank.calls=40", "docs.seconds=1200"] -> {"rerank": {"calls": 40.0}, "docs": {"seconds": 1200.0}}"""
+    budgets: Dict[str, Dict[str, float]] = {}
+    for item in items or []:
+        key, sep, value = item.partition("=")
+        stage, dot, metric = key.strip().partition(".")
+        if not sep or not dot or stage not in STAGES or metric not in BUDGET_METRICS:
+            raise ValueError(f"预算格式应为 <{'|'.join(STAGES)}>.<{'|'.join(BUDGET_METRICS)}>=<数值>：{item}")
+        budgets.setdefault(stage, {})[metric] = float(value)
+    return budgets
+
+
+def refine_profile(mode: str, wire: str, tiered: bool, batch: bool = False) -> str:
+    """步骤 4 的遥测按运行方式分开统计（两阶段 / 紧凑格式 / 分档 / 批处理的单篇开销与耗时差别很大）。"""
+    return "/".join([mode, wire] + (["tiered"] if tiered else []) + (["batch"] if batch else []))
+
+
+def query_candidate_ids(input_path: str) -> List[List[str]]:
+    """与步骤 3 get_top_ids 相同的取法：top_ids → 列式打分表 → sim_scores 名次。"""
+    data = storage.load_json(input_path)
+    queries = data.get("queries") or []
+    rank_lists = read_rank_lists(input_path, data.get("generated_at") or "")
+    result: List[List[str]] = []
+    for q in queries:
+        ids = list(q.get("top_ids") or [])
+        if not ids and rank_lists is not None:
+            ids = [pid for pid, _rank in rank_lists.get(query_key(q), [])]
+        if not ids:
+            ids = [pid for pid, _score in ordered_scores(q.get("sim_scores"))]
+        result.append([str(pid) for pid in ids])
+    return result
+
+
+def predict_rerank(id_lists: List[List[str]], telemetry: Dict[str, Any], max_k: int | None = None) -> Dict[str, Any]:
+    counts = [min(len(ids), max_k) if max_k else len(ids) for ids in id_lists]
+    docs = sum(counts)
+    # 全量模式的调用数由分批规则决定；级联模式只会更少，这里按上限估计
+    requests = sum(math.ceil(c / RERANK_BATCH_SIZE) for c in counts if c > 0)
+    return _cost(
+        requests,
+        docs * rate(telemetry, "rerank", "prompt_tokens"),
+        docs * rate(telemetry, "rerank", "completion_tokens"),
+        docs * rate(telemetry, "rerank", "seconds"),
+        docs=docs,
+        max_k=max_k,
+    )
+
+
+def predict_refine(
+    unique_docs: int,
+    telemetry: Dict[str, Any],
+    profile: str,
+    max_candidates: int | None = None,
+) -> Dict[str, Any]:
+    key = f"refine:{profile}"
+    candidates = int(round(unique_docs * rate(telemetry, "refine:funnel", "candidate_rate")))
+    if max_candidates is not None:
+        candidates = min(candidates, max_candidates)
+    return _cost(
+        candidates * rate(telemetry, key, "calls"),
+        candidates * rate(telemetry, key, "prompt_tokens"),
+        candidates * rate(telemetry, key, "completion_tokens"),
+        candidates * rate(telemetry, key, "seconds"),
+        candidates=candidates,
+        max_candidates=max_candidates,
+    )
+
+
+def predict_docs(telemetry: Dict[str, Any], skip_deep: bool, skims: bool) -> Dict[str, Any]:
+    deep = 0 if skims else int(round(rate(telemetry, "docs:counts", "deep_papers")))
+    quick = int(round(rate(telemetry, "docs:counts", "quick_papers")))
+    # 跳过精读总结时，精读区论文只做翻译 + 速览，与速读区单篇开销相同
+    deep_key = "docs:glance" if skip_deep else "docs:deep"
+
+    def total(metric: str) -> float:
+        return deep * rate(telemetry, deep_key, metric) + quick * rate(telemetry, "docs:glance", metric)
+
+    return _cost(
+        total("calls"),
+        total("prompt_tokens"),
+        total("completion_tokens"),
+        total("seconds"),
+        deep_papers=deep,
+        quick_papers=quick,
+        skip_deep=skip_deep,
+    )
+
+
+def refine_cap_for(caps: Dict[str, float], per_doc: Dict[str, float]) -> int | None:
+    """
+    按各预算指标与单篇开销换算步骤 4 的候选数上限，取最紧的一项。
+    没有任何指标的单篇开销为正时返回 None（无法换算，不限制）；否则至少为 1，
+    避免预算小于单篇开销时给出 0 而让步骤 4 一篇都不做。
+    """
+    limits = [int(caps[m] // per_doc[m]) for m in caps if per_doc.get(m, 0) > 0]
+    if not limits:
+        return None
+    return max(1, min(limits))
+
+
+def plan_run(
+    input_path: str,
+    budgets: Dict[str, Dict[str, float]],
+    refine_profile: str,
+    skims: bool = False,
+    date_str: str | None = None,
+) -> Dict[str, Any]:
+    """
+    预测步骤 3 / 4 / 6 的开销并按预算降级，结果写入运行报告。
+    返回值的 "actions" 给 main.py 用：rerank_max_k / refine_max_candidates / docs_skip_deep_summary。
+    """
+    telemetry = load_telemetry()
+    id_lists = query_candidate_ids(input_path) if storage.json_exists(input_path) else []
+
+    def unique_docs(max_k: int | None) -> int:
+        return len({pid for ids in id_lists for pid in (ids[:max_k] if max_k else ids)})
+
+    rerank_k: int | None = None
+    refine_cap: int | None = None
+    skip_deep = False
+    degradations: List[str] = []
+
+    rerank = predict_rerank(id_lists, telemetry)
+    initial = {
+        "rerank": rerank,
+        "refine": predict_refine(unique_docs(None), telemetry, refine_profile),
+        "docs": predict_docs(telemetry, False, skims),
+    }
+
+    caps = budgets.get("rerank") or {}
+    if caps and over_budget(rerank, caps):
+        longest = max((len(ids) for ids in id_lists), default=0)
+        rerank_k = MIN_RERANK_K
+        for k in range(longest - 1, MIN_RERANK_K - 1, -1):
+            if not over_budget(predict_rerank(id_lists, telemetry, k), caps):
+                rerank_k = k
+                break
+        rerank = predict_rerank(id_lists, telemetry, rerank_k)
+        degradations.append(f"rerank: 每个查询的候选数缩小到 {rerank_k}")
+
+    refine = predict_refine(unique_docs(rerank_k), telemetry, refine_profile)
+    caps = budgets.get("refine") or {}
+    if caps and over_budget(refine, caps):
+        key = f"refine:{refine_profile}"
+        per_doc = {
+            "calls": rate(telemetry, key, "calls"),
+            "tokens": rate(telemetry, key, "prompt_tokens") + rate(telemetry, key, "completion_tokens"),
+            "seconds": rate(telemetry, key, "seconds"),
+        }
+        refine_cap = refine_cap_for(caps, per_doc)
+        if refine_cap is None:
+            log(f"[WARN] 规划：{key} 在预算指标（{', '.join(caps)}）上没有单篇开销，无法换算候选数上限。")
+        else:
+            refine = predict_refine(unique_docs(rerank_k), telemetry, refine_profile, refine_cap)
+            degradations.append(f"refine: 候选数上限 {refine_cap}")
+
+    docs = predict_docs(telemetry, False, skims)
+    caps = budgets.get("docs") or {}
+    if caps and over_budget(docs, caps):
+        skip_deep = True
+        docs = predict_docs(telemetry, True, skims)
+        degradations.append("docs: 跳过精读总结（精读区只生成页面与速览）")
+
+    predicted = {"rerank": rerank, "refine": refine, "docs": docs}
+    for stage in STAGES:
+        still = over_budget(predicted[stage], budgets.get(stage) or {})
+        if still:
+            log(f"[WARN] 规划：{stage} 降级后预计仍超出预算（{', '.join(still)}），继续运行。")
+
+    plan = {
+        "planned_at": datetime.now(timezone.utc).isoformat(),
+        "input": input_path,
+        "queries": len(id_lists),
+        "refine_profile": refine_profile,
+        "telemetry_runs": {k: v.get("runs", 0) for k, v in (telemetry.get("rates") or {}).items()},
+        "budgets": budgets,
+        "initial": initial,
+        "predicted": predicted,
+        "degradations": degradations,
+        "actions": {"rerank_max_k": rerank_k, "refine_max_candidates": refine_cap, "docs_skip_deep_summary": skip_deep},
+    }
+    for stage in STAGES:
+        p = predicted[stage]
+        log(
+            f"[INFO] 规划 {stage}：requests≈{p['requests']}，prompt≈{p['prompt_tokens']}，"
+            f"completion≈{p['completion_tokens']}，耗时≈{p['seconds']:.0f}s"
+        )
+    for item in degradations:
+        log(f"[INFO] 按预算降级 {item}")
+    with storage.file_lock(LOCK_FILE):
+        report = _load_plain(run_report_path(date_str))
+        report["plan"] = plan
+        report.pop("actual", None)
+        storage.save_json(report, run_report_path(date_str), codec="none")
+    return plan
+
+
+def record_stage(
+    stage: str,
+    actual: Dict[str, Any],
+    rates: List[Tuple[str, Dict[str, float], float]],
+    date_str: str | None = None,
+) -> None:
+    """
+    步骤结束时调用：actual 写入运行报告的 actual[stage]；
+    rates 为 [(遥测 key, {metric: 本次总量}, 单位数)]，按单位数折算后更新滑动平均。
+    记录失败只告警，不影响步骤本身。
+    """
+    hedge = hedge_stats()
+    if hedge:
+        log_hedge_stats()
+        actual = {**actual, "hedge": hedge}
+    coalesced = coalesce_stats()
+    if coalesced:
+        log_coalesce_stats()
+        actual = {**actual, "coalesced": coalesced}
+    try:
+        with storage.file_lock(LOCK_FILE):
+            telemetry = load_telemetry()
+            for key, values, units in rates:
+                _update_rates(telemetry, key, values, units)
+            telemetry["updated_at"] = datetime.now(timezone.utc).isoformat()
+            storage.save_json(telemetry, TELEMETRY_FILE, codec="none")
+
+            path = run_report_path(date_str)
+            report = _load_plain(path)
+            report.setdefault("actual", {})[stage] = {
+                **actual,
+                "recorded_at": datetime.now(timezone.utc).isoformat(),
+            }
+            storage.save_json(report, path, codec="none")
+    except Exception as exc:
+        log(f"[WARN] 记录 {stage} 运行数据失败：{exc}")
+
+
+def summarize_report(date_str: str | None = None) -> None:
+    """main.py 结束时调用：逐阶段对比预测与实际，并检查预算。"""
+    report = _load_plain(run_report_path(date_str))
+    plan = report.get("plan") or {}
+    predicted = plan.get("predicted") or {}
+    actual = report.get("actual") or {}
+    budgets = plan.get("budgets") or {}
+    for stage in STAGES:
+        p, a = predicted.get(stage), actual.get(stage)
+        if not p or not a:
+            continue
+        log(
+            f"[INFO] 运行报告 {stage}：requests {p['requests']} → {a.get('requests', 0)}，"
+            f"tokens {p['prompt_tokens'] + p['completion_tokens']} → "
+            f"{a.get('prompt_tokens', 0) + a.get('completion_tokens', 0)}，"
+            f"耗时 {p['seconds']:.0f}s → {a.get('seconds', 0):.0f}s"
+        )
+        exceeded = over_budget(
+            _cost(a.get("requests", 0), a.get("prompt_tokens", 0), a.get("completion_tokens", 0), a.get("seconds", 0.0)),
+            budgets.get(stage) or {},
+        )
+        for name, h in (a.get("hedge") or {}).items():
+            log(
+                f"[INFO] 运行报告 {stage} 请求对冲 {name}：对冲 {h['hedged']}/{h['calls']}，"
+                f"胜率 {h['win_rate']:.0%}，省下约 {h['saved_seconds']:.0f}s"
+            )
+        if exceeded:
+            log(f"[WARN] {stage} 实际开销超出预算：{', '.join(exceeded)}")
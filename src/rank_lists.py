@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# 检索产物里"查询键"与"名次列表"的统一定义。
+# 2.3（RRF 融合）、score_table（列式打分表）、步骤 3 与 planner 都从这里导入，
+# 保证 JSON 路径与打分表路径对同一查询、同一 sim_scores 得到完全相同的键与顺序。
+
+from typing import Any, Dict, List, Tuple
+
+
+def make_query_key(q: Dict[str, Any]) -> Tuple[str, str]:
+    """
+    生成用于对齐 BM25 / Embedding 查询的稳定键 (type, key_text)。
+    优先使用 paper_tag（同一意图在 2.1/2.2 里一致），再退回 tag / query_text。
+    """
+    q_type = str(q.get("type") or "")
+    key_text = (
+        str(q.get("paper_tag") or "")
+        or str(q.get("tag") or "")
+        or str(q.get("query_text") or "")
+    )
+    return (q_type, key_text)
+
+
+def query_key(q: Dict[str, Any]) -> str:
+    """make_query_key 的字符串形式 "type::key_text"，用作打分表的 query_key 列。"""
+    q_type, key_text = make_query_key(q)
+    return f"{q_type}::{key_text}"
+
+
+def ordered_scores(sim_scores: Any) -> List[Tuple[str, float | None]]:
+    """
+    sim_scores -> [(paper_id, score)]，按名次排好序。
+    全部带 rank 时按 rank，否则按 score 降序（无分数的排在最后）。
+    """
+    if not isinstance(sim_scores, dict) or not sim_scores:
+        return []
+    items: List[Tuple[str, float | None, int | None]] = []
+    for pid, meta in sim_scores.items():
+        score = meta.get("score") if isinstance(meta, dict) else None
+        rank = meta.get("rank") if isinstance(meta, dict) else None
+        items.append((str(pid), float(score) if score is not None else None, int(rank) if rank is not None else None))
+    if all(r is not None for _, _, r in items):
+        items.sort(key=lambda x: x[2])
+    else:
+        items.sort(key=lambda x: (x[1] is None, -(x[1] or 0.0)))
+    return [(pid, score) for pid, score, _ in items]
+
+
+def normalize_rank_list(sim_scores: Any) -> List[Tuple[str, int]]:
+    """从 sim_scores 中提取 (paper_id, rank) 列表，rank 按 ordered_scores 的顺序从 1 重新编号。"""
+    return [(pid, idx) for idx, (pid, _score) in enumerate(ordered_scores(sim_scores), start=1)]
@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+# 步骤 3 的可插拔重排后端：
+# 1. api：BLT Rerank 接口（BltClient.rerank，需要 BLT_API_KEY）；
+# 2. local：在本进程 CPU 上运行小型 cross-encoder（sentence-transformers CrossEncoder），
+#    可选 torch 动态 int8 量化或 ONNX Runtime（需安装 optimum[onnxruntime]），不需要网络与密钥；
+# 两者的 rerank() 返回同样的 {"results": [{"index", "relevance_score"}]}，步骤 3 的 process_file 无需区分。
+# local 后端按文档长度分桶组批（长度相近的文档放在同一批，减少 padding），
+# `python src/reranker.py bench` 在步骤 2.3 的产物上对比各后端的吞吐与延迟（以及与 API 排序的一致性）。
+
+import argparse
+import json
+import os
+import statistics
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence
+
+DEFAULT_LOCAL_RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L6-v2"
+DEFAULT_LOCAL_BATCH_SIZE = 32
+DEFAULT_LOCAL_MAX_LENGTH = 512
+RERANK_BACKENDS = ("api", "local")
+LOCAL_RUNTIMES = ("torch", "onnx")
+# Hugging Face 上 cross-encoder 仓库导出的 int8 ONNX 文件名（optimum 动态量化，AVX512-VNNI）
+ONNX_INT8_FILE = "onnx/model_qint8_avx512_vnni.onnx"
+# 送入重排的文档截断长度（步骤 3 与 bench 共用 build_documents）
+MAX_CHARS_PER_DOC = 850
+
+
+def log(message: str) -> None:
+    ts = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    print(f"[{ts}] {message}", flush=True)
+
+
+def format_doc(title: str, abstract: str) -> str:
+    content = f"Title: {title}\nAbstract: {abstract}".strip()
+    if len(content) > MAX_CHARS_PER_DOC:
+        content = content[:MAX_CHARS_PER_DOC]
+    return content
+
+
+def build_documents(papers_by_id: Dict[str, Dict[str, Any]], paper_ids: List[str]) -> List[str]:
+    """按 paper_ids 顺序构造重排文档（标题 + 摘要，截断到 MAX_CHARS_PER_DOC）；步骤 3 与 bench 共用。"""
+    docs: List[str] = []
+    for pid in paper_ids:
+        p = papers_by_id.get(pid)
+        if not p:
+            docs.append(f"[Missing paper {pid}]")
+            continue
+        title = (p.get("title") or "").strip()
+        abstract = (p.get("abstract") or "").strip()
+        if title or abstract:
+            docs.append(format_doc(title, abstract))
+        else:
+            docs.append(f"[Empty paper {pid}]")
+    return docs
+
+
+def length_buckets(documents: Sequence[str], batch_size: int) -> List[List[int]]:
+    """按文档长度升序切成若干批，返回每批的原始下标；同一批内长度相近，padding 最少。"""
+    order = sorted(range(len(documents)), key=lambda i: len(documents[i]))
+    size = max(1, int(batch_size))
+    return [order[s : s + size] for s in range(0, len(order), size)]
+
+
+def results_from_scores(scores: Sequence[float], top_n: Optional[int] = None) -> Dict[str, Any]:
+    """[score_i] -> 与 BLT Rerank 相同的 {"results": [{"index", "relevance_score"}]}（按分数降序）。"""
+    ranked = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)
+    if top_n is not None:
+        ranked = ranked[: int(top_n)]
+    return {"results": [{"index": i, "relevance_score": float(scores[i])} for i in ranked]}
+
+
+class LocalCrossEncoderReranker:
+    """本进程 CPU cross-encoder；接口与 BltClient.rerank 相同（model 参数被忽略，使用构造时的模型）。"""
+
+    def __init__(
+        self,
+        model_name: str = DEFAULT_LOCAL_RERANK_MODEL,
+        device: str = "cpu",
+        batch_size: int = DEFAULT_LOCAL_BATCH_SIZE,
+        max_length: int = DEFAULT_LOCAL_MAX_LENGTH,
+        runtime: str = "torch",
+        int8: bool = False,
+    ):
+        if runtime not in LOCAL_RUNTIMES:
+            raise ValueError(f"未知的本地重排运行时：{runtime}")
+        # 延迟导入：只有使用本地后端时才需要 torch / sentence-transformers
+        from sentence_transformers import CrossEncoder
+
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.runtime = runtime
+        self.int8 = int8
+        log(f"[INFO] 正在加载本地重排模型：{model_name}（runtime={runtime}，int8={int8}，device={device}）")
+        if runtime == "onnx":
+            model_kwargs = {"file_name": ONNX_INT8_FILE} if int8 else None
+            self.model = CrossEncoder(model_name, device=device, max_length=max_length, backend="onnx", model_kwargs=model_kwargs)
+        else:
+            self.model = CrossEncoder(model_name, device=device, max_length=max_length)
+            if int8:
+                import torch
+
+                # 只量化 Linear 层的权重（动态量化），激活仍为 float32，CPU 上通常快 1.5~2 倍
+                self.model.model = torch.quantization.quantize_dynamic(
+                    self.model.model, {torch.nn.Linear}, dtype=torch.qint8
+                )
+        self.model_label = f"{model_name}[{runtime}{'-int8' if int8 else ''}]"
+
+    def score(self, query: str, documents: Sequence[str]) -> List[float]:
+        scores = [0.0] * len(documents)
+        for bucket in length_buckets(documents, self.batch_size):
+            pairs = [(query, documents[i]) for i in bucket]
+            batch_scores = self.model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+            for i, s in zip(bucket, batch_scores):
+                scores[i] = float(s)
+        return scores
+
+    def rerank(
+        self,
+        query: str,
+        documents: List[str],
+        top_n: Optional[int] = None,
+        model: Optional[str] = None,
+    ) -> dict:
+        if not query:
+            raise ValueError("rerank: query 不能为空")
+        if not documents:
+            raise ValueError("rerank: documents 不能为空")
+        return results_from_scores(self.score(query, documents), top_n)
+
+
+def build_reranker(
+    backend: str,
+    api_model: str,
+    local_model: str = DEFAULT_LOCAL_RERANK_MODEL,
+    local_batch_size: int = DEFAULT_LOCAL_BATCH_SIZE,
+    local_runtime: str = "torch",
+    local_int8: bool = False,
+    device: str = "cpu",
+):
+    """按后端名构造重排器；api 后端缺少 BLT_API_KEY 时抛出 RuntimeError。"""
+    if backend == "local":
+        return LocalCrossEncoderReranker(
+            model_name=local_model,
+            device=device,
+            batch_size=local_batch_size,
+            runtime=local_runtime,
+            int8=local_int8,
+        )
+    if backend != "api":
+        raise ValueError(f"未知的重排后端：{backend}")
+    from llm import BltClient
+
+    api_key = os.getenv("BLT_API_KEY")
+    if not api_key:
+        raise RuntimeError("缺少 BLT_API_KEY 环境变量，无法调用 BLT Rerank API（可改用 --rerank-backend local）。")
+    return BltClient(api_key=api_key, model=api_model)
+
+
+def add_reranker_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--rerank-backend",
+        choices=list(RERANK_BACKENDS),
+        default="api",
+        help="重排后端：api（BLT Rerank，默认）或 local（本进程 CPU cross-encoder，无需网络与密钥）。",
+    )
+    parser.add_argument(
+        "--local-rerank-model",
+        type=str,
+        default=os.getenv("LOCAL_RERANK_MODEL") or DEFAULT_LOCAL_RERANK_MODEL,
+        help=f"local 后端的 cross-encoder 模型（默认 {DEFAULT_LOCAL_RERANK_MODEL}）。",
+    )
+    parser.add_argument(
+        "--local-rerank-batch-size",
+        type=int,
+        default=DEFAULT_LOCAL_BATCH_SIZE,
+        help=f"local 后端按长度分桶后的每批文档数（默认 {DEFAULT_LOCAL_BATCH_SIZE}）。",
+    )
+    parser.add_argument(
+        "--local-rerank-runtime",
+        choices=list(LOCAL_RUNTIMES),
+        default="torch",
+        help="local 后端的推理运行时：torch（默认）或 onnx（需要 optimum[onnxruntime]）。",
+    )
+    parser.add_argument(
+        "--local-rerank-int8",
+        action="store_true",
+        help=f"local 后端使用 int8：torch 下为动态量化，onnx 下加载 {ONNX_INT8_FILE}。",
+    )
+
+
+def reranker_from_args(args: argparse.Namespace, api_model: str):
+    return build_reranker(
+        args.rerank_backend,
+        api_model,
+        local_model=args.local_rerank_model,
+        local_batch_size=args.local_rerank_batch_size,
+        local_runtime=args.local_rerank_runtime,
+        local_int8=args.local_rerank_int8,
+    )
+
+
+def _ranking(response: Dict[str, Any]) -> List[int]:
+    if isinstance(response, dict) and "output" in response:
+        results = response.get("output", {}).get("results", [])
+    else:
+        results = response.get("results", [])
+    ranked = sorted(results or [], key=lambda x: x.get("relevance_score", x.get("score", 0.0)), reverse=True)
+    return [int(item.get("index", -1)) for item in ranked]
+
+
+def overlap_at_k(a: Sequence[int], b: Sequence[int], k: int) -> float:
+    if k <= 0:
+        return 0.0
+    return len(set(a[:k]) & set(b[:k])) / float(min(k, len(a), len(b)) or 1)
+
+
+def benchmark(
+    rerankers: Dict[str, Any],
+    workload: List[Dict[str, Any]],
+    batch_docs: int = 100,
+    api_model: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """
+    workload：[{query, documents}]；每个查询按 batch_docs 切成与步骤 3 相同大小的请求。
+    返回每个后端的 docs/s、单次请求延迟（p50/p95），以及相对第一个后端的 overlap@10。
+    """
+    rows: List[Dict[str, Any]] = []
+    reference: Dict[int, List[int]] = {}
+    for name, reranker in rerankers.items():
+        latencies: List[float] = []
+        overlaps: List[float] = []
+        total_docs = 0
+        start = time.time()
+        call_idx = 0
+        for item in workload:
+            docs = item["documents"]
+            for s in range(0, len(docs), batch_docs):
+                chunk = docs[s : s + batch_docs]
+                t0 = time.time()
+                response = reranker.rerank(query=item["query"], documents=chunk, top_n=len(chunk), model=api_model)
+                latencies.append(time.time() - t0)
+                total_docs += len(chunk)
+                order = _ranking(response)
+                if not reference or call_idx not in reference:
+                    reference[call_idx] = order
+                else:
+                    overlaps.append(overlap_at_k(order, reference[call_idx], 10))
+                call_idx += 1
+        elapsed = time.time() - start
+        lat_sorted = sorted(latencies)
+        row = {
+            "backend": name,
+            "requests": len(latencies),
+            "docs": total_docs,
+            "docs_per_s": round(total_docs / elapsed, 2) if elapsed > 0 else 0.0,
+            "latency_p50_ms": round(statistics.median(lat_sorted) * 1000, 1) if lat_sorted else None,
+            "latency_p95_ms": round(lat_sorted[int(0.95 * (len(lat_sorted) - 1))] * 1000, 1) if lat_sorted else None,
+            "overlap_at_10_vs_first": round(statistics.mean(overlaps), 3) if overlaps else None,
+        }
+        log(
+            f"[INFO] {name}: {row['docs_per_s']} docs/s，p50={row['latency_p50_ms']}ms "
+            f"p95={row['latency_p95_ms']}ms，overlap@10={row['overlap_at_10_vs_first']}"
+        )
+        rows.append(row)
+    return rows
+
+
+def _load_workload(path: str, max_queries: int, max_docs: int) -> List[Dict[str, Any]]:
+    """从步骤 2.3 的产物构造与步骤 3 相同的 (query, documents)。"""
+    from storage import hydrate_papers, load_json, open_paper_store
+
+    data = load_json(path)
+    papers_by_id = {str(p.get("id")): dict(p) for p in data.get("papers") or [] if p.get("id")}
+    queries = [q for q in data.get("queries") or [] if (q.get("rewrite") or q.get("query_text"))]
+    queries = queries[:max_queries] if max_queries > 0 else queries
+
+    def top_ids(q: Dict[str, Any]) -> List[str]:
+        sim_scores = q.get("sim_scores") or {}
+        ids = q.get("top_ids") or sorted(sim_scores, key=lambda pid: sim_scores[pid].get("rank", 1e9))
+        return list(ids)[:max_docs]
+
+    if data.get("paper_store"):
+        store = open_paper_store(data, path)
+        hydrate_papers(list(papers_by_id.values()), store, {pid for q in queries for pid in top_ids(q)})
+    workload = []
+    for q in queries:
+        ids = top_ids(q)
+        if ids:
+            workload.append(
+                {
+                    "query": (q.get("rewrite") or q.get("query_text") or "").strip(),
+                    "documents": build_documents(papers_by_id, ids),
+                }
+            )
+    return workload
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="重排后端工具：对比本地 cross-encoder 与 BLT Rerank API 的吞吐与延迟。")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_bench = sub.add_parser("bench", help="在步骤 2.3 的产物上对各后端计时。")
+    p_bench.add_argument("--input", required=True, help="步骤 2.3 输出的 JSON（archive/YYYYMMDD/filtered/arxiv_papers_YYYYMMDD.json）。")
+    p_bench.add_argument("--backends", default="local", help="逗号分隔：local / local-int8 / local-onnx / local-onnx-int8 / api（默认 local）。")
+    p_bench.add_argument("--queries", type=int, default=5, help="最多使用多少个查询（默认 5，0 为全部）。")
+    p_bench.add_argument("--max-docs", type=int, default=200, help="每个查询最多使用多少篇候选（默认 200）。")
+    p_bench.add_argument("--local-rerank-model", default=DEFAULT_LOCAL_RERANK_MODEL)
+    p_bench.add_argument("--local-rerank-batch-size", type=int, default=DEFAULT_LOCAL_BATCH_SIZE)
+    p_bench.add_argument(
+        "--rerank-model",
+        default=os.getenv("BLT_RERANK_MODEL") or os.getenv("RERANK_MODEL") or "qwen3-reranker-4b",
+        help="api 后端的模型名。",
+    )
+    p_bench.add_argument("--report", default=None, help="可选：把结果写入该 JSON 文件。")
+
+    args = parser.parse_args()
+    if args.command == "bench":
+        workload = _load_workload(args.input, args.queries, args.max_docs)
+        if not workload:
+            log("[ERROR] 输入文件中没有可用的查询与候选。")
+            return
+        log(f"[INFO] 基准负载：{len(workload)} 个查询，共 {sum(len(w['documents']) for w in workload)} 篇文档")
+        rerankers: Dict[str, Any] = {}
+        for name in [b.strip() for b in args.backends.split(",") if b.strip()]:
+            if name == "api":
+                rerankers[name] = build_reranker("api", args.rerank_model)
+                continue
+            if not name.startswith("local"):
+                raise ValueError(f"未知的后端：{name}")
+            rerankers[name] = LocalCrossEncoderReranker(
+                model_name=args.local_rerank_model,
+                batch_size=args.local_rerank_batch_size,
+                runtime="onnx" if "onnx" in name else "torch",
+                int8=name.endswith("int8"),
+            )
+        rows = benchmark(rerankers, workload, api_model=args.rerank_model)
+        if args.report:
+            with open(args.report, "w", encoding="utf-8") as f:
+                json.dump({"input": args.input, "results": rows}, f, ensure_ascii=False, indent=2)
+            log(f"[INFO] 已写入基准结果：{args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# 查询 × 论文打分表的列式存储（Arrow IPC）。
+# 1. 2.1 / 2.2 / 2.3 在写 JSON 产物的同时写一份 <name>.scores.arrow 旁路文件，
+#    列为 query_key / paper_id / retriever / score / rank，按查询分段、段内按 rank 升序；
+# 2. 读取方（2.3 融合、步骤 3 选 rerank 候选）通过内存映射零拷贝打开，只取需要的列，
+#    不再对嵌套的 sim_scores 字典重新排序；
+# 3. pyarrow 为可选依赖：未安装或 DPR_SCORE_TABLES=0 时既不写也不读旁路文件，一律回退到 JSON；
+# 4. 旁路文件的 schema metadata 记录对应 JSON 的 generated_at，不一致时视为过期并忽略。
+
+import argparse
+import os
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Tuple
+
+import numpy as np
+
+from rank_lists import ordered_scores, query_key
+
+try:
+    import pyarrow as pa  # type: ignore
+    import pyarrow.ipc as pa_ipc  # type: ignore
+except Exception:  # pragma: no cover - 可选依赖
+    pa = None
+    pa_ipc = None
+
+SCORE_TABLE_SUFFIX = ".scores.arrow"
+FORMAT_VERSION = "1"
+
+
+def log(message: str) -> None:
+    ts = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    print(f"[{ts}] {message}", flush=True)
+
+
+def enabled() -> bool:
+    """DPR_SCORE_TABLES=0 关闭；默认在安装了 pyarrow 时启用。"""
+    flag = (os.getenv("DPR_SCORE_TABLES") or "").strip().lower()
+    if flag in ("0", "off", "false", "no"):
+        return False
+    return pa is not None
+
+
+def score_table_path(json_path: str) -> str:
+    """x.bm25.json -> x.bm25.scores.arrow（与 JSON 产物放在同一目录）。"""
+    base = json_path[:-5] if json_path.lower().endswith(".json") else json_path
+    return base + SCORE_TABLE_SUFFIX
+
+
+def write_score_table(
+    queries: Iterable[Dict[str, Any]],
+    json_path: str,
+    retriever: str,
+    generated_at: str,
+) -> str | None:
+    """把 queries[*].sim_scores 写成 Arrow IPC 文件，返回路径；未启用时返回 None。"""
+    if not enabled():
+        return None
+
+    keys: List[str] = []
+    paper_ids: List[str] = []
+    scores: List[float | None] = []
+    ranks: List[int] = []
+    for q in queries:
+        key = query_key(q)
+        for rank, (pid, score) in enumerate(ordered_scores(q.get("sim_scores")), start=1):
+            keys.append(key)
+            paper_ids.append(pid)
+            scores.append(score)
+            ranks.append(rank)
+
+    dict_type = pa.dictionary(pa.int32(), pa.string())
+    schema = pa.schema(
+        [
+            pa.field("query_key", dict_type),
+            pa.field("paper_id", pa.string()),
+            pa.field("retriever", dict_type),
+            pa.field("score", pa.float64()),
+            pa.field("rank", pa.int32()),
+        ],
+        metadata={
+            "format_version": FORMAT_VERSION,
+            "generated_at": generated_at or "",
+            "retriever": retriever,
+        },
+    )
+    table = pa.table(
+        [
+            pa.array(keys, pa.string()).dictionary_encode(),
+            pa.array(paper_ids, pa.string()),
+            pa.array([retriever] * len(keys), pa.string()).dictionary_encode(),
+            pa.array(scores, pa.float64()),
+            pa.array(ranks, pa.int32()),
+        ],
+        schema=schema,
+    )
+
+    path = score_table_path(json_path)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    # 不压缩：IPC 文件可以直接内存映射，读取时零拷贝
+    with pa.OSFile(tmp_path, "wb") as sink:
+        with pa_ipc.new_file(sink, schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+    return path
+
+
+def open_score_table(json_path: str, expected_generated_at: str | None = None):
+    """
+    内存映射打开 JSON 产物对应的打分表；不存在、未安装 pyarrow 或已过期时返回 None。
+    expected_generated_at 传入 JSON 里的 generated_at，用于识别手动改过 JSON 后遗留的旧表。
+    """
+    if not enabled():
+        return None
+    path = score_table_path(json_path)
+    if not os.path.exists(path):
+        return None
+    try:
+        table = pa_ipc.open_file(pa.memory_map(path, "r")).read_all()
+    except Exception as e:
+        log(f"[WARN] 打分表读取失败，将回退到 JSON：{path}（{e}）")
+        return None
+    meta = {k.decode(): v.decode() for k, v in (table.schema.metadata or {}).items()}
+    if expected_generated_at is not None and meta.get("generated_at", "") != (expected_generated_at or ""):
+        log(f"[WARN] 打分表与 JSON 的 generated_at 不一致，视为过期：{path}")
+        return None
+    return table
+
+
+def read_rank_lists(
+    json_path: str,
+    expected_generated_at: str | None = None,
+) -> Dict[str, List[Tuple[str, int]]] | None:
+    """
+    读取 {query_key: [(paper_id, rank), ...]}，段内已按 rank 升序，调用方无需再排序。
+    只访问 query_key / paper_id / rank 三列；表不可用时返回 None。
+    """
+    table = open_score_table(json_path, expected_generated_at)
+    if table is None:
+        return None
+    # 整列操作：query_key 取字典下标、rank 取 numpy 视图定位各查询段，
+    # 只对最终保留的段把 paper_id / rank 转成 Python 对象
+    cols = table.select(["query_key", "paper_id", "rank"]).unify_dictionaries().combine_chunks()
+    if cols.num_rows == 0:
+        return {}
+    key_col = cols.column(0).chunk(0)
+    dictionary = key_col.dictionary.to_pylist()
+    key_indices = key_col.indices.to_numpy(zero_copy_only=False)
+    ranks = cols.column(2).chunk(0).to_numpy(zero_copy_only=False)
+    pid_col = cols.column(1).chunk(0)
+
+    # 每个查询段从 rank=1 开始；段内 key 不变，key 变化处也视为新段
+    starts = np.flatnonzero((ranks == 1) | np.r_[True, key_indices[1:] != key_indices[:-1]])
+    ends = np.r_[starts[1:], len(ranks)]
+    # 同一 key 出现多段时与 JSON 侧 {key: q} 一样保留最后一段
+    last_segment: Dict[int, Tuple[int, int]] = {}
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        last_segment[int(key_indices[start])] = (start, end)
+
+    result: Dict[str, List[Tuple[str, int]]] = {}
+    for key_idx, (start, end) in last_segment.items():
+        pids = pid_col.slice(start, end - start).to_pylist()
+        result[dictionary[key_idx]] = list(zip(pids, ranks[start:end].tolist()))
+    return result
+
+
+def export_parquet(json_path: str, output_path: str) -> str:
+    """把打分表导出为 Parquet，便于离线分析（需要 pyarrow.parquet）。"""
+    import pyarrow.parquet as pq  # type: ignore
+
+    table = open_score_table(json_path)
+    if table is None:
+        raise FileNotFoundError(f"找不到打分表：{score_table_path(json_path)}")
+    pq.write_table(table, output_path)
+    return output_path
+
+
+def summarize(json_path: str) -> None:
+    table = open_score_table(json_path)
+    if table is None:
+        log(f"[WARN] 找不到可用的打分表：{score_table_path(json_path)}")
+        return
+    meta = {k.decode(): v.decode() for k, v in (table.schema.metadata or {}).items()}
+    counts = table.group_by("query_key").aggregate([("rank", "max"), ("score", "max")]).to_pylist()
+    log(
+        f"[INFO] {score_table_path(json_path)} rows={table.num_rows} queries={len(counts)} "
+        f"retriever={meta.get('retriever')} generated_at={meta.get('generated_at')}"
+    )
+    for row in counts:
+        log(f"[INFO]   {row['query_key']} | n={row['rank_max']} | max_score={row['score_max']}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="查询 × 论文打分表（Arrow IPC）工具。")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_show = sub.add_parser("summary", help="打印每个查询的候选数与最高分。")
+    p_show.add_argument("json_path", help="对应的 JSON 产物路径（如 archive/YYYYMMDD/filtered/arxiv_papers_YYYYMMDD.json）。")
+
+    p_parquet = sub.add_parser("parquet", help="导出为 Parquet。")
+    p_parquet.add_argument("json_path", help="对应的 JSON 产物路径。")
+    p_parquet.add_argument("output", help="Parquet 输出路径。")
+
+    args = parser.parse_args()
+    if pa is None:
+        log("[ERROR] 未安装 pyarrow，无法读取打分表。")
+        return
+    if args.command == "summary":
+        summarize(args.json_path)
+    elif args.command == "parquet":
+        log(f"[INFO] 已导出：{export_parquet(args.json_path, args.output)}")
+
+
+if __name__ == "__main__":
+    main()
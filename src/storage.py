@@ -0,0 +1,390 @@
+#!/usr/bin/env python
+# 归档存储层：统一各步骤的 load_json / save_json。
+# 1. archive/YYYYMMDD/{raw,filtered,rank,recommend} 下的产物默认以 zstd 压缩写入（<name>.json.zst）；
+# 2. 读取时按逻辑路径（<name>.json）自动定位 .json / .json.zst / .json.gz，调用方无需关心编码；
+# 3. 未安装 zstandard 时退回标准库 gzip；DPR_ARCHIVE_COMPRESSION=none 可恢复为明文缩进 JSON；
+# 4. 提供一次性迁移命令，把历史日期目录中的明文 JSON 转为压缩格式；
+# 5. PaperStore：按日的论文元数据库（JSONL + 偏移索引），中间产物只引用 arXiv ID。
+
+import argparse
+import gzip
+import json
+import os
+import re
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List
+
+try:
+    import zstandard  # type: ignore
+except Exception:  # pragma: no cover - 可选依赖
+    zstandard = None
+
+try:
+    import fcntl  # type: ignore
+except Exception:  # pragma: no cover - Windows 下没有 fcntl，退化为不加锁
+    fcntl = None
+
+SCRIPT_DIR = os.path.dirname(__file__)
+ROOT_DIR = os.path.abspath(os.path.join(SCRIPT_DIR, ".."))
+ARCHIVE_ROOT = os.path.join(ROOT_DIR, "archive")
+ARCHIVE_STAGE_DIRS = ("raw", "filtered", "rank", "recommend")
+PAPER_STORE_DIRNAME = "papers"
+PAPER_STORE_DATA = "papers.jsonl"
+PAPER_STORE_INDEX = "papers.index.json"
+PAPER_STORE_LOCK = ".lock"
+
+CODEC_SUFFIXES = {
+    "zstd": ".zst",
+    "gzip": ".gz",
+    "none": "",
+}
+ZSTD_LEVEL = 10
+
+
+def log(message: str) -> None:
+    ts = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    print(f"[{ts}] {message}", flush=True)
+
+
+def default_codec() -> str:
+    """DPR_ARCHIVE_COMPRESSION=zstd|gzip|none；未设置时优先 zstd，缺少依赖则用 gzip。"""
+    codec = (os.getenv("DPR_ARCHIVE_COMPRESSION") or "").strip().lower()
+    if codec in ("", "auto"):
+        return "zstd" if zstandard is not None else "gzip"
+    if codec in ("off", "false", "0", "plain", "json"):
+        return "none"
+    if codec == "zstd" and zstandard is None:
+        log("[WARN] 未安装 zstandard，归档压缩退回 gzip。")
+        return "gzip"
+    if codec not in CODEC_SUFFIXES:
+        log(f"[WARN] 未知的 DPR_ARCHIVE_COMPRESSION={codec}，将使用 gzip。")
+        return "gzip"
+    return codec
+
+
+def candidate_paths(path: str) -> List[str]:
+    """逻辑路径对应的所有物理路径（明文 + 各压缩后缀）。"""
+    return [path + suffix for suffix in CODEC_SUFFIXES.values()]
+
+
+def resolve_json_path(path: str) -> str | None:
+    """返回逻辑路径当前对应的物理文件；若同时存在多种编码，取最近写入的那一个。"""
+    existing = [p for p in candidate_paths(path) if os.path.exists(p)]
+    if not existing:
+        return None
+    if len(existing) == 1:
+        return existing[0]
+    return max(existing, key=os.path.getmtime)
+
+
+def json_exists(path: str) -> bool:
+    return resolve_json_path(path) is not None
+
+
+def logical_json_name(name: str) -> str | None:
+    """把目录中的文件名还原为逻辑名（foo.json.zst -> foo.json），非 JSON 产物返回 None。"""
+    for suffix in CODEC_SUFFIXES.values():
+        if suffix and name.endswith(suffix):
+            name = name[: -len(suffix)]
+            break
+    if name.lower().endswith(".json"):
+        return name
+    return None
+
+
+def list_json_files(directory: str) -> List[str]:
+    """列出目录下的逻辑 JSON 文件名（去重、排序），兼容压缩与明文两种形态。"""
+    if not os.path.isdir(directory):
+        return []
+    names = set()
+    for name in os.listdir(directory):
+        logical = logical_json_name(name)
+        if logical:
+            names.add(logical)
+    return sorted(names)
+
+
+def _decode(raw: bytes, physical_path: str) -> Any:
+    if physical_path.endswith(CODEC_SUFFIXES["zstd"]):
+        if zstandard is None:
+            raise RuntimeError(f"读取 {physical_path} 需要安装 zstandard")
+        with zstandard.ZstdDecompressor().stream_reader(raw) as reader:
+            raw = reader.read()
+    elif physical_path.endswith(CODEC_SUFFIXES["gzip"]):
+        raw = gzip.decompress(raw)
+    return json.loads(raw)
+
+
+def load_json(path: str) -> Any:
+    physical = resolve_json_path(path)
+    if physical is None:
+        raise FileNotFoundError(f"找不到文件：{path}")
+    with open(physical, "rb") as f:
+        return _decode(f.read(), physical)
+
+
+def save_json(data: Any, path: str, codec: str | None = None) -> str:
+    """
+    按逻辑路径写入 JSON，返回实际写入的物理路径。
+    - codec=None 时使用 default_codec()；状态文件等需要保持明文时传 codec="none"；
+    - 压缩写入使用紧凑分隔符，明文写入保持原来的 indent=2；
+    - 写入后删除同一逻辑路径下其它编码的旧文件，避免读取到过期版本。
+    """
+    codec = codec or default_codec()
+    if codec == "zstd" and zstandard is None:
+        codec = "gzip"
+    physical = path + CODEC_SUFFIXES[codec]
+    os.makedirs(os.path.dirname(physical) or ".", exist_ok=True)
+
+    if codec == "none":
+        with open(physical, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+    else:
+        raw = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        if codec == "zstd":
+            raw = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(raw)
+        else:
+            raw = gzip.compress(raw, compresslevel=6, mtime=0)
+        tmp_path = physical + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(raw)
+        os.replace(tmp_path, physical)
+
+    for other in candidate_paths(path):
+        if other != physical and os.path.exists(other):
+            os.remove(other)
+    return physical
+
+
+@contextmanager
+def file_lock(lock_path: str):
+    """对 lock_path 持有排他 flock（没有 fcntl 的平台上不加锁）。"""
+    os.makedirs(os.path.dirname(lock_path) or ".", exist_ok=True)
+    with open(lock_path, "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+class PaperStore:
+    """
+    按日的论文元数据库：archive/YYYYMMDD/papers/papers.jsonl + papers.index.json。
+    - 每行一篇论文（紧凑 JSON），索引记录 {paper_id: [offset, length]}；
+    - get_many() 只 seek 并解码被请求的行，不再整池解析；
+    - add() 只追加库里还没有的 ID，可重复调用（步骤 1 写入，2.1/2.2 为手动输入补齐）。
+    """
+
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+        self.data_path = os.path.join(store_dir, PAPER_STORE_DATA)
+        self.index_path = os.path.join(store_dir, PAPER_STORE_INDEX)
+        self._index: Dict[str, List[int]] | None = None
+
+    @property
+    def index(self) -> Dict[str, List[int]]:
+        if self._index is None:
+            self._index = {}
+            if os.path.exists(self.index_path) and os.path.exists(self.data_path):
+                try:
+                    with open(self.index_path, "r", encoding="utf-8") as f:
+                        raw = json.load(f) or {}
+                    self._index = {str(k): [int(v[0]), int(v[1])] for k, v in raw.items()}
+                except Exception as e:
+                    log(f"[WARN] 论文库索引损坏，将视为空库：{self.index_path}（{e}）")
+                    self._index = {}
+        return self._index
+
+    def __contains__(self, paper_id: str) -> bool:
+        return str(paper_id) in self.index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def _locked(self):
+        """多进程批处理时同一天的多个原始文件会并发入库，追加期间持有排他文件锁。"""
+        return file_lock(os.path.join(self.store_dir, PAPER_STORE_LOCK))
+
+    def add(self, papers: Iterable[Dict[str, Any]]) -> int:
+        """追加尚未入库的论文，返回新增条数。"""
+        papers = list(papers)
+        with self._locked():
+            # 其它进程可能刚追加过，加锁后重新读取索引
+            self._index = None
+            return self._add_locked(papers)
+
+    def _add_locked(self, papers: List[Dict[str, Any]]) -> int:
+        index = self.index
+        pending: List[Dict[str, Any]] = []
+        pending_ids = set()
+        for p in papers:
+            pid = str(p.get("id") or "").strip()
+            if not pid or pid in index or pid in pending_ids:
+                continue
+            record = {k: v for k, v in p.items() if k != "tags"}
+            record["id"] = pid
+            pending.append(record)
+            pending_ids.add(pid)
+        if not pending:
+            return 0
+
+        with open(self.data_path, "ab") as f:
+            offset = f.tell()
+            for record in pending:
+                line = json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+                f.write(line)
+                index[record["id"]] = [offset, len(line)]
+                offset += len(line)
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f, separators=(",", ":"))
+        os.replace(tmp_path, self.index_path)
+        return len(pending)
+
+    def get_many(self, paper_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """按 ID 读取论文元数据；库中不存在的 ID 会被忽略。按文件偏移排序读取以减少随机 IO。"""
+        index = self.index
+        wanted = sorted(
+            {str(pid) for pid in paper_ids if str(pid) in index},
+            key=lambda pid: index[pid][0],
+        )
+        result: Dict[str, Dict[str, Any]] = {}
+        if not wanted:
+            return result
+        with open(self.data_path, "rb") as f:
+            for pid in wanted:
+                offset, length = index[pid]
+                f.seek(offset)
+                result[pid] = json.loads(f.read(length))
+        return result
+
+    def get(self, paper_id: str) -> Dict[str, Any] | None:
+        return self.get_many([paper_id]).get(str(paper_id))
+
+
+def paper_store_dir_for(artifact_path: str) -> str:
+    """
+    推断某个阶段产物对应的论文库目录：
+    archive/YYYYMMDD/<raw|filtered|rank|recommend>/x.json -> archive/YYYYMMDD/papers；
+    其它自定义位置则使用同目录下的 papers/。
+    """
+    parent = os.path.dirname(os.path.abspath(artifact_path))
+    if os.path.basename(parent) in ARCHIVE_STAGE_DIRS:
+        return os.path.join(os.path.dirname(parent), PAPER_STORE_DIRNAME)
+    return os.path.join(parent, PAPER_STORE_DIRNAME)
+
+
+def paper_store_ref(store: PaperStore, artifact_path: str) -> str:
+    """写入中间产物的 paper_store 字段：相对于产物所在目录的路径。"""
+    base = os.path.dirname(os.path.abspath(artifact_path))
+    return os.path.relpath(store.store_dir, base)
+
+
+def open_paper_store(data: Dict[str, Any], artifact_path: str) -> PaperStore:
+    """按中间产物里记录的 paper_store（相对路径）打开论文库，缺省时按目录约定推断。"""
+    ref = str((data or {}).get("paper_store") or "").strip()
+    if ref:
+        store_dir = ref
+        if not os.path.isabs(store_dir):
+            store_dir = os.path.join(os.path.dirname(os.path.abspath(artifact_path)), ref)
+        return PaperStore(os.path.normpath(store_dir))
+    return PaperStore(paper_store_dir_for(artifact_path))
+
+
+def hydrate_papers(
+    papers: List[Dict[str, Any]],
+    store: PaperStore,
+    paper_ids: Iterable[str] | None = None,
+) -> List[Dict[str, Any]]:
+    """
+    为只含 {id, tags} 引用的论文条目补齐元数据（原地修改并返回同一列表）。
+    - paper_ids 非空时只补齐这些 ID，避免解码用不到的摘要；
+    - 已经带 title 的旧格式条目保持不变。
+    """
+    wanted = None if paper_ids is None else {str(pid) for pid in paper_ids}
+    missing = []
+    for p in papers:
+        pid = str(p.get("id") or "").strip()
+        if not pid or "title" in p:
+            continue
+        if wanted is not None and pid not in wanted:
+            continue
+        missing.append(pid)
+    if not missing:
+        return papers
+    records = store.get_many(missing)
+    if len(records) < len(missing):
+        log(f"[WARN] 论文库 {store.store_dir} 缺少 {len(missing) - len(records)} 篇论文的元数据。")
+    for p in papers:
+        record = records.get(str(p.get("id") or "").strip())
+        if not record:
+            continue
+        for k, v in record.items():
+            if k not in p:
+                p[k] = v
+    return papers
+
+
+def migrate_archive(archive_root: str, codec: str, days: List[str] | None = None) -> None:
+    """把历史日期目录下的阶段产物统一重写为指定编码（幂等，可重复执行）。"""
+    if not os.path.isdir(archive_root):
+        log(f"[WARN] 归档目录不存在：{archive_root}")
+        return
+    day_dirs = sorted(name for name in os.listdir(archive_root) if re.match(r"^\d{8}$", name))
+    if days:
+        wanted = set(days)
+        day_dirs = [d for d in day_dirs if d in wanted]
+
+    before_total = 0
+    after_total = 0
+    converted = 0
+    start = time.time()
+    for day in day_dirs:
+        for stage in ARCHIVE_STAGE_DIRS:
+            stage_dir = os.path.join(archive_root, day, stage)
+            for name in list_json_files(stage_dir):
+                logical = os.path.join(stage_dir, name)
+                physical = resolve_json_path(logical)
+                if physical is None:
+                    continue
+                size_before = os.path.getsize(physical)
+                before_total += size_before
+                if physical == logical + CODEC_SUFFIXES[codec]:
+                    after_total += size_before
+                    continue
+                written = save_json(load_json(logical), logical, codec=codec)
+                after_total += os.path.getsize(written)
+                converted += 1
+    elapsed = time.time() - start
+    log(
+        f"[INFO] 迁移完成：days={len(day_dirs)} converted={converted} codec={codec} "
+        f"size {before_total / 1024 / 1024:.2f}MB -> {after_total / 1024 / 1024:.2f}MB ({elapsed:.1f}s)"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="归档存储工具：把历史 archive 日期目录迁移为压缩 JSON。")
+    sub = parser.add_subparsers(dest="command", required=True)
+    migrate = sub.add_parser("migrate", help="重写 archive/YYYYMMDD/{raw,filtered,rank,recommend} 下的 JSON。")
+    migrate.add_argument("--archive-dir", type=str, default=ARCHIVE_ROOT, help="归档根目录（默认 archive/）。")
+    migrate.add_argument(
+        "--codec",
+        type=str,
+        default=None,
+        choices=sorted(CODEC_SUFFIXES.keys()),
+        help="目标编码（默认取 DPR_ARCHIVE_COMPRESSION，未设置时为 zstd）。",
+    )
+    migrate.add_argument("--days", type=str, default=None, help="只迁移指定日期，逗号分隔（YYYYMMDD）。")
+    args = parser.parse_args()
+
+    days = [d.strip() for d in (args.days or "").split(",") if d.strip()] or None
+    migrate_archive(args.archive_dir, args.codec or default_codec(), days)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# src/ 下的脚本以同级模块名互相导入（与 python src/main.py 的运行方式一致）
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
@@ -0,0 +1,36 @@
+import numpy as np
+
+import ann_index
+
+DIM = 8
+
+
+def _vectors(n, seed):
+    v = np.random.default_rng(seed).standard_normal((n, DIM)).astype(np.float32)
+    return v / np.linalg.norm(v, axis=1, keepdims=True)
+
+
+def _add(index, day, n):
+    vectors = _vectors(n, int(day))
+    ids = [f"{day}-{i}" for i in range(n)]
+    index.add(day, "papers", ids, ids, vectors, "test-model")
+    return ids, vectors
+
+
+def test_centroids_retrained_when_index_outgrows_training_set(tmp_path):
+    index = ann_index.AnnIndex(str(tmp_path / "ann"))
+    _add(index, "20260101", 50)
+    assert index.meta["trained_on"] == 50
+    first_nlist = index.meta["nlist"]
+
+    _add(index, "20260102", 100)
+    assert index.meta["trained_on"] == 50  # 150 条未超过 4 倍，不重建
+
+    ids, vectors = _add(index, "20260103", 100)
+    assert index.meta["trained_on"] == 250
+    assert index.meta["nlist"] > first_nlist
+
+    reopened = ann_index.AnnIndex(str(tmp_path / "ann"))
+    assert reopened.stats()["vectors"] == 250
+    hits = reopened.search(vectors[:1], k=1, nprobe=reopened.meta["nlist"])[0]
+    assert hits[0]["id"] == ids[0]
@@ -0,0 +1,80 @@
+import hashlib
+
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("sentence_transformers")
+
+from embedding_store import QueryEmbeddingCache  # noqa: E402
+from filter import EmbeddingCoarseFilter, LazyModel  # noqa: E402
+
+MODEL_NAME = "test/fake-e5"
+DIM = 16
+
+
+class Paper:
+  def __init__(self, pid: str):
+    self.id = pid
+    self.text_for_embedding = f"passage: paper {pid}"
+
+
+class HashEncoder:
+  """按文本哈希生成确定的单位向量，代替真实模型。"""
+
+  def __init__(self):
+    self.calls = 0
+    self.max_seq_length = 512
+
+  def encode(self, texts, **kwargs):
+    self.calls += 1
+    rows = []
+    for t in texts:
+      seed = int.from_bytes(hashlib.sha256(t.encode("utf-8")).digest()[:4], "little")
+      v = np.random.default_rng(seed).standard_normal(DIM).astype(np.float32)
+      rows.append(v / np.linalg.norm(v))
+    return np.stack(rows)
+
+
+def _must_not_load():
+  raise AssertionError("命中 int8 缓存时不应加载向量模型")
+
+
+def _make_filter(model, query_cache_file, exact=True):
+  filt = EmbeddingCoarseFilter(MODEL_NAME, top_k=5, model=model, embedding_cache="int8", embedding_cache_exact=exact)
+  filt.query_cache = QueryEmbeddingCache(MODEL_NAME, cache_file=str(query_cache_file))
+  return filt
+
+
+def test_int8_cache_hit_never_touches_model(tmp_path):
+  items = [Paper(f"p{i}") for i in range(64)]
+  queries = [{"query_text": "graph neural networks"}, {"query_text": "diffusion models"}]
+  cache_base = str(tmp_path / "embeddings" / "papers")
+  query_cache_file = tmp_path / "query_embeddings.npz"
+
+  encoder = HashEncoder()
+  first = _make_filter(encoder, query_cache_file).filter(items, queries, cache_base=cache_base)
+  assert encoder.calls > 0
+
+  lazy = LazyModel(_must_not_load)
+  second = _make_filter(lazy, query_cache_file).filter(items, queries, cache_base=cache_base)
+
+  assert not lazy.loaded
+  for a, b in zip(first["queries"], second["queries"]):
+    assert a["top_indices"] == b["top_indices"]
+    np.testing.assert_allclose(a["top_scores"], b["top_scores"], rtol=1e-6)
+
+
+def test_int8_cache_without_exact_copy_rescores_by_reencoding(tmp_path):
+  items = [Paper(f"p{i}") for i in range(64)]
+  queries = [{"query_text": "graph neural networks"}]
+  cache_base = str(tmp_path / "embeddings" / "papers")
+  query_cache_file = tmp_path / "query_embeddings.npz"
+
+  first = _make_filter(HashEncoder(), query_cache_file, exact=False).filter(items, queries, cache_base=cache_base)
+  assert not list((tmp_path / "embeddings").glob("*.exact.npy"))
+
+  encoder = HashEncoder()
+  second = _make_filter(encoder, query_cache_file, exact=False).filter(items, queries, cache_base=cache_base)
+  assert encoder.calls > 0
+  assert first["queries"][0]["top_indices"] == second["queries"][0]["top_indices"]
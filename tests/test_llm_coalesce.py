@@ -0,0 +1,100 @@
+import time
+
+import llm
+
+
+class FakeResponse:
+    def __init__(self, ok=True, total_tokens=42):
+        self.ok = ok
+        self._total = total_tokens
+
+    def json(self):
+        return {"usage": {"total_tokens": self._total}}
+
+
+def _counting(response):
+    calls = []
+
+    def fn():
+        calls.append(1)
+        return response
+
+    return fn, calls
+
+
+def test_default_does_not_reuse_completed_response(monkeypatch):
+    monkeypatch.delenv("LLM_COALESCE_TTL", raising=False)
+    flight = llm.SingleFlight()
+    fn, calls = _counting(FakeResponse())
+    _, shared_first = flight.do("k", fn)
+    _, shared_second = flight.do("k", fn)
+    assert len(calls) == 2 and not shared_first and not shared_second
+    assert flight.stats()["coalesced"] == 0
+
+
+def test_sequential_duplicate_reuses_completed_response(monkeypatch):
+    monkeypatch.setenv("LLM_COALESCE_TTL", "600")
+    flight = llm.SingleFlight()
+    resp = FakeResponse()
+    fn, calls = _counting(resp)
+
+    first, shared_first = flight.do("k", fn)
+    second, shared_second = flight.do("k", fn)
+
+    assert len(calls) == 1
+    assert first is second is resp
+    assert (shared_first, shared_second) == (False, True)
+    stats = flight.stats()
+    assert stats["requests"] == 1 and stats["coalesced"] == 1 and stats["memo_hits"] == 1
+    assert stats["saved_tokens"] == 42
+
+
+def test_fresh_retry_bypasses_memo(monkeypatch):
+    monkeypatch.setenv("LLM_COALESCE_TTL", "600")
+    flight = llm.SingleFlight()
+    fn, calls = _counting(FakeResponse())
+    flight.do("k", fn)
+    _, shared = flight.do("k", fn, fresh=True)
+    assert len(calls) == 2 and not shared
+
+
+def test_failed_response_not_memoized(monkeypatch):
+    monkeypatch.setenv("LLM_COALESCE_TTL", "600")
+    flight = llm.SingleFlight()
+    fn, calls = _counting(FakeResponse(ok=False))
+    flight.do("k", fn)
+    time.sleep(0.02)
+    flight.do("k", fn)
+    assert len(calls) == 2
+
+
+def test_memo_expires(monkeypatch):
+    monkeypatch.setenv("LLM_COALESCE_TTL", "0.01")
+    flight = llm.SingleFlight()
+    fn, calls = _counting(FakeResponse())
+    flight.do("k", fn)
+    time.sleep(0.02)
+    flight.do("k", fn)
+    assert len(calls) == 2
+
+
+def test_batch_replay_counts_tokens_once():
+    client = llm.LLMClient("key", "test-model", "http://localhost")
+    session = llm.BatchSession()
+    batch = llm.BatchChatClient(client, session)
+    messages = [{"role": "user", "content": "hi"}]
+    custom_id = llm.batch_request_id(client.build_chat_payload(messages))
+    session.results[custom_id] = {
+        "body": {
+            "choices": [{"message": {"content": "ok"}}],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+        }
+    }
+
+    first = batch.chat(messages)
+    replayed = batch.chat(messages)
+
+    assert first["content"] == replayed["content"] == "ok"
+    assert replayed["tokens"]["total"] == 0
+    usage = client.usage()
+    assert usage["calls"] == 1 and usage["total"] == 15 and usage["coalesced"] == 0
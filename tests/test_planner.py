@@ -0,0 +1,57 @@
+import json
+
+import pytest
+
+import planner
+
+
+def test_refine_cap_never_zero():
+    # 预算不足一篇的开销时仍至少保留 1 篇
+    assert planner.refine_cap_for({"tokens": 100.0}, {"tokens": 350.0}) == 1
+    assert planner.refine_cap_for({"calls": 0.0}, {"calls": 0.1}) == 1
+
+
+def test_refine_cap_takes_tightest_metric():
+    assert planner.refine_cap_for({"calls": 10.0, "tokens": 3500.0}, {"calls": 0.1, "tokens": 350.0}) == 10
+
+
+def test_refine_cap_none_without_rate():
+    # 预算指标上没有单篇开销（例如批处理模式不记录耗时），无法换算
+    assert planner.refine_cap_for({"seconds": 60.0}, {"calls": 0.1, "tokens": 350.0, "seconds": 0.0}) is None
+
+
+@pytest.fixture
+def archive(tmp_path, monkeypatch):
+    monkeypatch.setattr(planner, "ARCHIVE_ROOT", str(tmp_path))
+    monkeypatch.setattr(planner, "TELEMETRY_FILE", str(tmp_path / "llm_telemetry.json"))
+    monkeypatch.setattr(planner, "LOCK_FILE", str(tmp_path / ".planner.lock"))
+    monkeypatch.setenv("DPR_SCORE_TABLES", "0")
+    path = tmp_path / "rrf.json"
+    queries = [
+        {"type": "keyword", "tag": f"t{q}", "sim_scores": {f"p{q}-{i}": {"score": 1.0 / (i + 1), "rank": i + 1} for i in range(40)}}
+        for q in range(3)
+    ]
+    path.write_text(json.dumps({"queries": queries}), encoding="utf-8")
+    return tmp_path, str(path)
+
+
+def _plan(input_path, budgets, telemetry=None, tmp=None):
+    if telemetry is not None:
+        (tmp / "llm_telemetry.json").write_text(json.dumps(telemetry), encoding="utf-8")
+    return planner.plan_run(input_path, budgets, planner.refine_profile("single", "full", False), date_str="20260101")
+
+
+def test_plan_without_telemetry_uses_priors_and_positive_cap(archive):
+    tmp, input_path = archive
+    assert not (tmp / "llm_telemetry.json").exists()
+    plan = _plan(input_path, {"refine": {"tokens": 1.0}})
+    cap = plan["actions"]["refine_max_candidates"]
+    assert cap is not None and cap >= 1
+
+
+def test_plan_zero_budget_keeps_one_candidate(archive):
+    tmp, input_path = archive
+    telemetry = {"rates": {"refine:single/full": {"runs": 3, "calls": 0.1, "prompt_tokens": 300.0, "completion_tokens": 50.0, "seconds": 0.8}}}
+    plan = _plan(input_path, {"refine": {"calls": 0.0}}, telemetry, tmp)
+    assert plan["actions"]["refine_max_candidates"] == 1
+    assert plan["predicted"]["refine"]["candidates"] == 1